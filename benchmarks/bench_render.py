@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" bench_render.py
+
+Compare building commands per call (the way the core functions used to)
+with the compiled templates in :mod:`seam.render`.
+
+    $ python benchmarks/bench_render.py [n]
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from seam.freesurfer.v1 import core
+from seam.dti_qa.v1 import dtiqa_mcode
+
+
+# The previous implementations, kept here only for comparison
+
+def old_recon_all(subject_id, flags=None):
+    parts = ['recon-all', '-s {subject_id}'] + ['-all', '-qcache',
+        '-measure thickness', '-measure curv', '-measure sulc',
+        '-measure area', '-measure jacobian_white']
+    if flags:
+        parts.extend(flags)
+    return ' '.join(parts).format(**locals())
+
+def old_annot2label_cmd(subject_id, hemi, annot_path, outdir, surface='white'):
+    template = "mri_annotation2label --subject {subject_id} --hemi {hemi} --annotation {annot_path} --outdir {outdir} --surface {surface}"
+    return template.format(**locals())
+
+def old_dtiqa_mcode(images, basedir, dtiqa_path, n_b0=1):
+    # Single image case only
+    template = """addpath(genpath('{dtiqa_path}'))
+ec = 0;
+try
+    {pipeline_command}
+    load {regmat}
+    load {outmat}
+    csvwrite('{rotcsv}', rotation);
+    csvwrite('{transcsv}', translation);
+    csvwrite('{outcsv}', outs);
+    boxplotsmat_to_csv('{biasmat}', '{biascsv}');
+    boxplotsmat_to_csv('{famat}', '{facsv}');
+    boxplotsmat_to_csv('{fasigmamat}', '{fasigmacsv}');
+    boxplotsmat_to_csv('{mdmat}', '{mdcsv}');
+catch exception
+    disp(exception.message)
+    ec = 1;
+end
+disp(['Exiting with status ' num2str(ec)]);
+exit(ec);
+"""
+    pipeline_template = "DTI_QA_Pipeline('{images}', '{basedir}', '{dtiqa_path}', {n_b0});"
+    pipeline_command = pipeline_template.format(**locals())
+    regmat = os.path.join(basedir, 'extra', 'Registration_motion.mat')
+    outmat = os.path.join(basedir, 'extra', 'Outliers.mat')
+    rotcsv = os.path.join(basedir, 'extra', 'Rotation.csv')
+    transcsv = os.path.join(basedir, 'extra', 'Translation.csv')
+    outcsv = os.path.join(basedir, 'extra', 'Outliers.csv')
+    biasmat = os.path.join(basedir, 'extra', 'BoxplotsBias.mat')
+    biascsv = os.path.join(basedir, 'extra', 'BoxplotsBias.csv')
+    famat = os.path.join(basedir, 'extra', 'BoxplotsFA.mat')
+    facsv = os.path.join(basedir, 'extra', 'BoxplotsFA.csv')
+    fasigmamat = os.path.join(basedir, 'extra', 'BoxplotsFAsigma.mat')
+    fasigmacsv = os.path.join(basedir, 'extra', 'BoxplotsFAsigma.csv')
+    mdmat = os.path.join(basedir, 'extra', 'BoxplotsMD.mat')
+    mdcsv = os.path.join(basedir, 'extra', 'BoxplotsMD.csv')
+    return template.format(**locals())
+
+def bench(label, func, n):
+    best = min(timeit.repeat(func, number=1, repeat=3))
+    print('{:<45} {:8.3f}s {:10.0f}/s'.format(label, best, n / best))
+    return best
+
+def main(n=100000):
+    subjects = ['sub{:06d}'.format(i) for i in range(n // 2)]
+    rows = [(sid, hemi, '/sd/{}/label/{}.aparc.a2009s.annot'.format(sid, hemi),
+        '/sd/{}/label'.format(sid), 'white') for sid in subjects
+        for hemi in ('lh', 'rh')]
+    print('{:d} commands'.format(len(rows)))
+
+    old = bench('annot2label: format(**locals()) per call',
+        lambda: [old_annot2label_cmd(*row) for row in rows], len(rows))
+    new = bench('annot2label: annot2label_cmd per call',
+        lambda: [core.annot2label_cmd(*row) for row in rows], len(rows))
+    batch = bench('annot2label: ANNOT2LABEL_CMD.render_many',
+        lambda: core.ANNOT2LABEL_CMD.render_many(rows), len(rows))
+    columns = [list(column) for column in zip(*rows)]
+    bench('annot2label: annot2label_cmds(columns)',
+        lambda: core.annot2label_cmds(*columns), len(rows))
+    print('  speedup {:.1f}x per call, {:.1f}x batched'.format(old / new,
+        old / batch))
+
+    ids = [(sid,) for sid in subjects]
+    old = bench('recon_all: join + format per call',
+        lambda: [old_recon_all(sid) for (sid,) in ids], len(ids))
+    batch = bench('recon_all: RECON_ALL.render_many',
+        lambda: core.RECON_ALL.render_many(ids), len(ids))
+    print('  speedup {:.1f}x batched'.format(old / batch))
+
+    dirs = ['/qc/{}'.format(sid) for sid in subjects[:n // 10]]
+    old = bench('dtiqa: os.path.joins + format per call',
+        lambda: [old_dtiqa_mcode(d + '/dti.nii', d, '/opt/dtiqa', 6)
+            for d in dirs], len(dirs))
+    new = bench('dtiqa: dtiqa_mcode per call',
+        lambda: [dtiqa_mcode(d + '/dti.nii', d, '/opt/dtiqa', 6)
+            for d in dirs], len(dirs))
+    print('  speedup {:.1f}x per call'.format(old / new))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
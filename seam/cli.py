@@ -0,0 +1,473 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" cli.py
+
+The ``seam`` command line tool
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import sys
+import time
+import logging
+from argparse import ArgumentParser
+
+from . import __version__ as version
+from .runner.queue import FileQueue, Worker, STATES
+from .runner.policy import POLICIES
+from .runner.metrics import Exporter
+from .runner.disk import DiskGuard, GB
+from .freesurfer.v1.recipe import subjects_dir
+from .freesurfer.v1.manifest import (iter_batch, iter_manifest,
+    build_longitudinal_batch)
+from .freesurfer.v1.longitudinal import write_stage_lists
+from .freesurfer.v1.edits import build_edits_recipe, snapshot_edits
+from .freesurfer.v1.screenshots import postprocess_screenshots
+from .freesurfer.v1.validate import validate_manifest
+from .freesurfer.v1.logs import profile_subjects_dir, write_profile
+from .freesurfer.v1.progress import Progress
+from .freesurfer.v1.archive import PRUNE, archive_subject, SubjectArchive
+
+
+def build(args):
+    if args.validate:
+        # The SUBJECTS_DIR the scripts will be built for
+        report = validate_manifest(args.manifest,
+            subjects_dir=subjects_dir(args.script_dir))
+        if not report.ok:
+            print(report.text())
+            sys.exit(1)
+    jobs = iter_batch(args.manifest, args.script_dir, workers=args.workers,
+        ordered=not args.unordered, use_xvfb=args.use_xvfb,
+        threads=args.threads, freesurfer_env=args.freesurfer_env)
+    queue = FileQueue(args.queue) if args.queue else None
+    # Submit each subject as soon as it's built, workers can start on it
+    # while the rest of the batch is generated
+    for job in jobs:
+        if queue:
+            queue.submit(job)
+        print(job.script)
+        sys.stdout.flush()
+
+def build_long(args):
+    subjects = build_longitudinal_batch(args.manifest, args.script_dir,
+        threads=args.threads)
+    queue = FileQueue(args.queue) if args.queue else None
+    for stages in subjects:
+        for jobs in stages.values():
+            for job in jobs:
+                if queue:
+                    queue.submit(job)
+                print(job.script)
+    for stage, path in write_stage_lists(subjects, args.script_dir).items():
+        print("{} stage scripts listed in {}".format(stage, path))
+
+def build_edits(args):
+    for subject_id in args.subject_ids:
+        script = build_edits_recipe(subject_id, args.script_dir,
+            use_xvfb=args.use_xvfb, threads=args.threads,
+            screenshot_format=args.screenshot_format,
+            native_labels=args.native_labels,
+            native_screenshots=args.native_screenshots)
+        print(script or "{}: no edits since the last run".format(subject_id))
+
+def snapshot(args):
+    snapshot_edits(args.subject_dir)
+
+def validate(args):
+    report = validate_manifest(args.manifest, subjects_dir=args.subjects_dir,
+        threads=args.threads)
+    print(report.text())
+    if not report.ok:
+        sys.exit(1)
+
+def screenshots(args):
+    for ss_dir in args.ss_dirs:
+        written = postprocess_screenshots(ss_dir, fmt=args.format,
+            contact_sheet=not args.no_contact_sheet, columns=args.columns,
+            scale=args.scale, delete_tiffs=args.delete_tiffs,
+            processes=args.processes)
+        print("{}: wrote {:d} images".format(ss_dir, len(written)))
+
+def annot2label(args):
+    # NumPy is only needed here, so don't require it to import the CLI
+    from .freesurfer.v1.labels import annot2label
+    sd = args.subjects_dir or os.environ['SUBJECTS_DIR']
+    for hemi in args.hemis or ('lh', 'rh'):
+        annot_path = os.path.join(sd, args.subject_id, 'label',
+            '{}.{}.annot'.format(hemi, args.annot))
+        written = annot2label(args.subject_id, hemi, annot_path, args.outdir,
+            surface=args.surface, subjects_dir=sd)
+        print("{}: wrote {:d} labels".format(annot_path, len(written)))
+
+def render_slices(args):
+    # NumPy is only needed here, so don't require it to import the CLI
+    from .freesurfer.v1.slices import render_slices
+    written = render_slices(args.subject_id, args.outdir,
+        subjects_dir=args.subjects_dir, orientation=args.orientation,
+        scale=args.scale, threads=args.threads)
+    print("{}: wrote {:d} slices".format(args.outdir, len(written)))
+
+def render_surfaces(args):
+    # NumPy is only needed here, so don't require it to import the CLI
+    from .freesurfer.v1.surfaces import render_surfaces
+    written = render_surfaces(args.subject_id, args.outdir,
+        subjects_dir=args.subjects_dir, hemis=args.hemis or ('lh', 'rh'),
+        annots=args.annots or ('aparc.a2009s',), size=args.size,
+        threads=args.threads)
+    print("{}: wrote {:d} views".format(args.outdir, len(written)))
+
+def archive(args):
+    prune = None if args.no_prune else (args.prune or PRUNE)
+    path = archive_subject(args.subject_id, args.archive_dir,
+        subjects_dir=args.subjects_dir, prune=prune, threads=args.threads,
+        level=args.level, remove=args.remove)
+    print(path)
+
+def archive_read(args):
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    with SubjectArchive(args.archive) as archive:
+        names = archive.names(args.name)
+        if not names:
+            sys.exit("{}: no {} in {}".format(args.archive, args.name,
+                archive.subject_id))
+        for name in names:
+            out.write(archive.read(name))
+    out.flush()
+
+def profile(args):
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        write_profile(profile_subjects_dir(args.subjects_dir,
+            processes=args.processes), out)
+    finally:
+        if args.output:
+            out.close()
+
+def progress(args):
+    subject_ids = None
+    if args.manifest:
+        subject_ids = [row['subject_id'] for row in
+            iter_manifest(args.manifest)]
+    watch = Progress(args.subjects_dir, history=args.history,
+        subject_ids=subject_ids, slots=args.slots)
+    while True:
+        watch.poll()
+        print(watch.text())
+        sys.stdout.flush()
+        if args.once:
+            return
+        time.sleep(args.interval)
+        print('')
+
+def submit(args):
+    queue = FileQueue(args.queue)
+    for script in args.scripts:
+        job = queue.submit(script)
+        print("Submitted {}".format(job.name))
+
+def _exporter(args, slots=None):
+    if args.metrics_file is None and args.metrics_port is None:
+        return None
+    return Exporter(textfile=args.metrics_file, port=args.metrics_port,
+        host=args.metrics_host, slots=slots)
+
+def _disk_guard(args):
+    if args.disk_reserve is None:
+        return None
+    footprints = args.footprints or os.path.join(args.queue,
+        'footprints.json')
+    return DiskGuard(footprints, reserve=int(args.disk_reserve * GB))
+
+def worker(args):
+    w = Worker(args.queue, slots=args.slots, heartbeat=args.heartbeat,
+        stale_after=args.stale_after, resubmits=args.resubmits,
+        poll_interval=args.poll_interval,
+        exit_when_empty=args.exit_when_empty, policy=args.policy,
+        history=args.history, cores=args.cores,
+        metrics=_exporter(args, args.slots), disk=_disk_guard(args))
+    w.run()
+
+def metrics(args):
+    exporter = _exporter(args, args.slots)
+    if exporter is None:
+        exporter = Exporter(slots=args.slots)
+    queue = FileQueue(args.queue)
+    try:
+        while True:
+            text = exporter.update(queue.jobs(), force=True)
+            if args.once:
+                if not args.metrics_file:
+                    sys.stdout.write(text)
+                return
+            time.sleep(args.interval)
+    finally:
+        exporter.close()
+
+def status(args):
+    counts = FileQueue(args.queue).counts()
+    for state in STATES:
+        print("{}\t{:d}".format(state, counts[state]))
+
+
+def _metrics_args(parser):
+    parser.add_argument('--metrics-file', default=None, dest='metrics_file',
+        help="Write metrics here for node_exporter's textfile collector")
+    parser.add_argument('--metrics-port', type=int, default=None,
+        dest='metrics_port', help="Serve metrics on this port")
+    parser.add_argument('--metrics-host', default='127.0.0.1',
+        dest='metrics_host', help="Address to serve metrics on")
+
+
+def get_parser():
+    ap = ArgumentParser(prog='seam',
+        description="Run scripts generated by seam")
+    ap.add_argument('--version', action='version', version=version)
+    ap.add_argument('-v', '--verbose', action='store_true', default=False,
+        help="Log progress")
+    sub = ap.add_subparsers(dest='command')
+
+    bp = sub.add_parser('build',
+        help="Build recon scripts for every subject in a batch manifest")
+    bp.add_argument('manifest', help="Batch manifest (CSV or TSV)")
+    bp.add_argument('script_dir', help="Directory to write scripts")
+    bp.add_argument('--use-xvfb', action='store_true', default=False,
+        dest="use_xvfb", help="Use xvfb-run for graphical programs")
+    bp.add_argument('--threads', type=int, default=None,
+        help="Cores per subject (recon-all -openmp)")
+    bp.add_argument('--queue', default=None,
+        help="Submit the scripts, with their study & priority, to this queue")
+    bp.add_argument('--workers', type=int, default=1,
+        help="Subjects to build at once")
+    bp.add_argument('--unordered', action='store_true', default=False,
+        help="Report subjects as they finish rather than in manifest order")
+    bp.add_argument('--validate', action='store_true', default=False,
+        help="Check the manifest first, build nothing if it has errors")
+    bp.add_argument('--freesurfer-env', default=None, dest='freesurfer_env',
+        help="Scripts source this FreeSurfer environment snapshot, captured "
+        "from $FREESURFER_HOME if missing or stale")
+    bp.set_defaults(func=build)
+
+    blp = sub.add_parser('build-long',
+        help="Build longitudinal (cross, base & long) scripts for a manifest "
+        "with a base_id column")
+    blp.add_argument('manifest', help="Batch manifest (CSV or TSV)")
+    blp.add_argument('script_dir', help="Directory to write scripts")
+    blp.add_argument('--threads', type=int, default=None,
+        help="Cores per script (recon-all -openmp)")
+    blp.add_argument('--queue', default=None,
+        help="Submit the scripts, with their dependencies, to this queue")
+    blp.set_defaults(func=build_long)
+
+    ep = sub.add_parser('build-edits',
+        help="Build scripts rerunning only what manual edits invalidate")
+    ep.add_argument('script_dir', help="Directory to write scripts")
+    ep.add_argument('subject_ids', nargs='+', metavar='subject_id',
+        help="Edited subjects (in $SUBJECTS_DIR)")
+    ep.add_argument('--use-xvfb', action='store_true', default=False,
+        dest="use_xvfb", help="Use xvfb-run for graphical programs")
+    ep.add_argument('--threads', type=int, default=None,
+        help="Cores per subject (recon-all -openmp)")
+    ep.add_argument('--screenshot-format', default=None,
+        dest="screenshot_format", help="Convert screenshots to this format")
+    ep.add_argument('--native-labels', action='store_true', default=False,
+        dest="native_labels",
+        help="Convert annotations to labels without mri_annotation2label")
+    ep.add_argument('--native-screenshots', action='store_true',
+        default=False, dest="native_screenshots",
+        help="Render screenshots in Python instead of tkmedit & tksurfer")
+    ep.set_defaults(func=build_edits)
+
+    snp = sub.add_parser('snapshot-edits',
+        help="Record a subject's edit files as rerun (edits scripts do this)")
+    snp.add_argument('subject_dir', help="$SUBJECTS_DIR/<subject>")
+    snp.set_defaults(func=snapshot)
+
+    vp = sub.add_parser('validate',
+        help="Check a batch manifest's inputs & SUBJECTS_DIR")
+    vp.add_argument('manifest', help="Batch manifest (CSV or TSV)")
+    vp.add_argument('--subjects-dir', default=None, dest='subjects_dir',
+        help="Default: $SUBJECTS_DIR")
+    vp.add_argument('--threads', type=int, default=32,
+        help="Checks to run at once")
+    vp.set_defaults(func=validate)
+
+    ssp = sub.add_parser('screenshots',
+        help="Convert screenshot TIFFs & build contact sheets")
+    ssp.add_argument('ss_dirs', nargs='+', metavar='ss_dir',
+        help="Subject screenshot directories")
+    ssp.add_argument('--format', default='png',
+        help="Format to convert to (default: png)")
+    ssp.add_argument('--columns', type=int, default=6,
+        help="Images per contact sheet row")
+    ssp.add_argument('--scale', type=int, default=4,
+        help="Shrink images by this factor on the contact sheet")
+    ssp.add_argument('--no-contact-sheet', action='store_true', default=False,
+        dest='no_contact_sheet', help="Only convert the images")
+    ssp.add_argument('--delete-tiffs', action='store_true', default=False,
+        dest='delete_tiffs', help="Remove TIFFs once converted")
+    ssp.add_argument('--processes', type=int, default=None,
+        help="Worker processes (default: one per CPU)")
+    ssp.set_defaults(func=screenshots)
+
+    lp = sub.add_parser('annot2label',
+        help="Convert annotations to label files (requires NumPy)")
+    lp.add_argument('subject_id', help="Subject identifier")
+    lp.add_argument('annot', help="Annotation name, e.g. aparc.a2009s")
+    lp.add_argument('outdir', help="Directory to write labels")
+    lp.add_argument('--hemi', action='append', dest='hemis',
+        choices=['lh', 'rh'], help="Hemisphere(s) (default: both)")
+    lp.add_argument('--surface', default='white',
+        help="Surface supplying label coordinates")
+    lp.add_argument('--subjects-dir', default=None, dest='subjects_dir',
+        help="Default: $SUBJECTS_DIR")
+    lp.set_defaults(func=annot2label)
+
+    rsp = sub.add_parser('render-slices',
+        help="Render QC slices without tkmedit (requires NumPy)")
+    rsp.add_argument('subject_id', help="Subject identifier")
+    rsp.add_argument('outdir', help="Directory to write images")
+    rsp.add_argument('--orientation', default='coronal',
+        choices=['coronal', 'axial', 'sagittal'])
+    rsp.add_argument('--scale', type=int, default=1,
+        help="Pixels per voxel")
+    rsp.add_argument('--threads', type=int, default=None,
+        help="Slices rendered at once (default: one per CPU)")
+    rsp.add_argument('--subjects-dir', default=None, dest='subjects_dir',
+        help="Default: $SUBJECTS_DIR")
+    rsp.set_defaults(func=render_slices)
+
+    rfp = sub.add_parser('render-surfaces',
+        help="Render surface views without tksurfer (requires NumPy)")
+    rfp.add_argument('subject_id', help="Subject identifier")
+    rfp.add_argument('outdir', help="Directory to write images")
+    rfp.add_argument('--hemi', action='append', dest='hemis',
+        choices=['lh', 'rh'], help="Hemisphere(s) (default: both)")
+    rfp.add_argument('--annot', action='append', dest='annots',
+        help="Annotation(s) to render (default: aparc.a2009s)")
+    rfp.add_argument('--size', type=int, default=600,
+        help="Image width & height in pixels")
+    rfp.add_argument('--threads', type=int, default=None,
+        help="Hemispheres rendered at once (default: all)")
+    rfp.add_argument('--subjects-dir', default=None, dest='subjects_dir',
+        help="Default: $SUBJECTS_DIR")
+    rfp.set_defaults(func=render_surfaces)
+
+    arp = sub.add_parser('archive',
+        help="Prune a finished subject and pack it into a zip archive")
+    arp.add_argument('subject_id', help="Subject identifier")
+    arp.add_argument('archive_dir', help="Directory to write the archive")
+    arp.add_argument('--prune', action='append', default=None,
+        help="Pattern of files to remove first, relative to the subject "
+        "(default: {})".format(' '.join(PRUNE)))
+    arp.add_argument('--no-prune', action='store_true', default=False,
+        dest='no_prune', help="Keep every file")
+    arp.add_argument('--threads', type=int, default=None,
+        help="Compression threads (default: one per CPU)")
+    arp.add_argument('--level', type=int, default=6,
+        help="Compression level")
+    arp.add_argument('--remove', action='store_true', default=False,
+        help="Remove the subject directory once archived")
+    arp.add_argument('--subjects-dir', default=None, dest='subjects_dir',
+        help="Default: $SUBJECTS_DIR")
+    arp.set_defaults(func=archive)
+
+    arr = sub.add_parser('archive-read',
+        help="Write files from a subject archive to stdout")
+    arr.add_argument('archive', help="Subject archive (.zip)")
+    arr.add_argument('name',
+        help="File or pattern relative to the subject, e.g. stats/aseg.stats")
+    arr.set_defaults(func=archive_read)
+
+    pp = sub.add_parser('profile',
+        help="Tabulate per-step wall & CPU time from recon-all logs")
+    pp.add_argument('subjects_dir', help="SUBJECTS_DIR to profile")
+    pp.add_argument('-o', '--output', default=None,
+        help="TSV file to write (default: stdout)")
+    pp.add_argument('--processes', type=int, default=None,
+        help="Logs to parse at once (default: one per CPU)")
+    pp.set_defaults(func=profile)
+
+    gp = sub.add_parser('progress',
+        help="Follow running subjects and estimate when they'll finish")
+    gp.add_argument('subjects_dir', help="SUBJECTS_DIR to watch")
+    gp.add_argument('--history', default=None,
+        help="Step durations of past runs, from 'seam profile'")
+    gp.add_argument('--manifest', default=None,
+        help="Batch manifest of the cohort, to count subjects not set up "
+        "yet")
+    gp.add_argument('--slots', type=int, default=None,
+        help="Subjects run at once (default: as many as are running)")
+    gp.add_argument('--interval', type=float, default=60.0,
+        help="Seconds between updates")
+    gp.add_argument('--once', action='store_true', default=False,
+        help="Report once and exit")
+    gp.set_defaults(func=progress)
+
+    sp = sub.add_parser('submit', help="Add scripts to a queue directory")
+    sp.add_argument('queue', help="Queue directory")
+    sp.add_argument('scripts', nargs='+', help="Scripts to run")
+    sp.set_defaults(func=submit)
+
+    wp = sub.add_parser('worker',
+        help="Run scripts claimed from a (shared) queue directory")
+    wp.add_argument('queue', help="Queue directory")
+    wp.add_argument('--slots', type=int, default=1,
+        help="Scripts to run at once")
+    wp.add_argument('--cores', type=int, default=None,
+        help="Cores to share between scripts (default: all)")
+    wp.add_argument('--heartbeat', type=int, default=30,
+        help="Seconds between heartbeats")
+    wp.add_argument('--stale-after', type=int, default=300, dest='stale_after',
+        help="Seconds without a heartbeat before a claim is reclaimed")
+    wp.add_argument('--resubmits', type=int, default=1,
+        help="Resubmissions allowed for transient failures")
+    wp.add_argument('--poll-interval', type=float, default=5.0,
+        dest='poll_interval', help="Seconds between checks of the queue")
+    wp.add_argument('--exit-when-empty', action='store_true', default=False,
+        dest='exit_when_empty', help="Stop once the queue is drained")
+    wp.add_argument('--policy', default='fifo', choices=sorted(POLICIES),
+        help="Which pending job to claim next")
+    wp.add_argument('--history', default=None,
+        help="Runtime history file (default: runtimes.json in the queue)")
+    wp.add_argument('--disk-reserve', type=float, default=None,
+        dest='disk_reserve', help="Hold jobs unless this many GB would stay "
+        "free where they write, after running jobs grow to their peak")
+    wp.add_argument('--footprints', default=None,
+        help="Disk footprint history (default: footprints.json in the queue)")
+    _metrics_args(wp)
+    wp.set_defaults(func=worker)
+
+    mp = sub.add_parser('metrics',
+        help="Export a queue's progress as Prometheus metrics")
+    mp.add_argument('queue', help="Queue directory")
+    mp.add_argument('--slots', type=int, default=None,
+        help="Slots across workers, for xvfb utilization")
+    mp.add_argument('--interval', type=float, default=15.0,
+        help="Seconds between updates")
+    mp.add_argument('--once', action='store_true', default=False,
+        help="Update once (printing the metrics without --metrics-file)")
+    _metrics_args(mp)
+    mp.set_defaults(func=metrics)
+
+    st = sub.add_parser('status', help="Count jobs in a queue directory")
+    st.add_argument('queue', help="Queue directory")
+    st.set_defaults(func=status)
+    return ap
+
+
+def main(argv=None):
+    ap = get_parser()
+    args = ap.parse_args(argv)
+    if not getattr(args, 'func', None):
+        ap.print_help()
+        sys.exit(2)
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO,
+            format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,32 @@ __copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
 import os
 
 from ...util import STRING_TYPE
+from ...render import CommandTemplate
+
+# <basedir>/extra is joined once per call, the paths under it once here
+MCODE = CommandTemplate("""addpath(genpath('{dtiqa_path}'))
+ec = 0;
+try
+    {pipeline_command}
+    load {extra}/Registration_motion.mat
+    load {extra}/Outliers.mat
+    csvwrite('{extra}/Rotation.csv', rotation);
+    csvwrite('{extra}/Translation.csv', translation);
+    csvwrite('{extra}/Outliers.csv', outs);
+    boxplotsmat_to_csv('{extra}/BoxplotsBias.mat', '{extra}/BoxplotsBias.csv');
+    boxplotsmat_to_csv('{extra}/BoxplotsFA.mat', '{extra}/BoxplotsFA.csv');
+    boxplotsmat_to_csv('{extra}/BoxplotsFAsigma.mat', '{extra}/BoxplotsFAsigma.csv');
+    boxplotsmat_to_csv('{extra}/BoxplotsMD.mat', '{extra}/BoxplotsMD.csv');
+catch exception
+    disp(exception.message)
+    ec = 1;
+end
+disp(['Exiting with status ' num2str(ec)]);
+exit(ec);
+""")
+PIPELINE = CommandTemplate("DTI_QA_Pipeline('{image_string}', '{basedir}', '{dtiqa_path}', {n_b0});")
+PIPELINE_MULTI = CommandTemplate("DTI_QA_Pipeline_Multi('{dtiqa_path}', '{basedir}', {n_b0}, [], {image_string});")
+
 
 def dtiqa_mcode(images, basedir, dtiqa_path, n_b0=1):
     """
@@ -31,51 +57,19 @@ def dtiqa_mcode(images, basedir, dtiqa_path, n_b0=1):
       >>> f.write(dtiqa_mcode(images, basedir, dtiqa_path, n_b0))
       >>> f.close()
     """
-    template = """addpath(genpath('{dtiqa_path}'))
-ec = 0;
-try
-    {pipeline_command}
-    load {regmat}
-    load {outmat}
-    csvwrite('{rotcsv}', rotation);
-    csvwrite('{transcsv}', translation);
-    csvwrite('{outcsv}', outs);
-    boxplotsmat_to_csv('{biasmat}', '{biascsv}');
-    boxplotsmat_to_csv('{famat}', '{facsv}');
-    boxplotsmat_to_csv('{fasigmamat}', '{fasigmacsv}');
-    boxplotsmat_to_csv('{mdmat}', '{mdcsv}');
-catch exception
-    disp(exception.message)
-    ec = 1;
-end
-disp(['Exiting with status ' num2str(ec)]);
-exit(ec);
-"""
     if isinstance(images, STRING_TYPE):
         # single image passed as string
-        pipeline_template = "DTI_QA_Pipeline('{images}', '{basedir}', '{dtiqa_path}', {n_b0});"
-        pipeline_command = pipeline_template.format(**locals())
+        pipeline_command = PIPELINE.render(image_string=images,
+            basedir=basedir, dtiqa_path=dtiqa_path, n_b0=n_b0)
     elif len(images) == 1:
         # one image in the list, still need to run regular
-        pipeline_template = "DTI_QA_Pipeline('{image_string}', '{basedir}', '{dtiqa_path}', {n_b0});"
-        image_string = images[0]
-        pipeline_command = pipeline_template.format(**locals())
+        pipeline_command = PIPELINE.render(image_string=images[0],
+            basedir=basedir, dtiqa_path=dtiqa_path, n_b0=n_b0)
     else:
         # Multiple images, run DTI_QA_Pipeline_Multi
-        pipeline_template = "DTI_QA_Pipeline_Multi('{dtiqa_path}', '{basedir}', {n_b0}, [], {image_string});"
         image_string = ', '.join("'{}'".format(im) for im in images)
-        pipeline_command = pipeline_template.format(**locals())
-    regmat = os.path.join(basedir, 'extra', 'Registration_motion.mat')
-    outmat = os.path.join(basedir, 'extra', 'Outliers.mat')
-    rotcsv = os.path.join(basedir, 'extra', 'Rotation.csv')
-    transcsv = os.path.join(basedir, 'extra', 'Translation.csv')
-    outcsv = os.path.join(basedir, 'extra', 'Outliers.csv')
-    biasmat = os.path.join(basedir, 'extra', 'BoxplotsBias.mat')
-    biascsv = os.path.join(basedir, 'extra', 'BoxplotsBias.csv')
-    famat = os.path.join(basedir, 'extra', 'BoxplotsFA.mat')
-    facsv = os.path.join(basedir, 'extra', 'BoxplotsFA.csv')
-    fasigmamat = os.path.join(basedir, 'extra', 'BoxplotsFAsigma.mat')
-    fasigmacsv = os.path.join(basedir, 'extra', 'BoxplotsFAsigma.csv')
-    mdmat = os.path.join(basedir, 'extra', 'BoxplotsMD.mat')
-    mdcsv = os.path.join(basedir, 'extra', 'BoxplotsMD.csv')
-    return template.format(**locals())
\ No newline at end of file
+        pipeline_command = PIPELINE_MULTI.render(dtiqa_path=dtiqa_path,
+            basedir=basedir, n_b0=n_b0, image_string=image_string)
+    return MCODE.render(dtiqa_path=dtiqa_path,
+        pipeline_command=pipeline_command,
+        extra=os.path.join(basedir, 'extra'))
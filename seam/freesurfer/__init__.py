@@ -7,9 +7,15 @@ __copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
 # This exposes the "current" version
 from .v1 import recon_all, recon_input, tkmedit_screenshot_tcl, \
     tkmedit_screenshot_cmd, tksurfer_screenshot_tcl, tksurfer_screenshot_cmd, \
-    annot2label_cmd
+    annot2label_cmd, template_link_cmd, recon_all_cmds, recon_input_many, \
+    annot2label_cmds, tkmedit_screenshot_cmds, tksurfer_screenshot_cmds, \
+    recon_base, recon_long
 from .v1.recipe import build_recipe
+from .v1.longitudinal import build_longitudinal
 
 __all__ = ['build_recipe', 'recon_input', 'recon_all', 'tkmedit_screenshot_tcl',
     'tkmedit_screenshot_cmd', 'tksurfer_screenshot_tcl',
-    'tksurfer_screenshot_cmd', 'annot2label_cmd']
+    'tksurfer_screenshot_cmd', 'annot2label_cmd', 'template_link_cmd',
+    'recon_all_cmds', 'recon_input_many', 'annot2label_cmds',
+    'tkmedit_screenshot_cmds', 'tksurfer_screenshot_cmds', 'recon_base',
+    'recon_long', 'build_longitudinal']
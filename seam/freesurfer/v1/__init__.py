@@ -6,11 +6,15 @@ V1 defines the following recipes:
 
 * :func:`seam.freesurfer.v1.build_recipe` for building a complete
   script for executing the recon-all pipeline.
+* :func:`seam.freesurfer.v1.build_longitudinal` for building the
+  cross-sectional, base and long scripts of the longitudinal stream.
 
 V1 defines the following functions:
 
 * ``recon-all -all`` exposed through :func:`seam.freesurfer.v1.recon_all`
 * ``recon-all -i`` exposed through :func:`seam.freesurfer.v1.recon_input`
+* ``recon-all -base`` & ``recon-all -long`` exposed through
+  :func:`seam.freesurfer.v1.recon_base` & :func:`seam.freesurfer.v1.recon_long`
 * :func:`seam.freesurfer.v1.tkmedit_screenshot_tcl` for generating tcl
   to take screenshots of a volume loaded in ``tkmedit``.
 * :func:`seam.freesurfer.v1.tkmedit_screenshot_cmd` for supplying a
@@ -21,11 +25,23 @@ V1 defines the following functions:
   command to run ``tksurfer`` and generate screenshots.
 * :func:`seam.freesufer.v1.annot2label_cmd` for building a
   ``mri_annotation2label`` command.
+* :func:`seam.freesurfer.v1.template_link_cmd` for linking a shared
+  template subject (e.g. ``fsaverage``) into a SUBJECTS_DIR once.
+
+Batch variants (:func:`seam.freesurfer.v1.recon_all_cmds`,
+:func:`seam.freesurfer.v1.recon_input_many`,
+:func:`seam.freesurfer.v1.annot2label_cmds`,
+:func:`seam.freesurfer.v1.tkmedit_screenshot_cmds` and
+:func:`seam.freesurfer.v1.tksurfer_screenshot_cmds`) build commands for
+many subjects at once from columns, e.g. of a DataFrame.
 """
 __author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
 __copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
 
 from .core import recon_all, recon_input, tkmedit_screenshot_tcl, \
     tkmedit_screenshot_cmd, tksurfer_screenshot_tcl, tksurfer_screenshot_cmd, \
-    annot2label_cmd
+    annot2label_cmd, template_link_cmd, recon_all_cmds, recon_input_many, \
+    annot2label_cmds, tkmedit_screenshot_cmds, tksurfer_screenshot_cmds, \
+    recon_base, recon_long
 from .recipe import build_recipe
+from .longitudinal import build_longitudinal
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" archive.py
+
+Prune and pack finished subject directories into per-subject archives
+
+Only a fraction of a finished subject's files are ever read again.
+:func:`archive_subject` removes intermediates matching :data:`PRUNE`
+and packs the rest into ``<archive_dir>/<subject_id>.zip``, members named
+``<subject_id>/...`` so unzipping into ``SUBJECTS_DIR`` restores it.
+
+Members are deflated in a pool of threads (``zlib`` releases the GIL)
+and written in order, so packing uses every core while the archive stays
+an ordinary zip. Files that are already compressed (``.mgz``, ``.gz``,
+images) are stored as they are.
+
+The zip's central directory, at the end of the archive, is its index:
+:class:`SubjectArchive` reads single files such as ``stats/aseg.stats``
+or ``label/*.label`` by seeking to them, without extracting the rest.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import stat
+import glob
+import time
+import zlib
+import shutil
+import struct
+import logging
+import zipfile
+from os.path import join
+from fnmatch import fnmatch
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger(__name__)
+
+# Intermediates nobody reads once a subject is done, relative to its
+# directory
+PRUNE = ('trash/*', 'touch/*', 'surf/*.nofix', 'surf/*.defect_*',
+    'mri/filled-pretess*.mgz')
+# Already compressed, so stored rather than deflated again
+STORED_SUFFIXES = ('.mgz', '.gz', '.bz2', '.zip', '.png', '.jpg', '.jpeg')
+# Members compressed per batch, bounds memory use
+BATCH = 4
+
+_LOCAL = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END = struct.Struct('<IHHHHIIH')
+# Version 2.0, made on Unix
+_VERSION, _MADE_BY = 20, (3 << 8) | 20
+# Names are UTF-8
+_UTF8 = 0x800
+# Without zip64 records
+_MAX_SIZE, _MAX_ENTRIES = 0xFFFFFFFF, 0xFFFF
+
+
+def archive_path(archive_dir, subject_id):
+    return join(archive_dir, '{}.zip'.format(subject_id))
+
+
+def prune_subject(subject_dir, patterns=PRUNE):
+    """
+    Remove the files of *subject_dir* matching *patterns* (shell patterns
+    relative to it, ``*`` matching across directories).
+
+    :return: relative paths removed
+    :rtype: list
+    """
+    removed = []
+    for root, dirs, files in os.walk(subject_dir):
+        for name in sorted(files):
+            path = join(root, name)
+            rel = os.path.relpath(path, subject_dir).replace(os.sep, '/')
+            if any(fnmatch(rel, pattern) for pattern in patterns):
+                os.remove(path)
+                removed.append(rel)
+    return removed
+
+
+def _dos_time(mtime):
+    t = time.localtime(max(mtime, 315532800))
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def _members(subject_dir):
+    "(archive name, path, lstat) of every directory, file and link"
+    top = os.path.basename(os.path.normpath(subject_dir))
+    members = []
+    for root, dirs, files in os.walk(subject_dir):
+        dirs.sort()
+        rel = os.path.relpath(root, subject_dir).replace(os.sep, '/')
+        prefix = top if rel == '.' else '{}/{}'.format(top, rel)
+        members.append((prefix + '/', root, os.lstat(root)))
+        for name in sorted(files + [d for d in dirs
+            if os.path.islink(join(root, d))]):
+            path = join(root, name)
+            members.append(('{}/{}'.format(prefix, name), path,
+                os.lstat(path)))
+    return members
+
+
+def _compress(member, level):
+    "Compression method, CRC, size and data of one member"
+    name, path, st = member
+    if stat.S_ISDIR(st.st_mode):
+        data = b''
+    elif stat.S_ISLNK(st.st_mode):
+        # Info-ZIP stores a link as its target
+        data = os.readlink(path).encode('utf-8')
+    else:
+        with open(path, 'rb') as f:
+            data = f.read()
+    crc = zlib.crc32(data) & 0xFFFFFFFF
+    if data and not name.lower().endswith(STORED_SUFFIXES):
+        deflate = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        packed = deflate.compress(data) + deflate.flush()
+        if len(packed) < len(data):
+            return zipfile.ZIP_DEFLATED, crc, len(data), packed
+    return zipfile.ZIP_STORED, crc, len(data), data
+
+
+def _write_zip(f, members, compressed):
+    """
+    Write *members*, compressed as *compressed* yields them, to the open
+    file *f* as a zip archive
+    """
+    central = []
+    for (name, path, st), (method, crc, size, data) in zip(members,
+        compressed):
+        offset = f.tell()
+        if offset + len(data) > _MAX_SIZE:
+            raise ValueError('Archive is too large for a zip without zip64')
+        encoded = name.encode('utf-8')
+        dostime, dosdate = _dos_time(st.st_mtime)
+        f.write(_LOCAL.pack(0x04034b50, _VERSION, _UTF8, method, dostime,
+            dosdate, crc, len(data), size, len(encoded), 0))
+        f.write(encoded)
+        f.write(data)
+        attr = (st.st_mode & 0xFFFF) << 16
+        if stat.S_ISDIR(st.st_mode):
+            # MS-DOS directory flag
+            attr |= 0x10
+        central.append(_CENTRAL.pack(0x02014b50, _MADE_BY, _VERSION, _UTF8,
+            method, dostime, dosdate, crc, len(data), size, len(encoded), 0,
+            0, 0, 0, attr, offset) + encoded)
+    start = f.tell()
+    for record in central:
+        f.write(record)
+    f.write(_END.pack(0x06054b50, 0, 0, len(central), len(central),
+        f.tell() - start, start, 0))
+
+
+def _write_zip64(path, members):
+    """
+    Write *members* to a zip archive at *path* with :mod:`zipfile`, which
+    adds zip64 records where needed. Links are stored like
+    :func:`_compress` stores them, rather than followed.
+    """
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED,
+        allowZip64=True) as zf:
+        for name, member_path, st in members:
+            method = zipfile.ZIP_STORED if name.lower().endswith(
+                STORED_SUFFIXES) else zipfile.ZIP_DEFLATED
+            if stat.S_ISREG(st.st_mode):
+                zf.write(member_path, name, method)
+                continue
+            info = zipfile.ZipInfo(name,
+                time.localtime(max(st.st_mtime, 315532800))[:6])
+            info.create_system = 3
+            info.external_attr = (st.st_mode & 0xFFFF) << 16
+            if stat.S_ISDIR(st.st_mode):
+                info.external_attr |= 0x10
+                zf.writestr(info, b'')
+            else:
+                info.compress_type = zipfile.ZIP_STORED
+                zf.writestr(info, os.readlink(member_path).encode('utf-8'))
+
+
+def pack_subject(subject_dir, path, threads=None, level=6):
+    """
+    Pack *subject_dir* into the zip archive *path*, compressing members
+    in *threads* threads (default: CPU count).
+
+    Subjects too large for a plain zip (4 GB or 65535 members) are
+    packed by :mod:`zipfile`, with zip64 records, in one thread.
+
+    :return: number of members
+    :rtype: int
+    """
+    members = _members(subject_dir)
+    total = sum(st.st_size for _, _, st in members)
+    tmp = '{}.{:d}.tmp'.format(path, os.getpid())
+    if len(members) >= _MAX_ENTRIES or total >= _MAX_SIZE:
+        try:
+            _write_zip64(tmp, members)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        os.rename(tmp, path)
+        return len(members)
+    threads = threads or cpu_count()
+    pool = ThreadPool(threads)
+
+    def compressed():
+        size = threads * BATCH
+        for start in range(0, len(members), size):
+            batch = members[start:start + size]
+            for result in pool.map(lambda m: _compress(m, level), batch):
+                yield result
+
+    try:
+        with open(tmp, 'wb') as f:
+            _write_zip(f, members, compressed())
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        pool.close()
+        pool.join()
+    os.rename(tmp, path)
+    return len(members)
+
+
+def archive_subject(subject_id, archive_dir, subjects_dir=None,
+    prune=PRUNE, threads=None, level=6, remove=False):
+    """
+    Prune a finished subject and pack it into
+    ``<archive_dir>/<subject_id>.zip``.
+
+    :param str subject_id: subject identifier
+    :param str archive_dir: directory for the archive, created if need be
+    :param str subjects_dir: default ``$SUBJECTS_DIR``
+    :param prune: shell patterns of files to remove first, relative to the
+      subject directory (see :func:`prune_subject`); None to keep all
+    :param int threads: compression threads (default: CPU count)
+    :param int level: ``zlib`` compression level
+    :param boolean remove: remove the subject directory once the archive
+      is written and has been checked
+    :return: path to the archive
+    :rtype: str
+    :raises: ValueError if the subject doesn't exist or ``recon-all`` is
+      running on it
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.archive import archive_subject
+      >>> archive_subject('sub0001', '/archive', remove=True)
+      '/archive/sub0001.zip'
+    """
+    sd = subjects_dir or os.environ['SUBJECTS_DIR']
+    subject_dir = join(sd, subject_id)
+    if not os.path.isdir(subject_dir):
+        raise ValueError('{} not found'.format(subject_dir))
+    if glob.glob(join(subject_dir, 'scripts', 'IsRunning*')):
+        raise ValueError('recon-all is running on {}'.format(subject_dir))
+    if not os.path.isdir(archive_dir):
+        os.makedirs(archive_dir)
+    if prune:
+        removed = prune_subject(subject_dir, prune)
+        logger.info('%s: pruned %d files', subject_id, len(removed))
+    path = archive_path(archive_dir, subject_id)
+    count = pack_subject(subject_dir, path, threads=threads, level=level)
+    logger.info('%s: packed %d members into %s', subject_id, count, path)
+    if remove:
+        with zipfile.ZipFile(path) as zf:
+            bad = zf.testzip()
+        if bad is not None:
+            raise ValueError('{} is corrupt at {}, keeping {}'.format(path,
+                bad, subject_dir))
+        shutil.rmtree(subject_dir)
+    return path
+
+
+class SubjectArchive(object):
+    """
+    Read files of an archived subject without extracting it.
+
+    Names are relative to the subject directory, e.g. ``stats/aseg.stats``.
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.archive import SubjectArchive
+      >>> with SubjectArchive('/archive/sub0001.zip') as archive:
+      ...     aseg = archive.read('stats/aseg.stats')
+      ...     labels = archive.names('label/*.label')
+    """
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+        names = self._zip.namelist()
+        self.subject_id = names[0].split('/', 1)[0] if names else None
+
+    def _name(self, name):
+        return '{}/{}'.format(self.subject_id, name)
+
+    def names(self, pattern='*'):
+        "Files (not directories) matching the shell *pattern*, sorted"
+        offset = len(self.subject_id) + 1
+        return sorted(name[offset:] for name in self._zip.namelist()
+            if not name.endswith('/') and fnmatch(name[offset:], pattern))
+
+    def open(self, name):
+        "File-like object reading *name*"
+        return self._zip.open(self._name(name))
+
+    def read(self, name):
+        ":rtype: bytes"
+        return self._zip.read(self._name(name))
+
+    def extract(self, subjects_dir):
+        "Restore the subject directory under *subjects_dir*"
+        self._zip.extractall(subjects_dir)
+        return join(subjects_dir, self.subject_id)
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_member(path, name):
+    """
+    Contents of *name* (relative to the subject directory) in the
+    archive at *path*
+
+    :rtype: bytes
+    """
+    with SubjectArchive(path) as archive:
+        return archive.read(name)
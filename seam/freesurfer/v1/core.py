@@ -9,13 +9,64 @@ Core functions
 __author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
 __copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
 
+import io
 import os
+from itertools import repeat
 
-from ...util import STRING_TYPE
+from ...util import STRING_TYPE, shell_quote
+from ...render import CommandTemplate
 
 base_parts = ['recon-all', '-s {subject_id}']
+all_parts = base_parts + ['-all',
+                          '-qcache',
+                          '-measure thickness',
+                          '-measure curv',
+                          '-measure sulc',
+                          '-measure area',
+                          '-measure jacobian_white']
+
+# Compiled once, see seam.render
+RECON_ALL = CommandTemplate(' '.join(all_parts))
+RECON_ALL_THREADS = CommandTemplate(' '.join(all_parts +
+    ['-openmp {threads:d}']))
+RECON_INPUT = CommandTemplate(' '.join(base_parts + ['-i {data}']))
+# Longitudinal stream: a base (template) from every timepoint, then each
+# timepoint again against the base
+RECON_BASE = CommandTemplate('recon-all -base {base_id} {tp_flags} -all')
+RECON_LONG = CommandTemplate(' '.join(['recon-all',
+    '-long {timepoint_id} {base_id}'] + all_parts[2:]))
+# Partial reruns after manual edits, e.g. -autorecon2-wm -autorecon3
+RECON_EDITS = CommandTemplate(' '.join(base_parts + ['{stages}'] +
+    all_parts[3:]))
+TKMEDIT_TCL = CommandTemplate("""for {{ set i {beg} }} {{ $i < {end} }} {{ incr i {step} }} {{
+SetSlice $i
+RedrawScreen
+SaveTIFF {tiff_path}
+}}
+exit
+""")
+TKMEDIT_CMD = CommandTemplate(
+    "tkmedit {subject_id} {volume} {flag_string}-tcl {tcl_path}")
+TKSURFER_TCL = CommandTemplate("""make_lateral_view;
+redraw;
+save_tiff {basepath}-lateral.tiff;
+rotate_brain_y 180;
+redraw;
+save_tiff {basepath}-medial.tiff;
+labl_import_annotation {annot};
+redraw;
+make_lateral_view;
+redraw;
+save_tiff {basepath}-annot-lateral.tiff;
+rotate_brain_y 180;
+redraw;
+save_tiff {basepath}-annot-medial.tiff;
+exit;""")
+TKSURFER_CMD = CommandTemplate(
+    "tksurfer {subject_id} {hemi} {surface} {flag_string}-tcl {tcl_path}")
+ANNOT2LABEL_CMD = CommandTemplate("mri_annotation2label --subject {subject_id} --hemi {hemi} --annotation {annot_path} --outdir {outdir} --surface {surface}")
 
-def recon_all(subject_id, flags=None):
+def recon_all(subject_id, flags=None, threads=None):
     """
     This function supplies the ``recon-all -all`` command. This command
     will run the entire anatomical analysis suite of Freesurfer.
@@ -23,6 +74,7 @@ def recon_all(subject_id, flags=None):
     :note: Use :func:`seam.freesurfer.recon_input` to setup this subject
     :param str subject_id: Subject identifier on which to run ``recon-all``
     :param list flags: command-line flags to pass to ``recon-all``
+    :param int threads: OpenMP threads for ``recon-all`` to use (``-openmp``)
     :return: command that will execute ``recon-all -all``
     :rtype: str
 
@@ -31,17 +83,149 @@ def recon_all(subject_id, flags=None):
       >>> from seam.freesurfer import recon_all
       >>> recon_all('sub0001', flags=['-use-gpu'])
       'recon-all -s sub0001 -all -qcache -measure thickness -measure curv -measure sulc -measure area -measure jacobian_white -use-gpu'
+      >>> recon_all('sub0001', threads=4)
+      'recon-all -s sub0001 -all -qcache -measure thickness -measure curv -measure sulc -measure area -measure jacobian_white -openmp 4'
     """
-    parts = base_parts + ['-all',
-                          '-qcache',
-                          '-measure thickness',
-                          '-measure curv',
-                          '-measure sulc',
-                          '-measure area',
-                          '-measure jacobian_white']
+    if threads:
+        cmd = RECON_ALL_THREADS.render(subject_id=subject_id, threads=threads)
+    else:
+        cmd = RECON_ALL.render(subject_id=subject_id)
     if flags:
-        parts.extend(flags)
-    return ' '.join(parts).format(**locals())
+        cmd = ' '.join([cmd] + list(flags))
+    return cmd
+
+
+def recon_all_resume(subject_id, flags=None, threads=None):
+    """
+    Supplies the command carrying on an interrupted :func:`recon_all`:
+    ``recon-all -make all`` runs only the stages whose outputs are missing
+    or out of date, then the ``-qcache`` maps are made.
+
+    :param str subject_id: subject identifier
+    :param list flags: command-line flags to pass to ``recon-all``
+    :param int threads: OpenMP threads for ``recon-all`` to use (``-openmp``)
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.core import recon_all_resume
+      >>> recon_all_resume('sub0001')
+      'recon-all -s sub0001 -make all && recon-all -s sub0001 -qcache -measure thickness -measure curv -measure sulc -measure area -measure jacobian_white'
+    """
+    make, qcache = [_threads_and_flags(' '.join(base_parts + parts).format(
+        subject_id=subject_id), flags, threads)
+        for parts in (['-make all'], all_parts[3:])]
+    return '{} && {}'.format(make, qcache)
+
+
+def _threads_and_flags(cmd, flags, threads):
+    if threads:
+        cmd = '{} -openmp {:d}'.format(cmd, threads)
+    if flags:
+        cmd = ' '.join([cmd] + list(flags))
+    return cmd
+
+
+def recon_base(base_id, timepoint_ids, flags=None, threads=None):
+    """
+    Supplies the ``recon-all -base`` command, which builds the unbiased
+    template of a longitudinal subject from its cross-sectionally
+    processed timepoints.
+
+    :param str base_id: identifier for the template subject
+    :param list timepoint_ids: subject identifiers of the timepoints
+    :param list flags: command-line flags to pass to ``recon-all``
+    :param int threads: OpenMP threads for ``recon-all`` to use (``-openmp``)
+
+    Usage::
+
+      >>> from seam.freesurfer import recon_base
+      >>> recon_base('sub0001', ['sub0001_tp1', 'sub0001_tp2'])
+      'recon-all -base sub0001 -tp sub0001_tp1 -tp sub0001_tp2 -all'
+    """
+    tp_flags = ' '.join('-tp {}'.format(tp) for tp in timepoint_ids)
+    return _threads_and_flags(RECON_BASE.render(base_id=base_id,
+        tp_flags=tp_flags), flags, threads)
+
+
+def recon_base_resume(base_id, timepoint_ids, flags=None, threads=None):
+    """
+    Supplies the command carrying on an interrupted :func:`recon_base`
+    with ``-make all``, like :func:`recon_all_resume`.
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.core import recon_base_resume
+      >>> recon_base_resume('sub0001', ['sub0001_tp1', 'sub0001_tp2'])
+      'recon-all -base sub0001 -tp sub0001_tp1 -tp sub0001_tp2 -make all'
+    """
+    tp_flags = ' '.join('-tp {}'.format(tp) for tp in timepoint_ids)
+    return _threads_and_flags('recon-all -base {} {} -make all'.format(
+        base_id, tp_flags), flags, threads)
+
+
+def recon_long(timepoint_id, base_id, flags=None, threads=None):
+    """
+    Supplies the ``recon-all -long`` command, which reprocesses a
+    timepoint against its base. Results are written to the subject
+    ``<timepoint_id>.long.<base_id>`` (see :func:`long_subject_id`).
+
+    :param str timepoint_id: subject identifier of the timepoint
+    :param str base_id: identifier of the template subject
+    :param list flags: command-line flags to pass to ``recon-all``
+    :param int threads: OpenMP threads for ``recon-all`` to use (``-openmp``)
+
+    Usage::
+
+      >>> from seam.freesurfer import recon_long
+      >>> recon_long('sub0001_tp1', 'sub0001', threads=2)
+      'recon-all -long sub0001_tp1 sub0001 -all -qcache -measure thickness -measure curv -measure sulc -measure area -measure jacobian_white -openmp 2'
+    """
+    return _threads_and_flags(RECON_LONG.render(timepoint_id=timepoint_id,
+        base_id=base_id), flags, threads)
+
+
+def recon_long_resume(timepoint_id, base_id, flags=None, threads=None):
+    """
+    Supplies the command carrying on an interrupted :func:`recon_long`
+    with ``-make all`` then the ``-qcache`` maps, like
+    :func:`recon_all_resume`.
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.core import recon_long_resume
+      >>> recon_long_resume('sub0001_tp1', 'sub0001')
+      'recon-all -long sub0001_tp1 sub0001 -make all && recon-all -long sub0001_tp1 sub0001 -qcache -measure thickness -measure curv -measure sulc -measure area -measure jacobian_white'
+    """
+    make, qcache = [_threads_and_flags(' '.join(['recon-all',
+        '-long {} {}'.format(timepoint_id, base_id)] + parts), flags, threads)
+        for parts in (['-make all'], all_parts[3:])]
+    return '{} && {}'.format(make, qcache)
+
+
+def recon_edits(subject_id, stages, flags=None, threads=None):
+    """
+    Supplies a ``recon-all`` command rerunning only *stages* (e.g. after
+    manual edits, see :mod:`seam.freesurfer.v1.edits`), then refreshing
+    the ``-qcache`` maps like :func:`recon_all`.
+
+    :param str subject_id: subject identifier
+    :param list stages: ``recon-all`` stage flags
+    :param list flags: command-line flags to pass to ``recon-all``
+    :param int threads: OpenMP threads for ``recon-all`` to use (``-openmp``)
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.core import recon_edits
+      >>> recon_edits('sub0001', ['-autorecon-pial'])
+      'recon-all -s sub0001 -autorecon-pial -qcache -measure thickness -measure curv -measure sulc -measure area -measure jacobian_white'
+    """
+    return _threads_and_flags(RECON_EDITS.render(subject_id=subject_id,
+        stages=' '.join(stages)), flags, threads)
+
+
+def long_subject_id(timepoint_id, base_id):
+    "Subject ``recon-all -long`` writes *timepoint_id*'s results to"
+    return '{}.long.{}'.format(timepoint_id, base_id)
 
 
 def recon_input(subject_id, data):
@@ -65,13 +249,45 @@ def recon_input(subject_id, data):
       >>> recon_input('sub0001', ['/path/first.nii', '/path/second.nii'])
       'recon-all -s sub0001 -i /path/first.nii -i /path/second.nii'
     """
-    parts = list(base_parts)
-    if isinstance(data, STRING_TYPE):
-        parts.append('-i {}'.format(data))
-    else:
+    if not isinstance(data, STRING_TYPE):
         # We were passed a list of images
-        parts.extend(['-i {}'.format(image) for image in data])
-    return ' '.join(parts).format(**locals())
+        if not data:
+            return ' '.join(base_parts).format(subject_id=subject_id)
+        data = ' -i '.join(data)
+    return RECON_INPUT.render(subject_id=subject_id, data=data)
+
+
+def recon_input_resume(subject_id, data, subjects_dir):
+    """
+    Supplies the command carrying on an interrupted :func:`recon_input`.
+    It's skipped once every input has been converted (``mri/orig/001.mgz``,
+    ``002.mgz``...); otherwise, as ``recon-all -i`` refuses a subject
+    directory that exists already, a partial one is moved aside to
+    ``<subject_id>.partial`` and the inputs converted again.
+
+    :param str subject_id: subject identifier
+    :param str,list data: path(s) to input data
+    :param str subjects_dir: ``SUBJECTS_DIR`` the subject is in
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.core import recon_input_resume
+      >>> recon_input_resume('sub0001', '/data.nii', '/subjects')
+      'if [ -e /subjects/sub0001/mri/orig/001.mgz ]; then echo "sub0001 already set up"; else { [ ! -e /subjects/sub0001 ] || { rm -rf /subjects/sub0001.partial && mv /subjects/sub0001 /subjects/sub0001.partial; }; } && recon-all -s sub0001 -i /data.nii; fi'
+    """
+    subject_dir = os.path.join(subjects_dir, subject_id)
+    n_inputs = 1 if isinstance(data, STRING_TYPE) else len(data)
+    converted = ' && '.join('[ -e {} ]'.format(shell_quote(os.path.join(
+        subject_dir, 'mri', 'orig', '{:03d}.mgz'.format(i))))
+        for i in range(1, n_inputs + 1)) or \
+        '[ -d {} ]'.format(shell_quote(subject_dir))
+    partial = subject_dir + '.partial'
+    move_aside = '[ ! -e {sd} ] || {{ rm -rf {partial} && mv {sd} ' \
+        '{partial}; }}'.format(sd=shell_quote(subject_dir),
+        partial=shell_quote(partial))
+    return 'if {}; then echo "{} already set up"; else {{ {}; }} && {}; ' \
+        'fi'.format(converted, subject_id, move_aside,
+        recon_input(subject_id, data))
 
 
 def tkmedit_screenshot_tcl(basepath, beg=5, end=256, step=10):
@@ -95,15 +311,8 @@ def tkmedit_screenshot_tcl(basepath, beg=5, end=256, step=10):
       >>> f.close()
       $ tkmedit sub0001 brain.finalsurfs.mgz -aseg -surfs -tcl tkmedit_screenshots.tcl
     """
-    template = """for {{ set i {beg} }} {{ $i < {end} }} {{ incr i {step} }} {{
-SetSlice $i
-RedrawScreen
-SaveTIFF {tiff_path}
-}}
-exit
-"""
-    tiff_path = os.path.join(basepath, 'tkmedit-$i.tiff')
-    return template.format(**locals())
+    return TKMEDIT_TCL.render(beg=beg, end=end, step=step,
+        tiff_path=os.path.join(basepath, 'tkmedit-$i.tiff'))
 
 
 def tkmedit_screenshot_cmd(subject_id, volume, tcl_path, flags=None):
@@ -122,10 +331,9 @@ def tkmedit_screenshot_cmd(subject_id, volume, tcl_path, flags=None):
       >>> tkmedit_screenshot_cmd('sub0001', 'brain.finalsurfs.mgz', '/path/tkmedit.tcl', ['-aseg', '-surfs'])
       'tkmedit sub0001 brain.finalsurfs.mgz -aseg -surfs -tcl /path/tkmedit.tcl'
     """
-    template = "tkmedit {subject_id} {volume} {flag_string} -tcl {tcl_path}"
-    if flags:
-        flag_string = ' '.join(flags)
-    return template.format(**locals())
+    flag_string = ' '.join(flags) + ' ' if flags else ''
+    return TKMEDIT_CMD.render(subject_id=subject_id, volume=volume,
+        flag_string=flag_string, tcl_path=tcl_path)
 
 
 def tksurfer_screenshot_tcl(basepath, annot='aparc.a2009s.annot'):
@@ -152,22 +360,7 @@ def tksurfer_screenshot_tcl(basepath, annot='aparc.a2009s.annot'):
      >>> f.write(tksurfer_screenshot_tcl('/path/to/screenshots/lh'))
      >>> f.close()
     """
-    template = """make_lateral_view;
-redraw;
-save_tiff {basepath}-lateral.tiff;
-rotate_brain_y 180;
-redraw;
-save_tiff {basepath}-medial.tiff;
-labl_import_annotation {annot};
-redraw;
-make_lateral_view;
-redraw;
-save_tiff {basepath}-annot-lateral.tiff;
-rotate_brain_y 180;
-redraw;
-save_tiff {basepath}-annot-medial.tiff;
-exit;"""
-    return template.format(**locals())
+    return TKSURFER_TCL.render(basepath=basepath, annot=annot)
 
 
 def tksurfer_screenshot_cmd(subject_id, hemi, surface, tcl_path, flags=None):
@@ -187,12 +380,9 @@ def tksurfer_screenshot_cmd(subject_id, hemi, surface, tcl_path, flags=None):
       >>> tksurfer_screenshot_cmd('sub0001', 'lh', 'inflated', '/path/tksurfer.lh.tcl', ['-gray'])
       'tksurfer sub0001 lh inflated -gray -tcl /path/tksurfer.lh.tcl'
     """
-    template = "tksurfer {subject_id} {hemi} {surface} {flag_string}-tcl {tcl_path}"
-    if flags:
-        flag_string = ' '.join(flags) + ' '
-    else:
-        flag_string = ''
-    return template.format(**locals())
+    flag_string = ' '.join(flags) + ' ' if flags else ''
+    return TKSURFER_CMD.render(subject_id=subject_id, hemi=hemi,
+        surface=surface, flag_string=flag_string, tcl_path=tcl_path)
 
 
 def annot2label_cmd(subject_id, hemi, annot_path, outdir, surface='white'):
@@ -205,5 +395,281 @@ def annot2label_cmd(subject_id, hemi, annot_path, outdir, surface='white'):
     :param str outdir: output directory to place labels
     :param str surface: surface to use when generating coords in labels
     """
-    template = "mri_annotation2label --subject {subject_id} --hemi {hemi} --annotation {annot_path} --outdir {outdir} --surface {surface}"
-    return template.format(**locals())
+    return ANNOT2LABEL_CMD.render(subject_id=subject_id, hemi=hemi,
+        annot_path=annot_path, outdir=outdir, surface=surface)
+
+
+def annot2label_native_cmd(subject_id, annot, outdir, surface='white',
+    hemis=('lh', 'rh')):
+    """
+    Command running :func:`seam.freesurfer.v1.labels.annot2label` for
+    both hemispheres in one process, in place of two
+    ``mri_annotation2label`` commands (requires NumPy where it runs).
+
+    :param str annot: annotation name, e.g. ``aparc.a2009s``
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.core import annot2label_native_cmd
+      >>> annot2label_native_cmd('sub0001', 'aparc.a2009s', '/subjects/sub0001/label')
+      'seam annot2label sub0001 aparc.a2009s /subjects/sub0001/label --surface white --hemi lh --hemi rh'
+    """
+    parts = ['seam annot2label', subject_id, annot, outdir,
+        '--surface {}'.format(surface)]
+    parts.extend('--hemi {}'.format(hemi) for hemi in hemis)
+    return ' '.join(parts)
+
+
+def _render_cmd(command, subject_id, outdir, threads):
+    cmd = 'seam {} {} {}'.format(command, subject_id, shell_quote(outdir))
+    if threads:
+        cmd += ' --threads {:d}'.format(threads)
+    return cmd
+
+
+def render_slices_cmd(subject_id, outdir, threads=None):
+    """
+    Command rendering *subject_id*'s QC slices with
+    :func:`seam.freesurfer.v1.slices.render_slices` in place of
+    ``tkmedit`` (requires NumPy where it runs, but no X server).
+
+    :param int threads: slices rendered at once (default: one per CPU)
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.core import render_slices_cmd
+      >>> render_slices_cmd('sub0001', '/scripts/sub0001_screenshots', threads=4)
+      'seam render-slices sub0001 /scripts/sub0001_screenshots --threads 4'
+    """
+    return _render_cmd('render-slices', subject_id, outdir, threads)
+
+
+def render_surfaces_cmd(subject_id, outdir, threads=None):
+    """
+    Command rendering *subject_id*'s surface views with
+    :func:`seam.freesurfer.v1.surfaces.render_surfaces` in place of
+    ``tksurfer`` (requires NumPy where it runs, but no X server).
+
+    :param int threads: hemispheres rendered at once (default: all)
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.core import render_surfaces_cmd
+      >>> render_surfaces_cmd('sub0001', '/scripts/sub0001_screenshots')
+      'seam render-surfaces sub0001 /scripts/sub0001_screenshots'
+    """
+    return _render_cmd('render-surfaces', subject_id, outdir, threads)
+
+
+def remove_locks_cmd(subject_dir):
+    """
+    Command removing the ``IsRunning`` locks ``recon-all`` leaves behind
+    when it's killed, which would stop it from running again.
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.core import remove_locks_cmd
+      >>> remove_locks_cmd('/data/subjects/sub0001')
+      'rm -f /data/subjects/sub0001/scripts/IsRunning*'
+    """
+    return 'rm -f {}/scripts/IsRunning*'.format(shell_quote(subject_dir))
+
+
+def archive_cmd(subject_id, archive_dir, remove=True):
+    """
+    Command pruning & packing *subject_id* into *archive_dir* with
+    :func:`seam.freesurfer.v1.archive.archive_subject`, by default
+    removing the subject directory once it's archived.
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.core import archive_cmd
+      >>> archive_cmd('sub0001', '/archive')
+      'seam archive sub0001 /archive --remove'
+    """
+    cmd = 'seam archive {} {}'.format(subject_id, shell_quote(archive_dir))
+    if remove:
+        cmd += ' --remove'
+    return cmd
+
+
+def template_link_cmd(subjects_dir, template='fsaverage', mode='symlink',
+    source=None):
+    """
+    Build a command that links *template* into *subjects_dir* once, under
+    a ``flock`` so concurrent subjects sharing the directory don't race.
+
+    :param str subjects_dir: SUBJECTS_DIR to provision
+    :param str template: template subject name
+    :param str mode: ``'symlink'`` or ``'hardlink'`` (``cp -al``, copying
+      with ``cp -a`` where the template is on another filesystem)
+    :param str source: template to link (default is the template in
+      ``$FREESURFER_HOME/subjects``, resolved when the command runs)
+
+    Usage::
+
+      >>> from seam.freesurfer import template_link_cmd
+      >>> print(template_link_cmd('/scratch/subjects'))
+      flock /scratch/subjects/.fsaverage.lock -c 'test -e /scratch/subjects/fsaverage -o -L /scratch/subjects/fsaverage || ln -s "$FREESURFER_HOME"/subjects/fsaverage /scratch/subjects/fsaverage'
+    """
+    if source is None:
+        source = '"$FREESURFER_HOME"/subjects/{}'.format(shell_quote(template))
+    else:
+        source = shell_quote(source)
+    dest = os.path.join(subjects_dir, template)
+    # Unique per flock shell, so a rename never lands on another's tree
+    tmp = shell_quote(dest + '.') + '$$.tmp'
+    dest = shell_quote(dest)
+    lock = shell_quote(os.path.join(subjects_dir, '.{}.lock'.format(
+        template)))
+    if mode == 'symlink':
+        link = 'ln -s {source} {dest}'
+    elif mode == 'hardlink':
+        # Partial trees are removed, whether linking, copying or the rename
+        # failed
+        link = ('{{ (cp -al {source} {tmp} 2>/dev/null || '
+            '{{ rm -rf {tmp}; cp -a {source} {tmp}; }}) '
+            '&& mv {tmp} {dest} || {{ rm -rf {tmp}; exit 1; }}; }}')
+    else:
+        raise ValueError("mode must be 'symlink' or 'hardlink'")
+    inner = ('test -e {dest} -o -L {dest} || ' + link).format(**locals())
+    return 'flock {} -c {}'.format(lock, shell_quote(inner))
+
+
+# Batch variants
+#
+# Each takes columns (lists, tuples, NumPy arrays, pandas Series...) where
+# the scalar function takes a value, and broadcasts any argument given as a
+# single value. They return a list of commands or, given *out*, write one
+# command per line to it and return how many were written. *out* may be an
+# :mod:`io` text stream or a native file on either Python.
+
+def _column(value):
+    if value is None or isinstance(value, (STRING_TYPE, int, float)) or \
+        getattr(value, 'ndim', 1) == 0:
+        # A single value, including NumPy scalars
+        return None
+    if hasattr(value, 'tolist'):
+        # NumPy arrays & pandas Series: native Python values format faster
+        return value.tolist()
+    return list(value)
+
+def _rows(*values):
+    columns = [_column(v) for v in values]
+    lengths = set(len(c) for c in columns if c is not None)
+    if len(lengths) > 1:
+        raise ValueError('Columns have different lengths: {}'.format(
+            ', '.join(str(n) for n in sorted(lengths))))
+    n = lengths.pop() if lengths else 1
+    return zip(*[c if c is not None else repeat(v, n)
+        for c, v in zip(columns, values)])
+
+def _emit(commands, out):
+    if out is None:
+        return list(commands)
+    # io text streams only take unicode, which native strs aren't on Python 2
+    text = isinstance(out, io.TextIOBase)
+    newline = u'\n' if text else '\n'
+    count = 0
+    for cmd in commands:
+        if text and isinstance(cmd, bytes):
+            cmd = cmd.decode('utf-8')
+        out.write(cmd + newline)
+        count += 1
+    return count
+
+
+def recon_all_cmds(subject_ids, flags=None, threads=None, out=None):
+    """
+    :func:`recon_all` for many subjects.
+
+    :param subject_ids: column of subject identifiers
+    :param list flags: flags for every command
+    :param threads: ``-openmp`` threads, one value or a column
+    :param out: file-like object to write commands to, one per line
+    :return: the commands, or how many were written to *out*
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.core import recon_all_cmds
+      >>> import sys
+      >>> recon_all_cmds(['sub0001', 'sub0002'], threads=[4, None], out=sys.stdout)
+      recon-all -s sub0001 -all -qcache -measure thickness -measure curv -measure sulc -measure area -measure jacobian_white -openmp 4
+      recon-all -s sub0002 -all -qcache -measure thickness -measure curv -measure sulc -measure area -measure jacobian_white
+      2
+    """
+    if _column(threads) is None and not threads:
+        commands = RECON_ALL.iter_render(_rows(subject_ids))
+    else:
+        # Missing values (None, or NaN from a pandas column) mean no -openmp
+        commands = (recon_all(subject_id, threads=int(n) if n and n == n
+            else None) for subject_id, n in _rows(subject_ids, threads))
+    if flags:
+        suffix = ' ' + ' '.join(flags)
+        commands = (cmd + suffix for cmd in commands)
+    return _emit(commands, out)
+
+
+def recon_input_many(mapping, out=None):
+    """
+    :func:`recon_input` for many subjects.
+
+    :param mapping: dict of subject identifier to input path(s), or
+      ``(subject_id, data)`` pairs
+    :param out: file-like object to write commands to, one per line
+    :return: the commands, or how many were written to *out*
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.core import recon_input_many
+      >>> recon_input_many([('sub0001', '/data/1.nii'), ('sub0002', ['/data/2a.nii', '/data/2b.nii'])])
+      ['recon-all -s sub0001 -i /data/1.nii', 'recon-all -s sub0002 -i /data/2a.nii -i /data/2b.nii']
+    """
+    if hasattr(mapping, 'items'):
+        mapping = mapping.items()
+    return _emit((recon_input(subject_id, data)
+        for subject_id, data in mapping), out)
+
+
+def annot2label_cmds(subject_ids, hemis, annot_paths, outdirs,
+    surface='white', out=None):
+    """
+    :func:`annot2label_cmd` for many rows. Every argument may be a column
+    or a single value.
+
+    :param out: file-like object to write commands to, one per line
+    :return: the commands, or how many were written to *out*
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.core import annot2label_cmds
+      >>> annot2label_cmds(['sub0001', 'sub0001'], ['lh', 'rh'],
+      ...     ['/sd/sub0001/label/lh.aparc.annot', '/sd/sub0001/label/rh.aparc.annot'],
+      ...     '/sd/sub0001/label')[1]
+      'mri_annotation2label --subject sub0001 --hemi rh --annotation /sd/sub0001/label/rh.aparc.annot --outdir /sd/sub0001/label --surface white'
+    """
+    return _emit(ANNOT2LABEL_CMD.iter_render(_rows(subject_ids, hemis,
+        annot_paths, outdirs, surface)), out)
+
+
+def tkmedit_screenshot_cmds(subject_ids, volume, tcl_paths, flags=None,
+    out=None):
+    """
+    :func:`tkmedit_screenshot_cmd` for many rows. *subject_ids*,
+    *volume* & *tcl_paths* may each be a column or a single value.
+    """
+    flag_string = ' '.join(flags) + ' ' if flags else ''
+    return _emit(TKMEDIT_CMD.iter_render(_rows(subject_ids, volume,
+        flag_string, tcl_paths)), out)
+
+
+def tksurfer_screenshot_cmds(subject_ids, hemis, surface, tcl_paths,
+    flags=None, out=None):
+    """
+    :func:`tksurfer_screenshot_cmd` for many rows. *subject_ids*,
+    *hemis*, *surface* & *tcl_paths* may each be a column or a single
+    value.
+    """
+    flag_string = ' '.join(flags) + ' ' if flags else ''
+    return _emit(TKSURFER_CMD.iter_render(_rows(subject_ids, hemis, surface,
+        flag_string, tcl_paths)), out)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" edits.py
+
+Recipe for rerunning only what manual edits invalidate
+
+After QC, reviewers edit a subject's volumes or add control points.
+Each edit only invalidates ``recon-all`` from some stage on:
+
+=====================================  =================================
+Edit                                   Rerun
+=====================================  =================================
+``tmp/control.dat`` (control points)   ``-autorecon2-cp -autorecon3``
+``mri/wm.mgz``                         ``-autorecon2-wm -autorecon3``
+``mri/brainmask.mgz``                  ``-autorecon-pial``
+``mri/brain.finalsurfs.manedit.mgz``   ``-autorecon-pial``
+=====================================  =================================
+
+:func:`detect_edits` finds the edit files that changed since the last
+run: a snapshot of their size, mtime & hash kept in
+``scripts/seam-edits.json`` is compared by size & mtime first and by
+hash only when those differ, so merely touched files don't count. A
+subject without a snapshot is compared with ``scripts/recon-all.done``,
+which ``recon-all`` writes when it finishes.
+
+:func:`build_edits_recipe` writes a script rerunning the earliest stage
+any change needs, then the screenshots, and the labels only when the
+annotations are rebuilt (``-autorecon3``). Its last step records a new
+snapshot.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import json
+from os.path import join
+
+from ...util import shell_quote
+from ...runner.retry import state_dir
+from .core import recon_edits, remove_locks_cmd
+from .inputs import hash_file
+from .recipe import subjects_dir, screenshots_dir, qc_steps, \
+    write_step_script
+
+# Edit files, relative to the subject directory, in pipeline order
+EDIT_FILES = ('tmp/control.dat', 'mri/wm.mgz', 'mri/brainmask.mgz',
+    'mri/brain.finalsurfs.manedit.mgz')
+# recon-all stages to rerun for each edit
+EDIT_STAGES = {
+    'tmp/control.dat': ('-autorecon2-cp', '-autorecon3'),
+    'mri/wm.mgz': ('-autorecon2-wm', '-autorecon3'),
+    'mri/brainmask.mgz': ('-autorecon-pial',),
+    'mri/brain.finalsurfs.manedit.mgz': ('-autorecon-pial',),
+}
+SNAPSHOT = 'seam-edits.json'
+
+
+def snapshot_path(subject_dir):
+    return join(subject_dir, 'scripts', SNAPSHOT)
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def read_snapshot(subject_dir):
+    "The recorded edit files of *subject_dir*, or None without a snapshot"
+    try:
+        with open(snapshot_path(subject_dir)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def snapshot_edits(subject_dir):
+    """
+    Record the size, mtime & hash of *subject_dir*'s edit files, as the
+    baseline :func:`detect_edits` compares with.
+
+    :return: the snapshot
+    :rtype: dict
+    """
+    snapshot = {}
+    for rel in EDIT_FILES:
+        path = join(subject_dir, rel)
+        st = _stat(path)
+        if st is not None:
+            snapshot[rel] = {'size': st.st_size, 'mtime': st.st_mtime,
+                'hash': hash_file(path)}
+    path = snapshot_path(subject_dir)
+    tmp = '{}.{:d}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f, indent=1, sort_keys=True)
+    os.rename(tmp, path)
+    return snapshot
+
+
+def detect_edits(subject_dir):
+    """
+    Find the edit files of *subject_dir* that changed since the last run.
+
+    :return: changed (added, modified or removed) edit files, relative
+      to *subject_dir*, in :data:`EDIT_FILES` order
+    :rtype: list
+    :raises: ValueError if the subject has no snapshot and hasn't
+      finished ``recon-all``
+    """
+    snapshot = read_snapshot(subject_dir)
+    if snapshot is None:
+        done = _stat(join(subject_dir, 'scripts', 'recon-all.done'))
+        if done is None:
+            raise ValueError("{} hasn't finished recon-all".format(
+                subject_dir))
+    changed = []
+    for rel in EDIT_FILES:
+        path = join(subject_dir, rel)
+        st = _stat(path)
+        if snapshot is None:
+            if st is not None and st.st_mtime > done.st_mtime:
+                changed.append(rel)
+            continue
+        recorded = snapshot.get(rel)
+        if st is None:
+            if recorded is not None:
+                changed.append(rel)
+        elif recorded is None:
+            changed.append(rel)
+        elif (st.st_size, st.st_mtime) != (recorded['size'],
+            recorded['mtime']) and hash_file(path) != recorded['hash']:
+            changed.append(rel)
+    return changed
+
+
+def edit_stages(changed):
+    """
+    The ``recon-all`` stages to rerun for *changed* edit files: those of
+    the earliest edit, as later stages rerun with it.
+
+    :rtype: list
+    """
+    for rel in EDIT_FILES:
+        if rel in changed:
+            return list(EDIT_STAGES[rel])
+    return []
+
+
+def edits_script_name(subject_id):
+    return "{}.edits.sh".format(subject_id)
+
+
+def snapshot_cmd(subject_dir):
+    "Command recording a snapshot of *subject_dir*'s edit files"
+    return 'seam snapshot-edits {}'.format(shell_quote(subject_dir))
+
+
+def build_edits_recipe(subject_id, script_dir, use_xvfb=False,
+    recon_flags=None, threads=None, max_attempts=3, retry_delay=30,
+    screenshot_format=None, delete_tiffs=False, native_labels=False,
+    tmp_dir=None, native_screenshots=False):
+    """
+    Build a script rerunning only what *subject_id*'s manual edits
+    invalidate, followed by the screenshots (and labels) that depend on it.
+
+    The parameters are those of
+    :func:`seam.freesurfer.v1.recipe.build_recipe`.
+
+    :return: path to the script, or None if no edits changed
+    :rtype: str
+    :note: Completed-step markers of a previous edits script for the
+      subject are cleared, so every step runs again
+    """
+    sd = subjects_dir(script_dir)
+    subject_dir = join(sd, subject_id)
+    stages = edit_stages(detect_edits(subject_dir))
+    if not stages:
+        return None
+    if not os.path.isdir(script_dir):
+        os.makedirs(script_dir)
+    steps = [("Rerun after edits: {}".format(' '.join(stages)),
+        'recon_edits', recon_edits(subject_id, stages, recon_flags,
+        threads))]
+    qc, _ = qc_steps(subject_id, script_dir, sd, use_xvfb=use_xvfb,
+        labels='-autorecon3' in stages, native_labels=native_labels,
+        screenshot_format=screenshot_format, delete_tiffs=delete_tiffs,
+        native_screenshots=native_screenshots, threads=threads)
+    steps.extend(qc)
+    steps.append(("Record the edits this run includes", 'snapshot_edits',
+        snapshot_cmd(subject_dir)))
+    script = join(script_dir, edits_script_name(subject_id))
+    state = state_dir(script)
+    if os.path.isdir(state):
+        for name in os.listdir(state):
+            if name.endswith('.done') or name == 'failed':
+                os.remove(join(state, name))
+    write_step_script(script, steps, threads=threads,
+        use_xvfb=use_xvfb and not native_screenshots, tmp_dir=tmp_dir,
+        max_attempts=max_attempts, retry_delay=retry_delay,
+        cleanup=[remove_locks_cmd(subject_dir)],
+        disk_paths=[subject_dir, join(script_dir,
+            screenshots_dir(subject_id))])
+    return script
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" environment.py
+
+Snapshot of the FreeSurfer environment for generated scripts
+
+Sourcing ``$FREESURFER_HOME/SetUpFreeSurfer.sh`` for every job runs
+dozens of subshells and reads FreeSurfer's configuration over NFS.
+:func:`write_environment` sources it once and writes the variables it
+sets as a small static file of ``export`` lines, which scripts built
+with ``build_recipe(..., freesurfer_env=path)`` source instead.
+
+The file's header records the ``FREESURFER_HOME`` it came from and a
+stamp of that installation (its ``build-stamp.txt`` and setup scripts).
+:func:`ensure_environment` recaptures it when the stamp no longer
+matches, and the file refuses to load where that ``FREESURFER_HOME``
+doesn't exist. ``SUBJECTS_DIR`` is left to the caller.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import sys
+import json
+import hashlib
+import subprocess
+import threading
+from os.path import join
+from datetime import datetime
+
+from ... import __version__ as version
+from ...util import shell_quote
+from ...runner.job import script_metadata, script_metadata_line
+
+SETUP_SCRIPT = 'SetUpFreeSurfer.sh'
+# Files whose change means the installation changed
+STAMP_FILES = ('build-stamp.txt', SETUP_SCRIPT, 'FreeSurferEnv.sh')
+# Set per run or by the shell, never captured
+EXCLUDE = ('SUBJECTS_DIR', 'PWD', 'OLDPWD', 'SHLVL', '_')
+
+_DUMP = 'import os, json; print(json.dumps(dict(os.environ)))'
+# Builds of a batch share the file, capture it once
+_lock = threading.Lock()
+
+
+def _freesurfer_home(freesurfer_home):
+    if freesurfer_home is None:
+        if 'FREESURFER_HOME' not in os.environ:
+            raise ValueError('$FREESURFER_HOME is not set and no '
+                'freesurfer_home was given')
+        freesurfer_home = os.environ['FREESURFER_HOME']
+    return os.path.abspath(freesurfer_home)
+
+
+def freesurfer_build(freesurfer_home=None):
+    "Contents of the installation's ``build-stamp.txt``, or None"
+    path = join(_freesurfer_home(freesurfer_home), 'build-stamp.txt')
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except (IOError, OSError):
+        return None
+
+
+def freesurfer_stamp(freesurfer_home=None):
+    """
+    Stamp of a FreeSurfer installation, changing when it's rebuilt or its
+    setup scripts change.
+
+    :rtype: str
+    """
+    home = _freesurfer_home(freesurfer_home)
+    digest = hashlib.sha1(home.encode('utf-8'))
+    for name in STAMP_FILES:
+        try:
+            st = os.stat(join(home, name))
+        except OSError:
+            continue
+        digest.update('{}:{:d}:{:d}'.format(name, st.st_size,
+            int(st.st_mtime)).encode('utf-8'))
+    build = freesurfer_build(home)
+    if build:
+        digest.update(build.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def _environ(freesurfer_home, source=None):
+    env = {'FREESURFER_HOME': freesurfer_home,
+        'PATH': os.environ.get('PATH', os.defpath),
+        'HOME': os.environ.get('HOME', '/')}
+    script = ''
+    if source:
+        script = 'source {} >/dev/null 2>&1 || exit 1; '.format(
+            shell_quote(source))
+    script += '{} -c {}'.format(shell_quote(sys.executable),
+        shell_quote(_DUMP))
+    out = subprocess.check_output(['bash', '-c', script], env=env)
+    return json.loads(out.decode('utf-8'))
+
+
+def capture_environment(freesurfer_home=None):
+    """
+    Source *freesurfer_home*'s ``SetUpFreeSurfer.sh`` in a clean shell
+    and find the variables it sets.
+
+    :return: ``(name, value)`` pairs of what it sets or changes (and
+      ``FREESURFER_HOME``), sorted by name, and the clean environment it
+      was sourced in
+    :rtype: tuple
+    :raises: ValueError if sourcing the setup script fails
+    """
+    home = _freesurfer_home(freesurfer_home)
+    setup = join(home, SETUP_SCRIPT)
+    if not os.path.isfile(setup):
+        raise ValueError('{} not found'.format(setup))
+    before = _environ(home)
+    try:
+        after = _environ(home, setup)
+    except subprocess.CalledProcessError:
+        raise ValueError("Sourcing {} failed".format(setup))
+    changed = []
+    for name in sorted(after):
+        value = after[name]
+        if name in EXCLUDE or (before.get(name) == value and
+            name != 'FREESURFER_HOME'):
+            continue
+        changed.append((name, value))
+    return changed, before
+
+
+def _export(name, value, before):
+    "``export`` line for *name*, a value extending the caller's as ``$NAME``"
+    old = before.get(name)
+    if old and value.endswith(':' + old):
+        return 'export {}={}:"${}"'.format(name,
+            shell_quote(value[:-len(old) - 1]), name)
+    if old and value.startswith(old + ':'):
+        return 'export {}="${}":{}'.format(name, name,
+            shell_quote(value[len(old) + 1:]))
+    return 'export {}={}'.format(name, shell_quote(value))
+
+
+def write_environment(path, freesurfer_home=None):
+    """
+    Capture the FreeSurfer environment (see :func:`capture_environment`)
+    into *path*, a file for scripts to source.
+
+    :return: the file's metadata (``freesurfer_home``,
+      ``freesurfer_stamp`` and, if known, ``freesurfer_build``)
+    :rtype: dict
+    """
+    home = _freesurfer_home(freesurfer_home)
+    changed, before = capture_environment(home)
+    metadata = [('freesurfer_home', home),
+        ('freesurfer_stamp', freesurfer_stamp(home))]
+    build = freesurfer_build(home)
+    if build:
+        metadata.append(('freesurfer_build', build.splitlines()[0]))
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    lines = ["# FreeSurfer environment captured by seam version {} at "
+        "{}".format(version, now)]
+    lines.extend(script_metadata_line(k, v) for k, v in metadata)
+    lines.extend(["",
+        "if [ ! -d {} ]; then".format(shell_quote(home)),
+        "    echo \"seam: FREESURFER_HOME {} not found\" >&2".format(home),
+        "    return 1",
+        "fi"])
+    lines.extend(_export(name, value, before) for name, value in changed)
+    tmp = '{}.{:d}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write('\n'.join(lines))
+        f.write('\n')
+    os.rename(tmp, path)
+    return dict(metadata)
+
+
+def read_environment(path):
+    "Metadata of an environment file, empty if it can't be read"
+    return script_metadata(path)
+
+
+def is_current(path, freesurfer_home=None):
+    """
+    Whether the environment file *path* was captured from
+    *freesurfer_home* as it is now.
+
+    :rtype: bool
+    """
+    home = _freesurfer_home(freesurfer_home)
+    metadata = read_environment(path)
+    return metadata.get('freesurfer_home') == home and \
+        metadata.get('freesurfer_stamp') == freesurfer_stamp(home)
+
+
+def ensure_environment(path, freesurfer_home=None):
+    """
+    Capture the environment into *path* unless it's already current.
+
+    :param str path: environment file
+    :param str freesurfer_home: defaults to ``$FREESURFER_HOME``
+    :return: the file's metadata
+    :rtype: dict
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.environment import ensure_environment
+      >>> ensure_environment('/scripts/freesurfer-env.sh')
+    """
+    with _lock:
+        if not is_current(path, freesurfer_home):
+            write_environment(path, freesurfer_home)
+        return read_environment(path)
+
+
+def source_lines(path, exit_code=1):
+    "Script lines sourcing the environment file *path*"
+    return ["# FreeSurfer environment snapshot, instead of SetUpFreeSurfer.sh",
+        "source {} || exit {:d}".format(shell_quote(path), exit_code)]
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" formats.py
+
+Readers & writers for Freesurfer's file formats
+
+:note: These functions require `NumPy <http://www.numpy.org>`_.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import gzip
+
+import numpy as np
+
+TRIANGLE_MAGIC = b'\xff\xff\xfe'
+CURV_MAGIC = b'\xff\xff\xff'
+# magic, vertices, faces & values per vertex precede the values
+CURV_HEADER_SIZE = 15
+# Everything before an MGH volume's voxels
+MGH_HEADER_SIZE = 284
+MGH_TYPES = {0: '>u1', 1: '>i4', 3: '>f4', 4: '>i2'}
+
+
+def _read_int(f):
+    return int(np.frombuffer(f.read(4), '>i4')[0])
+
+def _read_string(f):
+    length = _read_int(f)
+    return f.read(length).rstrip(b'\x00').decode('utf-8', 'replace')
+
+
+def read_geometry(path):
+    """
+    Read a triangular surface (e.g. ``lh.white``).
+
+    :param str path: path to the surface
+    :return: vertex coordinates (float32, vertices x 3) & faces (int32,
+      faces x 3)
+    :rtype: tuple
+    """
+    with open(path, 'rb') as f:
+        if f.read(3) != TRIANGLE_MAGIC:
+            raise ValueError('{} is not a triangular surface'.format(path))
+        # "created by <user> on <date>" followed by a blank line
+        f.readline()
+        f.readline()
+        nvertices, nfaces = np.frombuffer(f.read(8), '>i4')
+        coords = np.frombuffer(f.read(int(nvertices) * 12), '>f4')
+        faces = np.frombuffer(f.read(int(nfaces) * 12), '>i4')
+    return (coords.reshape(-1, 3).astype(np.float32),
+        faces.reshape(-1, 3).astype(np.int32))
+
+
+def read_morph_data(path, mmap=True):
+    """
+    Read a per-vertex map in curv format (e.g. ``lh.thickness``,
+    ``lh.sulc``).
+
+    The values are memory-mapped rather than read, so nothing is copied
+    until they are used.
+
+    :param str path: path to the map
+    :param boolean mmap: map the file (default) instead of reading it
+    :return: one big-endian float32 per vertex
+    :rtype: :class:`numpy.ndarray` (a read-only :class:`numpy.memmap`
+      when *mmap*)
+    """
+    with open(path, 'rb') as f:
+        if f.read(3) != CURV_MAGIC:
+            raise ValueError('{} is not a curv format file'.format(path))
+        nvertices, _, per_vertex = np.frombuffer(f.read(12), '>i4')
+        if per_vertex != 1:
+            raise ValueError('{}: {:d} values per vertex is not supported'.format(
+                path, per_vertex))
+        if not mmap:
+            return np.frombuffer(f.read(int(nvertices) * 4), '>f4')
+    return np.memmap(path, '>f4', 'r', offset=CURV_HEADER_SIZE,
+        shape=(int(nvertices),))
+
+
+def read_mgh_header(path):
+    """
+    Read the header of an ``.mgh`` or ``.mgz`` volume.
+
+    :return: ``dims`` (width, height, depth, frames), ``dtype``,
+      ``voxel_size``, ``Mdc`` (3 x 3 direction cosines, one column per
+      axis), ``c_ras`` & ``good_ras``
+    :rtype: dict
+    """
+    opener = gzip.open if path.endswith('.mgz') else open
+    with opener(path, 'rb') as f:
+        return _mgh_header(f.read(MGH_HEADER_SIZE), path)
+
+def _mgh_header(buf, path):
+    if len(buf) < MGH_HEADER_SIZE:
+        raise ValueError('{} is truncated'.format(path))
+    version, width, height, depth, frames, kind, _ = np.frombuffer(buf[:28],
+        '>i4')
+    if version != 1 or kind not in MGH_TYPES:
+        raise ValueError('{} is not a supported MGH volume'.format(path))
+    good_ras = int(np.frombuffer(buf[28:30], '>i2')[0])
+    ras = np.frombuffer(buf[30:90], '>f4').astype(np.float64)
+    return {'dims': (int(width), int(height), int(depth), int(frames)),
+        'dtype': np.dtype(MGH_TYPES[kind]),
+        'voxel_size': tuple(ras[:3].tolist()),
+        'Mdc': ras[3:12].reshape(3, 3).T,
+        'c_ras': ras[12:15],
+        'good_ras': bool(good_ras)}
+
+def read_mgh(path, mmap=True):
+    """
+    Read an ``.mgh`` or ``.mgz`` volume, such as the surface maps
+    ``recon-all -qcache`` resamples onto ``fsaverage``.
+
+    Uncompressed volumes are memory-mapped, ``.mgz`` files must be
+    decompressed into memory.
+
+    :param str path: path to the volume
+    :param boolean mmap: map ``.mgh`` files (default) instead of reading them
+    :return: the voxels, shaped (width, height, depth, frames) in
+      Fortran order, and the header from :func:`read_mgh_header`
+    :rtype: tuple
+    """
+    if path.endswith('.mgz'):
+        with gzip.open(path, 'rb') as f:
+            buf = f.read()
+        header = _mgh_header(buf, path)
+        count = int(np.prod(header['dims']))
+        data = np.frombuffer(buf, header['dtype'], count, MGH_HEADER_SIZE)
+        return data.reshape(header['dims'], order='F'), header
+    header = read_mgh_header(path)
+    if mmap:
+        data = np.memmap(path, header['dtype'], 'r', offset=MGH_HEADER_SIZE,
+            shape=header['dims'], order='F')
+    else:
+        count = int(np.prod(header['dims']))
+        data = np.fromfile(path, header['dtype'], count,
+            offset=MGH_HEADER_SIZE).reshape(header['dims'], order='F')
+    return data, header
+
+
+def read_annot(path):
+    """
+    Read an annotation (e.g. ``lh.aparc.a2009s.annot``).
+
+    :param str path: path to the annotation
+    :return: ``(labels, ctab, names)`` where *labels* holds each vertex's
+      index into the color table (-1 where unlabelled), *ctab* the table
+      (entries x 5: r, g, b, transparency & annotation value) and *names*
+      the structure names
+    :rtype: tuple
+    """
+    with open(path, 'rb') as f:
+        nvertices = _read_int(f)
+        pairs = np.frombuffer(f.read(nvertices * 8), '>i4').reshape(-1, 2)
+        values = np.zeros(nvertices, np.int64)
+        values[pairs[:, 0]] = pairs[:, 1]
+        tag = f.read(4)
+        if len(tag) < 4 or np.frombuffer(tag, '>i4')[0] != 1:
+            raise ValueError('{} has no color table'.format(path))
+        ctab, names = _read_ctab(f, path)
+    # Vectorized lookup of each vertex's value in the color table
+    order = np.argsort(ctab[:, 4], kind='mergesort')
+    sorted_values = ctab[order, 4]
+    pos = np.clip(np.searchsorted(sorted_values, values), 0,
+        len(sorted_values) - 1)
+    labels = np.where(sorted_values[pos] == values, order[pos], -1)
+    return labels.astype(np.int32), ctab, names
+
+def _read_ctab(f, path):
+    n = _read_int(f)
+    rows, names = [], []
+    if n > 0:
+        # Original format: entries are indexed in order
+        _read_string(f)
+        for _ in range(n):
+            names.append(_read_string(f))
+            rows.append(np.frombuffer(f.read(16), '>i4'))
+    else:
+        if -n != 2:
+            raise ValueError('{}: unsupported color table version {:d}'.format(
+                path, -n))
+        max_index = _read_int(f)
+        _read_string(f)
+        entries = _read_int(f)
+        table = {}
+        for _ in range(entries):
+            index = _read_int(f)
+            name = _read_string(f)
+            table[index] = (name, np.frombuffer(f.read(16), '>i4'))
+        # Keep table positions meaningful even with gaps in the indices
+        for index in range(max_index):
+            name, rgbt = table.get(index, ('', np.zeros(4, '>i4')))
+            names.append(name)
+            rows.append(rgbt)
+    rgbt = np.array(rows, np.int64).reshape(-1, 4)
+    value = rgbt[:, 0] + (rgbt[:, 1] << 8) + (rgbt[:, 2] << 16)
+    return np.column_stack([rgbt, value]), names
+
+
+def label_text(vertices, coords, subject_id, values=None):
+    """
+    The ASCII label file for *vertices*, as ``mri_annotation2label``
+    writes it.
+
+    :param vertices: vertex numbers in the label
+    :param coords: coordinates of those vertices (n x 3)
+    :param str subject_id: subject the label belongs to
+    :param values: per-vertex statistic (default 0)
+    :rtype: str
+    """
+    vertices = np.asarray(vertices)
+    if values is None:
+        values = np.zeros(len(vertices))
+    lines = ['#!ascii label  , from subject {} vox2ras=TkReg'.format(
+        subject_id), '{:d}'.format(len(vertices))]
+    lines.extend('%d  %.3f  %.3f  %.3f %.10f' % row for row in zip(
+        vertices.tolist(), coords[:, 0].tolist(), coords[:, 1].tolist(),
+        coords[:, 2].tolist(), np.asarray(values).tolist()))
+    return '\n'.join(lines) + '\n'
+
+def write_label(path, vertices, coords, subject_id, values=None):
+    with open(path, 'w') as f:
+        f.write(label_text(vertices, coords, subject_id, values))
+
+def read_label(path):
+    """
+    Read an ASCII label file.
+
+    :return: vertex numbers & their coordinates (n x 3)
+    :rtype: tuple
+    """
+    data = np.loadtxt(path, skiprows=2, ndmin=2)
+    return data[:, 0].astype(np.int64), data[:, 1:4]
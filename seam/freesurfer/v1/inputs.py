@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" inputs.py
+
+Input preparation for ``recon-all -i``
+
+``recon-all`` averages every image it is given, so the same T1 passed
+twice (or copied under another name) costs motion-correction time and
+biases the average. These functions hash inputs by content and drop
+exact duplicates before the recon commands are built. Only inputs whose
+size matches another's are hashed.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import json
+import hashlib
+from warnings import warn
+from multiprocessing.pool import ThreadPool
+
+from ...util import STRING_TYPE
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def hash_file(path, algorithm='sha1', chunk_size=CHUNK_SIZE):
+    """
+    Hash the contents of *path*, reading it in chunks.
+
+    :param str path: file to hash
+    :param str algorithm: any algorithm known to :mod:`hashlib`
+    :param int chunk_size: bytes read and handed to the hash at a time
+    :return: hex digest of the file contents
+    :rtype: str
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashCache(object):
+    """
+    Content hashes keyed by (path, size, mtime).
+
+    A cached hash is reused only while the file's size and mtime are
+    unchanged, so repeated cohort builds don't re-read large volumes.
+    When *path* is given, the cache is loaded from and saved to that
+    JSON file.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}
+        self._dirty = False
+        if path and os.path.isfile(path):
+            with open(path) as f:
+                self._entries = json.load(f)
+
+    def get(self, path, st):
+        entry = self._entries.get(os.path.abspath(path))
+        if entry and entry['size'] == st.st_size and \
+                entry['mtime'] == st.st_mtime:
+            return entry['hash']
+        return None
+
+    def set(self, path, st, value):
+        self._entries[os.path.abspath(path)] = {'size': st.st_size,
+            'mtime': st.st_mtime, 'hash': value}
+        self._dirty = True
+
+    def save(self):
+        "Write the cache to disk (atomically), if it has a path & changed"
+        if not self.path or not self._dirty:
+            return
+        parent = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self._entries, f)
+        os.rename(tmp, self.path)
+        self._dirty = False
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def hash_files(paths, cache=None, processes=None):
+    """
+    Hash many files concurrently.
+
+    :param list paths: files to hash
+    :param cache: :class:`HashCache` (or path to one) to consult and update
+    :param int processes: number of hashing threads (default: one per CPU)
+    :return: mapping of path to hex digest, ``None`` for unreadable paths
+    :rtype: dict
+    """
+    if cache is None or isinstance(cache, STRING_TYPE):
+        cache = HashCache(cache)
+    hashes, todo = {}, []
+    for path in paths:
+        st = _stat(path)
+        if st is None or not os.path.isfile(path):
+            hashes[path] = None
+            continue
+        cached = cache.get(path, st)
+        if cached is not None:
+            hashes[path] = cached
+        else:
+            todo.append((path, st))
+    if len(todo) == 1:
+        path, st = todo[0]
+        computed = [hash_file(path)]
+    elif todo:
+        pool = ThreadPool(processes)
+        try:
+            computed = pool.map(hash_file, [path for path, _ in todo])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        computed = []
+    for (path, st), value in zip(todo, computed):
+        cache.set(path, st, value)
+        hashes[path] = value
+    cache.save()
+    return hashes
+
+
+def dedupe_inputs(data, cache=None, processes=None):
+    """
+    Drop inputs whose contents exactly match an earlier input.
+
+    Files can only match others of the same size, so only those are
+    hashed. Paths that cannot be read are kept (they may only exist where
+    the script runs) and are compared by path alone.
+
+    :param str,list data: path(s) to input data, as given to
+      :func:`seam.freesurfer.v1.recon_input`
+    :param cache: :class:`HashCache` (or path to one) to consult and update
+    :param int processes: number of hashing threads
+    :return: *data* with duplicates removed, order preserved
+    :rtype: str,list
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.inputs import dedupe_inputs
+      >>> dedupe_inputs(['/path/first.nii', '/path/copy_of_first.nii'])
+      ['/path/first.nii']
+    """
+    if isinstance(data, STRING_TYPE):
+        return data
+    data = list(data)
+    by_size = {}
+    for path in set(data):
+        st = _stat(path)
+        if st is not None and os.path.isfile(path):
+            by_size.setdefault(st.st_size, []).append(path)
+    hashes = hash_files([path for paths in by_size.values()
+        if len(paths) > 1 for path in paths], cache=cache,
+        processes=processes)
+    seen, kept, dropped = {}, [], []
+    for path in data:
+        key = hashes.get(path) or os.path.abspath(path)
+        if key in seen:
+            dropped.append((path, seen[key]))
+        else:
+            seen[key] = path
+            kept.append(path)
+    if dropped:
+        msg = 'Dropping duplicate inputs:\n' + '\n'.join(
+            '{} (same as {})'.format(dup, orig) for dup, orig in dropped)
+        warn(msg, category=UserWarning)
+    return kept
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" labels.py
+
+Convert annotations to label files without ``mri_annotation2label``
+
+:note: These functions require `NumPy <http://www.numpy.org>`_.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+from os.path import join
+
+import numpy as np
+
+from .formats import read_annot, read_geometry, write_label
+
+
+def annot_labels(annot_path, surface_path):
+    """
+    Group a surface's vertices by their structure in an annotation.
+
+    :param str annot_path: annotation file
+    :param str surface_path: surface supplying the vertex coordinates
+    :return: ``(name, vertices, coords)`` for every structure with at
+      least one vertex, in color table order
+    :rtype: list
+    """
+    labels, _, names = read_annot(annot_path)
+    coords, _ = read_geometry(surface_path)
+    if len(coords) != len(labels):
+        raise ValueError('{} has {:d} vertices but {} has {:d}'.format(
+            surface_path, len(coords), annot_path, len(labels)))
+    # One stable sort groups the vertices of every structure at once
+    order = np.argsort(labels, kind='mergesort')
+    grouped = labels[order]
+    bounds = np.flatnonzero(np.diff(grouped)) + 1
+    groups = []
+    for vertices in np.split(order, bounds):
+        index = labels[vertices[0]]
+        if index < 0 or not names[index]:
+            continue
+        groups.append((names[index], vertices, coords[vertices]))
+    return groups
+
+
+def annot2label(subject_id, hemi, annot_path, outdir, surface='white',
+    subjects_dir=None):
+    """
+    Write a ``<hemi>.<structure>.label`` file to *outdir* for every
+    structure in an annotation, like ``mri_annotation2label``.
+
+    :param str subject_id: subject identifier
+    :param str hemi: 'lh' or 'rh', hemisphere to use
+    :param str annot_path: path to annotation file
+    :param str outdir: output directory to place labels
+    :param str surface: surface to use when generating coords in labels
+    :param str subjects_dir: defaults to ``$SUBJECTS_DIR``
+    :return: paths of the labels written
+    :rtype: list
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.labels import annot2label
+      >>> annot2label('sub0001', 'lh', '/subjects/sub0001/label/lh.aparc.a2009s.annot',
+      ...     '/subjects/sub0001/label')
+    """
+    if subjects_dir is None:
+        subjects_dir = os.environ['SUBJECTS_DIR']
+    surface_path = join(subjects_dir, subject_id, 'surf',
+        '{}.{}'.format(hemi, surface))
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    written = []
+    for name, vertices, coords in annot_labels(annot_path, surface_path):
+        path = join(outdir, '{}.{}.label'.format(hemi, name))
+        write_label(path, vertices, coords, subject_id)
+        written.append(path)
+    return written
+
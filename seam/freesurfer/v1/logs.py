@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" logs.py
+
+Per-step profiles of past ``recon-all`` runs, from their logs
+
+Every subject keeps ``scripts/recon-all.log``, where ``recon-all`` marks
+the start of each step with a line like::
+
+    #@# Talairach Sat Jan  4 10:05:00 CST 2014
+
+follows each command with an ``fs_time`` line::
+
+    @#@FSTIME  2014:01:04:10:05:01 talairach_avi N 4 e 63.21 S 1.02 U 58.30 P 93% M 81232 ...
+
+(``e`` elapsed, ``S`` system & ``U`` user seconds) and records the host
+in the ``uname -a`` output of each invocation. :func:`parse_recon_log`
+turns one log into a row per step run; :func:`profile_subjects_dir`
+does so for a whole SUBJECTS_DIR in a process pool and
+:func:`write_profile` writes the rows as one TSV table, e.g. to load
+with pandas and find which steps dominate cluster time.
+
+Subjects without ``recon-all.log`` fall back to
+``scripts/recon-all-status.log``, which only has the step markers (wall
+time, but no CPU time or host).
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import io
+import os
+import re
+from os.path import join
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+COLUMNS = ('subject_id', 'run', 'step', 'host', 'start', 'wall', 'cpu',
+    'commands', 'status')
+DONE = 'done'
+ERROR = 'error'
+INCOMPLETE = 'incomplete'
+
+_MONTHS = dict((m, i) for i, m in enumerate(['Jan', 'Feb', 'Mar', 'Apr',
+    'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], 1))
+# `date` output, with or without a time zone: Sat Jan  4 10:05:00 CST 2014
+_date_re = re.compile(r'(?:\w{3}) +(\w{3}) +(\d{1,2}) (\d\d):(\d\d):(\d\d)'
+    r'(?: \S+)? (\d{4})\s*$')
+_marker_re = re.compile(r'^#@# (.*?) ((?:Mon|Tue|Wed|Thu|Fri|Sat|Sun) .*)$')
+_fstime_re = re.compile(r'^@#@FSTIME +(\d{4}):(\d\d):(\d\d):(\d\d):(\d\d):'
+    r'(\d\d) \S+ .*? e ([\d.]+) S ([\d.]+) U ([\d.]+)')
+_uname_re = re.compile(r'^(?:Linux|Darwin) (\S+) ')
+_end_re = re.compile(r'^recon-all .*(finished without error|exited with '
+    r'ERRORS) at (.*)$')
+
+
+def parse_date(text):
+    "Parse ``date`` output (the time zone is ignored), or return None"
+    match = _date_re.search(text)
+    if not match or match.group(1) not in _MONTHS:
+        return None
+    month, day, hour, minute, second, year = match.groups()
+    return datetime(int(year), _MONTHS[month], int(day), int(hour),
+        int(minute), int(second))
+
+
+def parse_marker(line):
+    """
+    Parse a ``#@# <step> <date>`` step marker.
+
+    :return: ``(step, datetime)``, or None if *line* isn't a marker
+    """
+    match = _marker_re.match(line.rstrip())
+    when = parse_date(match.group(2)) if match else None
+    if when is None:
+        return None
+    return match.group(1).strip(), when
+
+def parse_end(line):
+    """
+    Parse the line ``recon-all`` ends a run with.
+
+    :return: ``(status, datetime or None)`` with status :data:`DONE` or
+      :data:`ERROR`, or None if *line* isn't one
+    """
+    match = _end_re.match(line)
+    if not match:
+        return None
+    status = DONE if match.group(1).startswith('finished') else ERROR
+    return status, parse_date(match.group(2))
+
+
+def parse_recon_log(lines, subject_id=None):
+    """
+    Profile the steps in a ``recon-all.log`` (or ``recon-all-status.log``).
+
+    Lines are read one at a time, so logs of any size stream through.
+
+    :param lines: the log, as an iterable of lines (e.g. an open file)
+    :param str subject_id: value for the ``subject_id`` column
+    :return: a dict per step run with the :data:`COLUMNS` keys. ``run``
+      counts invocations of ``recon-all`` in the log, ``wall`` & ``cpu``
+      are seconds (``cpu`` is None without ``@#@FSTIME`` lines) and
+      ``status`` is ``done``, ``error`` (the run ended with errors in
+      this step) or ``incomplete`` (the log stops during the step, whose
+      ``wall`` then runs to the end of its last command)
+    :rtype: generator
+    """
+    run, host = 0, None
+    step = None
+    last_time = None
+
+    def close(end, status):
+        row = dict(step, wall=(end - step['start']).total_seconds(),
+            status=status)
+        row['start'] = step['start'].isoformat()
+        return row
+
+    for line in lines:
+        if line.startswith('#@# '):
+            marker = parse_marker(line)
+            if marker is None:
+                continue
+            name, when = marker
+            if run == 0:
+                # A status log, or a log missing its header
+                run = 1
+            if step:
+                yield close(when, DONE)
+            step = {'subject_id': subject_id, 'run': run,
+                'step': name, 'host': host, 'start': when,
+                'cpu': None, 'commands': 0}
+            last_time = when
+        elif line.startswith('@#@FSTIME'):
+            match = _fstime_re.match(line)
+            if not match:
+                continue
+            fields = [int(g) for g in match.groups()[:6]]
+            elapsed, system, user = [float(g) for g in match.groups()[6:]]
+            # The line is written when the command ends, stamped with its
+            # start
+            last_time = datetime(*fields) + timedelta(seconds=elapsed)
+            if step:
+                step['cpu'] = (step['cpu'] or 0) + system + user
+                step['commands'] += 1
+        else:
+            match = _uname_re.match(line)
+            if match:
+                # A new invocation
+                if step:
+                    yield close(last_time, INCOMPLETE)
+                    step = None
+                run += 1
+                host = match.group(1)
+                continue
+            end = parse_end(line) if step else None
+            if end:
+                status, when = end
+                yield close(when or last_time, status)
+                step = None
+    if step:
+        yield close(last_time, INCOMPLETE)
+
+
+def profile_subject(subject_dir):
+    """
+    Profile one subject's recon from its logs.
+
+    :param str subject_dir: ``$SUBJECTS_DIR/<subject>``
+    :return: rows as from :func:`parse_recon_log` (empty if there are no logs)
+    :rtype: list
+    """
+    subject_id = os.path.basename(os.path.normpath(subject_dir))
+    for fname in ('recon-all.log', 'recon-all-status.log'):
+        path = join(subject_dir, 'scripts', fname)
+        if os.path.isfile(path):
+            with io.open(path, errors='replace') as f:
+                return list(parse_recon_log(f, subject_id))
+    return []
+
+
+def subject_dirs(subjects_dir):
+    "Subject directories in *subjects_dir* that have a ``scripts`` directory"
+    return [join(subjects_dir, name) for name in sorted(os.listdir(
+        subjects_dir)) if os.path.isdir(join(subjects_dir, name, 'scripts'))]
+
+
+def profile_subjects_dir(subjects_dir, processes=None, chunksize=8):
+    """
+    Profile every subject in *subjects_dir*, parsing logs in a process
+    pool.
+
+    :param str subjects_dir: a SUBJECTS_DIR
+    :param int processes: worker processes (default: one per CPU)
+    :param int chunksize: subjects handed to a worker at a time
+    :return: each subject's rows, in subject order, as they're parsed
+    :rtype: generator
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.logs import profile_subjects_dir, write_profile
+      >>> with open('profile.tsv', 'w') as f:
+      ...     write_profile(profile_subjects_dir('/data/subjects'), f)
+    """
+    dirs = subject_dirs(subjects_dir)
+    if processes == 1 or len(dirs) < 2:
+        for d in dirs:
+            yield profile_subject(d)
+        return
+    pool = Pool(processes)
+    try:
+        for rows in pool.imap(profile_subject, dirs, chunksize):
+            yield rows
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return '{:.2f}'.format(value)
+    return str(value)
+
+def write_profile(subject_rows, out):
+    """
+    Write profiles as a TSV table with a header of :data:`COLUMNS`.
+
+    :param subject_rows: lists of rows, e.g. from :func:`profile_subjects_dir`
+    :param out: file-like object
+    :return: rows written
+    :rtype: int
+    """
+    out.write('\t'.join(COLUMNS) + '\n')
+    count = 0
+    for rows in subject_rows:
+        for row in rows:
+            out.write('\t'.join(_cell(row[c]) for c in COLUMNS) + '\n')
+            count += 1
+    return count
+
+
+def read_profile(path):
+    """
+    Read a table written by :func:`write_profile`.
+
+    :return: rows, with numbers (and missing values) as parsed by
+      :func:`parse_recon_log`
+    :rtype: list
+    """
+    def number(text, kind=float):
+        return kind(text) if text else None
+    rows = []
+    with open(path) as f:
+        header = f.readline().rstrip('\n').split('\t')
+        for line in f:
+            row = dict(zip(header, line.rstrip('\n').split('\t')))
+            for c in ('wall', 'cpu'):
+                row[c] = number(row.get(c))
+            for c in ('run', 'commands'):
+                row[c] = number(row.get(c), int)
+            rows.append(row)
+    return rows
+
+
+def to_columns(subject_rows):
+    """
+    Gather profiles into a dict of column name to list of values, e.g.
+    for ``pandas.DataFrame``.
+    """
+    columns = dict((c, []) for c in COLUMNS)
+    for rows in subject_rows:
+        for row in rows:
+            for c in COLUMNS:
+                columns[c].append(row[c])
+    return columns
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" longitudinal.py
+
+Recipe for FreeSurfer's longitudinal stream
+
+A longitudinal subject is processed in three stages:
+
+1. ``cross``: every timepoint through ``recon-all -all``, independently
+2. ``base``: an unbiased template from all the timepoints
+   (``recon-all -base``)
+3. ``long``: every timepoint again, initialized from the base
+   (``recon-all -long``)
+
+:func:`build_longitudinal` writes a script per timepoint and stage, and
+returns them as :class:`seam.runner.job.Job` whose ``depends_on`` encode
+the graph: timepoints run concurrently, the base starts as soon as its
+timepoints are done and the long runs fan out again. Give the jobs to a
+:class:`seam.runner.local.LocalRunner` or submit them to a
+:class:`seam.runner.queue.FileQueue`, which both honor dependencies.
+
+For array schedulers, :func:`write_stage_lists` writes a list of scripts
+per stage to submit as three arrays, each depending on the one before,
+e.g. with SLURM::
+
+    cross=$(sbatch --parsable --array=1-$(wc -l < cross.txt) \\
+        --wrap 'bash $(sed -n ${SLURM_ARRAY_TASK_ID}p cross.txt)')
+    base=$(sbatch --parsable --dependency=afterok:$cross \\
+        --array=1-$(wc -l < base.txt) \\
+        --wrap 'bash $(sed -n ${SLURM_ARRAY_TASK_ID}p base.txt)')
+    sbatch --dependency=afterok:$base --array=1-$(wc -l < long.txt) \\
+        --wrap 'bash $(sed -n ${SLURM_ARRAY_TASK_ID}p long.txt)'
+
+(there a stage waits for the whole previous array, not just the subject's
+own timepoints).
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+from os.path import join
+from collections import OrderedDict
+
+from ...runner.job import Job
+from .core import (recon_input, recon_input_resume, recon_all,
+    recon_all_resume, recon_base, recon_base_resume, recon_long,
+    recon_long_resume, long_subject_id, template_link_cmd, remove_locks_cmd)
+from .inputs import dedupe_inputs
+from .recipe import subjects_dir, write_step_script
+
+STAGES = ('cross', 'base', 'long')
+
+
+def cross_script_name(timepoint_id):
+    return "{}.cross.sh".format(timepoint_id)
+
+def base_script_name(base_id):
+    return "{}.base.sh".format(base_id)
+
+def long_script_name(timepoint_id, base_id):
+    return "{}.sh".format(long_subject_id(timepoint_id, base_id))
+
+
+def build_longitudinal(base_id, timepoints, script_dir, recon_flags=None,
+    dedupe=True, hash_cache=None, template_mode=None, max_attempts=3,
+    retry_delay=30, threads=None, study=None, priority=0):
+    """
+    Build the scripts of one longitudinal subject.
+
+    :param str base_id: identifier for the subject's template (base)
+    :param timepoints: ``(timepoint_id, input_data)`` pairs (or a dict),
+      input_data being a path or list of paths to the timepoint's T1s
+    :param str script_dir: directory to write scripts
+    :param list recon_flags: other flags to pass to every ``recon-all``
+    :param boolean dedupe: drop inputs duplicating another input of the
+      same timepoint
+    :param hash_cache: path to a JSON cache of input hashes
+    :param str template_mode: how to share ``fsaverage`` (see
+      :func:`seam.freesurfer.v1.recipe.build_recipe`)
+    :param int max_attempts: times to try a step failing transiently
+    :param int retry_delay: seconds before retrying a step
+    :param int threads: cores per script (``recon-all -openmp``)
+    :param str study: study of the jobs, for fair-share scheduling
+    :param int priority: priority of the jobs
+    :return: jobs by stage (see :data:`STAGES`), in order
+    :rtype: collections.OrderedDict
+
+    Usage::
+
+      >>> from seam.freesurfer.v1 import build_longitudinal
+      >>> from seam.runner import LocalRunner
+      >>> stages = build_longitudinal('sub0001', [('sub0001_tp1', 'tp1.nii'),
+      ...     ('sub0001_tp2', 'tp2.nii')], '/path/to/scripts')
+      >>> LocalRunner().run([job for jobs in stages.values() for job in jobs])
+    """
+    if hasattr(timepoints, 'items'):
+        timepoints = list(timepoints.items())
+    if not timepoints:
+        raise ValueError('{} has no timepoints'.format(base_id))
+    sd = subjects_dir(script_dir)
+    if not os.path.isdir(script_dir):
+        os.makedirs(script_dir)
+
+    def job(path, steps, subject_id, depends_on=()):
+        write_step_script(path, steps, threads=threads,
+            max_attempts=max_attempts, retry_delay=retry_delay,
+            cleanup=[remove_locks_cmd(join(sd, subject_id))],
+            disk_paths=[join(sd, subject_id)])
+        return Job(path, study=study, priority=priority, threads=threads,
+            depends_on=[j.name for j in depends_on])
+
+    cross = []
+    for timepoint_id, input_data in timepoints:
+        if dedupe:
+            input_data = dedupe_inputs(input_data, cache=hash_cache)
+        steps = [("Recon Input Command", 'recon_input',
+            recon_input(timepoint_id, input_data),
+            recon_input_resume(timepoint_id, input_data, sd))]
+        if template_mode:
+            steps.append(("Provision shared fsaverage", 'provision_fsaverage',
+                template_link_cmd(sd, 'fsaverage', mode=template_mode)))
+        steps.append(("Recon All command", 'recon_all',
+            recon_all(timepoint_id, recon_flags, threads),
+            recon_all_resume(timepoint_id, recon_flags, threads)))
+        cross.append(job(join(script_dir, cross_script_name(timepoint_id)),
+            steps, timepoint_id))
+    timepoint_ids = [timepoint_id for timepoint_id, _ in timepoints]
+    base = job(join(script_dir, base_script_name(base_id)),
+        [("Base (template) command", 'recon_base',
+            recon_base(base_id, timepoint_ids, recon_flags, threads),
+            recon_base_resume(base_id, timepoint_ids, recon_flags, threads))],
+        base_id, depends_on=cross)
+    longs = [job(join(script_dir, long_script_name(timepoint_id, base_id)),
+        [("Longitudinal command", 'recon_long',
+            recon_long(timepoint_id, base_id, recon_flags, threads),
+            recon_long_resume(timepoint_id, base_id, recon_flags, threads))],
+        long_subject_id(timepoint_id, base_id), depends_on=[base])
+        for timepoint_id in timepoint_ids]
+    return OrderedDict([('cross', cross), ('base', [base]), ('long', longs)])
+
+
+def write_stage_lists(subjects, script_dir):
+    """
+    Write ``cross.txt``, ``base.txt`` and ``long.txt`` in *script_dir*,
+    listing every subject's scripts of that stage one per line, for
+    submitting each stage as an array job.
+
+    :param subjects: stages (as returned by :func:`build_longitudinal`)
+      of one or more subjects
+    :return: paths of the lists, by stage
+    :rtype: collections.OrderedDict
+    """
+    if hasattr(subjects, 'items'):
+        subjects = [subjects]
+    paths = OrderedDict((stage, join(script_dir, '{}.txt'.format(stage)))
+        for stage in STAGES)
+    files = dict((stage, open(path, 'w')) for stage, path in paths.items())
+    try:
+        for stages in subjects:
+            for stage, jobs in stages.items():
+                for j in jobs:
+                    files[stage].write(j.script + '\n')
+    finally:
+        for f in files.values():
+            f.close()
+    return paths
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" manifest.py
+
+Batch manifests: one row per subject to build a recipe for
+
+A manifest is a CSV (or, with a ``.tsv`` extension, tab separated) file
+with a header row. Columns:
+
+* ``subject_id`` (required)
+* ``input`` (required): path to the subject's T1, separate several
+  with ``;``
+* ``study``: study the subject belongs to, for fair-share scheduling
+* ``priority``: integer, higher priorities are run first
+* ``base_id``: for :func:`build_longitudinal_batch`, the longitudinal
+  subject a row (timepoint) belongs to
+
+For example::
+
+    subject_id,input,study,priority
+    sub0001,/data/sub0001/t1.nii,adni,0
+    sub0002,/data/sub0002/t1_a.nii;/data/sub0002/t1_b.nii,clinical,10
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import csv
+from collections import deque, OrderedDict
+from multiprocessing.pool import ThreadPool
+try:
+    from queue import Queue
+except ImportError:  # Python 2
+    from Queue import Queue
+
+from ...util import STRING_TYPE
+from ...runner.job import Job
+from .recipe import build_recipe
+from .longitudinal import build_longitudinal
+
+REQUIRED = ('subject_id', 'input')
+
+
+def iter_manifest(path):
+    """
+    Read a batch manifest one row at a time.
+
+    :param str path: path to the manifest
+    :return: one dict per subject with ``subject_id``, ``input_data``
+      (list of paths), ``study`` and ``priority`` keys, plus any other
+      columns as they were
+    :rtype: generator
+    """
+    delimiter = '\t' if path.endswith('.tsv') else ','
+    with open(path) as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+        missing = [c for c in REQUIRED if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError('{} is missing column(s): {}'.format(path,
+                ', '.join(missing)))
+        for line, raw in enumerate(reader, 2):
+            row = dict(raw)
+            inputs = row.pop('input')
+            row['input_data'] = [i.strip() for i in inputs.split(';')
+                if i.strip()]
+            row['study'] = row.get('study') or None
+            try:
+                row['priority'] = int(row.get('priority') or 0)
+            except ValueError:
+                raise ValueError('{}:{:d}: priority must be an integer'.format(
+                    path, line))
+            yield row
+
+def read_manifest(path):
+    """
+    Read a whole batch manifest, see :func:`iter_manifest`.
+
+    :rtype: list
+    """
+    return list(iter_manifest(path))
+
+
+def _build(row, script_dir, kwargs):
+    written = build_recipe(row['subject_id'], row['input_data'], script_dir,
+        **kwargs)
+    return Job(written[0], name=row['subject_id'], study=row.get('study'),
+        priority=row.get('priority', 0), threads=kwargs.get('threads') or 1)
+
+def _try_build(row, script_dir, kwargs):
+    # Exceptions travel back as values so they reach the consumer in order
+    try:
+        return _build(row, script_dir, kwargs), None
+    except Exception as e:
+        return None, e
+
+def iter_batch(manifest, script_dir, workers=1, ordered=True,
+    max_in_flight=None, **kwargs):
+    """
+    Build a recipe (see :func:`seam.freesurfer.v1.recipe.build_recipe`)
+    for every subject in *manifest*, yielding each subject's
+    :class:`seam.runner.job.Job` as soon as its scripts are written.
+
+    Rows are read from the manifest as they are needed and at most
+    *max_in_flight* subjects are being built at once, so memory use
+    doesn't grow with the size of the cohort and a runner can start the
+    first subjects while later ones are still being generated.
+
+    :param manifest: path to a manifest, or an iterable of rows from
+      :func:`iter_manifest`
+    :param str script_dir: directory to write scripts & screenshots
+    :param int workers: threads building recipes (inputs are hashed and
+      scripts written in parallel)
+    :param boolean ordered: yield jobs in manifest order; otherwise as
+      soon as each is built
+    :param int max_in_flight: subjects submitted to the workers but not
+      yet yielded (default: twice *workers*)
+    :param kwargs: passed to :func:`~seam.freesurfer.v1.recipe.build_recipe`
+    :rtype: generator
+    :raises: the first exception raised building a recipe, once the jobs
+      before it (in the order they are yielded) have been yielded
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.manifest import iter_batch
+      >>> for job in iter_batch('batch.csv', '/scripts', workers=8, ordered=False):
+      ...     queue.submit(job)
+    """
+    rows = iter_manifest(manifest) if isinstance(manifest, STRING_TYPE) \
+        else manifest
+    if workers <= 1:
+        for row in rows:
+            yield _build(row, script_dir, kwargs)
+        return
+    max_in_flight = max(1, max_in_flight or 2 * workers)
+    pool = ThreadPool(workers)
+    try:
+        if ordered:
+            window = deque()
+            for row in rows:
+                window.append(pool.apply_async(_build,
+                    (row, script_dir, kwargs)))
+                if len(window) >= max_in_flight:
+                    yield window.popleft().get()
+            while window:
+                yield window.popleft().get()
+        else:
+            done = Queue()
+            in_flight = 0
+            for row in rows:
+                pool.apply_async(_try_build, (row, script_dir, kwargs),
+                    callback=done.put)
+                in_flight += 1
+                if in_flight >= max_in_flight:
+                    job, error = done.get()
+                    in_flight -= 1
+                    if error is not None:
+                        raise error
+                    yield job
+            while in_flight:
+                job, error = done.get()
+                in_flight -= 1
+                if error is not None:
+                    raise error
+                yield job
+    finally:
+        # Let subjects already started finish writing their scripts
+        pool.close()
+        pool.join()
+
+
+def build_batch(manifest, script_dir, **kwargs):
+    """
+    Build a recipe (see :func:`seam.freesurfer.v1.recipe.build_recipe`)
+    for every subject in *manifest*.
+
+    :param manifest: path to a manifest, or rows from :func:`read_manifest`
+    :param str script_dir: directory to write scripts & screenshots
+    :param kwargs: passed to :func:`~seam.freesurfer.v1.recipe.build_recipe`
+    :return: a :class:`seam.runner.job.Job` per subject, carrying the
+      subject's study and priority, ready to give to a runner
+    :rtype: list
+    :note: :func:`iter_batch` does the same without holding every job
+    """
+    return list(iter_batch(manifest, script_dir, **kwargs))
+
+
+def build_longitudinal_batch(manifest, script_dir, **kwargs):
+    """
+    Build the longitudinal scripts (see
+    :func:`seam.freesurfer.v1.longitudinal.build_longitudinal`) of every
+    subject in *manifest*, where each row is a timepoint and the
+    ``base_id`` column groups timepoints into subjects.
+
+    :param manifest: path to a manifest, or rows from :func:`read_manifest`
+    :param str script_dir: directory to write scripts
+    :param kwargs: passed to
+      :func:`~seam.freesurfer.v1.longitudinal.build_longitudinal`
+    :return: each subject's jobs by stage, in manifest order
+    :rtype: list
+    """
+    rows = iter_manifest(manifest) if isinstance(manifest, STRING_TYPE) \
+        else manifest
+    subjects = OrderedDict()
+    for row in rows:
+        if not row.get('base_id'):
+            raise ValueError('{} has no base_id'.format(row['subject_id']))
+        subjects.setdefault(row['base_id'], []).append(row)
+    built = []
+    for base_id, timepoints in subjects.items():
+        first = timepoints[0]
+        built.append(build_longitudinal(base_id, [(row['subject_id'],
+            row['input_data']) for row in timepoints], script_dir,
+            study=first.get('study'), priority=first.get('priority', 0),
+            **kwargs))
+    return built
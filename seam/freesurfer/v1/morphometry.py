@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" morphometry.py
+
+Stack per-vertex maps of a cohort into one on-disk matrix
+
+``recon-all -measure <measure> -qcache`` leaves every subject with maps
+like ``surf/lh.thickness.fwhm10.fsaverage.mgh``, all with the same
+vertices. :func:`stack_cohort` copies them one row at a time into a
+(subjects x vertices) ``.npy`` file, so a cohort never has to fit in RAM.
+Load it again with ``numpy.load(path, mmap_mode='r')``.
+
+:note: These functions require `NumPy <http://www.numpy.org>`_.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+from os.path import join
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from .formats import read_morph_data, read_mgh
+
+
+def morph_path(subject_id, measure, hemi, subjects_dir=None, fwhm=None,
+    target='fsaverage'):
+    """
+    Path to a subject's map of *measure*.
+
+    :param str measure: e.g. ``thickness``, ``area`` or ``jacobian_white``
+    :param int fwhm: smoothing of a ``-qcache`` map on *target*; without
+      it, the map on the subject's own surface
+    :rtype: str
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.morphometry import morph_path
+      >>> morph_path('sub0001', 'thickness', 'lh', '/subjects', fwhm=10)
+      '/subjects/sub0001/surf/lh.thickness.fwhm10.fsaverage.mgh'
+    """
+    if subjects_dir is None:
+        subjects_dir = os.environ['SUBJECTS_DIR']
+    if fwhm is None:
+        fname = '{}.{}'.format(hemi, measure)
+    else:
+        fname = '{}.{}.fwhm{:d}.{}.mgh'.format(hemi, measure, fwhm, target)
+    return join(subjects_dir, subject_id, 'surf', fname)
+
+
+def read_surface_map(path, mmap=True):
+    """
+    Read a per-vertex map in curv or ``.mgh``/``.mgz`` format as a flat
+    array, memory-mapped where the format allows.
+    """
+    if path.endswith(('.mgh', '.mgz')):
+        data, _ = read_mgh(path, mmap)
+        # (vertices, 1, 1, 1) in Fortran order flattens without a copy
+        return data.ravel(order='F')
+    return read_morph_data(path, mmap)
+
+
+def stack_cohort(paths, out_path, dtype=np.float32, threads=4):
+    """
+    Write each map in *paths* as one row of a (subjects x vertices)
+    ``.npy`` file.
+
+    Rows are filled from a thread pool straight into the memory-mapped
+    output, so memory use is a few rows regardless of cohort size.
+
+    :param list paths: per-vertex maps, all with the same vertices
+    :param str out_path: ``.npy`` file to write
+    :param dtype: element type of the matrix
+    :param int threads: maps to read at once
+    :return: the matrix, memory-mapped read-only
+    :rtype: :class:`numpy.memmap`
+    :raises ValueError: if a map's vertex count differs from the first's
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.morphometry import morph_path, stack_cohort
+      >>> paths = [morph_path(s, 'thickness', 'lh', fwhm=10) for s in subjects]
+      >>> matrix = stack_cohort(paths, 'lh.thickness.fwhm10.npy')
+      >>> matrix.mean(axis=0)
+    """
+    paths = list(paths)
+    if not paths:
+        raise ValueError('No maps to stack')
+    nvertices = len(read_surface_map(paths[0]))
+    out = open_memmap(out_path, 'w+', dtype, (len(paths), nvertices))
+
+    def fill(row):
+        values = read_surface_map(paths[row])
+        if len(values) != nvertices:
+            raise ValueError('{} has {:d} vertices, expected {:d}'.format(
+                paths[row], len(values), nvertices))
+        out[row] = values
+
+    pool = ThreadPool(max(1, threads))
+    try:
+        pool.map(fill, range(len(paths)))
+    finally:
+        pool.close()
+        pool.join()
+    out.flush()
+    return np.load(out_path, mmap_mode='r')
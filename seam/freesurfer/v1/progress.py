@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" progress.py
+
+Live progress and ETA of a cohort recon-all is running
+
+:class:`Progress` follows ``scripts/recon-all-status.log`` of every
+subject in a SUBJECTS_DIR. Each poll costs one ``listdir`` plus one
+``stat`` per subject, one more ``listdir`` per running subject (for its
+lock) and one more ``stat`` per subject yet to start; a log is only
+opened when it has grown, and then only the appended bytes are read, so
+polling thousands of subjects on NFS stays cheap.
+
+The step a subject is in is turned into an expected remaining time with
+a :class:`StepHistory`: median durations of each step, from a table
+written by ``seam profile`` (see :mod:`seam.freesurfer.v1.logs`) and
+from steps finishing while we watch. Subjects yet to start are expected
+to take a whole run each, as many at once as there are slots, so the
+ETA is when the last subject of the cohort should finish.
+
+A ``recon-all`` that was killed never writes its end to the log, so a
+subject still in a step is reported as stalled once its
+``scripts/IsRunning*`` lock is gone, or once its log hasn't changed for
+*stall_factor* times the step's expected duration.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import glob
+import heapq
+from os.path import join
+from datetime import datetime, timedelta
+
+from .logs import parse_marker, parse_end, read_profile, DONE, ERROR
+
+STATUS_LOG = 'recon-all-status.log'
+RUNNING = 'running'
+STALLED = 'stalled'
+# Written after the last step of a successful run
+_run_time_prefix = '#@#%# recon-all-run-time-hours'
+
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+class StepHistory(object):
+    """
+    Expected duration of each ``recon-all`` step, from past runs.
+
+    :param rows: rows as from :func:`seam.freesurfer.v1.logs.parse_recon_log`
+    """
+    def __init__(self, rows=()):
+        self.durations = {}
+        # Steps of the longest complete run seen, in order
+        self.order = []
+        self._expected = {}
+        runs = {}
+        for row in rows:
+            if row['status'] != DONE or row['wall'] is None:
+                continue
+            self.observe(row['step'], row['wall'])
+            runs.setdefault((row['subject_id'], row['run']), []).append(
+                row['step'])
+        for steps in runs.values():
+            self.observe_order(steps)
+
+    @classmethod
+    def from_profile(cls, path):
+        "History from a table written by ``seam profile``"
+        return cls(read_profile(path))
+
+    def observe(self, step, seconds):
+        self.durations.setdefault(step, []).append(seconds)
+        self._expected.pop(step, None)
+
+    def observe_order(self, steps):
+        if len(steps) > len(self.order):
+            self.order = list(steps)
+
+    def expected(self, step):
+        "Median seconds *step* takes, or None if it's never been seen"
+        if step not in self._expected:
+            if step not in self.durations:
+                return None
+            self._expected[step] = _median(self.durations[step])
+        return self._expected[step]
+
+    def remaining(self, step, elapsed):
+        """
+        Expected seconds until a run that's been in *step* for *elapsed*
+        seconds finishes, or None without a history of *step*.
+        """
+        expected = self.expected(step)
+        if expected is None:
+            return None
+        remaining = max(expected - elapsed, 0)
+        if step in self.order:
+            for later in self.order[self.order.index(step) + 1:]:
+                remaining += self.expected(later) or 0
+        return remaining
+
+    def total(self):
+        "Expected seconds of a whole run, or None without a complete one"
+        if not self.order:
+            return None
+        return self.remaining(self.order[0], 0)
+
+
+class StatusLog(object):
+    """
+    Incrementally reads a ``recon-all-status.log``.
+
+    After :meth:`poll`, ``step`` and ``started`` are the last step marker
+    and ``status`` is None while the run is going, or ``done`` / ``error``.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.inode = None
+        self.offset = 0
+        self.mtime = None
+        self._reset()
+
+    def _reset(self):
+        self.step = None
+        self.started = None
+        self.status = None
+        # Whether the last step's duration is still to be recorded
+        self._open = False
+        # Steps of the current run
+        self.steps = []
+        # (step, seconds) finished since the last poll
+        self.finished = []
+
+    def poll(self):
+        """
+        Read what's been appended since the last poll.
+
+        :return: whether there was anything new
+        :rtype: bool
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            # New or replaced, start over
+            self.inode, self.offset = st.st_ino, 0
+            self._reset()
+        self.mtime = st.st_mtime
+        self.finished = []
+        if st.st_size == self.offset:
+            return False
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        # A line still being written is left for next time
+        complete = data[:data.rfind(b'\n') + 1]
+        self.offset += len(complete)
+        for line in complete.decode('utf-8', 'replace').splitlines():
+            self._read_line(line)
+        return bool(complete)
+
+    def _finish_step(self, when):
+        if self._open and when:
+            self.finished.append((self.step,
+                (when - self.started).total_seconds()))
+        self._open = False
+
+    def _read_line(self, line):
+        marker = parse_marker(line)
+        if marker:
+            step, when = marker
+            self._finish_step(when)
+            if self.status is not None:
+                # A new run
+                self.steps = []
+            self.step, self.started, self.status = step, when, None
+            self._open = True
+            self.steps.append(step)
+            return
+        if line.startswith(_run_time_prefix):
+            self.status = DONE
+            return
+        end = parse_end(line)
+        if end:
+            status, when = end
+            self._finish_step(when if status == DONE else None)
+            self.status = status
+
+
+class Progress(object):
+    """
+    Progress of every subject in a SUBJECTS_DIR.
+
+    :param str subjects_dir: SUBJECTS_DIR to watch
+    :param history: :class:`StepHistory`, learned as steps finish (or
+      the path of a ``seam profile`` table)
+    :param float stall_factor: a running subject whose log hasn't changed
+      for this many times its step's expected duration is stalled
+    :param list subject_ids: every subject of the cohort, so those not
+      set up yet count as pending too (by default only subjects set up
+      by ``recon-all -i`` do)
+    :param int slots: subjects run at once (default: as many as are
+      running)
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.progress import Progress
+      >>> progress = Progress('/data/subjects', history='profile.tsv',
+      ...     slots=64)
+      >>> progress.poll()
+      >>> print(progress.text())
+    """
+    def __init__(self, subjects_dir, history=None, stall_factor=3.0,
+            subject_ids=None, slots=None):
+        self.subjects_dir = subjects_dir
+        self.stall_factor = stall_factor
+        self.subject_ids = set(subject_ids or ())
+        self.slots = slots
+        if history is None:
+            history = StepHistory()
+        elif not isinstance(history, StepHistory):
+            history = StepHistory.from_profile(history)
+        self.history = history
+        self.logs = {}
+        # Subjects in a step whose IsRunning lock is gone
+        self.unlocked = set()
+        # Subjects that haven't started a step yet
+        self.pending = set()
+        self.now = None
+
+    def poll(self, now=None):
+        "Read new status log lines of every subject"
+        self.now = now or datetime.now()
+        try:
+            names = os.listdir(self.subjects_dir)
+        except OSError:
+            names = []
+        for name in self.subject_ids.union(names):
+            if name not in self.logs:
+                self.logs[name] = StatusLog(join(self.subjects_dir, name,
+                    'scripts', STATUS_LOG))
+        for log in self.logs.values():
+            if not log.poll():
+                continue
+            for step, seconds in log.finished:
+                self.history.observe(step, seconds)
+            if log.status == DONE:
+                self.history.observe_order(log.steps)
+        self.unlocked = set(name for name, log in self.logs.items()
+            if log.step is not None and log.status is None and
+            not glob.glob(join(self.subjects_dir, name, 'scripts',
+                'IsRunning*')))
+        self.pending = set(name for name, log in self.logs.items()
+            if log.step is None and (name in self.subject_ids or
+                os.path.exists(join(self.subjects_dir, name, 'mri', 'orig',
+                    '001.mgz'))))
+
+    def _stalled(self, subject_id, log):
+        "Whether *log*'s subject is no longer running its step"
+        if subject_id in self.unlocked:
+            return True
+        expected = self.history.expected(log.step)
+        if expected is None or log.mtime is None:
+            return False
+        quiet = (self.now - datetime.fromtimestamp(log.mtime)).total_seconds()
+        return quiet > self.stall_factor * expected
+
+    def subjects(self):
+        """
+        Where each subject with a status log is.
+
+        :return: dicts with ``subject_id``, ``status`` (``running``,
+          ``stalled``, ``done`` or ``error``), ``step``, ``elapsed``
+          (seconds in the step) and ``remaining`` (expected seconds left,
+          None if unknown or stalled) keys
+        :rtype: list
+        """
+        rows = []
+        for subject_id in sorted(self.logs):
+            log = self.logs[subject_id]
+            if log.step is None:
+                continue
+            row = {'subject_id': subject_id, 'step': log.step,
+                'status': log.status or RUNNING, 'elapsed': None,
+                'remaining': None}
+            if log.status is None:
+                row['elapsed'] = max((self.now - log.started).total_seconds(),
+                    0)
+                if self._stalled(subject_id, log):
+                    row['status'] = STALLED
+                else:
+                    row['remaining'] = self.history.remaining(log.step,
+                        row['elapsed'])
+            elif log.status == DONE:
+                row['remaining'] = 0
+            rows.append(row)
+        return rows
+
+    def eta(self, rows=None):
+        """
+        When the last subject of the cohort is expected to finish.
+
+        Running subjects finish their run, then each pending subject
+        takes a whole run in the first slot to free up. Stalled and failed
+        subjects are left out.
+
+        :return: None if nothing is left to run, or a subject is in a step
+          (or pending subjects need a run) with no history
+        :rtype: datetime
+        """
+        if rows is None:
+            rows = self.subjects()
+        remaining = [r['remaining'] for r in rows if r['status'] == RUNNING]
+        if None in remaining:
+            return None
+        if self.pending:
+            total = self.history.total()
+            if total is None:
+                return None
+            # When each slot frees up
+            free = remaining + [0] * max((self.slots or len(remaining) or 1) -
+                len(remaining), 0)
+            heapq.heapify(free)
+            for _ in range(len(self.pending)):
+                heapq.heapreplace(free, free[0] + total)
+            remaining = free
+        if not remaining:
+            return None
+        return self.now + timedelta(seconds=max(remaining))
+
+    def text(self):
+        "A table of running & stalled subjects and a summary line"
+        rows = self.subjects()
+        lines = []
+        for row in rows:
+            if row['status'] not in (RUNNING, STALLED):
+                continue
+            remaining = STALLED if row['status'] == STALLED else \
+                _duration(row['remaining'])
+            lines.append('{subject_id}\t{step}\t{elapsed}\t{remaining}'.format(
+                subject_id=row['subject_id'], step=row['step'],
+                elapsed=_duration(row['elapsed']), remaining=remaining))
+        counts = dict((s, 0) for s in (RUNNING, STALLED, DONE, ERROR))
+        for row in rows:
+            counts[row['status']] += 1
+        eta = self.eta(rows)
+        summary = '{:d} running, {:d} done, {:d} failed'.format(
+            counts[RUNNING], counts[DONE], counts[ERROR])
+        if counts[STALLED]:
+            summary += ', {:d} stalled'.format(counts[STALLED])
+        if self.pending:
+            summary += ', {:d} pending'.format(len(self.pending))
+        if eta:
+            summary += '; ETA {} (in {})'.format(
+                eta.strftime('%Y-%m-%d %H:%M'),
+                _duration((eta - self.now).total_seconds()))
+        elif counts[RUNNING] or self.pending:
+            summary += '; ETA unknown'
+        lines.append(summary)
+        return '\n'.join(lines)
+
+
+def _duration(seconds):
+    if seconds is None:
+        return '?'
+    minutes = int(seconds) // 60
+    return '{:d}h{:02d}m'.format(minutes // 60, minutes % 60)
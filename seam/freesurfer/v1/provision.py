@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" provision.py
+
+Share template subjects (e.g. ``fsaverage``) across a SUBJECTS_DIR
+
+``recon-all -qcache`` resamples onto ``fsaverage``. Rather than every
+subject copying or creating the template in a scratch SUBJECTS_DIR, the
+template is linked in once under a lock so concurrent subjects on the
+same node don't race.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import errno
+import shutil
+from os.path import join, lexists
+
+from ...util import locked
+
+MODES = ('symlink', 'hardlink')
+
+
+def template_source(template='fsaverage', freesurfer_home=None):
+    """
+    Path to *template* inside a Freesurfer installation.
+
+    :param str template: template subject name
+    :param str freesurfer_home: defaults to ``$FREESURFER_HOME``
+    :rtype: str
+    """
+    if freesurfer_home is None:
+        if 'FREESURFER_HOME' not in os.environ:
+            raise ValueError('$FREESURFER_HOME is not set and no '
+                'freesurfer_home was given')
+        freesurfer_home = os.environ['FREESURFER_HOME']
+    return join(freesurfer_home, 'subjects', template)
+
+
+def template_lock_path(subjects_dir, template='fsaverage'):
+    return join(subjects_dir, '.{}.lock'.format(template))
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        # Different filesystem: fall back to a single copy
+        shutil.copy2(src, dst)
+
+
+def _link_tree(src, dst):
+    "Recreate the tree *src* at *dst*, files linked or copied, links kept"
+    os.makedirs(dst)
+    for root, dirs, files in os.walk(src):
+        target = join(dst, os.path.relpath(root, src))
+        for name in dirs + files:
+            path = join(root, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), join(target, name))
+            elif os.path.isdir(path):
+                os.mkdir(join(target, name))
+            else:
+                _link_or_copy(path, join(target, name))
+
+
+def provision_template(subjects_dir, template='fsaverage',
+    freesurfer_home=None, mode='symlink'):
+    """
+    Make *template* available in *subjects_dir*, at most once.
+
+    If the template already exists (as a directory or link) nothing is
+    done. Otherwise it is symlinked, or its tree is hardlinked (falling
+    back to copies across filesystems), while holding a lock in
+    *subjects_dir*. Hardlinked trees are built beside the destination
+    and renamed into place so other processes never see a partial tree.
+
+    :param str subjects_dir: SUBJECTS_DIR to provision
+    :param str template: template subject name
+    :param str freesurfer_home: defaults to ``$FREESURFER_HOME``
+    :param str mode: ``'symlink'`` or ``'hardlink'``
+    :return: path to the template in *subjects_dir*
+    :rtype: str
+    """
+    if mode not in MODES:
+        raise ValueError('mode must be one of {}'.format(', '.join(MODES)))
+    dest = join(subjects_dir, template)
+    if lexists(dest):
+        return dest
+    src = template_source(template, freesurfer_home)
+    if not os.path.isdir(src):
+        raise ValueError('No template found at {}'.format(src))
+    if not os.path.isdir(subjects_dir):
+        os.makedirs(subjects_dir)
+    with locked(template_lock_path(subjects_dir, template)):
+        if lexists(dest):
+            return dest
+        if mode == 'symlink':
+            os.symlink(src, dest)
+        else:
+            tmp = '{}.{}.tmp'.format(dest, os.getpid())
+            try:
+                _link_tree(src, tmp)
+                os.rename(tmp, dest)
+            except BaseException:
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+    return dest
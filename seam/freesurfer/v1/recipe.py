@@ -16,10 +16,19 @@ from warnings import warn
 from argparse import ArgumentParser
 
 from ... import __version__ as version
-from ...util import wrap_with_xvfb
-from .core import recon_input, recon_all, tkmedit_screenshot_cmd, \
-    tkmedit_screenshot_tcl, tksurfer_screenshot_cmd, tksurfer_screenshot_tcl, \
-    annot2label_cmd
+from ...util import wrap_with_xvfb, tmp_preamble
+from ...runner.retry import step_preamble, step_cmd, state_dir, \
+    EXIT_TRANSIENT
+from ...runner.job import script_metadata_line
+from ...runner.disk import disk_metadata_line
+from .core import recon_input, recon_input_resume, recon_all, \
+    recon_all_resume, tkmedit_screenshot_cmd, tkmedit_screenshot_tcl, \
+    tksurfer_screenshot_cmd, tksurfer_screenshot_tcl, annot2label_cmd, \
+    annot2label_native_cmd, template_link_cmd, \
+    render_slices_cmd, render_surfaces_cmd, remove_locks_cmd, archive_cmd
+from .inputs import dedupe_inputs
+from .environment import ensure_environment, source_lines
+from .screenshots import postprocess_cmd
 
 
 def recon_script_name(subject_id):
@@ -43,10 +52,20 @@ def a2009s_file(subject_id, sd, hemi):
 def label_directory(subject_id, sd):
     return join(sd, subject_id, 'label')
 
-def recon_parts(subject_id, input_data, recon_flags=None):
+def subjects_dir(script_dir):
+    "$SUBJECTS_DIR, falling back (with a warning) to *script_dir*"
+    if 'SUBJECTS_DIR' not in os.environ:
+        msg = """You have not set your $SUBJECTS_DIR environment variable.
+
+Using {} as your SUBJECTS_DIR""".format(script_dir)
+        warn(msg, category=UserWarning)
+        return script_dir
+    return os.environ['SUBJECTS_DIR']
+
+def recon_parts(subject_id, input_data, recon_flags=None, threads=None):
     "Build the recon_input and recon_all commands"
     recon_input_cmd = recon_input(subject_id, input_data)
-    recon_all_cmd = recon_all(subject_id, recon_flags)
+    recon_all_cmd = recon_all(subject_id, recon_flags, threads)
     return recon_input_cmd, recon_all_cmd
 
 def tkmedit_parts(subject_id, script_dir, use_xvfb=False):
@@ -59,6 +78,11 @@ def tkmedit_parts(subject_id, script_dir, use_xvfb=False):
         tkmedit_cmd = wrap_with_xvfb(tkmedit_cmd)
     return tkmedit_tcl_script, tkmedit_tcl_path, tkmedit_cmd
 
+def thread_exports(threads):
+    "Limit OpenMP & ITK tools to *threads* threads"
+    return ['export OMP_NUM_THREADS={:d}'.format(threads),
+        'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={:d}'.format(threads)]
+
 def tksurfer_parts(subject_id, script_dir, hemi, use_xvfb=False):
     tksurfer_tcl_path = join(script_dir,
         tksurfer_tcl_name(subject_id, hemi))
@@ -73,12 +97,18 @@ def tksurfer_parts(subject_id, script_dir, hemi, use_xvfb=False):
     return tksurfer_tcl_script, tksurfer_tcl_path, tksurfer_cmd
 
 def build_recipe(subject_id, input_data, script_dir, use_xvfb=False,
-    recon_flags=None):
+    recon_flags=None, dedupe=True, hash_cache=None, template_mode=None,
+    max_attempts=3, retry_delay=30, threads=None, screenshot_format=None,
+    delete_tiffs=False, native_labels=False, tmp_dir=None,
+    native_screenshots=False, freesurfer_env=None, archive_dir=None):
     """This function builds a complete pipeline around Freesufer.
 
     It does the following:
 
+    * Drops input images whose contents duplicate another input
     * Imports data using ``recon-all -i``
+    * Optionally links ``fsaverage`` into SUBJECTS_DIR, once per
+      directory, for ``-qcache`` to resample onto
     * Runs the main ``recon-all`` command with the following flags:
         * ``-qcache``
         * ``-measure thickness``
@@ -92,6 +122,9 @@ def build_recipe(subject_id, input_data, script_dir, use_xvfb=False,
           ``label`` directory
         * Takes screenshots of the inflated surface with and without the
           advanced labels.
+    * Optionally converts the screenshots to a compressed format and
+      builds a contact sheet of them
+    * Optionally prunes the subject directory and packs it into an archive
 
     :param str subject_id: subject identifier
     :param str,list input_data: list of paths or string to subject's T1 images
@@ -99,73 +132,212 @@ def build_recipe(subject_id, input_data, script_dir, use_xvfb=False,
     :param boolean use_xvfb: Wrap ``tksurfer`` & ``tkmedit`` commands in xvfb-run,
       useful if running in a non-graphical (ie cluster) environment.
     :param list recon_flags: other flags to pass to ``recon-all``
+    :param boolean dedupe: Drop (with a warning) inputs whose contents
+      exactly match another input
+    :param hash_cache: path to a JSON cache of input hashes, reused while
+      an input's size and mtime are unchanged
+    :param str template_mode: ``'symlink'`` or ``'hardlink'`` to share
+      ``fsaverage`` from ``$FREESURFER_HOME`` under a ``flock``; None (the
+      default) leaves it to ``recon-all``
+    :param int max_attempts: times to try a step failing transiently
+    :param int retry_delay: seconds before retrying a step, doubled per retry
+    :param int threads: cores the subject may use. ``recon-all`` gets
+      ``-openmp`` *threads*, OpenMP & ITK tools are limited to as many
+      threads and the script header records it for runners to budget
+      cores with (see :class:`seam.runner.local.LocalRunner`).
+    :param str screenshot_format: convert screenshots to this format
+      (e.g. ``png``) with
+      :func:`seam.freesurfer.v1.screenshots.postprocess_screenshots`
+    :param boolean delete_tiffs: remove the TIFF screenshots once converted
+    :param boolean native_labels: convert both hemispheres' annotations to
+      labels in one Python process (see
+      :func:`seam.freesurfer.v1.labels.annot2label`, requires NumPy where
+      the script runs) instead of with ``mri_annotation2label``
+    :param str tmp_dir: where the script keeps temp files (e.g. a tmpfs)
+      unless ``$SEAM_TMPDIR`` is set when it runs; default ``$TMPDIR``
+    :param boolean native_screenshots: render the volume slices and
+      surface views in Python (see
+      :func:`seam.freesurfer.v1.slices.render_slices` and
+      :func:`seam.freesurfer.v1.surfaces.render_surfaces`, requiring NumPy
+      where the script runs) instead of with ``tkmedit`` & ``tksurfer``
+    :param str freesurfer_env: FreeSurfer environment file for the script
+      to source instead of relying on ``SetUpFreeSurfer.sh`` having been
+      sourced; (re)captured from ``$FREESURFER_HOME`` when missing or
+      stale (see :mod:`seam.freesurfer.v1.environment`)
+    :param str archive_dir: finally prune the subject's intermediates, pack
+      it into ``<archive_dir>/<subject_id>.zip`` and remove its directory
+      (see :func:`seam.freesurfer.v1.archive.archive_subject`)
 
     :rtype: tuple
-    :return: paths to recon script, tkmedit script and lh & rh tksurfer scripts
+    :return: paths to recon script, tkmedit script and lh & rh tksurfer
+      scripts (the tcl scripts are None with *native_screenshots*)
     :note: the main script is set as executable
+    :note: Each step runs through ``seam_step``
+      (see :func:`seam.runner.retry.step_preamble`): completed steps are
+      skipped when the script is rerun, transient failures are retried
+      and deterministic failures are recorded so the script won't rerun.
     :note: This function is exposed on the command line through ``build-recon-v1``
     """
-    to_return = []
-    if 'SUBJECTS_DIR' not in os.environ:
-        msg = """You have not set your $SUBJECTS_DIR environment variable.
-
-Using {} as your SUBJECTS_DIR""".format(script_dir)
-        warn(msg, category=UserWarning)
-        sd = script_dir
-    else:
-        sd = os.environ['SUBJECTS_DIR']
+    sd = subjects_dir(script_dir)
     # Check script directory
     if not os.path.isdir(script_dir):
         os.makedirs(script_dir)
+    if dedupe:
+        input_data = dedupe_inputs(input_data, cache=hash_cache)
+    # recon commands
+    input_cmd, all_cmd = recon_parts(subject_id, input_data, recon_flags,
+        threads)
+    final_script = os.path.join(script_dir, recon_script_name(subject_id))
+    # (comment, step name, command[, resume command])
+    steps = [("Recon Input Command", 'recon_input', input_cmd,
+        recon_input_resume(subject_id, input_data, sd))]
+    if template_mode:
+        steps.append(("Provision shared fsaverage", 'provision_fsaverage',
+            template_link_cmd(sd, 'fsaverage', mode=template_mode)))
+    steps.append(("Recon All command", 'recon_all', all_cmd,
+        recon_all_resume(subject_id, recon_flags, threads)))
+    qc, tcl_paths = qc_steps(subject_id, script_dir, sd, use_xvfb=use_xvfb,
+        native_labels=native_labels, screenshot_format=screenshot_format,
+        delete_tiffs=delete_tiffs, native_screenshots=native_screenshots,
+        threads=threads)
+    steps.extend(qc)
+    if archive_dir:
+        steps.append(("Prune & archive the subject", 'archive',
+            archive_cmd(subject_id, archive_dir)))
+    to_return = [final_script] + tcl_paths
+
+    # Nothing graphical is left to run under xvfb with native screenshots
+    write_step_script(final_script, steps, threads=threads,
+        use_xvfb=use_xvfb and not native_screenshots, tmp_dir=tmp_dir,
+        max_attempts=max_attempts, retry_delay=retry_delay,
+        freesurfer_env=freesurfer_env,
+        cleanup=[remove_locks_cmd(join(sd, subject_id))],
+        disk_paths=[join(sd, subject_id), join(script_dir,
+            screenshots_dir(subject_id))])
+    return tuple(to_return)
+
+
+def qc_steps(subject_id, script_dir, sd, use_xvfb=False, labels=True,
+    native_labels=False, screenshot_format=None, delete_tiffs=False,
+    native_screenshots=False, threads=None):
+    """
+    The steps following ``recon-all`` in a recipe: ``tkmedit`` screenshots,
+    then per hemisphere the 2009 annotation's labels (unless not *labels*)
+    and ``tksurfer`` screenshots, then optionally converting the
+    screenshots. Writes the tcl scripts the screenshot steps run. With
+    *native_screenshots*, slices and surfaces are rendered in Python
+    instead, the surfaces in one step after the labels, using *threads*.
+
+    :return: ``(comment, step name, command)`` steps and the tcl paths
+      (tkmedit, then lh & rh tksurfer; None where no tcl is needed)
+    :rtype: tuple
+    """
     ss_dir = join(script_dir, screenshots_dir(subject_id))
     if not os.path.isdir(ss_dir):
         os.makedirs(ss_dir)
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    # recon commands
-    input_cmd, all_cmd = recon_parts(subject_id, input_data, recon_flags)
-    # tkmedit parts
-    tkm_tcl_script, tkm_tcl_path, tkm_cmd = tkmedit_parts(subject_id,
-        script_dir, use_xvfb)
-    with open(tkm_tcl_path, 'w') as f:
-        f.write(tkm_tcl_script)
-
-    final_script = os.path.join(script_dir, recon_script_name(subject_id))
-    to_return.append(final_script)
-    to_return.append(tkm_tcl_path)
-    ingredients = ["#!/bin/bash",
-        "# Generated by seam version {} at {}".format(version, now),
-        "",
-        "# Recon Input Command",
-        input_cmd,
-        "",
-        "# Recon All command",
-        all_cmd,
-        "",
-        "# TKMedit Screenshots command",
-        tkm_cmd,]
+    if native_screenshots:
+        tcl_paths = [None]
+        steps = [("Render slices", 'slices',
+            render_slices_cmd(subject_id, ss_dir, threads))]
+    else:
+        tkm_tcl_script, tkm_tcl_path, tkm_cmd = tkmedit_parts(subject_id,
+            script_dir, use_xvfb)
+        with open(tkm_tcl_path, 'w') as f:
+            f.write(tkm_tcl_script)
+        tcl_paths = [tkm_tcl_path]
+        steps = [("TKMedit Screenshots command", 'tkmedit', tkm_cmd)]
+    label_dir = label_directory(subject_id, sd)
+    if labels and native_labels:
+        steps.append(("Convert 2009 annotations to labels", 'annot2label',
+            annot2label_native_cmd(subject_id, 'aparc.a2009s', label_dir)))
     for hemi in ('lh', 'rh'):
         # annot2label on the 2009 atlas
-        annot_file = a2009s_file(subject_id, sd, hemi)
-        label_dir = label_directory(subject_id, sd)
-        a2l_cmd = annot2label_cmd(subject_id, hemi=hemi, annot_path=annot_file,
-            outdir=label_dir, surface='white')
-        ingredients.extend(["", "# Convert 2009 {} annotation to labels".format(hemi),
-            a2l_cmd])
+        if labels and not native_labels:
+            annot_file = a2009s_file(subject_id, sd, hemi)
+            a2l_cmd = annot2label_cmd(subject_id, hemi=hemi,
+                annot_path=annot_file, outdir=label_dir, surface='white')
+            steps.append(("Convert 2009 {} annotation to labels".format(hemi),
+                'annot2label_{}'.format(hemi), a2l_cmd))
+        if native_screenshots:
+            tcl_paths.append(None)
+            continue
         # tksurfer parts
         tks_tcl_script, tks_tcl_path, tks_cmd = tksurfer_parts(subject_id,
             script_dir, hemi, use_xvfb)
         with open(tks_tcl_path, 'w') as f:
             f.write(tks_tcl_script)
-        to_return.append(tks_tcl_path)
-        ingredients.extend(["",
-            "# TKSurfer {} Screenshot command".format(hemi),
-            tks_cmd])
+        tcl_paths.append(tks_tcl_path)
+        steps.append(("TKSurfer {} Screenshot command".format(hemi),
+            'tksurfer_{}'.format(hemi), tks_cmd))
+    if native_screenshots:
+        steps.append(("Render surfaces", 'surfaces',
+            render_surfaces_cmd(subject_id, ss_dir, threads)))
+    if screenshot_format:
+        steps.append(("Convert screenshots & build a contact sheet",
+            'screenshots', postprocess_cmd(ss_dir, screenshot_format,
+            delete_tiffs)))
+    return steps, tcl_paths
 
-    with open(final_script, 'w') as f:
+
+def write_step_script(path, steps, threads=None, use_xvfb=False,
+    tmp_dir=None, max_attempts=3, retry_delay=30, freesurfer_env=None,
+    cleanup=None, disk_paths=None):
+    """
+    Write an executable script running *steps* through ``seam_step``.
+
+    :param str path: script to write
+    :param list steps: ``(comment, step name, command)`` tuples, or with
+      a fourth item, the command resuming a step that was started before
+      (see :func:`seam.runner.retry.step_cmd`)
+    :param int threads: cores the script uses, recorded in its header
+    :param boolean use_xvfb: some commands run under ``xvfb-run``, so keep
+      a temp directory for its files
+    :param str freesurfer_env: FreeSurfer environment file to source,
+      recorded with its installation in the header
+    :param list cleanup: commands to run before a retry or if the script
+      is preempted (see
+      :func:`seam.runner.retry.step_preamble`)
+    :param list disk_paths: directories the script writes to, recorded in
+      its header for :class:`seam.runner.disk.DiskGuard`
+    """
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    ingredients = ["#!/bin/bash",
+        "# Generated by seam version {} at {}".format(version, now)]
+    if threads:
+        ingredients.append(script_metadata_line('threads', threads))
+    if freesurfer_env:
+        freesurfer_env = os.path.abspath(freesurfer_env)
+        env = ensure_environment(freesurfer_env)
+        ingredients.append(script_metadata_line('freesurfer_env',
+            freesurfer_env))
+        for key in ('freesurfer_home', 'freesurfer_stamp',
+            'freesurfer_build'):
+            if key in env:
+                ingredients.append(script_metadata_line(key, env[key]))
+    if disk_paths:
+        ingredients.append(disk_metadata_line(disk_paths))
+    if threads:
+        ingredients.extend([""] + thread_exports(threads))
+    if freesurfer_env:
+        # FreeSurfer missing on this node isn't the subject's fault
+        ingredients.extend([""] + source_lines(freesurfer_env,
+            EXIT_TRANSIENT))
+    if use_xvfb:
+        # xvfb-run's auth & error files go in a directory removed on exit
+        ingredients.extend(["", tmp_preamble(tmp_dir, EXIT_TRANSIENT)])
+    ingredients.extend(["",
+        step_preamble(state_dir(path), max_attempts=max_attempts,
+            delay=retry_delay, cleanup=cleanup)])
+    for step in steps:
+        comment, name, cmd = step[:3]
+        resume = step[3] if len(step) > 3 else None
+        ingredients.extend(["", "# " + comment, step_cmd(name, cmd,
+            resume)])
+
+    with open(path, 'w') as f:
         f.write('\n'.join(ingredients))
         f.write('\n')
-    os.chmod(final_script, S_IRWXU)
-    return tuple(to_return)
+    os.chmod(path, S_IRWXU)
 
 
 def get_parser():
@@ -179,6 +351,36 @@ def get_parser():
         dest="inputs")
     ap.add_argument('--use-xvfb', action='store_true', default=False,
         dest="use_xvfb", help="Use xvfb-run for graphical programs")
+    ap.add_argument('--no-dedupe', action='store_false', default=True,
+        dest="dedupe", help="Keep inputs with duplicate contents")
+    ap.add_argument('--template-mode', default=None, dest="template_mode",
+        choices=['symlink', 'hardlink'],
+        help="Share fsaverage into SUBJECTS_DIR once, with flock (default: "
+        "leave it to recon-all)")
+    ap.add_argument('--max-attempts', type=int, default=3,
+        dest="max_attempts", help="Attempts per step on transient failures")
+    ap.add_argument('--threads', type=int, default=None,
+        help="Cores for the subject (recon-all -openmp)")
+    ap.add_argument('--screenshot-format', default=None,
+        dest="screenshot_format", help="Convert screenshots to this format")
+    ap.add_argument('--delete-tiffs', action='store_true', default=False,
+        dest="delete_tiffs", help="Remove TIFF screenshots once converted")
+    ap.add_argument('--native-labels', action='store_true', default=False,
+        dest="native_labels",
+        help="Convert annotations to labels without mri_annotation2label")
+    ap.add_argument('--hash-cache', default=None, dest="hash_cache",
+        help="JSON file caching input hashes between builds")
+    ap.add_argument('--tmp-dir', default=None, dest="tmp_dir",
+        help="Directory for temp files, e.g. a tmpfs (default: $TMPDIR)")
+    ap.add_argument('--native-screenshots', action='store_true',
+        default=False, dest="native_screenshots",
+        help="Render screenshots in Python instead of tkmedit & tksurfer")
+    ap.add_argument('--freesurfer-env', default=None, dest="freesurfer_env",
+        help="Source this FreeSurfer environment snapshot (captured from "
+        "$FREESURFER_HOME if missing or stale)")
+    ap.add_argument('--archive-dir', default=None, dest="archive_dir",
+        help="Finally prune & pack the subject into an archive here, "
+        "removing its directory")
     return ap
 
 
@@ -187,7 +389,13 @@ def main():
     args, recon_flags = ap.parse_known_args()
     written_files = build_recipe(subject_id=args.subject_id,
         input_data=args.inputs, script_dir=args.script_dir,
-        use_xvfb=args.use_xvfb, recon_flags=recon_flags)
+        use_xvfb=args.use_xvfb, recon_flags=recon_flags, dedupe=args.dedupe,
+        hash_cache=args.hash_cache, template_mode=args.template_mode,
+        max_attempts=args.max_attempts, threads=args.threads,
+        screenshot_format=args.screenshot_format,
+        delete_tiffs=args.delete_tiffs, native_labels=args.native_labels,
+        tmp_dir=args.tmp_dir, native_screenshots=args.native_screenshots,
+        freesurfer_env=args.freesurfer_env, archive_dir=args.archive_dir)
     main_script, tkm_script, tks_lh, tks_rh = written_files
     print("Main executable script written to {}".format(main_script))
 
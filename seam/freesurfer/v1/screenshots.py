@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" screenshots.py
+
+Post-process the screenshots ``tkmedit`` & ``tksurfer`` save
+
+Each subject's :func:`~seam.freesurfer.v1.recipe.screenshots_dir` holds
+~25 ``tkmedit-$i.tiff`` slices and four ``<hemi>-*.tiff`` views per
+hemisphere, all uncompressed. These functions convert them to a
+compressed format in a process pool, build one contact sheet per subject
+and optionally delete the TIFFs. The PNGs the native renderers write
+(:mod:`~seam.freesurfer.v1.slices`, :mod:`~seam.freesurfer.v1.surfaces`)
+go on the contact sheet too.
+
+PNG needs nothing beyond the standard library. Other formats (e.g.
+``webp``) are written with `Pillow <https://python-pillow.org>`_, which
+must then be installed.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import re
+from os.path import join, splitext
+from multiprocessing import Pool
+
+from ...util import shell_quote
+from ...images import read_tiff, read_png, write_png, subsample, montage
+
+CONTACT_SHEET = 'contact-sheet'
+
+
+def _sort_key(fname):
+    "Sort tkmedit slices numerically, then surfaces by name"
+    match = re.match(r'tkmedit-(\d+)\.(tiff?|png)$', fname)
+    if match:
+        return (0, int(match.group(1)), fname)
+    return (1, 0, fname)
+
+def list_tiffs(ss_dir):
+    "TIFFs in *ss_dir*, slices in order followed by the surface views"
+    return sorted((f for f in os.listdir(ss_dir)
+        if f.lower().endswith(('.tif', '.tiff'))), key=_sort_key)
+
+def list_images(ss_dir):
+    """
+    Screenshots in *ss_dir* ordered like :func:`list_tiffs`: the TIFFs, and
+    PNGs that weren't converted from one (e.g. rendered natively)
+    """
+    tiffs = list_tiffs(ss_dir)
+    stems = set(splitext(f)[0] for f in tiffs)
+    pngs = [f for f in os.listdir(ss_dir) if f.lower().endswith('.png')
+        and splitext(f)[0] not in stems and
+        not f.startswith(CONTACT_SHEET + '.')]
+    return sorted(tiffs + pngs, key=_sort_key)
+
+
+def _save(image, path):
+    if path.lower().endswith('.png'):
+        write_png(path, image)
+        return
+    try:
+        from PIL import Image as PILImage
+    except ImportError:
+        raise ImportError('Pillow is required to write {}, only PNG is '
+            'supported without it'.format(os.path.basename(path)))
+    mode = {1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}[image.channels]
+    PILImage.frombytes(mode, (image.width, image.height),
+        bytes(image.data)).save(path)
+
+def convert_image(path, fmt='png', scale=None):
+    """
+    Convert one TIFF (or PNG), next to the original.
+
+    :param str path: TIFF or PNG to convert
+    :param str fmt: extension of the format to write, e.g. ``png``
+    :param int scale: also return a copy subsampled by this factor
+    :return: path written (None for a PNG already in *fmt*), and the
+      subsampled image (or None)
+    :rtype: tuple
+    """
+    stem, ext = splitext(path)
+    if ext.lower() == '.png':
+        image = read_png(path)
+        out_path = None if fmt == 'png' else '{}.{}'.format(stem, fmt)
+    else:
+        image = read_tiff(path)
+        out_path = '{}.{}'.format(stem, fmt)
+    if out_path:
+        _save(image, out_path)
+    return out_path, subsample(image, scale) if scale else None
+
+def _convert(args):
+    return convert_image(*args)
+
+
+def postprocess_screenshots(ss_dir, fmt='png', contact_sheet=True, columns=6,
+    scale=4, delete_tiffs=False, processes=None):
+    """
+    Convert every TIFF in *ss_dir* to *fmt* in a process pool and build a
+    contact sheet of all of them, and of PNGs rendered natively (see
+    :func:`list_images`).
+
+    :param str ss_dir: a subject's screenshot directory
+    :param str fmt: extension of the format to write, e.g. ``png`` or ``webp``
+    :param boolean contact_sheet: write ``contact-sheet.<fmt>`` in *ss_dir*
+    :param int columns: images per row of the contact sheet
+    :param int scale: shrink images by this factor on the contact sheet
+    :param boolean delete_tiffs: remove each TIFF once converted
+    :param int processes: worker processes (default: one per CPU)
+    :return: paths written, contact sheet last
+    :rtype: list
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.screenshots import postprocess_screenshots
+      >>> postprocess_screenshots('/path/to/scripts/sub0001_screenshots',
+      ...     delete_tiffs=True)
+    """
+    tiffs = [join(ss_dir, f) for f in list_tiffs(ss_dir)]
+    paths = [join(ss_dir, f) for f in list_images(ss_dir)]
+    if not paths:
+        return []
+    tasks = [(path, fmt, scale if contact_sheet else None) for path in paths]
+    if len(tasks) == 1:
+        results = [_convert(tasks[0])]
+    else:
+        pool = Pool(processes)
+        try:
+            results = pool.map(_convert, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    written = [path for path, _ in results if path]
+    if contact_sheet:
+        sheet_path = join(ss_dir, '{}.{}'.format(CONTACT_SHEET, fmt))
+        _save(montage([thumb for _, thumb in results], columns), sheet_path)
+        written.append(sheet_path)
+    if delete_tiffs:
+        for path in tiffs:
+            os.remove(path)
+    return written
+
+
+def postprocess_cmd(ss_dir, fmt='png', delete_tiffs=False):
+    """
+    Command to run :func:`postprocess_screenshots` from a generated script
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.screenshots import postprocess_cmd
+      >>> postprocess_cmd('/path/My Study/sub0001_screenshots',
+      ...     delete_tiffs=True)
+      "seam screenshots '/path/My Study/sub0001_screenshots' --format png --delete-tiffs"
+    """
+    parts = ['seam screenshots', shell_quote(ss_dir),
+        '--format {}'.format(shell_quote(fmt))]
+    if delete_tiffs:
+        parts.append('--delete-tiffs')
+    return ' '.join(parts)
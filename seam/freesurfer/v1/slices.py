@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" slices.py
+
+Render QC slices without ``tkmedit`` or an X server
+
+:func:`render_slices` reads ``brain.finalsurfs.mgz`` and ``aseg.mgz``
+into NumPy, blends the segmentation's color table over the intensities
+and draws where the white & pial surfaces cross each slice, writing a
+PNG per slice named like the ``tkmedit`` screenshots
+(``tkmedit-<slice>.png``). Slices are rendered in a thread pool: the
+blending is vectorized and PNG compression releases the GIL.
+
+Colors come from ``$FREESURFER_HOME/FreeSurferColorLUT.txt`` when
+FreeSurfer is installed, otherwise from the standard ``aseg`` colors
+built in here.
+
+:note: These functions require `NumPy <http://www.numpy.org>`_.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+from os.path import join
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from ...images import encode_png_rows
+from .formats import read_mgh, read_geometry
+
+ORIENTATIONS = {'sagittal': 0, 'coronal': 1, 'axial': 2}
+# The slices the tkmedit screenshots take
+DEFAULT_SLICES = tuple(range(5, 256, 10))
+# Surface outline colors, as tkmedit draws them
+SURFACE_COLORS = {'white': (255, 255, 0), 'pial': (255, 0, 0)}
+
+# Standard aseg structures from FreeSurferColorLUT.txt
+ASEG_COLORS = {
+    2: (245, 245, 245), 3: (205, 62, 78), 4: (120, 18, 134),
+    5: (196, 58, 250), 7: (220, 248, 164), 8: (230, 148, 34),
+    10: (0, 118, 14), 11: (122, 186, 220), 12: (236, 13, 176),
+    13: (12, 48, 255), 14: (204, 182, 142), 15: (42, 204, 164),
+    16: (119, 159, 176), 17: (220, 216, 20), 18: (103, 255, 255),
+    24: (60, 60, 60), 26: (255, 165, 0), 28: (165, 42, 42),
+    30: (160, 32, 240), 31: (0, 200, 200), 41: (245, 245, 245),
+    42: (205, 62, 78), 43: (120, 18, 134), 44: (196, 58, 250),
+    46: (220, 248, 164), 47: (230, 148, 34), 49: (0, 118, 14),
+    50: (122, 186, 220), 51: (236, 13, 176), 52: (13, 48, 255),
+    53: (220, 216, 20), 54: (103, 255, 255), 58: (255, 165, 0),
+    60: (165, 42, 42), 62: (160, 32, 240), 63: (0, 200, 221),
+    72: (120, 190, 150), 77: (200, 70, 255), 85: (234, 169, 30),
+    251: (0, 0, 64), 252: (0, 0, 112), 253: (0, 0, 160),
+    254: (0, 0, 208), 255: (0, 0, 255),
+}
+
+
+def _lut_array(colors):
+    lut = np.zeros((max(colors) + 1, 3), np.uint8)
+    for label, rgb in colors.items():
+        lut[label] = rgb
+    return lut
+
+def read_lut(path):
+    """
+    Read a FreeSurfer color table (e.g. ``FreeSurferColorLUT.txt``).
+
+    :return: RGB colors indexed by label, uint8 (labels x 3)
+    :rtype: numpy.ndarray
+    """
+    colors = {}
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5 or not parts[0].isdigit():
+                continue
+            colors[int(parts[0])] = tuple(int(p) for p in parts[2:5])
+    return _lut_array(colors)
+
+def default_lut():
+    "FreeSurfer's color table if it's installed, else :data:`ASEG_COLORS`"
+    path = join(os.environ.get('FREESURFER_HOME', ''),
+        'FreeSurferColorLUT.txt')
+    if os.path.isfile(path):
+        return read_lut(path)
+    return _lut_array(ASEG_COLORS)
+
+
+def ras_axes(Mdc):
+    """
+    How to reorder and flip a volume's axes so they increase toward
+    right, anterior & superior.
+
+    :param Mdc: direction cosines, one column per voxel axis
+    :return: voxel axis for each of R, A & S, and whether to flip it
+    :rtype: tuple
+    """
+    Mdc = np.asarray(Mdc)
+    dominant = np.abs(Mdc).argmax(axis=0)
+    order = [int(np.flatnonzero(dominant == r)[0]) for r in range(3)]
+    flips = [bool(Mdc[r, a] < 0) for r, a in enumerate(order)]
+    return order, flips
+
+def to_ras(data, Mdc):
+    "View *data* (first frame) with axes increasing toward R, A & S"
+    if data.ndim == 4:
+        data = data[..., 0]
+    order, flips = ras_axes(Mdc)
+    data = data.transpose(order)
+    index = tuple(slice(None, None, -1) if flip else slice(None)
+        for flip in flips)
+    return data[index]
+
+def surface_voxels(coords, header):
+    """
+    Convert surface (tkregister RAS) coordinates to the voxel coordinates
+    of :func:`to_ras` views of the volume described by *header*.
+
+    :rtype: numpy.ndarray
+    """
+    dims = np.array(header['dims'][:3], np.float64)
+    M = header['Mdc'] * np.array(header['voxel_size'])
+    vox = np.linalg.solve(M, coords.T.astype(np.float64)).T + dims / 2
+    order, flips = ras_axes(header['Mdc'])
+    vox = vox[:, order]
+    for r, flip in enumerate(flips):
+        if flip:
+            vox[:, r] = dims[order[r]] - 1 - vox[:, r]
+    return vox
+
+
+def slice_segments(vox, faces, axis, index):
+    """
+    Where a surface crosses a slice.
+
+    :param vox: vertex coordinates from :func:`surface_voxels`
+    :param faces: triangles (faces x 3 vertex indices)
+    :param int axis: axis of the slice (0, 1 or 2)
+    :param float index: position of the slice along *axis*
+    :return: line segments (segments x 2 points x 2), in the slice's
+      remaining axes
+    :rtype: numpy.ndarray
+    """
+    others = [a for a in range(3) if a != axis]
+    tri = vox[faces]
+    depth = tri[:, :, axis] - index
+    above = depth >= 0
+    crossing = above.any(axis=1) & ~above.all(axis=1)
+    tri, depth, above = tri[crossing], depth[crossing], above[crossing]
+    if not len(tri):
+        return np.zeros((0, 2, 2))
+    points, crosses = [], []
+    for a, b in ((0, 1), (1, 2), (2, 0)):
+        da, db = depth[:, a], depth[:, b]
+        edge = above[:, a] != above[:, b]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(edge, da / (da - db), 0)
+        point = tri[:, a] + t[:, None] * (tri[:, b] - tri[:, a])
+        points.append(point[:, others])
+        crosses.append(edge)
+    points = np.stack(points, axis=1)
+    crosses = np.stack(crosses, axis=1)
+    # The two crossing edges of each triangle, first
+    first = np.argsort(~crosses, axis=1, kind='mergesort')[:, :2]
+    return np.take_along_axis(points, first[:, :, None], axis=1)
+
+
+def _draw_segments(rgb, segments, color, height, scale):
+    "Draw *segments* (slice voxel coordinates) into *rgb*, in place"
+    if not len(segments):
+        return
+    p0, p1 = segments[:, 0], segments[:, 1]
+    counts = np.ceil(np.abs(p1 - p0).max(axis=1) * scale).astype(int) + 1
+    which = np.repeat(np.arange(len(segments)), counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    t = (np.arange(counts.sum()) - starts) / np.maximum(counts[which] - 1, 1)
+    points = p0[which] + t[:, None] * (p1 - p0)[which]
+    cols = np.floor((points[:, 0] + 0.5) * scale).astype(int)
+    rows = np.floor((height - 1 - points[:, 1] + 0.5) * scale).astype(int)
+    inside = (cols >= 0) & (cols < rgb.shape[1]) & (rows >= 0) & \
+        (rows < rgb.shape[0])
+    rgb[rows[inside], cols[inside]] = color
+
+def blend(gray, labels, lut, alpha=0.4):
+    """
+    Blend label colors over a grayscale slice.
+
+    :param gray: intensities scaled to 0-255 (rows x columns)
+    :param labels: segmentation labels of the slice, 0 is left unblended
+    :param lut: colors indexed by label, see :func:`read_lut`
+    :param float alpha: opacity of the label colors
+    :return: RGB slice, uint8 (rows x columns x 3)
+    :rtype: numpy.ndarray
+    """
+    rgb = np.repeat(gray.astype(np.float32)[:, :, None], 3, axis=2)
+    if labels is not None:
+        labels = labels.astype(np.int64)
+        known = (labels > 0) & (labels < len(lut))
+        colors = lut[np.where(known, labels, 0)].astype(np.float32)
+        rgb[known] = (1 - alpha) * rgb[known] + alpha * colors[known]
+    return np.clip(rgb + 0.5, 0, 255).astype(np.uint8)
+
+def encode_rgb_png(rgb, level=6):
+    "PNG file contents for an RGB array (rows x columns x 3, uint8)"
+    height, width = rgb.shape[:2]
+    raw = np.zeros((height, width * 3 + 1), np.uint8)
+    # Filter type 0 (none) per row
+    raw[:, 1:] = rgb.reshape(height, -1)
+    return encode_png_rows(width, height, 3, raw.tobytes(), level)
+
+
+class SliceRenderer(object):
+    """
+    Renders slices of one subject's volume, segmentation and surfaces.
+
+    :param volume: intensities, in :func:`to_ras` orientation
+    :param labels: segmentation in the same orientation, or None
+    :param surfaces: ``(vertex voxel coordinates, faces, color)`` tuples
+    :param lut: label colors, see :func:`read_lut`
+    :param float alpha: opacity of the label colors
+    :param int scale: pixels per voxel
+    """
+    def __init__(self, volume, labels=None, surfaces=(), lut=None,
+        alpha=0.4, scale=1):
+        nonzero = volume[volume > 0]
+        top = np.percentile(nonzero, 99.5) if len(nonzero) else 1
+        self.volume = volume
+        self.gain = 255.0 / max(float(top), 1e-6)
+        self.labels = labels
+        self.surfaces = surfaces
+        self.lut = default_lut() if lut is None else lut
+        self.alpha = alpha
+        self.scale = scale
+
+    def render(self, axis, index):
+        "RGB image of slice *index* along *axis*, superior/anterior up"
+        take = [slice(None)] * 3
+        take[axis] = index
+        gray = np.asarray(self.volume[tuple(take)], np.float32).T[::-1]
+        labels = None
+        if self.labels is not None:
+            labels = np.asarray(self.labels[tuple(take)]).T[::-1]
+        rgb = blend(np.clip(gray * self.gain, 0, 255), labels, self.lut,
+            self.alpha)
+        if self.scale > 1:
+            rgb = rgb.repeat(self.scale, axis=0).repeat(self.scale, axis=1)
+        height = gray.shape[0]
+        for vox, faces, color in self.surfaces:
+            _draw_segments(rgb, slice_segments(vox, faces, axis, index),
+                color, height, self.scale)
+        return rgb
+
+
+def render_slices(subject_id, outdir, subjects_dir=None,
+    volume='brain.finalsurfs.mgz', seg='aseg.mgz',
+    surfaces=('white', 'pial'), orientation='coronal', slices=DEFAULT_SLICES,
+    alpha=0.4, scale=1, threads=None):
+    """
+    Write a PNG per slice of *subject_id*'s *volume*, with *seg* blended
+    over it and the outlines of *surfaces* of both hemispheres, in place
+    of ``tkmedit`` screenshots.
+
+    :param str subject_id: subject identifier
+    :param str outdir: directory to write ``tkmedit-<slice>.png`` files
+    :param str subjects_dir: default ``$SUBJECTS_DIR``
+    :param str volume: volume in the subject's ``mri`` directory
+    :param str seg: segmentation in ``mri`` to blend, None for none
+    :param surfaces: surfaces to outline (missing ones are skipped)
+    :param str orientation: ``coronal``, ``axial`` or ``sagittal``
+    :param slices: slice indices to render
+    :param float alpha: opacity of the segmentation colors
+    :param int scale: pixels per voxel
+    :param int threads: slices rendered at once (default: one per CPU)
+    :return: paths written, in slice order
+    :rtype: list
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.slices import render_slices
+      >>> render_slices('sub0001', '/path/to/sub0001_screenshots')
+    """
+    sd = subjects_dir or os.environ['SUBJECTS_DIR']
+    mri = join(sd, subject_id, 'mri')
+    data, header = read_mgh(join(mri, volume))
+    labels = None
+    if seg:
+        seg_data, seg_header = read_mgh(join(mri, seg))
+        labels = to_ras(seg_data, seg_header['Mdc'])
+    outlines = []
+    for surface in surfaces:
+        for hemi in ('lh', 'rh'):
+            path = join(sd, subject_id, 'surf', '{}.{}'.format(hemi, surface))
+            if not os.path.isfile(path):
+                continue
+            coords, faces = read_geometry(path)
+            outlines.append((surface_voxels(coords, header), faces,
+                SURFACE_COLORS.get(surface, (0, 255, 0))))
+    renderer = SliceRenderer(to_ras(data, header['Mdc']), labels, outlines,
+        alpha=alpha, scale=scale)
+    axis = ORIENTATIONS[orientation]
+    slices = [i for i in slices if 0 <= i < renderer.volume.shape[axis]]
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    def write(index):
+        path = join(outdir, 'tkmedit-{:d}.png'.format(index))
+        with open(path, 'wb') as f:
+            f.write(encode_rgb_png(renderer.render(axis, index)))
+        return path
+
+    pool = ThreadPool(threads)
+    try:
+        return pool.map(write, slices)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" surfaces.py
+
+Render surface screenshots without ``tksurfer`` or an X server
+
+:func:`render_surfaces` reads each hemisphere's ``inflated`` surface
+(shaded by ``?h.curv``, light gyri & dark sulci as ``tksurfer -gray``)
+and ``aparc.a2009s`` annotation, and writes the four views the
+``tksurfer`` screenshots take, as PNGs named like them:
+``<hemi>-lateral``, ``<hemi>-medial``, ``<hemi>-annot-lateral`` and
+``<hemi>-annot-medial``.
+
+The mesh is rasterized with a z-buffer in NumPy: every triangle's
+candidate pixels are tested at once and the nearest triangle kept per
+pixel. A :class:`SurfaceRenderer` rasterizes each view once and colors
+it for any number of annotations, so all views of a hemisphere come
+from one surface load.
+
+:note: These functions require `NumPy <http://www.numpy.org>`_.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+from os.path import join
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from .formats import read_geometry, read_annot, read_morph_data
+from .slices import encode_rgb_png
+
+VIEWS = ('lateral', 'medial')
+# Side the viewer is on (-x left, +x right) for each hemisphere's views
+_VIEWER_SIDE = {('lh', 'lateral'): -1, ('lh', 'medial'): 1,
+    ('rh', 'lateral'): 1, ('rh', 'medial'): -1}
+# Binary curvature grays, as tksurfer -gray
+GYRUS_GRAY, SULCUS_GRAY = 165, 100
+# Light from the viewer: ambient plus diffuse
+AMBIENT = 0.35
+# Triangles rasterized at once, bounds memory use
+CHUNK = 65536
+
+
+def vertex_normals(coords, faces):
+    "Unit normal of each vertex, the area weighted mean of its faces'"
+    tri = coords[faces].astype(np.float64)
+    face_normals = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    normals = np.zeros(coords.shape, np.float64)
+    for corner in range(3):
+        np.add.at(normals, faces[:, corner], face_normals)
+    lengths = np.sqrt((normals ** 2).sum(axis=1))
+    return normals / np.maximum(lengths, 1e-12)[:, None]
+
+
+def curvature_colors(curv, nvertices):
+    "Gray of each vertex: gyri (curv <= 0) light, sulci dark"
+    colors = np.empty((nvertices, 3), np.uint8)
+    if curv is None:
+        colors[:] = GYRUS_GRAY
+    else:
+        colors[:] = np.where(np.asarray(curv) > 0, SULCUS_GRAY,
+            GYRUS_GRAY)[:, None]
+    return colors
+
+def annot_colors(annot_path, base):
+    """
+    Color of each vertex from an annotation, *base* colors where it's
+    unlabelled.
+
+    :rtype: numpy.ndarray
+    """
+    labels, ctab, _ = read_annot(annot_path)
+    colors = base.copy()
+    labelled = labels >= 0
+    colors[labelled] = ctab[labels[labelled], :3]
+    return colors
+
+
+class SurfaceRenderer(object):
+    """
+    Renders views of one hemisphere's surface.
+
+    :param coords: vertex coordinates (vertices x 3)
+    :param faces: triangles (faces x 3 vertex indices)
+    :param str hemi: ``lh`` or ``rh``, which side is lateral
+    :param curv: curvature per vertex for the gray shading, or None
+    :param int size: width & height of the images, in pixels
+    """
+    def __init__(self, coords, faces, hemi, curv=None, size=600):
+        self.coords = np.asarray(coords, np.float64)
+        self.faces = np.asarray(faces, np.int64)
+        self.hemi = hemi
+        self.size = size
+        self.normals = vertex_normals(self.coords, self.faces)
+        self.base = curvature_colors(curv, len(self.coords))
+        # Lateral & medial views mirror each other, so frame both the same
+        lo = self.coords[:, 1:].min(axis=0)
+        hi = self.coords[:, 1:].max(axis=0)
+        self.center = (lo + hi) / 2
+        self.zoom = 0.9 * size / max(float((hi - lo).max()), 1e-6)
+        self._rasters = {}
+
+    def _project(self, side):
+        "Pixel x, y & depth (larger is nearer) of each vertex"
+        x = (side * (self.coords[:, 1] - self.center[0])) * self.zoom + \
+            self.size / 2.0
+        y = self.size / 2.0 - (self.coords[:, 2] - self.center[1]) * self.zoom
+        return np.stack([x, y], axis=1), side * self.coords[:, 0]
+
+    def rasterize(self, view):
+        """
+        The nearest triangle at each covered pixel of *view*.
+
+        :return: flat pixel indices, the triangle covering each and the
+          barycentric weights of its vertices there (pixels x 3)
+        :rtype: tuple
+        """
+        if view in self._rasters:
+            return self._rasters[view]
+        side = _VIEWER_SIDE[(self.hemi, view)]
+        points, depth = self._project(side)
+        pixels, tris, weights, depths = [], [], [], []
+        for start in range(0, len(self.faces), CHUNK):
+            found = self._rasterize_chunk(points, depth,
+                np.arange(start, min(start + CHUNK, len(self.faces))))
+            for acc, part in zip((pixels, tris, weights, depths), found):
+                acc.append(part)
+        pixels = np.concatenate(pixels)
+        tris = np.concatenate(tris)
+        weights = np.concatenate(weights)
+        depths = np.concatenate(depths)
+        # Nearest first within each pixel, keep the first
+        order = np.lexsort((-depths, pixels))
+        pixels = pixels[order]
+        first = np.ones(len(pixels), bool)
+        first[1:] = pixels[1:] != pixels[:-1]
+        raster = (pixels[first], tris[order][first], weights[order][first])
+        self._rasters[view] = raster
+        return raster
+
+    def _rasterize_chunk(self, points, depth, which):
+        tri = points[self.faces[which]]
+        lo = np.ceil(tri.min(axis=1) - 0.5).astype(np.int64)
+        hi = np.floor(tri.max(axis=1) - 0.5).astype(np.int64)
+        lo = np.maximum(lo, 0)
+        hi = np.minimum(hi, self.size - 1)
+        spans = np.maximum(hi - lo + 1, 0)
+        counts = spans[:, 0] * spans[:, 1]
+        # Every candidate pixel of every triangle
+        owner = np.repeat(np.arange(len(which)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) -
+            counts, counts)
+        width = spans[owner, 0]
+        px = lo[owner, 0] + local % np.maximum(width, 1)
+        py = lo[owner, 1] + local // np.maximum(width, 1)
+        a, b, c = tri[owner, 0], tri[owner, 1], tri[owner, 2]
+        det = (b[:, 1] - c[:, 1]) * (a[:, 0] - c[:, 0]) + \
+            (c[:, 0] - b[:, 0]) * (a[:, 1] - c[:, 1])
+        dx, dy = px + 0.5 - c[:, 0], py + 0.5 - c[:, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            l1 = ((b[:, 1] - c[:, 1]) * dx + (c[:, 0] - b[:, 0]) * dy) / det
+            l2 = ((c[:, 1] - a[:, 1]) * dx + (a[:, 0] - c[:, 0]) * dy) / det
+            l3 = 1 - l1 - l2
+        eps = -1e-9
+        inside = (det != 0) & (l1 >= eps) & (l2 >= eps) & (l3 >= eps)
+        weights = np.stack([l1, l2, l3], axis=1)[inside]
+        owner = owner[inside]
+        faces = which[owner]
+        z = (depth[self.faces[faces]] * weights).sum(axis=1)
+        return (py[inside] * self.size + px[inside], faces, weights, z)
+
+    def render(self, view, colors=None):
+        """
+        RGB image of *view* (``lateral`` or ``medial``).
+
+        :param colors: color of each vertex (vertices x 3), e.g. from
+          :func:`annot_colors`; default the curvature grays
+        :return: RGB image, uint8 (size x size x 3)
+        :rtype: numpy.ndarray
+        """
+        if colors is None:
+            colors = self.base
+        pixels, tris, weights = self.rasterize(view)
+        corners = self.faces[tris]
+        # Flat color from the nearest vertex keeps annotation borders sharp
+        nearest = corners[np.arange(len(tris)), weights.argmax(axis=1)]
+        normal = (self.normals[corners] * weights[:, :, None]).sum(axis=1)
+        # The light is at the viewer; abs() ignores the faces' winding
+        side = _VIEWER_SIDE[(self.hemi, view)]
+        length = np.sqrt((normal ** 2).sum(axis=1))
+        light = np.abs(side * normal[:, 0]) / np.maximum(length, 1e-12)
+        shade = AMBIENT + (1 - AMBIENT) * light
+        rgb = np.zeros((self.size * self.size, 3), np.uint8)
+        rgb[pixels] = np.clip(colors[nearest] * shade[:, None] + 0.5, 0,
+            255).astype(np.uint8)
+        return rgb.reshape(self.size, self.size, 3)
+
+
+def render_hemisphere(subject_id, hemi, basepath, subjects_dir=None,
+    surface='inflated', annots=('aparc.a2009s',), views=VIEWS, size=600):
+    """
+    Write the views of one hemisphere, plain and with each annotation.
+
+    Images are named ``<basepath>-<view>.png`` and, for the first
+    annotation, ``<basepath>-annot-<view>.png`` as ``tksurfer``'s; further
+    annotations are named ``<basepath>-<annot>-<view>.png``. Annotations
+    that don't exist are skipped.
+
+    :return: paths written
+    :rtype: list
+    """
+    sd = subjects_dir or os.environ['SUBJECTS_DIR']
+    subject_dir = join(sd, subject_id)
+    coords, faces = read_geometry(join(subject_dir, 'surf',
+        '{}.{}'.format(hemi, surface)))
+    curv_path = join(subject_dir, 'surf', '{}.curv'.format(hemi))
+    curv = read_morph_data(curv_path) if os.path.isfile(curv_path) else None
+    renderer = SurfaceRenderer(coords, faces, hemi, curv=curv, size=size)
+    layers = [('', None)]
+    for i, annot in enumerate(annots):
+        annot_path = join(subject_dir, 'label', '{}.{}.annot'.format(hemi,
+            annot))
+        if os.path.isfile(annot_path):
+            layers.append(('annot-' if i == 0 else annot + '-',
+                annot_colors(annot_path, renderer.base)))
+    written = []
+    for view in views:
+        for prefix, colors in layers:
+            path = '{}-{}{}.png'.format(basepath, prefix, view)
+            with open(path, 'wb') as f:
+                f.write(encode_rgb_png(renderer.render(view, colors)))
+            written.append(path)
+    return written
+
+
+def render_surfaces(subject_id, outdir, subjects_dir=None,
+    hemis=('lh', 'rh'), surface='inflated', annots=('aparc.a2009s',),
+    views=VIEWS, size=600, threads=None):
+    """
+    Write the ``tksurfer`` screenshot views of *subject_id*'s hemispheres
+    (see :func:`render_hemisphere`), in place of ``tksurfer``.
+
+    :param str subject_id: subject identifier
+    :param str outdir: directory to write ``<hemi>-*.png`` files
+    :param str subjects_dir: default ``$SUBJECTS_DIR``
+    :param hemis: hemispheres to render
+    :param str surface: surface to render
+    :param annots: annotation names, e.g. ``aparc.a2009s``
+    :param views: ``lateral`` and/or ``medial``
+    :param int size: width & height of the images, in pixels
+    :param int threads: hemispheres rendered at once (default: all)
+    :return: paths written
+    :rtype: list
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.surfaces import render_surfaces
+      >>> render_surfaces('sub0001', '/path/to/sub0001_screenshots')
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    def render(hemi):
+        return render_hemisphere(subject_id, hemi, join(outdir, hemi),
+            subjects_dir=subjects_dir, surface=surface, annots=annots,
+            views=views, size=size)
+
+    pool = ThreadPool(threads or len(hemis))
+    try:
+        return [path for paths in pool.map(render, hemis) for path in paths]
+    finally:
+        pool.close()
+        pool.join()
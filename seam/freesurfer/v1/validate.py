@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" validate.py
+
+Check a batch manifest before any scripts are run
+
+:func:`validate_manifest` looks for the problems that otherwise fail a
+job in its first minute, after it has waited in a queue:
+
+* inputs that don't exist, can't be read, aren't NIfTI, DICOM or MGH,
+  or are truncated
+* a SUBJECTS_DIR that can't be written
+* subject IDs repeated in the manifest or already in SUBJECTS_DIR
+  (``recon-all -i`` refuses to overwrite a subject)
+
+Nothing is executed; every check is an ``os.stat``, ``os.access`` or a
+read of a few hundred header bytes, run from a thread pool so thousands
+of subjects on a network filesystem take seconds.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import gzip
+import struct
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from .manifest import read_manifest
+
+ERROR = 'ERROR'
+WARNING = 'WARNING'
+# Smaller files can't hold a usable T1 (or, for DICOM, even one slice)
+MIN_BYTES = 16 * 1024
+HEADER_BYTES = 352
+
+Problem = namedtuple('Problem', 'level subject_id path message')
+
+
+def sniff_header(buf):
+    """
+    Identify an image from its first bytes.
+
+    :param bytes buf: at least the first 352 bytes of the (decompressed)
+      file, fewer if the file is shorter
+    :return: ``(format, expected_bytes)`` where *format* is ``nifti1``,
+      ``nifti2``, ``dicom``, ``mgh`` or None, and *expected_bytes* the
+      size the header implies (None when unknown)
+    :rtype: tuple
+    """
+    if buf[128:132] == b'DICM':
+        return 'dicom', None
+    for endian in '<>':
+        if len(buf) >= 348 and struct.unpack_from(endian + 'i', buf)[0] == 348 \
+            and buf[344:347] in (b'n+1', b'ni1'):
+            dims = struct.unpack_from(endian + '8h', buf, 40)
+            bitpix = struct.unpack_from(endian + 'h', buf, 72)[0]
+            offset = int(struct.unpack_from(endian + 'f', buf, 108)[0])
+            if buf[344:347] == b'ni1':
+                # Header only, the voxels are in a separate .img
+                return 'nifti1', None
+            return 'nifti1', _expected(dims, bitpix, max(offset, 352))
+        if len(buf) >= 16 and struct.unpack_from(endian + 'i', buf)[0] == 540 \
+            and buf[4:7] in (b'n+2', b'ni2'):
+            return 'nifti2', None
+    if len(buf) >= 28 and struct.unpack_from('>i', buf)[0] == 1:
+        dims = struct.unpack_from('>5i', buf, 4)
+        kind = struct.unpack_from('>i', buf, 20)[0]
+        bitpix = {0: 8, 1: 32, 3: 32, 4: 16}.get(kind)
+        if bitpix:
+            return 'mgh', _expected((4,) + dims[:4], bitpix, 284)
+    return None, None
+
+def _expected(dims, bitpix, offset):
+    ndim = dims[0]
+    if not 0 < ndim <= 7 or bitpix <= 0:
+        return None
+    voxels = 1
+    for d in dims[1:ndim + 1]:
+        voxels *= max(d, 1)
+    return offset + voxels * bitpix // 8
+
+
+def check_input(path, min_bytes=MIN_BYTES):
+    """
+    Check one input image without loading it.
+
+    :param str path: path to a NIfTI, DICOM or MGH file (possibly gzipped)
+    :param int min_bytes: warn about files smaller than this
+    :return: ``(level, message)`` for each problem found
+    :rtype: list
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [(ERROR, 'does not exist')]
+    if not os.path.isfile(path):
+        return [(ERROR, 'is not a file')]
+    if not os.access(path, os.R_OK):
+        return [(ERROR, 'is not readable')]
+    problems = []
+    if st.st_size < min_bytes:
+        problems.append((WARNING, 'is only {:d} bytes'.format(st.st_size)))
+    compressed = path.endswith(('.gz', '.mgz'))
+    opener = gzip.open if compressed else open
+    try:
+        with opener(path, 'rb') as f:
+            buf = f.read(HEADER_BYTES)
+    except (IOError, OSError, EOFError) as e:
+        return problems + [(ERROR, 'could not be read ({})'.format(e))]
+    fmt, expected = sniff_header(buf)
+    if fmt is None:
+        problems.append((ERROR, 'is not NIfTI, DICOM or MGH'))
+    elif expected is not None and not compressed and st.st_size < expected:
+        problems.append((ERROR, 'is truncated: {:d} of {:d} bytes'.format(
+            st.st_size, expected)))
+    return problems
+
+
+def check_subjects_dir(subjects_dir):
+    "Problems with writing subjects to *subjects_dir*, as messages"
+    if os.path.isdir(subjects_dir):
+        if not os.access(subjects_dir, os.W_OK | os.X_OK):
+            return ['{} is not writable'.format(subjects_dir)]
+        return []
+    if os.path.exists(subjects_dir):
+        return ['{} is not a directory'.format(subjects_dir)]
+    # build_recipe's scripts create it, which needs a writable ancestor
+    parent = os.path.dirname(os.path.abspath(subjects_dir))
+    while not os.path.exists(parent):
+        parent = os.path.dirname(parent)
+    if not os.access(parent, os.W_OK | os.X_OK):
+        return ['{} does not exist and {} is not writable'.format(
+            subjects_dir, parent)]
+    return []
+
+
+class Report(object):
+    """
+    The outcome of :func:`validate_manifest`.
+
+    :ivar list problems: :class:`Problem` tuples, errors first
+    :ivar int subjects: subjects checked
+    :ivar int inputs: distinct inputs checked
+    """
+    def __init__(self, problems, subjects, inputs):
+        self.problems = sorted(problems, key=lambda p: (p.level != ERROR,
+            p.subject_id or '', p.path or ''))
+        self.subjects = subjects
+        self.inputs = inputs
+
+    @property
+    def errors(self):
+        return [p for p in self.problems if p.level == ERROR]
+
+    @property
+    def warnings(self):
+        return [p for p in self.problems if p.level == WARNING]
+
+    @property
+    def ok(self):
+        "True when nothing would stop a job"
+        return not self.errors
+
+    def text(self):
+        "One tab separated line per problem, then a summary"
+        lines = ['\t'.join([p.level, p.subject_id or '-', p.path or '-',
+            p.message]) for p in self.problems]
+        lines.append('{:d} subjects, {:d} inputs: {:d} errors, {:d} '
+            'warnings'.format(self.subjects, self.inputs, len(self.errors),
+            len(self.warnings)))
+        return '\n'.join(lines)
+
+
+def validate_manifest(manifest, subjects_dir=None, threads=32,
+    min_bytes=MIN_BYTES):
+    """
+    Check every subject & input in a batch manifest.
+
+    :param manifest: path to a manifest, or rows from
+      :func:`seam.freesurfer.v1.manifest.read_manifest`
+    :param str subjects_dir: defaults to ``$SUBJECTS_DIR``
+    :param int threads: checks to run at once; they spend their time
+      waiting on the filesystem, so this can be well above the core count
+    :param int min_bytes: warn about inputs smaller than this
+    :rtype: :class:`Report`
+
+    Usage::
+
+      >>> from seam.freesurfer.v1.validate import validate_manifest
+      >>> report = validate_manifest('batch.csv')
+      >>> if not report.ok:
+      ...     print(report.text())
+    """
+    if not isinstance(manifest, list):
+        manifest = read_manifest(manifest)
+    if subjects_dir is None:
+        subjects_dir = os.environ.get('SUBJECTS_DIR')
+    problems = []
+    if subjects_dir is None:
+        problems.append(Problem(ERROR, None, None, 'SUBJECTS_DIR is not set'))
+    else:
+        problems.extend(Problem(ERROR, None, subjects_dir, msg)
+            for msg in check_subjects_dir(subjects_dir))
+
+    owners = {}
+    seen = set()
+    for row in manifest:
+        sid = row['subject_id']
+        if sid in seen:
+            problems.append(Problem(ERROR, sid, None,
+                'subject_id appears more than once'))
+        seen.add(sid)
+        if not row['input_data']:
+            problems.append(Problem(ERROR, sid, None, 'has no inputs'))
+        for path in row['input_data']:
+            owners.setdefault(path, []).append(sid)
+    for path, sids in owners.items():
+        if len(set(sids)) > 1:
+            problems.extend(Problem(WARNING, sid, path,
+                'is also an input of {}'.format(', '.join(
+                    sorted(set(sids) - set([sid]))))) for sid in set(sids))
+
+    def check(task):
+        kind, value = task
+        if kind == 'input':
+            return [Problem(level, sid, value, msg)
+                for level, msg in check_input(value, min_bytes)
+                for sid in sorted(set(owners[value]))]
+        if os.path.lexists(os.path.join(subjects_dir, value)):
+            return [Problem(ERROR, value, os.path.join(subjects_dir, value),
+                'already exists in SUBJECTS_DIR')]
+        return []
+
+    tasks = [('input', path) for path in owners]
+    if subjects_dir is not None:
+        tasks.extend(('subject', sid) for sid in sorted(seen))
+    pool = ThreadPool(max(1, threads))
+    try:
+        for found in pool.imap_unordered(check, tasks, chunksize=16):
+            problems.extend(found)
+    finally:
+        pool.close()
+        pool.join()
+    return Report(problems, len(seen), len(owners))
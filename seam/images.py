@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" images.py
+
+Just enough image I/O to post-process screenshots without dependencies:
+reading the uncompressed (or PackBits) TIFFs ``tkmedit`` & ``tksurfer``
+save, writing PNGs, subsampling and tiling images into contact sheets.
+
+Images are 8-bit with 1 (gray), 2 (gray & alpha), 3 (RGB) or 4 (RGBA)
+channels, stored row by row in a ``bytearray``.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import zlib
+import struct
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# PNG color type by number of channels
+PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+
+
+class Image(object):
+    """
+    An 8-bit image.
+
+    :param int width: columns
+    :param int height: rows
+    :param int channels: samples per pixel
+    :param data: ``width * height * channels`` bytes, row by row
+      (default: black)
+    """
+    def __init__(self, width, height, channels=3, data=None):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        if data is None:
+            data = bytearray(width * height * channels)
+        if len(data) != width * height * channels:
+            raise ValueError('Expected {:d} bytes of image data, got {:d}'.format(
+                width * height * channels, len(data)))
+        self.data = bytearray(data)
+
+    @property
+    def stride(self):
+        return self.width * self.channels
+
+    def row(self, y):
+        return self.data[y * self.stride:(y + 1) * self.stride]
+
+    def __repr__(self):
+        return 'Image({:d}x{:d}x{:d})'.format(self.width, self.height,
+            self.channels)
+
+
+# TIFF
+
+_TIFF_TYPES = {1: 'B', 2: 's', 3: 'H', 4: 'I', 6: 'b', 7: 'B', 8: 'h',
+    9: 'i', 16: 'Q'}
+
+def _tiff_tags(buf, endian):
+    ifd = struct.unpack_from(endian + 'I', buf, 4)[0]
+    count = struct.unpack_from(endian + 'H', buf, ifd)[0]
+    tags = {}
+    for i in range(count):
+        tag, typ, n, value = struct.unpack_from(endian + 'HHI4s', buf,
+            ifd + 2 + 12 * i)
+        if typ not in _TIFF_TYPES:
+            continue
+        fmt = '{}{:d}{}'.format(endian, n, _TIFF_TYPES[typ])
+        size = struct.calcsize(fmt)
+        if size <= 4:
+            values = struct.unpack_from(fmt, value)
+        else:
+            offset = struct.unpack(endian + 'I', value)[0]
+            values = struct.unpack_from(fmt, buf, offset)
+        tags[tag] = values
+    return tags
+
+def _unpackbits(data):
+    out = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        header = data[i]
+        header = header if header < 128 else header - 256
+        i += 1
+        if header >= 0:
+            out.extend(data[i:i + header + 1])
+            i += header + 1
+        elif header != -128:
+            out.extend(data[i:i + 1] * (1 - header))
+            i += 1
+    return out
+
+def read_tiff(path):
+    """
+    Read an 8-bit, single image TIFF saved without compression or with
+    PackBits, e.g. by ``tkmedit``'s ``SaveTIFF``.
+
+    :rtype: :class:`Image`
+    :raises ValueError: for TIFFs this reader doesn't support
+    """
+    with open(path, 'rb') as f:
+        buf = f.read()
+    endian = {b'II': '<', b'MM': '>'}.get(buf[:2])
+    if endian is None or struct.unpack_from(endian + 'H', buf, 2)[0] != 42:
+        raise ValueError('{} is not a TIFF'.format(path))
+    tags = _tiff_tags(buf, endian)
+    width, height = tags[256][0], tags[257][0]
+    channels = tags.get(277, (1,))[0]
+    compression = tags.get(259, (1,))[0]
+    photometric = tags.get(262, (2 if channels >= 3 else 1,))[0]
+    if set(tags.get(258, (8,))) != set([8]):
+        raise ValueError('{}: only 8-bit TIFFs are supported'.format(path))
+    if compression not in (1, 32773):
+        raise ValueError('{}: unsupported TIFF compression {:d}'.format(path,
+            compression))
+    if tags.get(284, (1,))[0] != 1 or photometric not in (0, 1, 2):
+        raise ValueError('{}: unsupported TIFF layout'.format(path))
+    data = bytearray()
+    for offset, nbytes in zip(tags[273], tags[279]):
+        strip = buf[offset:offset + nbytes]
+        data.extend(_unpackbits(bytearray(strip)) if compression == 32773
+            else strip)
+    image = Image(width, height, channels,
+        data[:width * height * channels])
+    if photometric == 0:
+        # WhiteIsZero
+        image.data = bytearray(255 - b for b in image.data)
+    if tags.get(274, (1,))[0] == 4:
+        # Rows stored bottom to top
+        image = flip_vertical(image)
+    return image
+
+
+# PNG
+
+def _png_chunk(kind, data):
+    crc = zlib.crc32(kind + data) & 0xffffffff
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', crc)
+
+def encode_png_rows(width, height, channels, raw, level=6):
+    """
+    PNG file contents from *raw* image data whose rows are each preceded
+    by a filter type byte (e.g. 0, none), deflated at *level* (0-9)
+    """
+    header = struct.pack('>IIBBBBB', width, height, 8,
+        PNG_COLOR_TYPES[channels], 0, 0, 0)
+    return b''.join([PNG_SIGNATURE, _png_chunk(b'IHDR', header),
+        _png_chunk(b'IDAT', zlib.compress(bytes(raw), level)),
+        _png_chunk(b'IEND', b'')])
+
+def encode_png(image, level=6):
+    "PNG file contents for *image*, deflated at *level* (0-9)"
+    stride = image.stride
+    raw = bytearray()
+    for y in range(image.height):
+        # Filter type 0 (none) per row
+        raw.append(0)
+        raw.extend(image.data[y * stride:(y + 1) * stride])
+    return encode_png_rows(image.width, image.height, image.channels, raw,
+        level)
+
+def write_png(path, image, level=6):
+    with open(path, 'wb') as f:
+        f.write(encode_png(image, level))
+
+def read_png(path):
+    """
+    Read a PNG written by :func:`write_png` (8-bit, unfiltered rows).
+
+    :rtype: :class:`Image`
+    """
+    with open(path, 'rb') as f:
+        buf = f.read()
+    if buf[:8] != PNG_SIGNATURE:
+        raise ValueError('{} is not a PNG'.format(path))
+    pos, idat, header = 8, [], None
+    while pos < len(buf):
+        length, kind = struct.unpack_from('>I4s', buf, pos)
+        data = buf[pos + 8:pos + 8 + length]
+        if kind == b'IHDR':
+            header = struct.unpack('>IIBBBBB', data)
+        elif kind == b'IDAT':
+            idat.append(data)
+        pos += 12 + length
+    width, height, depth, color_type = header[:4]
+    channels = dict((v, k) for k, v in PNG_COLOR_TYPES.items())[color_type]
+    raw = zlib.decompress(b''.join(idat))
+    stride = width * channels
+    data = bytearray()
+    for y in range(height):
+        row = raw[y * (stride + 1):(y + 1) * (stride + 1)]
+        if bytearray(row[:1])[0] != 0:
+            raise ValueError('{}: filtered PNG rows are not supported'.format(
+                path))
+        data.extend(row[1:])
+    return Image(width, height, channels, data)
+
+
+# Manipulation
+
+def flip_vertical(image):
+    rows = [image.row(y) for y in range(image.height - 1, -1, -1)]
+    return Image(image.width, image.height, image.channels,
+        bytearray().join(rows))
+
+def to_rgb(image):
+    "Drop alpha and expand gray so *image* has 3 channels"
+    if image.channels == 3:
+        return image
+    out = Image(image.width, image.height, 3)
+    if image.channels in (1, 2):
+        gray = image.data[::image.channels]
+        for c in range(3):
+            out.data[c::3] = gray
+    else:
+        for c in range(3):
+            out.data[c::3] = image.data[c::4]
+    return out
+
+def subsample(image, factor):
+    "Keep every *factor*-th pixel of every *factor*-th row"
+    if factor <= 1:
+        return image
+    width = (image.width + factor - 1) // factor
+    height = (image.height + factor - 1) // factor
+    ch = image.channels
+    out = Image(width, height, ch)
+    for y in range(height):
+        row = image.row(y * factor)
+        dst = bytearray(width * ch)
+        for c in range(ch):
+            dst[c::ch] = row[c::ch * factor]
+        out.data[y * width * ch:(y + 1) * width * ch] = dst
+    return out
+
+def montage(images, columns, background=0, padding=0):
+    """
+    Tile *images* (converted to RGB) left to right, top to bottom in
+    cells the size of the largest image.
+
+    :param list images: :class:`Image` instances
+    :param int columns: images per row
+    :param int background: gray level between & around images
+    :param int padding: pixels between cells
+    :rtype: :class:`Image`
+    """
+    images = [to_rgb(image) for image in images]
+    columns = max(1, min(columns, len(images)))
+    rows = (len(images) + columns - 1) // columns
+    cell_w = max(image.width for image in images) + padding
+    cell_h = max(image.height for image in images) + padding
+    sheet = Image(cell_w * columns + padding, cell_h * rows + padding, 3,
+        bytearray([background]) * ((cell_w * columns + padding) *
+        (cell_h * rows + padding) * 3))
+    for i, image in enumerate(images):
+        x0 = padding + (i % columns) * cell_w
+        y0 = padding + (i // columns) * cell_h
+        for y in range(image.height):
+            start = ((y0 + y) * sheet.width + x0) * 3
+            sheet.data[start:start + image.stride] = image.row(y)
+    return sheet
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" render.py
+
+Command templates compiled once and rendered many times
+
+The command builders in seam fill a ``str.format`` template. Building
+the template (joining parts, computing paths) on every call costs far
+more than filling it, which matters when a QC sweep renders the same
+command for hundreds of thousands of subjects. A :class:`CommandTemplate`
+does the building once, at import time, and renders single commands or
+whole batches of parameter tuples.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+from string import Formatter
+
+
+def _escape(literal):
+    return literal.replace('{', '{{').replace('}', '}}')
+
+
+class CommandTemplate(object):
+    """
+    A ``str.format`` template with named fields, compiled for fast
+    rendering.
+
+    :param str template: the template, e.g. ``'tksurfer {subject_id} {hemi}'``
+    :ivar tuple fields: field names in order of first appearance, the
+      order :meth:`render_many` expects tuples in
+
+    Usage::
+
+      >>> from seam.render import CommandTemplate
+      >>> t = CommandTemplate('tksurfer {subject_id} {hemi} inflated')
+      >>> t.render(subject_id='sub0001', hemi='lh')
+      'tksurfer sub0001 lh inflated'
+      >>> t.render_many([('sub0001', 'lh'), ('sub0001', 'rh')])
+      ['tksurfer sub0001 lh inflated', 'tksurfer sub0001 rh inflated']
+    """
+    def __init__(self, template):
+        self.template = template
+        fields = []
+        pieces = []
+        for literal, name, spec, conversion in Formatter().parse(template):
+            pieces.append(_escape(literal))
+            if name is None:
+                continue
+            if not name or name.isdigit():
+                raise ValueError('Template fields must be named: {!r}'.format(
+                    template))
+            # Attribute & index lookups ride along on the positional field
+            base = name.split('.')[0].split('[')[0]
+            if base not in fields:
+                fields.append(base)
+            field = str(fields.index(base)) + name[len(base):]
+            if conversion:
+                field += '!' + conversion
+            if spec:
+                field += ':' + spec
+            pieces.append('{' + field + '}')
+        self.fields = tuple(fields)
+        self._named = template.format
+        self._positional = ''.join(pieces).format
+
+    def render(self, **params):
+        "Fill the template from keyword arguments"
+        return self._named(**params)
+
+    def render_many(self, rows):
+        """
+        Render one command per row.
+
+        :param rows: tuples of values in :attr:`fields` order, or dicts
+          keyed by field name
+        :rtype: list
+        """
+        return list(self.iter_render(rows))
+
+    def iter_render(self, rows):
+        "Like :meth:`render_many`, but lazily"
+        positional, named = self._positional, self._named
+        for row in rows:
+            if isinstance(row, dict):
+                yield named(**row)
+            else:
+                yield positional(*row)
+
+    def __repr__(self):
+        return 'CommandTemplate({!r})'.format(self.template)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Runner
+======
+
+Seam generates scripts and leaves executing them up to you. When you
+don't have a better option, these runners will execute generated
+scripts for you.
+
+* :class:`seam.runner.local.LocalRunner` runs scripts concurrently on
+  this machine, resubmitting those that fail transiently.
+* :class:`seam.runner.queue.Worker` claims scripts from a
+  :class:`seam.runner.queue.FileQueue` directory shared between hosts.
+  Start one per machine with ``seam worker <queue directory>``.
+* :class:`seam.runner.metrics.Exporter` publishes a runner's progress
+  as Prometheus metrics; ``seam metrics <queue directory>`` does the same
+  for a queue.
+* :class:`seam.runner.disk.DiskGuard` holds jobs back while the disk
+  they write to is short of space.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+from .job import Job
+from .local import LocalRunner
+from .queue import FileQueue, Worker
+from .metrics import Exporter
+from .disk import DiskGuard
+
+__all__ = ['Job', 'LocalRunner', 'FileQueue', 'Worker', 'Exporter',
+    'DiskGuard']
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" disk.py
+
+Admission control keeping runners from filling the disk
+
+A finished recon subject takes 300-500 MB and recon-all's intermediates
+peak higher, so a batch started on a nearly full ``SUBJECTS_DIR`` volume
+fails every running subject at once when it fills up.
+
+Scripts record the directories they write to in their header (see
+:func:`disk_metadata_line`; recipes record the subject directory and its
+screenshots directory). A :class:`DiskGuard` measures how much each
+running job has written so far and predicts its peak from those of
+finished jobs, recorded in a :class:`FootprintHistory`. A job only starts
+when, on every filesystem it writes to, what's free after the running
+jobs grow to their predicted peaks still holds its own peak plus a
+reserve. Held jobs start by themselves once space frees up.
+
+A guard only walks the directories of the jobs it runs. Queue workers
+publish what their jobs have written in the jobs' claims
+(``Job.disk_usage``), which is what other workers count for them.
+
+Free space is what ``statvfs`` reports as available to unprivileged users,
+so directory (project) quotas that show up there, as on XFS and ext4, are
+honoured too.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import time
+import logging
+from os.path import join
+from collections import defaultdict
+
+from ..util import STRING_TYPE
+from .job import script_metadata, script_metadata_line
+from .policy import RuntimeHistory
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 ** 3
+# Script header key listing the directories a script writes to
+DISK_KEY = 'disk'
+# Peak footprint assumed before any has been recorded
+DEFAULT_FOOTPRINT = GB
+# Space always left free
+DEFAULT_RESERVE = 2 * GB
+
+
+def disk_metadata_line(paths):
+    """
+    Header line recording the directories a script writes to, for
+    :class:`DiskGuard`
+
+    Usage::
+
+      >>> from seam.runner.disk import disk_metadata_line
+      >>> disk_metadata_line(['/subjects/sub0001', '/scripts/sub0001_screenshots'])
+      '# seam: disk=/subjects/sub0001:/scripts/sub0001_screenshots'
+    """
+    return script_metadata_line(DISK_KEY, os.pathsep.join(
+        os.path.abspath(path) for path in paths))
+
+def job_paths(job):
+    "Directories *job*'s script writes to, as recorded in its header"
+    value = script_metadata(job.script).get(DISK_KEY)
+    if not value:
+        return []
+    return [path for path in value.split(os.pathsep) if path]
+
+
+def disk_usage(path):
+    "Bytes allocated under *path* (not following links), 0 if it's missing"
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                st = os.lstat(join(root, name))
+            except OSError:
+                # Removed while we looked
+                continue
+            blocks = getattr(st, 'st_blocks', None)
+            total += st.st_size if blocks is None else blocks * 512
+    return total
+
+def free_space(path):
+    """
+    Bytes available on the filesystem *path* is on, or will be on once
+    it's created.
+
+    :return: the filesystem's device and its free bytes
+    :rtype: tuple
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    st = os.statvfs(path)
+    return os.stat(path).st_dev, st.f_bavail * st.f_frsize
+
+
+def _gb(size):
+    return '{:.1f} GB'.format(size / float(GB))
+
+
+class FootprintHistory(RuntimeHistory):
+    """
+    Recorded peak disk use (bytes) of finished jobs, by job name & study.
+    Predictions fall back like :class:`seam.runner.policy.RuntimeHistory`.
+    """
+    section = 'footprints'
+
+
+class DiskGuard(object):
+    """
+    Decides whether a job may start given the disk space it and the
+    running jobs will need.
+
+    :param history: :class:`FootprintHistory` (or path to one) to record
+      peaks in and predict from
+    :param int reserve: bytes to leave free on every filesystem
+    :param int default_footprint: peak bytes assumed for a job until
+      anything has been recorded
+    :param float interval: seconds between measurements of a job's usage
+
+    Usage::
+
+      >>> from seam.runner import LocalRunner
+      >>> from seam.runner.disk import DiskGuard
+      >>> guard = DiskGuard('/scripts/footprints.json', reserve=50 * 1024 ** 3)
+      >>> LocalRunner(processes=8, disk=guard).run(scripts)
+    """
+    def __init__(self, history=None, reserve=DEFAULT_RESERVE,
+        default_footprint=DEFAULT_FOOTPRINT, interval=60.0):
+        if history is None or isinstance(history, STRING_TYPE):
+            history = FootprintHistory(history)
+        self.history = history
+        self.reserve = reserve
+        self.default_footprint = default_footprint
+        self.interval = interval
+        # job name -> directories
+        self._paths = {}
+        # job name -> (measured at, bytes by directory, peak bytes)
+        self._usage = {}
+        # Names of jobs being held
+        self.held = set()
+
+    def paths(self, job):
+        if job.name not in self._paths:
+            self._paths[job.name] = job_paths(job)
+        return self._paths[job.name]
+
+    def predict(self, job):
+        "Predicted peak bytes of *job*"
+        predicted = self.history.predict(job)
+        if predicted is None:
+            return self.default_footprint
+        return predicted
+
+    def usage(self, job, force=False):
+        """
+        Bytes *job* has written to each of its directories, measured at
+        most every *interval* seconds unless *force*
+
+        :rtype: dict
+        """
+        now = time.time()
+        cached = self._usage.get(job.name)
+        if cached and not force and now - cached[0] < self.interval:
+            return cached[1]
+        usage = dict((path, disk_usage(path)) for path in self.paths(job))
+        peak = max(sum(usage.values()), cached[2] if cached else 0)
+        self._usage[job.name] = (now, usage, peak)
+        return usage
+
+    def sample(self, running):
+        """
+        Measure the *running* jobs that are due, keeping track of peaks.
+        These are the jobs this guard measures from then on, others' usage
+        is taken from their ``disk_usage``.
+        """
+        for job in running:
+            self.usage(job)
+        now = time.time()
+        for name, (measured, _, _) in list(self._usage.items()):
+            # Long unmeasured, finished without us noticing
+            if now - measured > 3 * self.interval and name not in self.held:
+                del self._usage[name]
+
+    def _growth(self, job, device_of, measure=True):
+        """
+        Bytes *job* has still to write, by device. Unless *measure* (or
+        we've measured it before), what it has written is what it
+        published, nothing if it hasn't.
+        """
+        if measure or job.name in self._usage:
+            usage = self.usage(job)
+        else:
+            usage = job.disk_usage or {}
+        written = defaultdict(int)
+        for path in self.paths(job):
+            written[device_of(path)] += usage.get(path, 0)
+        predicted = self.predict(job)
+        return dict((device, max(predicted - size, 0))
+            for device, size in written.items())
+
+    def admit(self, job, running):
+        """
+        Whether *job* may start beside the *running* jobs without leaving
+        less than *reserve* free where it writes. Jobs that don't record
+        their directories are always admitted. Only *job* and the running
+        jobs passed to :meth:`sample` are measured.
+
+        :rtype: bool
+        """
+        if not self.paths(job):
+            return True
+        free, paths, devices = {}, {}, {}
+
+        def device_of(path):
+            if path not in devices:
+                devices[path], available = free_space(path)
+                free[devices[path]] = available
+                paths.setdefault(devices[path], path)
+            return devices[path]
+
+        need = defaultdict(int)
+        for device, size in self._growth(job, device_of).items():
+            need[device] += size + self.reserve
+        for other in running:
+            if other.name == job.name:
+                continue
+            for device, size in self._growth(other, device_of,
+                measure=False).items():
+                if device in need:
+                    need[device] += size
+        short = [device for device in need if free[device] < need[device]]
+        if short:
+            if job.name not in self.held:
+                device = short[0]
+                logger.warning('Holding %s: %s free on %s, %s needed',
+                    job.name, _gb(free[device]), paths[device],
+                    _gb(need[device]))
+            self.held.add(job.name)
+            return False
+        if job.name in self.held:
+            self.held.discard(job.name)
+            logger.info('%s admitted, disk space freed up', job.name)
+        return True
+
+    def finished(self, job, record=True):
+        """
+        Forget *job*, after recording its peak use if *record* (it
+        finished successfully)
+        """
+        if record and self.paths(job):
+            self.usage(job, force=True)
+            self.history.record(job, self._usage[job.name][2])
+            self.history.save()
+        self._usage.pop(job.name, None)
+        self.held.discard(job.name)
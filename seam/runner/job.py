@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" job.py
+
+A generated script scheduled by a runner
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import time
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+# Deterministic failure, don't resubmit
+FAILED = 'failed'
+# Transient failure that outlasted its resubmits
+TRANSIENT = 'transient'
+
+
+def job_name(script):
+    """
+    Name of the job running *script*, e.g. the subject id of a recon script
+
+    Usage::
+
+      >>> from seam.runner.job import job_name
+      >>> job_name('/path/to/scripts/sub0001.recon.sh')
+      'sub0001'
+    """
+    name = os.path.basename(script)
+    for suffix in ('.sh', '.recon'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def script_metadata_line(key, value):
+    """
+    A header comment recording *key* for runners, see :func:`script_metadata`
+
+    Usage::
+
+      >>> from seam.runner.job import script_metadata_line
+      >>> script_metadata_line('threads', 4)
+      '# seam: threads=4'
+    """
+    return '# seam: {}={}'.format(key, value)
+
+def script_metadata(script):
+    """
+    Read the ``# seam: key=value`` lines from the header (the leading
+    comments) of *script*.
+
+    :return: values by key, empty if *script* can't be read
+    :rtype: dict
+    """
+    metadata = {}
+    try:
+        with open(script) as f:
+            for line in f:
+                if not line.startswith('#'):
+                    break
+                if line.startswith('# seam: ') and '=' in line:
+                    key, value = line[8:].rstrip('\n').split('=', 1)
+                    metadata[key] = value
+    except (IOError, OSError):
+        pass
+    return metadata
+
+
+class Job(object):
+    """
+    A script to run, and what has happened to it so far.
+
+    :param str script: path to the (bash) script
+    :param str name: job name, defaults to :func:`job_name` of *script*
+    :param str study: study the job belongs to, for fair-share scheduling
+    :param int priority: jobs with higher priorities are started first
+      (see :mod:`seam.runner.policy`)
+    :param int threads: cores the job uses, by default as recorded in the
+      script's header (see :func:`script_metadata`), else 1
+    :param list depends_on: names of jobs that must finish successfully
+      before this one starts
+    """
+    def __init__(self, script, name=None, study=None, priority=0,
+        threads=None, depends_on=None):
+        self.script = script
+        self.name = name or job_name(script)
+        self.study = study
+        self.priority = priority
+        if threads is None:
+            threads = int(script_metadata(script).get('threads', 1))
+        self.threads = threads
+        self.depends_on = list(depends_on or [])
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.status = PENDING
+        self.attempts = 0
+        # Attempts stopped by preemption, which don't count as failures
+        self.preemptions = 0
+        self.returncode = None
+        self.reason = None
+        # Earliest time (time.time()) the job may be (re)started
+        self.not_before = 0
+        # Bytes written to each directory the job writes to, as last
+        # measured by the worker running it (see seam.runner.disk)
+        self.disk_usage = None
+
+    # Attributes saved by to_dict, e.g. in a queue directory
+    fields = ('script', 'name', 'study', 'priority', 'threads', 'depends_on',
+        'submitted', 'started', 'finished', 'status', 'attempts',
+        'preemptions', 'returncode', 'reason', 'not_before', 'disk_usage')
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.fields)
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['script'], data.get('name'),
+            threads=data.get('threads'))
+        for field in cls.fields:
+            if field in data:
+                setattr(job, field, data[field])
+        return job
+
+    @property
+    def failed_attempts(self):
+        "Attempts that ended other than by preemption"
+        return self.attempts - self.preemptions
+
+    @property
+    def runtime(self):
+        "Seconds the last attempt ran for, None until it finishes"
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def __repr__(self):
+        return 'Job({!r}, status={!r})'.format(self.name, self.status)
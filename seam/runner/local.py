@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" local.py
+
+Run generated scripts concurrently on this machine
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import time
+import signal
+import logging
+import threading
+import subprocess
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+
+from ..util import STRING_TYPE
+from .policy import RuntimeHistory, get_policy
+from .job import Job, PENDING, RUNNING, DONE, FAILED, TRANSIENT
+from .retry import EXIT_TRANSIENT, EXIT_REQUEUE, DETERMINISTIC, PREEMPTED, \
+    TRANSIENT as TRANSIENT_FAILURE, classify_failure, read_failure, \
+    read_preempted, state_dir
+
+logger = logging.getLogger(__name__)
+
+
+def script_log(script):
+    "Where a runner writes the output of *script*"
+    return os.path.join(state_dir(script), 'script.log')
+
+def _tail(path, nbytes=64 * 1024):
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - nbytes))
+            return f.read().decode('utf-8', 'replace')
+    except (IOError, OSError):
+        return ''
+
+
+def settle(job, returncode):
+    """
+    Record how *job* ended given its script's *returncode*.
+
+    Sets the job's status (failures are marked
+    :data:`~seam.runner.job.FAILED` or :data:`~seam.runner.job.TRANSIENT`,
+    preempted jobs :data:`~seam.runner.job.PENDING`) and reason, and
+    returns the kind of failure (see
+    :func:`seam.runner.retry.classify_failure`),
+    :data:`~seam.runner.retry.PREEMPTED` or None on success.
+    """
+    job.returncode = returncode
+    job.finished = time.time()
+    if returncode == 0:
+        job.status = DONE
+        job.reason = None
+        logger.info('%s done', job.name)
+        return None
+    if returncode == EXIT_REQUEUE:
+        job.status = PENDING
+        job.preemptions += 1
+        preempted = read_preempted(job.script) or {'step': '-'}
+        job.reason = 'preempted in step {}'.format(preempted['step'])
+        logger.warning('%s %s, requeueing', job.name, job.reason)
+        return PREEMPTED
+    failure = read_failure(job.script)
+    if failure:
+        kind = DETERMINISTIC
+        job.reason = '{step}: {reason}'.format(**failure)
+    elif returncode == EXIT_TRANSIENT:
+        kind = TRANSIENT_FAILURE
+        job.reason = 'transient failure'
+    else:
+        kind, job.reason = classify_failure(returncode,
+            _tail(script_log(job.script)))
+    job.status = FAILED if kind == DETERMINISTIC else TRANSIENT
+    logger.error('%s failed: %s', job.name, job.reason)
+    return kind
+
+
+def launch(job, shell='bash'):
+    "Start *job*'s script, appending its output to :func:`script_log`"
+    job.attempts += 1
+    job.status = RUNNING
+    job.started = time.time()
+    log_path = script_log(job.script)
+    if not os.path.isdir(os.path.dirname(log_path)):
+        os.makedirs(os.path.dirname(log_path))
+    logger.info('Starting %s (attempt %d)', job.name, job.attempts)
+    with open(log_path, 'ab') as log:
+        return subprocess.Popen([shell, job.script], stdout=log,
+            stderr=subprocess.STDOUT)
+
+
+def process_tree(pid):
+    "*pid* and its descendants' process ids, parents first"
+    tree = [pid]
+    for parent in tree:
+        try:
+            out = subprocess.check_output(['pgrep', '-P', str(parent)])
+        except (subprocess.CalledProcessError, OSError):
+            continue
+        tree.extend(int(child) for child in out.split())
+    return tree
+
+def kill_tree(proc):
+    """
+    Kill *proc* and everything it started, without giving its script the
+    chance to clean up (e.g. another run now owns the subject's locks)
+    """
+    # Stopped processes can't start more before they're killed
+    for pid in process_tree(proc.pid):
+        try:
+            os.kill(pid, signal.SIGSTOP)
+        except OSError:
+            pass
+    for pid in process_tree(proc.pid):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+    proc.wait()
+
+
+class DependencyFailed(Exception):
+    "A job's dependency failed, so it can't run"
+
+
+# Signals a batch system sends ahead of preempting or stopping a job
+PREEMPT_SIGNALS = (signal.SIGTERM, signal.SIGUSR1)
+
+@contextmanager
+def forwarding_signals(running):
+    """
+    While active, forward preemption signals (see :data:`PREEMPT_SIGNALS`)
+    to the scripts running as the keys of *running*, so they stop at
+    once and exit for requeueing.
+
+    :return: list of the signals received, for the runner to stop
+      starting scripts once it's non-empty
+    """
+    received = []
+
+    def forward(signum, frame):
+        received.append(signum)
+        for proc in list(running):
+            try:
+                proc.send_signal(signum)
+            except OSError:
+                pass
+
+    if threading.current_thread().name != 'MainThread':
+        # Handlers can only be set from the main thread
+        yield received
+        return
+    previous = dict((signum, signal.signal(signum, forward))
+        for signum in PREEMPT_SIGNALS)
+    try:
+        yield received
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+
+def fits(job, running, cores):
+    "Whether *job* can start beside *running* jobs within *cores*"
+    if not running:
+        # Always start something, even if it wants more than we have
+        return True
+    return sum(j.threads for j in running) + job.threads <= cores
+
+
+class LocalRunner(object):
+    """
+    Runs scripts (see :func:`seam.freesurfer.v1.recipe.build_recipe`)
+    as concurrent subprocesses.
+
+    Scripts retry transient failures of a step themselves. When a script
+    still exits with :data:`seam.runner.retry.EXIT_TRANSIENT` the runner
+    resubmits it (completed steps are skipped) up to *resubmits* times,
+    waiting *resubmit_delay* seconds, doubled on each resubmission.
+    Scripts with a recorded deterministic failure are never started.
+    Scripts that exit for requeueing after a preemption signal (see
+    :mod:`seam.runner.retry`) are restarted right away, without using up
+    resubmissions. If the runner itself gets ``SIGTERM`` or ``SIGUSR1``
+    it passes it on to the running scripts, waits for them to exit and
+    returns, leaving unfinished jobs pending.
+
+    A job with ``depends_on`` starts once those jobs (by name) are done,
+    and fails without starting if one of them fails. Dependencies that
+    aren't among the jobs run are taken to be done already.
+
+    :param int processes: scripts to run at once (default: CPU count)
+    :param int cores: cores to share between running scripts (default: CPU
+      count). A job's ``threads`` count against this, so thread count
+      times concurrent subjects never oversubscribes the machine. When
+      the next job doesn't fit, the runner waits for cores to free up
+      rather than starting a smaller job ahead of it.
+    :param int resubmits: resubmissions allowed per script
+    :param int resubmit_delay: seconds to wait before the first resubmission
+    :param float poll_interval: seconds between checks on running scripts
+    :param str shell: interpreter for the scripts
+    :param policy: which ready job to start next, a name or object from
+      :mod:`seam.runner.policy` (default ``fifo``)
+    :param history: :class:`seam.runner.policy.RuntimeHistory` (or path to
+      one) to record runtimes in and predict from
+    :param metrics: :class:`seam.runner.metrics.Exporter` to publish
+      progress to
+    :param disk: :class:`seam.runner.disk.DiskGuard` holding jobs back
+      while the disk they write to is short of space. Held jobs wait, like
+      jobs that don't fit the cores, and start once space frees up.
+    """
+    def __init__(self, processes=None, resubmits=1, resubmit_delay=60,
+        poll_interval=1.0, shell='bash', policy=None, history=None,
+        cores=None, metrics=None, disk=None):
+        if history is None or isinstance(history, STRING_TYPE):
+            history = RuntimeHistory(history)
+        self.history = history
+        self.policy = get_policy(policy, history)
+        self.processes = processes or cpu_count()
+        self.cores = cores or cpu_count()
+        self.resubmits = resubmits
+        self.resubmit_delay = resubmit_delay
+        self.poll_interval = poll_interval
+        self.shell = shell
+        self.metrics = metrics
+        self.disk = disk
+        self._held = False
+
+    def run(self, jobs):
+        """
+        Run *jobs* (:class:`seam.runner.job.Job` or script paths) to
+        completion.
+
+        :return: the jobs, with ``status`` set to one of
+          :data:`~seam.runner.job.DONE`, :data:`~seam.runner.job.FAILED`
+          or :data:`~seam.runner.job.TRANSIENT` (or still
+          :data:`~seam.runner.job.PENDING` if the runner was stopped)
+        :rtype: list
+        """
+        jobs = [job if isinstance(job, Job) else Job(job) for job in jobs]
+        self._by_name = dict((job.name, job) for job in jobs)
+        pending = list(jobs)
+        running = {}
+        with forwarding_signals(running) as stopping:
+            while pending or running:
+                self._reap(running, pending)
+                if stopping:
+                    if not running:
+                        logger.warning('Stopped, %d jobs left pending',
+                            len(pending))
+                        break
+                else:
+                    self._start(pending, running)
+                if self.disk:
+                    self.disk.sample(running.values())
+                if pending and not running and not stopping and \
+                    not self._held and all(job.not_before <= time.time() for job in pending):
+                    # Nothing can ever start: a dependency cycle
+                    for job in pending:
+                        job.status = FAILED
+                        job.reason = 'dependency cycle'
+                        logger.error('%s not started, %s', job.name,
+                            job.reason)
+                    del pending[:]
+                if self.metrics:
+                    self.metrics.update(jobs)
+                if pending or running:
+                    time.sleep(self.poll_interval)
+        if self.metrics:
+            self.metrics.update(jobs, force=True)
+        return jobs
+
+    def _waiting_on(self, job):
+        "Dependencies of *job* that aren't done (raising if one failed)"
+        waiting = []
+        for name in job.depends_on:
+            dep = self._by_name.get(name)
+            if dep is None or dep.status == DONE:
+                continue
+            if dep.status in (FAILED, TRANSIENT):
+                raise DependencyFailed(name)
+            waiting.append(name)
+        return waiting
+
+    def _next(self, pending, running):
+        now = time.time()
+        ready = []
+        for job in list(pending):
+            if job.not_before > now:
+                continue
+            try:
+                if self._waiting_on(job):
+                    continue
+            except DependencyFailed as e:
+                pending.remove(job)
+                job.status = FAILED
+                job.reason = 'dependency {} failed'.format(e)
+                logger.error('%s not started, %s', job.name, job.reason)
+                continue
+            ready.append(job)
+        return self.policy.choose(ready, list(running.values()))
+
+    def _start(self, pending, running):
+        self._held = False
+        while len(running) < self.processes:
+            job = self._next(pending, running)
+            if job is None or not fits(job, running.values(), self.cores):
+                return
+            if self.disk and not self.disk.admit(job, running.values()):
+                # Wait for space rather than start a job behind it
+                self._held = True
+                return
+            pending.remove(job)
+            failure = read_failure(job.script)
+            if failure:
+                job.status = FAILED
+                job.reason = '{step}: {reason}'.format(**failure)
+                logger.warning('%s not started, it previously failed (%s)',
+                    job.name, job.reason)
+                continue
+            running[launch(job, self.shell)] = job
+
+    def _reap(self, running, pending):
+        for proc, job in list(running.items()):
+            returncode = proc.poll()
+            if returncode is None:
+                continue
+            del running[proc]
+            self._finish(job, returncode, pending)
+
+    def _finish(self, job, returncode, pending):
+        kind = settle(job, returncode)
+        if kind is None:
+            self.history.record(job, job.runtime)
+            self.history.save()
+        if self.disk:
+            self.disk.finished(job, record=kind is None)
+        if kind == PREEMPTED:
+            job.not_before = 0
+            pending.append(job)
+        elif kind == TRANSIENT_FAILURE and \
+            job.failed_attempts <= self.resubmits:
+            delay = self.resubmit_delay * 2 ** (job.failed_attempts - 1)
+            job.status = PENDING
+            job.not_before = time.time() + delay
+            pending.append(job)
+            logger.warning('%s failed (%s), resubmitting in %ds', job.name,
+                job.reason, delay)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" metrics.py
+
+Export the progress of a cohort as Prometheus metrics
+
+An :class:`Exporter` is updated by a runner (or ``seam metrics`` for a
+queue directory) with its jobs and publishes:
+
+* ``seam_jobs{state=...}``: jobs pending, running, done, failed or
+  waiting to be resubmitted (transient)
+* ``seam_step_duration_seconds{step=...}``: histogram of successful step
+  attempts, read from the ``timings.tsv`` each generated script keeps
+  (see :func:`seam.runner.retry.step_preamble`)
+* ``seam_step_failures_total{step=...}``: failed step attempts
+* ``seam_xvfb_in_use`` and ``seam_xvfb_utilization``: running jobs
+  currently in a step that runs under ``xvfb-run``, and that as a
+  fraction of the runner's slots (each slot holds at most one server)
+* ``seam_throughput_subjects_per_hour``: subjects finished in the last
+  *window* seconds, per hour
+* ``seam_last_completion_timestamp_seconds``: when a subject last
+  finished, so stalls are visible
+
+Metrics are in Prometheus' text exposition format, which both
+node_exporter's textfile collector and scrapers accept. They are written
+atomically to a file for the collector, served over HTTP at
+``/metrics``, or both.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import re
+import time
+import logging
+import threading
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:  # Python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from .job import PENDING, RUNNING, DONE, FAILED, TRANSIENT
+from .retry import read_timings, current_step, timings_path
+
+logger = logging.getLogger(__name__)
+
+JOB_STATES = (PENDING, RUNNING, DONE, FAILED, TRANSIENT)
+# FreeSurfer steps take from seconds (annot2label) to most of a day
+# (recon-all)
+DEFAULT_BUCKETS = (10, 30, 60, 300, 900, 1800, 3600, 7200, 14400, 28800,
+    57600, 86400)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_step_re = re.compile(r"^seam_step (\S+) (.*)$")
+
+
+def xvfb_steps(script):
+    "Names of the steps in *script* that run under ``xvfb-run``"
+    steps = set()
+    try:
+        with open(script) as f:
+            for line in f:
+                match = _step_re.match(line)
+                if match and 'xvfb-run' in match.group(2):
+                    steps.add(match.group(1))
+    except (IOError, OSError):
+        pass
+    return steps
+
+
+class Histogram(object):
+    "Cumulative histogram of observations, Prometheus style"
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+        .replace('"', '\\"')) for k, v in sorted(labels.items())) + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics(object):
+    """
+    Accumulates metrics about jobs across updates.
+
+    Step timings are read incrementally: each update only reads what
+    scripts have appended to their ``timings.tsv`` since the last one.
+
+    :param buckets: upper bounds (seconds) of the step duration histogram
+    :param int window: seconds of completions throughput is computed over
+    :param int slots: scripts the runner runs at once, for xvfb utilization
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=3600, slots=None):
+        self.buckets = buckets
+        self.window = window
+        self.slots = slots
+        self.durations = {}
+        self.failures = {}
+        # timings file -> (inode, offset)
+        self._offsets = {}
+        self._xvfb_steps = {}
+        # Finished jobs whose timings have all been read
+        self._complete = set()
+
+    def _read_steps(self, job):
+        path = timings_path(job.script)
+        try:
+            inode = os.stat(path).st_ino
+        except OSError:
+            return
+        known_inode, offset = self._offsets.get(path, (inode, 0))
+        if known_inode != inode:
+            # Replaced (e.g. the subject was rebuilt), start over
+            offset = 0
+        timings, offset = read_timings(job.script, offset)
+        self._offsets[path] = (inode, offset)
+        for t in timings:
+            if t['status'] == 0:
+                if t['step'] not in self.durations:
+                    self.durations[t['step']] = Histogram(self.buckets)
+                self.durations[t['step']].observe(t['end'] - t['start'])
+            else:
+                self.failures[t['step']] = self.failures.get(t['step'], 0) + 1
+
+    def _in_xvfb(self, job):
+        if job.script not in self._xvfb_steps:
+            self._xvfb_steps[job.script] = xvfb_steps(job.script)
+        current = current_step(job.script)
+        return bool(current) and current[0] in self._xvfb_steps[job.script]
+
+    def update(self, jobs, now=None):
+        """
+        Read new step timings of *jobs* and render every metric.
+
+        :param list jobs: :class:`seam.runner.job.Job` instances
+        :return: the metrics in Prometheus text format
+        :rtype: str
+        """
+        now = now or time.time()
+        counts = dict((state, 0) for state in JOB_STATES)
+        in_xvfb = 0
+        recent = 0
+        last = 0
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+            if job.script not in self._complete:
+                self._read_steps(job)
+                if job.status in (DONE, FAILED):
+                    self._complete.add(job.script)
+            elif job.status not in (DONE, FAILED):
+                # Running again
+                self._complete.discard(job.script)
+                self._read_steps(job)
+            if job.status == RUNNING and self._in_xvfb(job):
+                in_xvfb += 1
+            if job.status == DONE and job.finished:
+                last = max(last, job.finished)
+                if now - job.finished <= self.window:
+                    recent += 1
+
+        lines = ['# TYPE seam_jobs gauge',
+            '# HELP seam_jobs Jobs by state']
+        lines.extend('seam_jobs{} {:d}'.format(_labels(state=state),
+            counts[state]) for state in sorted(counts))
+
+        lines.extend(['# TYPE seam_step_duration_seconds histogram',
+            '# HELP seam_step_duration_seconds Duration of successful '
+            'step attempts'])
+        for step in sorted(self.durations):
+            h = self.durations[step]
+            for bound, count in zip(h.buckets, h.counts):
+                lines.append('seam_step_duration_seconds_bucket{} {:d}'.format(
+                    _labels(step=step, le=_number(float(bound))), count))
+            lines.append('seam_step_duration_seconds_bucket{} {:d}'.format(
+                _labels(step=step, le='+Inf'), h.count))
+            lines.append('seam_step_duration_seconds_sum{} {}'.format(
+                _labels(step=step), _number(float(h.sum))))
+            lines.append('seam_step_duration_seconds_count{} {:d}'.format(
+                _labels(step=step), h.count))
+
+        lines.extend(['# TYPE seam_step_failures_total counter',
+            '# HELP seam_step_failures_total Failed step attempts'])
+        lines.extend('seam_step_failures_total{} {:d}'.format(
+            _labels(step=step), self.failures[step])
+            for step in sorted(self.failures))
+
+        lines.extend(['# TYPE seam_xvfb_in_use gauge',
+            '# HELP seam_xvfb_in_use Running jobs in a step under xvfb-run',
+            'seam_xvfb_in_use {:d}'.format(in_xvfb)])
+        if self.slots:
+            lines.extend(['# TYPE seam_xvfb_utilization gauge',
+                '# HELP seam_xvfb_utilization Fraction of slots running '
+                'xvfb-run',
+                'seam_xvfb_utilization {}'.format(_number(
+                    in_xvfb / float(self.slots)))])
+
+        lines.extend(['# TYPE seam_throughput_subjects_per_hour gauge',
+            '# HELP seam_throughput_subjects_per_hour Subjects finished '
+            'per hour over the last {:d}s'.format(self.window),
+            'seam_throughput_subjects_per_hour {}'.format(_number(
+                recent * 3600.0 / self.window))])
+        if last:
+            lines.extend(['# TYPE seam_last_completion_timestamp_seconds '
+                'gauge',
+                '# HELP seam_last_completion_timestamp_seconds When a subject '
+                'last finished',
+                'seam_last_completion_timestamp_seconds {}'.format(
+                    _number(float(last)))])
+        return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path, text):
+    "Replace *path* atomically, as node_exporter's textfile collector needs"
+    tmp = '{}.{:d}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.rename(tmp, path)
+
+
+class MetricsServer(object):
+    """
+    Serves the latest metrics at ``http://<host>:<port>/metrics`` from a
+    daemon thread.
+
+    :param int port: port to listen on (0 picks a free one, see ``port``)
+    :param str host: address to bind
+    """
+    def __init__(self, port, host='127.0.0.1'):
+        self.text = ''
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = server.text.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer((host, port), Handler)
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class Exporter(object):
+    """
+    Publishes :class:`Metrics` for a runner's jobs.
+
+    :param str textfile: file to write for node_exporter's textfile
+      collector (name it ``*.prom``)
+    :param int port: serve ``/metrics`` on this port
+    :param str host: address to serve on
+    :param float interval: minimum seconds between updates
+    :param int slots: scripts the runner runs at once
+    :param int window: seconds of completions throughput is computed over
+
+    Usage::
+
+      >>> from seam.runner import LocalRunner
+      >>> from seam.runner.metrics import Exporter
+      >>> metrics = Exporter(textfile='/var/lib/node_exporter/seam.prom')
+      >>> LocalRunner(processes=8, metrics=metrics).run(scripts)
+    """
+    def __init__(self, textfile=None, port=None, host='127.0.0.1',
+        interval=15, slots=None, window=3600):
+        self.textfile = textfile
+        self.interval = interval
+        self.metrics = Metrics(window=window, slots=slots)
+        self.server = MetricsServer(port, host) if port is not None else None
+        self.last_update = 0
+        self.text = None
+
+    def update(self, jobs, force=False):
+        """
+        Publish metrics for *jobs*, at most once per *interval* unless
+        *force*
+
+        :param jobs: the jobs, or a function returning them, only called
+          when an update is due (e.g. listing a queue)
+        """
+        now = time.time()
+        if not force and now - self.last_update < self.interval:
+            return self.text
+        self.last_update = now
+        if callable(jobs):
+            jobs = jobs()
+        self.text = self.metrics.update(jobs, now)
+        if self.textfile:
+            try:
+                write_textfile(self.textfile, self.text)
+            except (IOError, OSError) as e:
+                logger.warning('Could not write metrics to %s: %s',
+                    self.textfile, e)
+        if self.server:
+            self.server.text = self.text
+        return self.text
+
+    def close(self):
+        if self.server:
+            self.server.close()
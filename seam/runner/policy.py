@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" policy.py
+
+Scheduling policies deciding which ready job a runner starts next
+
+* ``fifo`` starts jobs in the order they were submitted.
+* ``priority`` starts jobs with a higher ``priority`` first.
+* ``fair-share`` starts a job from the study with the fewest running
+  jobs, so one large study can't starve the others.
+* ``shortest-first`` starts the job predicted to finish soonest, using
+  runtimes recorded in a :class:`RuntimeHistory`.
+
+Every policy but ``fifo`` honours explicit priorities first, so e.g.
+clinical QC subjects jump the queue whichever policy is in use.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import json
+from collections import defaultdict
+
+from ..util import STRING_TYPE, locked
+
+# Key of the median over all studies
+_ALL = object()
+
+
+def _median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+class RuntimeHistory(object):
+    """
+    Recorded runtimes (seconds) of finished jobs, by job name & study.
+
+    When *path* is given, the history is loaded from and saved to that
+    JSON file. Runners sharing the file take turns saving under a lock
+    on ``<path>.lock``.
+    """
+    # Key of the recorded values in the file
+    section = 'runtimes'
+
+    def __init__(self, path=None):
+        self.path = path
+        self.runtimes = {}
+        self.studies = {}
+        # Recorded here, since loading
+        self._recorded = {}
+        self._medians = None
+        self.load()
+
+    def load(self):
+        "(Re)load the history file, keeping runtimes recorded here"
+        if not self.path or not os.path.isfile(self.path):
+            return
+        with open(self.path) as f:
+            data = json.load(f)
+        self.runtimes = data.get(self.section, {})
+        self.studies = data.get('studies', {})
+        for name, (seconds, study) in self._recorded.items():
+            self.runtimes[name] = seconds
+            self.studies[name] = study
+        self._medians = None
+
+    def record(self, job, seconds):
+        self.runtimes[job.name] = seconds
+        self.studies[job.name] = job.study
+        self._recorded[job.name] = (seconds, job.study)
+        self._medians = None
+
+    def _median_by_study(self):
+        if self._medians is None:
+            by_study = defaultdict(list)
+            for name, seconds in self.runtimes.items():
+                by_study[self.studies.get(name)].append(seconds)
+            self._medians = dict((study, _median(times))
+                for study, times in by_study.items())
+            self._medians[_ALL] = _median(self.runtimes.values())
+        return self._medians
+
+    def predict(self, job):
+        """
+        Predicted runtime of *job*: its own last runtime, else the median
+        of its study's, else the median of all. None when nothing has
+        been recorded.
+        """
+        if job.name in self.runtimes:
+            return self.runtimes[job.name]
+        medians = self._median_by_study()
+        if job.study in medians:
+            return medians[job.study]
+        return medians[_ALL]
+
+    def save(self):
+        """
+        Write the history file, merging in what other runners sharing it
+        have recorded meanwhile
+        """
+        if not self.path:
+            return
+        # Or a runner saving at the same time loses what we merge
+        with locked('{}.lock'.format(self.path)):
+            self.load()
+            tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump({self.section: self.runtimes,
+                    'studies': self.studies}, f)
+            os.rename(tmp, self.path)
+
+
+class Fifo(object):
+    "Start jobs in the order they were submitted"
+    name = 'fifo'
+
+    def key(self, job):
+        return (job.submitted, job.name)
+
+    def choose(self, ready, running):
+        """
+        Pick the job to start next.
+
+        :param list ready: jobs that may start now
+        :param list running: jobs already running (on any host)
+        :return: one of *ready*, or None if it is empty
+        """
+        if not ready:
+            return None
+        return min(ready, key=self.key)
+
+
+class Priority(Fifo):
+    "Start jobs with higher priorities first, then in submission order"
+    name = 'priority'
+
+    def key(self, job):
+        return (-job.priority, job.submitted, job.name)
+
+
+class FairShare(Priority):
+    """
+    Start jobs from the study with the fewest running jobs, relative to
+    its share (default 1 for every study).
+
+    :param dict shares: relative share of the runner per study
+    """
+    name = 'fair-share'
+
+    def __init__(self, shares=None):
+        self.shares = shares or {}
+
+    def choose(self, ready, running):
+        if not ready:
+            return None
+        top = max(job.priority for job in ready)
+        ready = [job for job in ready if job.priority == top]
+        load = defaultdict(int)
+        for job in running:
+            load[job.study] += 1
+        def usage(job):
+            return load[job.study] / float(self.shares.get(job.study, 1))
+        return min(ready, key=lambda job: (usage(job),) + self.key(job))
+
+
+class ShortestFirst(Priority):
+    """
+    Start the job with the shortest predicted runtime. Jobs without a
+    prediction are started after those with one.
+
+    :param history: :class:`RuntimeHistory` (or path to one)
+    """
+    name = 'shortest-first'
+
+    def __init__(self, history=None):
+        if history is None or isinstance(history, STRING_TYPE):
+            history = RuntimeHistory(history)
+        self.history = history
+
+    def key(self, job):
+        predicted = self.history.predict(job)
+        return (-job.priority, predicted is None, predicted or 0,
+            job.submitted, job.name)
+
+
+POLICIES = dict((cls.name, cls) for cls in (Fifo, Priority, FairShare,
+    ShortestFirst))
+
+
+def get_policy(policy=None, history=None):
+    """
+    Resolve *policy* (a policy object or name in :data:`POLICIES`) to a
+    policy object; ``None`` is ``fifo``.
+    """
+    if policy is None:
+        return Fifo()
+    if not isinstance(policy, STRING_TYPE):
+        return policy
+    if policy not in POLICIES:
+        raise ValueError('Unknown policy {}, choose from {}'.format(policy,
+            ', '.join(sorted(POLICIES))))
+    if policy == ShortestFirst.name:
+        return ShortestFirst(history)
+    return POLICIES[policy]()
@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" queue.py
+
+A job queue kept in a shared directory, and workers that drain it
+
+Any number of :class:`Worker` processes, on any hosts that share the
+queue directory (e.g. over NFS), claim jobs by atomically renaming them
+from ``pending/`` into ``claimed/``. A worker touches its claims as a
+heartbeat while their scripts run; claims whose heartbeat stops (the
+worker or its host died) are returned to ``pending/`` by the other
+workers. No services beyond the shared filesystem are needed.
+
+Layout of a queue directory::
+
+    pending/<name>.json    waiting to be claimed
+    claimed/<name>.json    being run, mtime is the last heartbeat
+    done/<name>.json       finished successfully
+    failed/<name>.json     failed deterministically (or gave up)
+
+Jobs with ``depends_on`` are only claimed once those jobs are in
+``done/``, and are moved to ``failed/`` if one of them fails.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import json
+import time
+import errno
+import socket
+import logging
+from os.path import join
+from multiprocessing import cpu_count
+
+from .job import Job, PENDING, RUNNING, DONE, FAILED
+from .local import launch, settle, forwarding_signals, kill_tree
+from .policy import RuntimeHistory, get_policy
+from .retry import read_failure, TRANSIENT as TRANSIENT_FAILURE, PREEMPTED
+
+logger = logging.getLogger(__name__)
+
+STATES = (PENDING, 'claimed', 'done', 'failed')
+
+
+def worker_id():
+    "Identify this process across hosts, as ``host:pid``"
+    return '{}:{:d}'.format(socket.gethostname(), os.getpid())
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class FileQueue(object):
+    """
+    A queue of :class:`seam.runner.job.Job` stored under *path*.
+
+    :param str path: queue directory, created if need be
+    """
+    def __init__(self, path):
+        self.path = path
+        # entry path -> (mtime, job)
+        self._cache = {}
+        for state in STATES:
+            if not os.path.isdir(join(path, state)):
+                try:
+                    os.makedirs(join(path, state))
+                except OSError as e:
+                    # Another host got there first
+                    if e.errno != errno.EEXIST:
+                        raise
+
+    def entry(self, state, name):
+        return join(self.path, state, '{}.json'.format(name))
+
+    def names(self, state):
+        "Job names currently in *state*"
+        return sorted(f[:-5] for f in os.listdir(join(self.path, state))
+            if f.endswith('.json'))
+
+    def counts(self):
+        return dict((state, len(self.names(state))) for state in STATES)
+
+    def read(self, state, name):
+        with open(self.entry(state, name)) as f:
+            data = json.load(f)
+        return Job.from_dict(data['job']), data.get('worker')
+
+    def _write(self, path, job, worker=None):
+        "Replace *path* atomically, so readers never see a partial entry"
+        tmp = join(self.path, '.{}.{}.tmp'.format(os.path.basename(path),
+            worker_id()))
+        with open(tmp, 'w') as f:
+            json.dump({'job': job.to_dict(), 'worker': worker}, f)
+        os.rename(tmp, path)
+
+    def submit(self, job):
+        """
+        Add *job* (a :class:`seam.runner.job.Job` or script path) to the
+        queue.
+        """
+        if not isinstance(job, Job):
+            job = Job(job)
+        job.status = PENDING
+        self._write(self.entry(PENDING, job.name), job)
+        return job
+
+    def _jobs(self, state):
+        """
+        Jobs in *state*, by name. Entries are cached by name and mtime so
+        polling a large queue doesn't re-read every file.
+        """
+        jobs, seen = {}, set()
+        for name in self.names(state):
+            path = self.entry(state, name)
+            seen.add(path)
+            try:
+                mtime = os.stat(path).st_mtime
+                cached = self._cache.get(path)
+                if cached and cached[0] == mtime:
+                    job = cached[1]
+                else:
+                    job, _ = self.read(state, name)
+                    self._cache[path] = (mtime, job)
+            except (IOError, OSError, ValueError):
+                # Claimed or rewritten under us
+                continue
+            jobs[name] = job
+        state_dir = join(self.path, state)
+        for path in list(self._cache):
+            if os.path.dirname(path) == state_dir and path not in seen:
+                del self._cache[path]
+        return jobs
+
+    def jobs(self):
+        """
+        Every job in the queue, with ``status`` set from where its entry is
+        (claimed jobs are :data:`~seam.runner.job.RUNNING`).
+
+        :rtype: list
+        """
+        statuses = {PENDING: PENDING, 'claimed': RUNNING, 'done': DONE,
+            'failed': FAILED}
+        jobs = []
+        for state in STATES:
+            for job in self._jobs(state).values():
+                job.status = statuses[state]
+                jobs.append(job)
+        return jobs
+
+    def claim(self, worker, policy=None, max_threads=None, admit=None):
+        """
+        Claim a pending job for *worker*.
+
+        :param policy: picks among the ready jobs (see
+          :mod:`seam.runner.policy`), default ``fifo``
+        :param int max_threads: don't claim the job *policy* picks if it
+          needs more threads than this
+        :param admit: don't claim the job *policy* picks unless
+          ``admit(job, running)`` (with the claimed jobs) is true, e.g.
+          :meth:`seam.runner.disk.DiskGuard.admit`
+        :return: the claimed job, or None if nothing is ready
+        """
+        policy = get_policy(policy)
+        now = time.time()
+        pending = self._jobs(PENDING)
+        running = list(self._jobs('claimed').values())
+        ready = [job for job in pending.values() if job.not_before <= now]
+        if any(job.depends_on for job in ready):
+            ready = self._dependencies_met(ready, pending, running)
+        while ready:
+            job = policy.choose(ready, running)
+            if max_threads is not None and job.threads > max_threads:
+                return None
+            if admit is not None and not admit(job, running):
+                return None
+            ready.remove(job)
+            src = self.entry(PENDING, job.name)
+            dst = self.entry('claimed', job.name)
+            try:
+                # Refresh the heartbeat before the claim is visible so
+                # nobody mistakes it for a stale one
+                os.utime(src, None)
+                os.rename(src, dst)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    # Someone else claimed it
+                    continue
+                raise
+            job, _ = self.read('claimed', job.name)
+            job.status = RUNNING
+            self._write(dst, job, worker)
+            return job
+        return None
+
+    def _dependencies_met(self, ready, pending, running):
+        """
+        Those of *ready* whose dependencies are done (or not in the queue).
+        Jobs with a failed dependency are moved to ``failed``.
+        """
+        failed = set(self.names('failed'))
+        unfinished = set(pending) | set(job.name for job in running)
+        met = []
+        for job in ready:
+            failed_deps = [name for name in job.depends_on if name in failed]
+            if failed_deps:
+                src = self.entry(PENDING, job.name)
+                dst = self.entry('failed', job.name)
+                try:
+                    os.rename(src, dst)
+                except OSError as e:
+                    if e.errno == errno.ENOENT:
+                        continue
+                    raise
+                job.status = FAILED
+                job.reason = 'dependency {} failed'.format(failed_deps[0])
+                self._write(dst, job)
+                logger.error('%s will not run, %s', job.name, job.reason)
+            elif not any(name in unfinished for name in job.depends_on):
+                met.append(job)
+        return met
+
+    def heartbeat(self, job):
+        "Mark a claim as alive, False if the claim was lost"
+        try:
+            os.utime(self.entry('claimed', job.name), None)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return False
+            raise
+        return True
+
+    def update(self, job, worker=None):
+        "Save a claimed *job* as it is now"
+        if os.path.exists(self.entry('claimed', job.name)):
+            self._write(self.entry('claimed', job.name), job, worker)
+
+    def release(self, job, state, worker=None):
+        """
+        Move *job*'s claim to *state* (``pending``, ``done`` or
+        ``failed``), saving the job as it is now.
+
+        :return: False if the claim had already been lost
+        """
+        src = self.entry('claimed', job.name)
+        dst = self.entry(state, job.name)
+        try:
+            os.rename(src, dst)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                logger.warning('Lost the claim on %s', job.name)
+                return False
+            raise
+        self._write(dst, job, worker)
+        return True
+
+    def server_time(self):
+        """
+        The time on the queue's file server, the mtime of a file touched
+        just now, which heartbeats' mtimes can be compared to whatever
+        this host's clock says
+        """
+        path = join(self.path, '.clock.{}'.format(socket.gethostname()))
+        with open(path, 'a'):
+            pass
+        os.utime(path, None)
+        return os.stat(path).st_mtime
+
+    def reclaim_stale(self, stale_after):
+        """
+        Return claims to ``pending`` whose heartbeat is older than
+        *stale_after* seconds, or whose worker ran on this host and has
+        exited.
+
+        :return: names of the reclaimed jobs
+        :rtype: list
+        """
+        host = socket.gethostname()
+        now = self.server_time()
+        reclaimed = []
+        for name in self.names('claimed'):
+            path = self.entry('claimed', name)
+            try:
+                age = now - os.stat(path).st_mtime
+                _, worker = self.read('claimed', name)
+            except (IOError, OSError, ValueError):
+                continue
+            stale = age > stale_after
+            if not stale and worker:
+                worker_host, _, pid = worker.rpartition(':')
+                stale = worker_host == host and not _pid_alive(int(pid))
+            if not stale:
+                continue
+            try:
+                os.rename(path, self.entry(PENDING, name))
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    continue
+                raise
+            logger.warning('Reclaimed %s from %s', name, worker)
+            reclaimed.append(name)
+        return reclaimed
+
+
+class Worker(object):
+    """
+    Claims jobs from a :class:`FileQueue` and runs their scripts.
+
+    Failures are handled like :class:`seam.runner.local.LocalRunner`:
+    transient ones go back to ``pending`` (after a delay) up to
+    *resubmits* times, deterministic ones go to ``failed``. Scripts
+    preempted by a signal go straight back to ``pending``, and a worker
+    sent ``SIGTERM`` or ``SIGUSR1`` forwards it to its scripts, releases
+    them and exits.
+
+    :param queue: :class:`FileQueue` or path to the queue directory
+    :param int slots: scripts to run at once
+    :param int cores: cores to share between running scripts (default: CPU
+      count), see :class:`seam.runner.local.LocalRunner`
+    :param int heartbeat: seconds between heartbeats
+    :param int stale_after: seconds without a heartbeat before a claim is
+      considered dead and reclaimed
+    :param int resubmits: resubmissions allowed per job
+    :param int resubmit_delay: seconds to wait before the first resubmission
+    :param float poll_interval: seconds between checks of the queue
+    :param bool exit_when_empty: stop once nothing is pending or running
+      (instead of waiting for more work)
+    :param policy: which ready job to claim next, a name or object from
+      :mod:`seam.runner.policy` (default ``fifo``)
+    :param history: :class:`seam.runner.policy.RuntimeHistory` (or path
+      to one), default is ``runtimes.json`` in the queue directory
+    :param metrics: :class:`seam.runner.metrics.Exporter` to publish the
+      whole queue's progress to
+    :param disk: :class:`seam.runner.disk.DiskGuard` holding jobs back
+      while the disk they write to is short of space, counting what the
+      jobs of every worker have still to write. Each worker measures its
+      own jobs and publishes their usage in their claims.
+    """
+    def __init__(self, queue, slots=1, heartbeat=30, stale_after=300,
+        resubmits=1, resubmit_delay=60, poll_interval=5.0,
+        exit_when_empty=False, shell='bash', policy=None, history=None,
+        cores=None, metrics=None, disk=None):
+        if not isinstance(queue, FileQueue):
+            queue = FileQueue(queue)
+        self.queue = queue
+        if history is None:
+            history = join(queue.path, 'runtimes.json')
+        if not isinstance(history, RuntimeHistory):
+            history = RuntimeHistory(history)
+        self.history = history
+        self.policy = get_policy(policy, history)
+        self.slots = slots
+        self.cores = cores or cpu_count()
+        self.heartbeat = heartbeat
+        self.stale_after = stale_after
+        self.resubmits = resubmits
+        self.resubmit_delay = resubmit_delay
+        self.poll_interval = poll_interval
+        self.exit_when_empty = exit_when_empty
+        self.shell = shell
+        self.metrics = metrics
+        self.disk = disk
+        self.id = worker_id()
+
+    def run(self):
+        """
+        Work until the queue is drained (with *exit_when_empty*) or forever.
+
+        :return: jobs this worker finished
+        :rtype: list
+        """
+        running = {}
+        finished = []
+        last_beat = 0
+        with forwarding_signals(running) as stopping:
+            while True:
+                self._reap(running, finished)
+                if time.time() - last_beat >= self.heartbeat:
+                    self._beat(running)
+                    self.queue.reclaim_stale(self.stale_after)
+                    last_beat = time.time()
+                if stopping and not running:
+                    logger.warning('Worker %s stopped', self.id)
+                    return finished
+                if not stopping:
+                    self._fill(running)
+                if self.disk:
+                    self.disk.sample(running.values())
+                if self.metrics:
+                    # Only lists the queue when an update is due
+                    self.metrics.update(self.queue.jobs)
+                if self.exit_when_empty and not running and \
+                        not self.queue.names(PENDING):
+                    if self.metrics:
+                        self.metrics.update(self.queue.jobs, force=True)
+                    return finished
+                time.sleep(self.poll_interval)
+
+    def _beat(self, running):
+        """
+        Heartbeat the running jobs' claims, publishing their disk usage. A
+        job whose claim was lost (reclaimed as stale) may already be
+        running elsewhere, so it's killed and left to whoever holds the
+        claim now.
+        """
+        for proc, job in list(running.items()):
+            if self.queue.heartbeat(job):
+                if self.disk and self.disk.paths(job):
+                    # For other workers' admission decisions
+                    job.disk_usage = self.disk.usage(job)
+                    self.queue.update(job, self.id)
+                continue
+            logger.error('Lost the claim on %s, killing it', job.name)
+            kill_tree(proc)
+            del running[proc]
+
+    def _fill(self, running):
+        while len(running) < self.slots:
+            max_threads = None
+            if running:
+                max_threads = self.cores - sum(j.threads
+                    for j in running.values())
+            job = self.queue.claim(self.id, self.policy, max_threads,
+                self.disk.admit if self.disk else None)
+            if job is None:
+                return
+            failure = read_failure(job.script)
+            if failure:
+                job.status = FAILED
+                job.reason = '{step}: {reason}'.format(**failure)
+                self.queue.release(job, 'failed', self.id)
+                continue
+            running[launch(job, self.shell)] = job
+            self.queue.update(job, self.id)
+
+    def _reap(self, running, finished):
+        for proc, job in list(running.items()):
+            returncode = proc.poll()
+            if returncode is None:
+                continue
+            del running[proc]
+            kind = settle(job, returncode)
+            if self.disk:
+                self.disk.finished(job, record=kind is None)
+            if kind is None:
+                state = 'done'
+                self.history.record(job, job.runtime)
+                self.history.save()
+            elif kind == PREEMPTED:
+                state = PENDING
+            elif kind == TRANSIENT_FAILURE and \
+                job.failed_attempts <= self.resubmits:
+                job.status = PENDING
+                job.not_before = time.time() + \
+                    self.resubmit_delay * 2 ** (job.failed_attempts - 1)
+                state = PENDING
+            else:
+                state = 'failed'
+            self.queue.release(job, state, self.id)
+            finished.append(job)
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" retry.py
+
+Failure classification and step-level retries for generated scripts
+
+Failures are either *transient* (stale NFS handles, a busy X display,
+license-server blips) and worth retrying, or *deterministic* (bad input,
+topology defects) and not. Generated scripts run each step through the
+``seam_step`` shell function defined by :func:`step_preamble`, which
+retries transient failures of that step with exponential backoff and
+records deterministic failures in the script's state directory so
+runners don't resubmit them.
+
+A script sent ``SIGTERM`` or ``SIGUSR1`` (e.g. preemption with a grace
+period) stops its running step, records it in the ``preempted`` marker,
+runs its cleanup and exits with :data:`EXIT_REQUEUE`. Runners requeue
+such scripts, which then resume from the step that was interrupted.
+With SLURM, ``--signal=B:TERM@60`` delivers the signal to the script
+ahead of the kill, and ``RequeueExit=99`` in ``slurm.conf`` requeues
+array tasks that exit with it.
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import re
+
+from ..util import shell_quote
+
+TRANSIENT = 'transient'
+DETERMINISTIC = 'deterministic'
+# Stopped by a signal, to be requeued rather than counted as a failure
+PREEMPTED = 'preempted'
+
+# Exit codes a generated script finishes with (see sysexits.h)
+EXIT_DETERMINISTIC = 65
+EXIT_TRANSIENT = 75
+# Not in sysexits.h, chosen not to collide with commands' own statuses
+EXIT_REQUEUE = 99
+
+# timeout(1) and EX_TEMPFAIL
+TRANSIENT_EXIT_CODES = (75, 124)
+TRANSIENT_PATTERNS = (
+    r'Stale (NFS )?file handle',
+    r'Xvfb failed to start',
+    r'Server is already active for display',
+    r'[Cc]annot open display',
+    r'Resource temporarily unavailable',
+    r'Connection timed out',
+    r'Input/output error',
+    r'[Ll]icense server',
+)
+# Not needed to decide (unmatched failures are deterministic), but they
+# give a better reason than the exit status
+DETERMINISTIC_PATTERNS = (
+    r'ERROR: .*(does not exist|not found)',
+    r'ERROR: [Tt]alairach',
+    r'[Tt]opolog(y|ical) defect',
+    r'[Ss]egmentation fault',
+    r'recon-all .* exited with ERRORS',
+)
+
+_transient_re = re.compile('|'.join(TRANSIENT_PATTERNS))
+_deterministic_re = re.compile('|'.join(DETERMINISTIC_PATTERNS))
+
+
+def classify_failure(returncode, log_text=''):
+    """
+    Classify a failed step by its exit code and output.
+
+    :param int returncode: exit status of the step
+    :param str log_text: output of the step
+    :return: (:data:`TRANSIENT` or :data:`DETERMINISTIC`, reason)
+    :rtype: tuple
+    """
+    if returncode in TRANSIENT_EXIT_CODES:
+        return TRANSIENT, 'exit status {:d}'.format(returncode)
+    match = _transient_re.search(log_text)
+    if match:
+        return TRANSIENT, match.group(0)
+    match = _deterministic_re.search(log_text)
+    if match:
+        return DETERMINISTIC, match.group(0)
+    return DETERMINISTIC, 'exit status {:d}'.format(returncode)
+
+
+def state_dir(script):
+    "Directory holding step markers & logs for *script*"
+    return '{}.state'.format(os.path.splitext(script)[0])
+
+def failure_marker(script):
+    return os.path.join(state_dir(script), 'failed')
+
+def read_failure(script):
+    """
+    Return the recorded deterministic failure of *script*, if any.
+
+    :return: dict with ``step``, ``status`` and ``reason`` keys, or None
+    """
+    marker = failure_marker(script)
+    if not os.path.isfile(marker):
+        return None
+    with open(marker) as f:
+        step, status, reason = f.read().rstrip('\n').split('\t', 2)
+    return {'step': step, 'status': int(status), 'reason': reason}
+
+def read_preempted(script):
+    """
+    Return the step *script* was running when last preempted, if it
+    hasn't run since.
+
+    :return: dict with ``step`` (``-`` if between steps), ``signal`` and
+      ``time`` (epoch seconds) keys, or None
+    """
+    try:
+        with open(os.path.join(state_dir(script), 'preempted')) as f:
+            step, signal, when = f.read().rstrip('\n').split('\t')
+        return {'step': step, 'signal': signal, 'time': int(when)}
+    except (IOError, OSError, ValueError):
+        return None
+
+def clear_failure(script):
+    "Forget a recorded failure (e.g. after fixing the input) so *script* can run"
+    if os.path.isfile(failure_marker(script)):
+        os.remove(failure_marker(script))
+
+
+def timings_path(script):
+    return os.path.join(state_dir(script), 'timings.tsv')
+
+def read_timings(script, offset=0):
+    """
+    Read the step attempts *script* has recorded, starting *offset* bytes
+    into the file, so a poller only reads what's new.
+
+    :return: list of dicts with ``step``, ``attempt``, ``start``, ``end``
+      (epoch seconds) and ``status`` keys, and the offset to read from
+      next time
+    :rtype: tuple
+    """
+    try:
+        with open(timings_path(script), 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except (IOError, OSError):
+        return [], offset
+    # A line still being written is left for next time
+    complete = data[:data.rfind(b'\n') + 1]
+    timings = []
+    for line in complete.decode('utf-8', 'replace').splitlines():
+        parts = line.split('\t')
+        if len(parts) != 5:
+            continue
+        step, attempt, start, end, status = parts
+        try:
+            timings.append({'step': step, 'attempt': int(attempt),
+                'start': int(start), 'end': int(end), 'status': int(status)})
+        except ValueError:
+            # Garbled, e.g. by a node crashing mid-write
+            continue
+    return timings, offset + len(complete)
+
+def current_step(script):
+    """
+    The step *script* is running, if any.
+
+    :return: ``(step, start)`` with start in epoch seconds, or None
+    """
+    try:
+        with open(os.path.join(state_dir(script), 'current')) as f:
+            step, start = f.read().rstrip('\n').split('\t')
+        return step, int(start)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def step_preamble(state_directory, max_attempts=3, delay=30, max_delay=600,
+    cleanup=None, stop_grace=20):
+    """
+    Supplies bash that defines ``seam_step``, to be placed at the top of
+    a generated script.
+
+    ``seam_step <name> <command> [<resume command>]`` skips steps already
+    completed, runs the command while saving its output under
+    *state_directory*, and on failure classifies it like
+    :func:`classify_failure`. Transient failures are retried up to
+    *max_attempts* times, sleeping *delay* seconds (doubling each attempt,
+    up to *max_delay*) in between, after running the *cleanup* commands;
+    if they persist the script exits with :data:`EXIT_TRANSIENT`. Once a
+    step has been started, later attempts (including those of a rerun
+    script) run its resume command instead, if it has one, e.g. carrying
+    on from the last completed stage.
+    Deterministic failures are recorded in the ``failed`` marker and the
+    script exits with :data:`EXIT_DETERMINISTIC`.
+
+    While a step runs, ``current`` in *state_directory* holds its name and
+    start time; every attempt is appended to ``timings.tsv`` (see
+    :func:`read_timings`).
+
+    Steps run in the background so that ``SIGTERM`` & ``SIGUSR1`` are
+    handled at once: the step's process tree (including any ``Xvfb``) is
+    sent ``SIGTERM``, then ``SIGKILL`` after *stop_grace* seconds, the
+    step is recorded in ``preempted`` (see :func:`read_preempted`), the
+    *cleanup* commands run and the script exits with
+    :data:`EXIT_REQUEUE`. An ``EXIT`` trap set later (e.g. by
+    :func:`seam.util.tmp_preamble`) still runs.
+
+    :param str state_directory: directory for step markers & logs
+    :param int max_attempts: attempts per step for transient failures
+    :param int delay: seconds to wait before the first retry
+    :param int max_delay: cap on the wait between retries
+    :param list cleanup: commands to run before retrying a step and when
+      preempted, e.g. removing ``recon-all``'s ``IsRunning`` locks
+    :param int stop_grace: seconds a preempted step has to exit
+    """
+    template = """SEAM_STATE_DIR={state}
+SEAM_MAX_ATTEMPTS={max_attempts:d}
+SEAM_RETRY_DELAY={delay:d}
+SEAM_MAX_RETRY_DELAY={max_delay:d}
+SEAM_TRANSIENT_RE={transient_re}
+SEAM_DETERMINISTIC_RE={deterministic_re}
+SEAM_STOP_GRACE={stop_grace:d}
+SEAM_CHILD=
+mkdir -p "$SEAM_STATE_DIR"
+if [ -e "$SEAM_STATE_DIR/failed" ]; then
+    echo "seam: refusing to run, previous failure recorded in $SEAM_STATE_DIR/failed" >&2
+    exit {exit_deterministic:d}
+fi
+if [ -e "$SEAM_STATE_DIR/preempted" ]; then
+    echo "seam: resuming after preemption ($(cut -f1,2 "$SEAM_STATE_DIR/preempted"))"
+    rm -f "$SEAM_STATE_DIR/preempted"
+fi
+
+seam_kill_tree() {{
+    local child
+    for child in $(pgrep -P "$1" 2>/dev/null); do
+        seam_kill_tree "$child" "$2"
+    done
+    kill -"$2" "$1" 2>/dev/null
+}}
+
+seam_cleanup() {{
+{cleanup_body}
+}}
+
+seam_preempt() {{
+    local name=- child=$SEAM_CHILD waited=0
+    trap '' TERM USR1
+    if [ -e "$SEAM_STATE_DIR/current" ]; then
+        name=$(cut -f1 "$SEAM_STATE_DIR/current")
+        # The signal may land between starting the step and noting its pid
+        child=${{child:-$!}}
+        echo "seam: step $name preempted by SIG$1 $(date '+%Y-%m-%d %H:%M:%S')" >> "$SEAM_STATE_DIR/$name.log"
+    fi
+    printf '%s\t%s\t%s\n' "$name" "$1" "$(date +%s)" > "$SEAM_STATE_DIR/preempted"
+    if [ -n "$child" ]; then
+        seam_kill_tree $child TERM
+        while kill -0 $child 2>/dev/null && [ $waited -lt $SEAM_STOP_GRACE ]; do
+            sleep 1
+            waited=$((waited + 1))
+        done
+        seam_kill_tree $child KILL
+    fi
+    rm -f "$SEAM_STATE_DIR/current"
+    seam_cleanup
+    echo "seam: stopped by SIG$1, exiting for requeue" >&2
+    exit {exit_requeue:d}
+}}
+trap 'seam_preempt TERM' TERM
+trap 'seam_preempt USR1' USR1
+
+seam_classify() {{
+    case $1 in
+        {transient_codes}) echo transient; return ;;
+    esac
+    if grep -Eq "$SEAM_TRANSIENT_RE" "$2"; then
+        echo transient
+    else
+        echo deterministic
+    fi
+}}
+
+seam_step() {{
+    local name=$1 cmd=$2 resume=${{3:-}} attempt=1 delay=$SEAM_RETRY_DELAY status kind reason start run
+    local log="$SEAM_STATE_DIR/$name.log" out="$SEAM_STATE_DIR/$name.attempt.log"
+    local started="$SEAM_STATE_DIR/$name.started"
+    if [ -e "$SEAM_STATE_DIR/$name.done" ]; then
+        echo "seam: step $name already complete, skipping"
+        return 0
+    fi
+    while true; do
+        run=$cmd
+        if [ -n "$resume" ] && [ -e "$started" ]; then
+            echo "seam: step $name was started before, resuming"
+            run=$resume
+        fi
+        echo "seam: step $name attempt $attempt started $(date '+%Y-%m-%d %H:%M:%S')" >> "$log"
+        start=$(date +%s)
+        printf '%s\t%s\n' "$name" "$start" > "$SEAM_STATE_DIR/current"
+        touch "$started"
+        # In the background so signals are handled while it runs
+        ( eval "$run" 2>&1 | tee "$out"; exit ${{PIPESTATUS[0]}} ) &
+        SEAM_CHILD=$!
+        wait $SEAM_CHILD
+        status=$?
+        SEAM_CHILD=
+        printf '%s\t%d\t%d\t%d\t%d\n' "$name" $attempt $start $(date +%s) \
+            $status >> "$SEAM_STATE_DIR/timings.tsv"
+        rm -f "$SEAM_STATE_DIR/current"
+        cat "$out" >> "$log"
+        if [ $status -eq 0 ]; then
+            rm -f "$out" "$started"
+            touch "$SEAM_STATE_DIR/$name.done"
+            return 0
+        fi
+        kind=$(seam_classify $status "$out")
+        reason=$(grep -Eo -m1 "$SEAM_DETERMINISTIC_RE" "$out")
+        rm -f "$out"
+        echo "seam: step $name attempt $attempt failed with status $status ($kind)" >> "$log"
+        if [ "$kind" != transient ]; then
+            printf '%s\\t%s\\t%s\\n' "$name" "$status" \\
+                "${{reason:-exit status $status}}" > "$SEAM_STATE_DIR/failed"
+            exit {exit_deterministic:d}
+        fi
+        # e.g. locks a killed command left behind, which would fail the
+        # retry for good
+        seam_cleanup
+        if [ $attempt -ge $SEAM_MAX_ATTEMPTS ]; then
+            exit {exit_transient:d}
+        fi
+        # In the background too, or the traps wait for the sleep to end
+        sleep $delay &
+        SEAM_CHILD=$!
+        wait $SEAM_CHILD
+        SEAM_CHILD=
+        attempt=$((attempt + 1))
+        delay=$((delay * 2))
+        if [ $delay -gt $SEAM_MAX_RETRY_DELAY ]; then
+            delay=$SEAM_MAX_RETRY_DELAY
+        fi
+    done
+}}"""
+    state = shell_quote(state_directory)
+    transient_re = shell_quote('|'.join(TRANSIENT_PATTERNS))
+    deterministic_re = shell_quote('|'.join(DETERMINISTIC_PATTERNS))
+    transient_codes = '|'.join(str(c) for c in TRANSIENT_EXIT_CODES)
+    exit_deterministic = EXIT_DETERMINISTIC
+    exit_transient = EXIT_TRANSIENT
+    exit_requeue = EXIT_REQUEUE
+    cleanup_body = '\n'.join('    ' + cmd for cmd in cleanup or [':'])
+    return template.format(**locals())
+
+
+def step_cmd(name, command, resume=None):
+    """
+    Run *command* as step *name* of a script using :func:`step_preamble`,
+    or *resume* if the step was started before
+
+    Usage::
+
+      >>> from seam.runner.retry import step_cmd
+      >>> print(step_cmd('recon_all', 'recon-all -s sub0001 -all'))
+      seam_step recon_all 'recon-all -s sub0001 -all'
+    """
+    cmd = 'seam_step {} {}'.format(name, shell_quote(command))
+    if resume:
+        cmd += ' ' + shell_quote(resume)
+    return cmd
@@ -10,6 +10,10 @@ __copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
 
 import sys
 import os
+import fcntl
+import atexit
+import tempfile
+from contextlib import contextmanager
 from string import digits, ascii_letters
 from random import choice
 
@@ -19,18 +23,167 @@ if PY2:
 else:
     STRING_TYPE = str
 
+try:
+    from shlex import quote as shell_quote
+except ImportError:  # Python 2
+    from pipes import quote as shell_quote
+
+try:
+    from shutil import which
+except ImportError:  # Python 2
+    from distutils.spawn import find_executable as which
+
 total = digits + ascii_letters
 
+# Temp files go under $SEAM_TMPDIR (e.g. a tmpfs or node-local scratch),
+# else $TMPDIR, else /tmp
+TMPDIR_ENV = 'SEAM_TMPDIR'
+# Where generated scripts keep their temp files, see tmp_preamble
+SCRIPT_TMP = '${SEAM_TMP:-${TMPDIR:-/tmp}}'
+
+
+@contextmanager
+def locked(lock_path):
+    "Hold an exclusive ``flock`` on *lock_path* (created if need be)"
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o664)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# Files of every TempFiles that cleans up at exit, so one handler does
+# for all of them however many there are
+_exit_paths = set()
+
+@atexit.register
+def _cleanup_at_exit():
+    paths = list(_exit_paths)
+    _exit_paths.clear()
+    for path in paths:
+        _remove(path)
+
+
+def fast_tmp_dir():
+    "Directory for temp files: ``$SEAM_TMPDIR``, ``$TMPDIR`` or ``/tmp``"
+    return os.environ.get(TMPDIR_ENV) or tempfile.gettempdir()
+
+
+class TempFiles(object):
+    """
+    Allocates temp files atomically and removes them together.
+
+    Each file is created (``O_EXCL``, mode 0600) when allocated, so two
+    processes can never be handed the same path, and is removed by
+    :meth:`cleanup`: at interpreter exit, or when used as a context
+    manager, on leaving the block.
+
+    :param str directory: where to create files (default: :func:`fast_tmp_dir`)
+    :param str prefix: file name prefix
+    :param boolean cleanup_at_exit: register :meth:`cleanup` with ``atexit``
+
+    Usage::
+
+      >>> from seam.util import TempFiles
+      >>> with TempFiles() as tmp:
+      ...     auth = tmp.allocate('.auth')
+    """
+    def __init__(self, directory=None, prefix='seam-', cleanup_at_exit=True):
+        self.directory = directory or fast_tmp_dir()
+        self.prefix = prefix
+        self.paths = []
+        self.cleanup_at_exit = cleanup_at_exit
+
+    def allocate(self, suffix=''):
+        "Create an empty file and return its path"
+        fd, path = tempfile.mkstemp(suffix, self.prefix, self.directory)
+        os.close(fd)
+        self.paths.append(path)
+        if self.cleanup_at_exit:
+            _exit_paths.add(path)
+        return path
+
+    def cleanup(self):
+        "Remove every file allocated so far"
+        paths, self.paths = self.paths, []
+        for path in paths:
+            _exit_paths.discard(path)
+            _remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+def tmp_preamble(tmp_dir=None, exit_code=75):
+    """
+    Supplies bash that makes a private temp directory, ``$SEAM_TMP``,
+    for a generated script and removes it when the script exits.
+
+    The directory is ``mktemp -d`` under ``$SEAM_TMPDIR`` if set when the
+    script runs, else *tmp_dir*, else ``$TMPDIR`` or ``/tmp``.
+
+    :param str tmp_dir: default parent directory, e.g. a tmpfs
+    :param int exit_code: exit status if the directory can't be made
+    """
+    base = shell_quote(tmp_dir) if tmp_dir else '${TMPDIR:-/tmp}'
+    template = """SEAM_TMP=$(mktemp -d "${{SEAM_TMPDIR:-{base}}}/seam.XXXXXXXXXX") || exit {exit_code:d}
+trap 'rm -rf "$SEAM_TMP"' EXIT"""
+    return template.format(**locals())
+
+
+def script_mktemp(name, directory=False):
+    """
+    Shell expansion that creates a temp file (or *directory*) when the
+    command runs, in ``$SEAM_TMP`` (see :func:`tmp_preamble`) or, outside
+    a seam script, ``$TMPDIR``.
+
+    Usage::
+
+      >>> from seam.util import script_mktemp
+      >>> script_mktemp('xvfb-auth')
+      '"$(mktemp "${SEAM_TMP:-${TMPDIR:-/tmp}}/xvfb-auth.XXXXXXXXXX")"'
+    """
+    flags = '-d ' if directory else ''
+    return '"$(mktemp {}"{}/{}.XXXXXXXXXX")"'.format(flags, SCRIPT_TMP, name)
+
+
 def get_tmp_filename(ext='out', basename='/tmp', fname_length=32):
+    """
+    A random file name under *basename*.
+
+    :note: The file isn't created, so the name may be taken by the time
+      it's used. Prefer :class:`TempFiles`, or :func:`script_mktemp` for
+      commands in generated scripts.
+    """
     fname = ''.join(choice(total) for _ in range(fname_length))
     return os.path.join(basename, '{}.{}'.format(fname, ext))
 
 def wrap_with_xvfb(command, wait=5, server_args='-screen 0, 1600x1200x24'):
+    """
+    Run *command* under ``xvfb-run``, in a subshell.
+
+    The auth & error files go in a directory made with ``mktemp`` when the
+    command runs (see :func:`script_mktemp`), so concurrent commands never
+    share them, and the subshell removes it on exit, in a generated script
+    or not.
+    """
     parts = ['xvfb-run',
         '-a', # automatically get a free server number
-        '-f {}'.format(get_tmp_filename()),
-        '-e {}'.format(get_tmp_filename(ext='err')),
+        '-f "$xvfb_tmp/auth"',
+        '-e "$xvfb_tmp/err"',
         '--wait={:d}'.format(wait),
         '--server-args="{}"'.format(server_args),
         command]
-    return ' '.join(parts)
+    return '(xvfb_tmp={} || exit 75; trap \'rm -rf "$xvfb_tmp"\' EXIT; ' \
+        '{})'.format(script_mktemp('xvfb', directory=True), ' '.join(parts))
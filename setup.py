@@ -83,11 +83,14 @@ setup(
     # If there are data files included in your packages, specify them here.
     package_data={
     },
+    # Label conversion & reading FreeSurfer's binary formats need NumPy
+    extras_require={'numpy': ['numpy']},
 
     # To provide executable scripts, use entry points in preference to the
     # "scripts" keyword. Entry points provide cross-platform support and allow
     # pip to create the appropriate form of executable for the target platform.
     entry_points={'console_scripts': [
-        'build-recon-v1 = seam.freesurfer.v1.recipe:main']
+        'build-recon-v1 = seam.freesurfer.v1.recipe:main',
+        'seam = seam.cli:main']
     },
 )
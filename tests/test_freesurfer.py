@@ -8,10 +8,16 @@ Functions for testing freesurfer functionality
 __author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
 __copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
 
+import os
+import time
+
+import pytest
+
 from seam.freesurfer import recon_all, recon_input, tkmedit_screenshot_tcl,\
     tkmedit_screenshot_cmd, tksurfer_screenshot_tcl, tksurfer_screenshot_cmd,\
     annot2label_cmd
 from seam.freesurfer import v1
+from seam.util import shell_quote
 
 # Version specific
 v1_recon_all = 'recon-all -s foo -all -qcache -measure thickness' \
@@ -82,6 +88,7 @@ def test_v1_recon_all():
     with_flags = v1_recon_all + ' -use-gpu -mprage -log /path/to/file'
     assert with_flags == v1.recon_all('foo', flags=['-use-gpu',
         '-mprage', '-log /path/to/file'])
+    assert v1_recon_all + ' -openmp 4' == v1.recon_all('foo', threads=4)
 
 def test_v1_recon_input():
     assert v1_recon_input == v1.recon_input('foo', '/path/to/data/t1.nii')
@@ -145,3 +152,349 @@ def test_parser():
     assert ['-mprage', '-log', '/tmp/log.log'] == recon_flags
 
 
+def test_build_recipe(tmpdir, monkeypatch):
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    script_dir = str(tmpdir.join('scripts'))
+    written = v1.build_recipe('foo', '/path/to/t1.nii', script_dir)
+    assert len(written) == 4
+    with open(written[0]) as f:
+        script = f.read()
+    assert script.startswith('#!/bin/bash\n')
+    assert "seam_step recon_input 'recon-all -s foo -i /path/to/t1.nii'" in script
+    for step in ('recon_all', 'tkmedit',
+        'annot2label_lh', 'tksurfer_lh', 'annot2label_rh', 'tksurfer_rh'):
+        assert 'seam_step {} '.format(step) in script
+    assert 'OMP_NUM_THREADS' not in script
+    # Sharing fsaverage is opt-in
+    assert 'provision_fsaverage' not in script
+    assert 'flock' not in script
+    written = v1.build_recipe('foo', '/path/to/t1.nii', script_dir,
+        template_mode='symlink')
+    with open(written[0]) as f:
+        assert 'seam_step provision_fsaverage ' in f.read()
+
+def test_build_recipe_preempt_cleanup(tmpdir, monkeypatch):
+    sd = tmpdir.join('subjects')
+    monkeypatch.setenv('SUBJECTS_DIR', str(sd))
+    written = v1.build_recipe('foo', '/path/to/t1.nii', str(tmpdir))
+    with open(written[0]) as f:
+        script = f.read()
+    # A preempted recon-all leaves its lock behind otherwise
+    cleanup = script[script.index('seam_cleanup() {'):]
+    assert 'rm -f {}/scripts/IsRunning*'.format(sd.join('foo')) in \
+        cleanup[:cleanup.index('}')]
+    assert "trap 'seam_preempt TERM' TERM" in script
+
+def test_build_recipe_resume(tmpdir, monkeypatch):
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    written = v1.build_recipe('foo', '/path/to/t1.nii', str(tmpdir))
+    with open(written[0]) as f:
+        script = f.read()
+    line = script[script.index('seam_step recon_input '):].splitlines()[0]
+    # recon-all -i refuses a subject that was set up before preemption
+    assert line.endswith(' ' + shell_quote(v1.core.recon_input_resume('foo',
+        ['/path/to/t1.nii'], str(tmpdir.join('subjects')))))
+    line = script[script.index('seam_step recon_all '):].splitlines()[0]
+    assert line.endswith(" 'recon-all -s foo -make all && recon-all -s foo "
+        "-qcache -measure thickness -measure curv -measure sulc "
+        "-measure area -measure jacobian_white'")
+
+def test_recon_input_resume(tmpdir, monkeypatch):
+    import subprocess
+    sd = tmpdir.join('subjects')
+    subject = sd.join('foo')
+    # Stands in for recon-all -i: sets the subject up, or refuses to
+    bin_dir = tmpdir.mkdir('bin')
+    fake = bin_dir.join('recon-all')
+    fake.write('#!/bin/bash\necho "$@" >> {log}\nd={sd}/$2\n'
+        '[ -e "$d" ] && exit 1\nmkdir -p "$d/mri/orig"\nn=0\n'
+        'for a in "$@"; do [ "$a" = -i ] && n=$((n+1)) && '
+        'touch "$d/mri/orig/$(printf %03d $n).mgz"; done\nexit 0\n'.format(
+            log=tmpdir.join('calls'), sd=sd))
+    fake.chmod(0o755)
+    monkeypatch.setenv('PATH', '{}:{}'.format(bin_dir, os.environ['PATH']))
+    cmd = v1.core.recon_input_resume('foo', ['/d/1.nii', '/d/2.nii'], str(sd))
+    # Interrupted before the second input
+    subject.join('mri', 'orig', '001.mgz').write('', ensure=True)
+    subject.join('scripts', 'recon-all.log').write('', ensure=True)
+    assert subprocess.call(['bash', '-c', cmd]) == 0
+    assert tmpdir.join('calls').read() == '-s foo -i /d/1.nii -i /d/2.nii\n'
+    assert subject.join('mri', 'orig', '002.mgz').check()
+    assert sd.join('foo.partial', 'scripts', 'recon-all.log').check()
+    # Every input converted, so skipped
+    assert subprocess.check_output(['bash', '-c', cmd]).decode() == \
+        'foo already set up\n'
+    assert len(tmpdir.join('calls').readlines()) == 1
+    # Interrupted before the first, then again
+    for _ in range(2):
+        subject.join('mri', 'orig', '001.mgz').remove()
+        subject.join('mri', 'orig', '002.mgz').remove()
+        assert subprocess.call(['bash', '-c', cmd]) == 0
+        assert subject.join('mri', 'orig', '002.mgz').check()
+    assert len(tmpdir.join('calls').readlines()) == 3
+
+def test_build_recipe_threads(tmpdir, monkeypatch):
+    from seam.runner import Job
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    written = v1.build_recipe('foo', '/path/to/t1.nii', str(tmpdir), threads=4)
+    with open(written[0]) as f:
+        script = f.read()
+    assert 'export OMP_NUM_THREADS=4\n' in script
+    assert 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS=4\n' in script
+    assert '-openmp 4' in script
+    assert Job(written[0]).threads == 4
+
+def test_build_recipe_native_labels(tmpdir, monkeypatch):
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    written = v1.build_recipe('foo', '/path/to/t1.nii', str(tmpdir),
+        native_labels=True)
+    with open(written[0]) as f:
+        script = f.read()
+    assert 'mri_annotation2label' not in script
+    assert 'annot2label_lh' not in script
+    assert "seam_step annot2label 'seam annot2label foo aparc.a2009s" in script
+    assert script.index('seam_step annot2label ') < script.index(
+        'seam_step tksurfer_lh ')
+
+def test_build_recipe_native_screenshots(tmpdir, monkeypatch):
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    written = v1.build_recipe('foo', '/path/to/t1.nii', str(tmpdir),
+        use_xvfb=True, native_screenshots=True)
+    assert written[1] is None
+    with open(written[0]) as f:
+        script = f.read()
+    assert written[2:] == (None, None)
+    assert 'tkmedit' not in script
+    assert 'tksurfer' not in script
+    assert 'xvfb-run' not in script
+    ss_dir = tmpdir.join('foo_screenshots')
+    assert "seam_step slices 'seam render-slices foo {}'".format(
+        ss_dir) in script
+    assert "seam_step surfaces 'seam render-surfaces foo {}'".format(
+        ss_dir) in script
+    assert script.index('seam_step annot2label_rh ') < script.index(
+        'seam_step surfaces ')
+
+def test_build_recipe_native_screenshots_threads(tmpdir, monkeypatch):
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    script_dir = tmpdir.join('my scripts')
+    written = v1.build_recipe('foo', '/path/to/t1.nii', str(script_dir),
+        native_screenshots=True, threads=4, screenshot_format='png')
+    with open(written[0]) as f:
+        script = f.read()
+    outdir = shell_quote(str(script_dir.join('foo_screenshots')))
+    for step, command in (('slices', 'render-slices'),
+        ('surfaces', 'render-surfaces')):
+        assert 'seam_step {} {}'.format(step, shell_quote(
+            'seam {} foo {} --threads 4'.format(command, outdir))) in script
+
+def test_manifest(tmpdir, monkeypatch):
+    from seam.freesurfer.v1 import manifest
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    path = tmpdir.join('batch.csv')
+    path.write('subject_id,input,study,priority\n'
+        'foo,/data/foo.nii,adni,\n'
+        'bar,/data/bar_a.nii; /data/bar_b.nii,clinical,10\n')
+    rows = manifest.read_manifest(str(path))
+    assert rows[0]['input_data'] == ['/data/foo.nii']
+    assert rows[0]['priority'] == 0
+    assert rows[1]['input_data'] == ['/data/bar_a.nii', '/data/bar_b.nii']
+    assert rows[1]['study'] == 'clinical'
+    jobs = manifest.build_batch(rows, str(tmpdir.join('scripts')))
+    assert [(j.name, j.study, j.priority) for j in jobs] == [
+        ('foo', 'adni', 0), ('bar', 'clinical', 10)]
+    assert jobs[1].script.endswith('bar.recon.sh')
+
+def test_annot2label_cmds():
+    subjects = ['s1', 's2', 's3']
+    cmds = v1.annot2label_cmds(subjects, ['lh', 'rh', 'lh'],
+        ['/a/{}.annot'.format(s) for s in subjects], '/out')
+    assert cmds == [v1.annot2label_cmd(s, h, '/a/{}.annot'.format(s), '/out')
+        for s, h in zip(subjects, ['lh', 'rh', 'lh'])]
+    with pytest.raises(ValueError):
+        v1.annot2label_cmds(subjects, ['lh', 'rh'], '/a.annot', '/out')
+
+def test_batch_cmds_numpy_columns():
+    np = pytest.importorskip('numpy')
+    subjects = np.array(['s1', 's2'])
+    assert v1.recon_all_cmds(subjects, threads=np.array([2., np.nan])) == [
+        v1.recon_all('s1', threads=2), v1.recon_all('s2')]
+    assert v1.tksurfer_screenshot_cmds(subjects, np.str_('lh'), 'inflated',
+        ['/t1.tcl', '/t2.tcl'], ['-gray']) == [
+        v1.tksurfer_screenshot_cmd('s1', 'lh', 'inflated', '/t1.tcl', ['-gray']),
+        v1.tksurfer_screenshot_cmd('s2', 'lh', 'inflated', '/t2.tcl', ['-gray'])]
+
+def test_batch_cmds_to_stream(tmpdir):
+    from io import StringIO
+    out = StringIO()
+    assert v1.recon_input_many({'s1': '/d/1.nii'}, out=out) == 1
+    assert v1.tkmedit_screenshot_cmds(['s1', 's2'], 'brain.mgz', '/t.tcl',
+        out=out) == 2
+    assert out.getvalue() == ('recon-all -s s1 -i /d/1.nii\n'
+        'tkmedit s1 brain.mgz -tcl /t.tcl\n'
+        'tkmedit s2 brain.mgz -tcl /t.tcl\n')
+    path = str(tmpdir.join('cmds.txt'))
+    with open(path, 'w') as f:
+        assert v1.recon_all_cmds(['s1', 's2'], out=f) == 2
+    assert open(path).read() == '{}\n{}\n'.format(v1.recon_all('s1'),
+        v1.recon_all('s2'))
+    assert v1.recon_all_cmds(['s1'], flags=['-use-gpu']) == [
+        v1.recon_all('s1', flags=['-use-gpu'])]
+
+def manifest_rows(n):
+    return [{'subject_id': 's{:03d}'.format(i), 'input_data': ['/d/{}.nii'.format(i)],
+        'study': None, 'priority': 0} for i in range(n)]
+
+def test_iter_batch_ordered(tmpdir, monkeypatch):
+    from seam.freesurfer.v1 import manifest
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    rows = manifest_rows(12)
+    jobs = manifest.iter_batch(iter(rows), str(tmpdir), workers=4,
+        max_in_flight=3)
+    assert [job.name for job in jobs] == [r['subject_id'] for r in rows]
+
+def test_iter_batch_is_lazy_and_bounded(tmpdir, monkeypatch):
+    from seam.freesurfer.v1 import manifest
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    consumed = []
+    def rows():
+        for row in manifest_rows(100):
+            consumed.append(row['subject_id'])
+            yield row
+    jobs = manifest.iter_batch(rows(), str(tmpdir), workers=2,
+        max_in_flight=4, ordered=False)
+    first = next(jobs)
+    assert first.name in consumed
+    assert len(consumed) <= 4
+    jobs.close()
+    assert len(consumed) <= 5
+
+def test_iter_batch_errors(tmpdir, monkeypatch):
+    from seam.freesurfer.v1 import manifest
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    rows = manifest_rows(3)
+    rows[1]['input_data'] = 5
+    for ordered in (True, False):
+        with pytest.raises(TypeError):
+            list(manifest.iter_batch(rows, str(tmpdir), workers=2,
+                ordered=ordered, dedupe=False))
+
+def test_annot2label_native_cmd():
+    assert v1.core.annot2label_native_cmd('sub0001', 'aparc.a2009s',
+        '/sd/sub0001/label', hemis=('rh',)) == ('seam annot2label sub0001 '
+        'aparc.a2009s /sd/sub0001/label --surface white --hemi rh')
+
+def test_build_recipe_xvfb_tmp(tmpdir, monkeypatch):
+    import subprocess
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    written = v1.build_recipe('foo', '/path/to/t1.nii', str(tmpdir),
+        use_xvfb=True, tmp_dir='/dev/shm')
+    with open(written[0]) as f:
+        script = f.read()
+    assert 'SEAM_TMP=$(mktemp -d "${SEAM_TMPDIR:-/dev/shm}/seam.XXXXXXXXXX")' \
+        in script
+    assert "trap 'rm -rf \"$SEAM_TMP\"' EXIT" in script
+    assert script.index('SEAM_TMP=') < script.index('seam_step tkmedit')
+    subprocess.check_call(['bash', '-n', written[0]])
+
+def test_recon_base_and_long():
+    assert v1.recon_base('foo', ['foo_1', 'foo_2'], threads=2) == \
+        'recon-all -base foo -tp foo_1 -tp foo_2 -all -openmp 2'
+    assert v1.recon_long('foo_1', 'foo').startswith(
+        'recon-all -long foo_1 foo -all -qcache ')
+
+def test_build_longitudinal(tmpdir, monkeypatch):
+    from seam.freesurfer.v1 import longitudinal
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    script_dir = str(tmpdir.join('scripts'))
+    stages = v1.build_longitudinal('foo', [('foo_1', '/data/1.nii'),
+        ('foo_2', '/data/2.nii')], script_dir, threads=2)
+    assert list(stages) == ['cross', 'base', 'long']
+    cross, (base,), longs = stages.values()
+    assert [j.name for j in cross] == ['foo_1.cross', 'foo_2.cross']
+    assert base.depends_on == ['foo_1.cross', 'foo_2.cross']
+    assert [j.name for j in longs] == ['foo_1.long.foo', 'foo_2.long.foo']
+    assert all(j.depends_on == ['foo.base'] and j.threads == 2 for j in longs)
+    # Preempted or retried, base & long runs carry on with -make all
+    with open(base.script) as f:
+        assert "seam_step recon_base 'recon-all -base foo -tp foo_1 -tp " \
+            "foo_2 -all -openmp 2' 'recon-all -base foo -tp foo_1 -tp foo_2 " \
+            "-make all -openmp 2'\n" in f.read()
+    resume = v1.core.recon_long_resume('foo_1', 'foo', threads=2)
+    assert resume.startswith('recon-all -long foo_1 foo -make all -openmp 2 '
+        '&& recon-all -long foo_1 foo -qcache')
+    with open(longs[0].script) as f:
+        assert ' {}\n'.format(shell_quote(resume)) in f.read()
+    paths = longitudinal.write_stage_lists([stages], script_dir)
+    with open(paths['long']) as f:
+        assert f.read().split() == [j.script for j in longs]
+
+def test_build_longitudinal_batch(tmpdir, monkeypatch):
+    from seam.freesurfer.v1 import manifest
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    path = tmpdir.join('batch.csv')
+    path.write('subject_id,input,base_id\n'
+        'foo_1,/data/foo_1.nii,foo\nbar_1,/data/bar_1.nii,bar\n'
+        'foo_2,/data/foo_2.nii,foo\n')
+    subjects = manifest.build_longitudinal_batch(str(path),
+        str(tmpdir.join('scripts')))
+    assert [s['base'][0].name for s in subjects] == ['foo.base', 'bar.base']
+    assert [len(s['cross']) for s in subjects] == [2, 1]
+
+def edited_subject(tmpdir, monkeypatch):
+    sd = tmpdir.join('subjects')
+    monkeypatch.setenv('SUBJECTS_DIR', str(sd))
+    subject = sd.join('foo')
+    for rel in ('mri/wm.mgz', 'mri/brainmask.mgz'):
+        subject.join(rel).write('original', ensure=True)
+    done = subject.join('scripts', 'recon-all.done')
+    done.write('', ensure=True)
+    old = time.time() - 100
+    for path in (subject.join('mri/wm.mgz'), subject.join('mri/brainmask.mgz'),
+        done):
+        os.utime(str(path), (old, old))
+    return subject
+
+def test_detect_edits(tmpdir, monkeypatch):
+    from seam.freesurfer.v1 import edits
+    subject = edited_subject(tmpdir, monkeypatch)
+    assert edits.detect_edits(str(subject)) == []
+    # Without a snapshot, files newer than recon-all.done are edits
+    subject.join('mri/brainmask.mgz').write('edited')
+    assert edits.detect_edits(str(subject)) == ['mri/brainmask.mgz']
+    edits.snapshot_edits(str(subject))
+    assert edits.detect_edits(str(subject)) == []
+    # Touched but unchanged isn't an edit
+    later = time.time() + 10
+    os.utime(str(subject.join('mri/wm.mgz')), (later, later))
+    assert edits.detect_edits(str(subject)) == []
+    subject.join('mri/wm.mgz').write('edited')
+    subject.join('tmp/control.dat').write('0 0 0\n', ensure=True)
+    changed = edits.detect_edits(str(subject))
+    assert changed == ['tmp/control.dat', 'mri/wm.mgz']
+    assert edits.edit_stages(changed) == ['-autorecon2-cp', '-autorecon3']
+    assert edits.edit_stages(['mri/brainmask.mgz']) == ['-autorecon-pial']
+    with pytest.raises(ValueError):
+        edits.detect_edits(str(tmpdir.join('unfinished')))
+
+def test_build_edits_recipe(tmpdir, monkeypatch):
+    from seam.freesurfer.v1 import edits
+    subject = edited_subject(tmpdir, monkeypatch)
+    script_dir = str(tmpdir.join('scripts'))
+    assert edits.build_edits_recipe('foo', script_dir) is None
+    subject.join('mri/brainmask.mgz').write('edited')
+    script = edits.build_edits_recipe('foo', script_dir)
+    with open(script) as f:
+        text = f.read()
+    assert "seam_step recon_edits 'recon-all -s foo -autorecon-pial -qcache" \
+        in text
+    assert 'seam_step tkmedit ' in text and 'seam_step tksurfer_rh ' in text
+    # Pial edits don't change the annotations
+    assert 'annot2label' not in text
+    assert text.rstrip().endswith("seam_step snapshot_edits 'seam "
+        "snapshot-edits {}'".format(subject))
+    subject.join('mri/wm.mgz').write('edited')
+    with open(edits.build_edits_recipe('foo', script_dir)) as f:
+        text = f.read()
+    assert '-autorecon2-wm -autorecon3 -qcache' in text
+    assert 'seam_step annot2label_lh ' in text
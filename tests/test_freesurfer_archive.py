@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_freesurfer_archive.py
+
+Tests for pruning and archiving finished subjects
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import stat
+import zipfile
+
+import pytest
+
+from seam.freesurfer.v1 import archive
+from seam.freesurfer import v1
+
+ASEG = '# Title Segmentation Statistics\n' * 200
+
+
+def write_bytes(path, data):
+    path.dirpath().ensure(dir=True)
+    with open(str(path), 'wb') as f:
+        f.write(data)
+
+def make_subject(sd, subject_id='foo'):
+    subject = sd.join(subject_id)
+    subject.join('stats', 'aseg.stats').write(ASEG, ensure=True)
+    for name in ('lh.BA1.label', 'rh.BA1.label', 'lh.cortex.label'):
+        subject.join('label', name).write('#!ascii label\n' + name,
+            ensure=True)
+    write_bytes(subject.join('mri', 'aseg.mgz'), os.urandom(4096))
+    subject.join('mri', 'filled-pretess127.mgz').write('x', ensure=True)
+    subject.join('surf', 'lh.orig.nofix').write('x' * 1000, ensure=True)
+    subject.join('trash', 'old', 'junk').write('x', ensure=True)
+    subject.join('bem').ensure(dir=True)
+    return subject
+
+
+def test_prune_subject(tmpdir):
+    subject = make_subject(tmpdir)
+    removed = archive.prune_subject(str(subject))
+    assert sorted(removed) == ['mri/filled-pretess127.mgz',
+        'surf/lh.orig.nofix', 'trash/old/junk']
+    assert subject.join('stats', 'aseg.stats').check()
+    assert archive.prune_subject(str(subject), ['label/rh.*']) == \
+        ['label/rh.BA1.label']
+
+def test_pack_subject(tmpdir):
+    subject = make_subject(tmpdir.join('subjects'))
+    path = str(tmpdir.join('foo.zip'))
+    archive.pack_subject(str(subject), path, threads=3)
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        infos = dict((info.filename, info) for info in zf.infolist())
+        assert zf.read('foo/stats/aseg.stats').decode() == ASEG
+    # Text is deflated, compressed volumes stored as they are
+    assert infos['foo/stats/aseg.stats'].compress_type == \
+        zipfile.ZIP_DEFLATED
+    assert infos['foo/stats/aseg.stats'].compress_size < len(ASEG)
+    assert infos['foo/mri/aseg.mgz'].compress_type == zipfile.ZIP_STORED
+    # Empty directories are kept
+    assert 'foo/bem/' in infos
+    assert not tmpdir.join('foo.zip.{:d}.tmp'.format(os.getpid())).check()
+
+def test_pack_subject_zip64(tmpdir, monkeypatch):
+    monkeypatch.setattr(archive, '_MAX_ENTRIES', 1)
+    subject = make_subject(tmpdir.join('subjects'))
+    # Dangling, as links into a removed scratch directory can be
+    subject.join('mri', 'orig.mgz').mksymlinkto('/no/such/orig.mgz')
+    path = str(tmpdir.join('foo.zip'))
+    archive.pack_subject(str(subject), path)
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        infos = dict((info.filename, info) for info in zf.infolist())
+        assert zf.read('foo/stats/aseg.stats').decode() == ASEG
+        assert zf.read('foo/mri/orig.mgz') == b'/no/such/orig.mgz'
+    assert stat.S_ISLNK(infos['foo/mri/orig.mgz'].external_attr >> 16)
+    assert 'foo/bem/' in infos
+    assert infos['foo/mri/aseg.mgz'].compress_type == zipfile.ZIP_STORED
+
+def test_pack_subject_zip64_failure(tmpdir, monkeypatch):
+    monkeypatch.setattr(archive, '_MAX_ENTRIES', 1)
+
+    def broken(*args):
+        raise IOError('disk full')
+    monkeypatch.setattr(zipfile.ZipFile, 'write', broken)
+    subject = make_subject(tmpdir.join('subjects'))
+    with pytest.raises(IOError):
+        archive.pack_subject(str(subject), str(tmpdir.join('foo.zip')))
+    assert tmpdir.listdir() == [tmpdir.join('subjects')]
+
+def test_archive_subject(tmpdir):
+    sd = tmpdir.join('subjects')
+    make_subject(sd)
+    path = archive.archive_subject('foo', str(tmpdir.join('archive')),
+        subjects_dir=str(sd), remove=True)
+    assert path == str(tmpdir.join('archive', 'foo.zip'))
+    assert not sd.join('foo').check()
+    with archive.SubjectArchive(path) as subject:
+        assert subject.subject_id == 'foo'
+        assert subject.names('label/*.label') == ['label/lh.BA1.label',
+            'label/lh.cortex.label', 'label/rh.BA1.label']
+        # Pruned
+        assert subject.names('surf/*') == []
+        assert subject.open('stats/aseg.stats').readline() == \
+            b'# Title Segmentation Statistics\n'
+        restored = subject.extract(str(sd))
+    assert restored == str(sd.join('foo'))
+    assert sd.join('foo', 'stats', 'aseg.stats').read() == ASEG
+    assert archive.read_member(path, 'label/rh.BA1.label').endswith(
+        b'rh.BA1.label')
+
+def test_archive_subject_running(tmpdir):
+    sd = tmpdir.join('subjects')
+    make_subject(sd).join('scripts', 'IsRunning.lh+rh').write('',
+        ensure=True)
+    with pytest.raises(ValueError):
+        archive.archive_subject('foo', str(tmpdir.join('archive')),
+            subjects_dir=str(sd))
+    with pytest.raises(ValueError):
+        archive.archive_subject('bar', str(tmpdir.join('archive')),
+            subjects_dir=str(sd))
+
+def test_build_recipe_archive(tmpdir, monkeypatch):
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    written = v1.build_recipe('foo', '/path/to/t1.nii', str(tmpdir),
+        archive_dir='/archive')
+    with open(written[0]) as f:
+        script = f.read()
+    assert "seam_step archive 'seam archive foo /archive --remove'" in script
+    assert script.index('seam_step tksurfer_rh ') < script.index(
+        'seam_step archive ')
+
+def test_archive_cli(tmpdir, monkeypatch, capsys):
+    from seam.cli import main
+    sd = tmpdir.join('subjects')
+    monkeypatch.setenv('SUBJECTS_DIR', str(sd))
+    make_subject(sd)
+    archive_dir = str(tmpdir.join('archive'))
+    main(['archive', 'foo', archive_dir, '--no-prune', '--threads', '2'])
+    path = capsys.readouterr()[0].strip()
+    assert path == os.path.join(archive_dir, 'foo.zip')
+    # Kept without --remove
+    assert sd.join('foo', 'surf', 'lh.orig.nofix').check()
+    main(['archive-read', path, 'stats/aseg.stats'])
+    assert capsys.readouterr()[0] == ASEG
+    with pytest.raises(SystemExit):
+        main(['archive-read', path, 'stats/missing.stats'])
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_freesurfer_environment.py
+
+Tests for the FreeSurfer environment snapshot generated scripts source
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import subprocess
+
+import pytest
+
+from seam.freesurfer.v1 import environment
+from seam.freesurfer import v1
+
+SETUP = """echo "-------- freesurfer-linux-centos7 --------"
+export FSFAST_HOME=$FREESURFER_HOME/fsfast
+export FS_LICENSE="$FREESURFER_HOME/license with spaces.txt"
+if [ -z "$SUBJECTS_DIR" ]; then
+    export SUBJECTS_DIR=$FREESURFER_HOME/subjects
+fi
+export PATH=$FREESURFER_HOME/bin:$FSFAST_HOME/bin:$PATH
+"""
+
+
+@pytest.fixture
+def freesurfer_home(tmpdir, monkeypatch):
+    home = tmpdir.join('freesurfer')
+    home.ensure(dir=True)
+    home.join('SetUpFreeSurfer.sh').write(SETUP)
+    home.join('build-stamp.txt').write('freesurfer-linux-centos7-7.1.1\n')
+    monkeypatch.setenv('FREESURFER_HOME', str(home))
+    return home
+
+def sourced(path, name):
+    out = subprocess.check_output(['bash', '-c',
+        'source "$1" && echo "${}"'.format(name), 'bash', str(path)],
+        env={'PATH': os.environ['PATH']})
+    return out.decode('utf-8').rstrip('\n')
+
+
+def test_capture_environment(freesurfer_home):
+    changed, before = environment.capture_environment()
+    names = [name for name, _ in changed]
+    assert names == sorted(names)
+    assert 'FSFAST_HOME' in names and 'PATH' in names
+    assert 'FREESURFER_HOME' in names
+    assert 'SUBJECTS_DIR' not in names
+    assert before['PATH'] == os.environ['PATH']
+
+def test_write_environment(freesurfer_home, tmpdir):
+    path = tmpdir.join('fs-env.sh')
+    metadata = environment.write_environment(str(path))
+    assert metadata['freesurfer_home'] == str(freesurfer_home)
+    assert metadata['freesurfer_build'] == 'freesurfer-linux-centos7-7.1.1'
+    assert environment.read_environment(str(path)) == metadata
+    text = path.read()
+    # The setup script's output isn't captured
+    assert '--------' not in text
+    assert sourced(path, 'FSFAST_HOME') == freesurfer_home.join('fsfast')
+    assert sourced(path, 'FS_LICENSE') == freesurfer_home.join(
+        'license with spaces.txt')
+    # PATH keeps the value of whoever sources it
+    assert sourced(path, 'PATH') == '{}:{}:{}'.format(
+        freesurfer_home.join('bin'), freesurfer_home.join('fsfast', 'bin'),
+        os.environ['PATH'])
+
+def test_environment_missing_home(freesurfer_home, tmpdir):
+    path = tmpdir.join('fs-env.sh')
+    environment.write_environment(str(path))
+    freesurfer_home.remove()
+    with pytest.raises(subprocess.CalledProcessError):
+        sourced(path, 'FSFAST_HOME')
+
+def test_ensure_environment(freesurfer_home, tmpdir):
+    path = str(tmpdir.join('fs-env.sh'))
+    assert not environment.is_current(path)
+    first = environment.ensure_environment(path)
+    assert environment.is_current(path)
+    # Whole seconds, which survive the round trip on every Python
+    mtime = int(os.stat(path).st_mtime) - 100
+    os.utime(path, (mtime, mtime))
+    assert environment.ensure_environment(path) == first
+    # Not recaptured while current
+    assert os.stat(path).st_mtime == mtime
+    freesurfer_home.join('build-stamp.txt').write('freesurfer-7.2.0\n')
+    assert not environment.is_current(path)
+    assert environment.ensure_environment(path)['freesurfer_build'] == \
+        'freesurfer-7.2.0'
+
+def test_build_recipe_freesurfer_env(freesurfer_home, tmpdir, monkeypatch):
+    from seam.runner.job import script_metadata
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    env_path = str(tmpdir.join('fs-env.sh'))
+    written = v1.build_recipe('foo', '/path/to/t1.nii',
+        str(tmpdir.join('scripts')), freesurfer_env=env_path)
+    metadata = script_metadata(written[0])
+    assert metadata['freesurfer_env'] == env_path
+    assert metadata['freesurfer_home'] == str(freesurfer_home)
+    assert metadata['freesurfer_stamp'] == environment.freesurfer_stamp()
+    with open(written[0]) as f:
+        script = f.read()
+    assert 'source {} || exit 75\n'.format(env_path) in script
+    assert script.index('source ') < script.index('seam_step() {')
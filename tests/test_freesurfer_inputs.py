@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_freesurfer_inputs.py
+
+Tests for recon-all input preparation
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import hashlib
+import warnings
+
+from seam.freesurfer.v1 import inputs
+
+
+def write(path, content):
+    with open(str(path), 'wb') as f:
+        f.write(content)
+    return str(path)
+
+def test_hash_file(tmpdir):
+    content = os.urandom(1024 * 10)
+    path = write(tmpdir.join('t1.nii'), content)
+    known = hashlib.sha1(content).hexdigest()
+    assert inputs.hash_file(path) == known
+    assert inputs.hash_file(path, chunk_size=1000) == known
+
+def test_hash_empty_file(tmpdir):
+    path = write(tmpdir.join('empty.nii'), b'')
+    assert inputs.hash_file(path) == hashlib.sha1(b'').hexdigest()
+
+def test_hash_cache(tmpdir):
+    path = write(tmpdir.join('t1.nii'), b'first')
+    cache_path = str(tmpdir.join('cache.json'))
+    first = inputs.hash_files([path], cache=cache_path)
+    # A cached hash is reused while size & mtime match...
+    cache = inputs.HashCache(cache_path)
+    st = os.stat(path)
+    assert cache.get(path, st) == first[path]
+    # ...and ignored once the file changes
+    write(path, b'second, longer')
+    assert cache.get(path, os.stat(path)) is None
+    assert inputs.hash_files([path], cache=cache)[path] != first[path]
+
+def test_dedupe_inputs(tmpdir):
+    first = write(tmpdir.join('first.nii'), b'same')
+    copy = write(tmpdir.join('copy.nii'), b'same')
+    other = write(tmpdir.join('other.nii'), b'different')
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        kept = inputs.dedupe_inputs([first, copy, other, first])
+    assert kept == [first, other]
+    assert len(caught) == 1
+    assert copy in str(caught[0].message)
+
+def test_dedupe_hashes_same_sizes(tmpdir, monkeypatch):
+    hashed = []
+
+    def hash_file(path):
+        hashed.append(path)
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    monkeypatch.setattr(inputs, 'hash_file', hash_file)
+    first = write(tmpdir.join('first.nii'), b'same')
+    other = write(tmpdir.join('other.nii'), b'diff')
+    longer = write(tmpdir.join('longer.nii'), b'different')
+    assert inputs.dedupe_inputs([first, other, longer]) == \
+        [first, other, longer]
+    # Only files of the same size can match
+    assert sorted(hashed) == sorted([first, other])
+
+def test_dedupe_missing_inputs():
+    data = ['/does/not/exist.nii', '/does/not/exist.nii', '/other.nii']
+    with warnings.catch_warnings(record=True):
+        warnings.simplefilter('always')
+        assert inputs.dedupe_inputs(data) == ['/does/not/exist.nii', '/other.nii']
+    assert inputs.dedupe_inputs('/single.nii') == '/single.nii'
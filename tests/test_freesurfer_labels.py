@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_freesurfer_labels.py
+
+Tests for reading Freesurfer surfaces & annotations and writing labels
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import struct
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from seam.cli import main
+from seam.freesurfer.v1 import formats, labels
+
+COORDS = [(0., 0., 0.), (1., 0., 0.), (0., 1., 0.), (1., 1., 0.5),
+    (2., 1., -1.25)]
+FACES = [(0, 1, 2), (1, 3, 2), (1, 4, 3)]
+# name, rgb; ctab value is r + g << 8 + b << 16
+STRUCTURES = [('Unknown', (25, 5, 25)), ('G_front', (10, 20, 30)),
+    ('S_calc', (200, 100, 50))]
+# Vertex 2 carries a value that isn't in the color table
+VERTEX_STRUCTURES = [1, 2, None, 1, 2]
+
+
+def value(rgb):
+    return rgb[0] + (rgb[1] << 8) + (rgb[2] << 16)
+
+def _string(s):
+    s = s.encode('ascii') + b'\x00'
+    return struct.pack('>i', len(s)) + s
+
+def write_surface(path):
+    with open(str(path), 'wb') as f:
+        f.write(b'\xff\xff\xfe')
+        f.write(b'created by test on today\n\n')
+        f.write(struct.pack('>ii', len(COORDS), len(FACES)))
+        for xyz in COORDS:
+            f.write(struct.pack('>3f', *xyz))
+        for face in FACES:
+            f.write(struct.pack('>3i', *face))
+
+def write_annot(path, new_ctab=True):
+    with open(str(path), 'wb') as f:
+        f.write(struct.pack('>i', len(VERTEX_STRUCTURES)))
+        for vertex, index in enumerate(VERTEX_STRUCTURES):
+            v = value(STRUCTURES[index][1]) if index is not None else 12345
+            f.write(struct.pack('>ii', vertex, v))
+        f.write(struct.pack('>i', 1))
+        if new_ctab:
+            f.write(struct.pack('>ii', -2, len(STRUCTURES)))
+            f.write(_string('colortable.txt'))
+            f.write(struct.pack('>i', len(STRUCTURES)))
+            for index, (name, rgb) in enumerate(STRUCTURES):
+                f.write(struct.pack('>i', index))
+                f.write(_string(name))
+                f.write(struct.pack('>4i', rgb[0], rgb[1], rgb[2], 0))
+        else:
+            f.write(struct.pack('>i', len(STRUCTURES)))
+            f.write(_string('colortable.txt'))
+            for name, rgb in STRUCTURES:
+                f.write(_string(name))
+                f.write(struct.pack('>4i', rgb[0], rgb[1], rgb[2], 0))
+
+def fake_subject(tmpdir, new_ctab=True):
+    subject = tmpdir.mkdir('sub0001')
+    write_surface(subject.mkdir('surf').join('lh.white'))
+    annot = subject.mkdir('label').join('lh.aparc.a2009s.annot')
+    write_annot(annot, new_ctab)
+    return str(annot)
+
+
+def test_read_geometry(tmpdir):
+    write_surface(tmpdir.join('lh.white'))
+    coords, faces = formats.read_geometry(str(tmpdir.join('lh.white')))
+    assert coords.shape == (5, 3)
+    assert np.allclose(coords, COORDS)
+    assert faces.tolist() == [list(face) for face in FACES]
+
+@pytest.mark.parametrize('new_ctab', [True, False])
+def test_read_annot_ctab_formats(tmpdir, new_ctab):
+    annot = fake_subject(tmpdir, new_ctab)
+    vertex_labels, ctab, names = formats.read_annot(annot)
+    assert vertex_labels.tolist() == [1, 2, -1, 1, 2]
+    assert names == ['Unknown', 'G_front', 'S_calc']
+    assert ctab[:, 4].tolist() == [value(rgb) for _, rgb in STRUCTURES]
+
+def test_label_text():
+    text = formats.label_text([1, 3], np.array([[1., 0., 0.],
+        [1., 1., 0.5]]), 'sub0001')
+    assert text == ('#!ascii label  , from subject sub0001 vox2ras=TkReg\n'
+        '2\n'
+        '1  1.000  0.000  0.000 0.0000000000\n'
+        '3  1.000  1.000  0.500 0.0000000000\n')
+
+def test_annot2label(tmpdir):
+    annot = fake_subject(tmpdir)
+    outdir = str(tmpdir.join('labels'))
+    written = labels.annot2label('sub0001', 'lh', annot, outdir,
+        subjects_dir=str(tmpdir))
+    assert [os.path.basename(p) for p in written] == ['lh.G_front.label',
+        'lh.S_calc.label']
+    vertices, coords = formats.read_label(written[1])
+    assert vertices.tolist() == [1, 4]
+    assert np.allclose(coords, [COORDS[1], COORDS[4]])
+
+def test_annot_labels_vertex_mismatch(tmpdir):
+    annot = fake_subject(tmpdir)
+    with open(str(tmpdir.join('sub0001', 'surf', 'lh.white')), 'r+b') as f:
+        f.seek(3 + len(b'created by test on today\n\n'))
+        f.write(struct.pack('>i', 4))
+    with pytest.raises(ValueError):
+        labels.annot_labels(annot, str(tmpdir.join('sub0001', 'surf',
+            'lh.white')))
+
+def test_cli_annot2label(tmpdir, capsys):
+    fake_subject(tmpdir)
+    outdir = tmpdir.join('out')
+    main(['annot2label', 'sub0001', 'aparc.a2009s', str(outdir), '--hemi',
+        'lh', '--subjects-dir', str(tmpdir)])
+    assert sorted(os.listdir(str(outdir))) == ['lh.G_front.label',
+        'lh.S_calc.label']
+    assert 'wrote 2 labels' in capsys.readouterr()[0]
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Test profiling recon-all logs
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+
+from seam.freesurfer.v1 import logs
+
+RECON_LOG = """\
+Sat Jan  4 10:00:00 CST 2014
+/data/subjects/{subject_id}
+/usr/local/freesurfer/bin/recon-all -s {subject_id} -all
+Linux node01 2.6.32-431.el6.x86_64 #1 SMP x86_64 x86_64 x86_64 GNU/Linux
+#--------------------------------------------
+#@# Motion Correction Sat Jan  4 10:00:00 CST 2014
+mri_convert orig/001.mgz orig.mgz
+@#@FSTIME  2014:01:04:10:00:01 mri_convert N 2 e 3.00 S 0.50 U 2.50 P 99% M 1 F 0 R 1 W 0 c 1 w 1 I 0 O 1 L 1.0 1.0 1.0
+@#@FSTIME  2014:01:04:10:00:04 mri_robust_template N 9 e 50.00 S 1.00 U 40.00 P 82% M 1 F 0 R 1 W 0 c 1 w 1 I 0 O 1 L 1.0 1.0 1.0
+#--------------------------------------------
+#@# Talairach Sat Jan  4 10:01:00 CST 2014
+@#@FSTIME  2014:01:04:10:01:01 talairach_avi N 4 e 60.00 S 2.00 U 55.00 P 95% M 1 F 0 R 1 W 0 c 1 w 1 I 0 O 1 L 1.0 1.0 1.0
+{ending}"""
+
+
+def write_log(subjects_dir, subject_id, text, fname='recon-all.log'):
+    scripts = os.path.join(str(subjects_dir), subject_id, 'scripts')
+    if not os.path.isdir(scripts):
+        os.makedirs(scripts)
+    with open(os.path.join(scripts, fname), 'w') as f:
+        f.write(text)
+
+
+def test_parse_date():
+    assert logs.parse_date('Sat Jan  4 10:01:00 CST 2014').isoformat() == \
+        '2014-01-04T10:01:00'
+    assert logs.parse_date('Sat Jan 14 10:01:00 2014').day == 14
+    assert logs.parse_date('not a date') is None
+
+def test_parse_recon_log():
+    text = RECON_LOG.format(subject_id='s1', ending='recon-all -s s1 '
+        'finished without error at Sat Jan  4 10:03:30 CST 2014\n')
+    rows = list(logs.parse_recon_log(text.splitlines(True), 's1'))
+    assert [(r['step'], r['host'], r['run'], r['wall'], r['cpu'],
+        r['commands'], r['status']) for r in rows] == [
+        ('Motion Correction', 'node01', 1, 60.0, 44.0, 2, logs.DONE),
+        ('Talairach', 'node01', 1, 150.0, 57.0, 1, logs.DONE)]
+    assert rows[0]['start'] == '2014-01-04T10:00:00'
+
+def test_restarted_run():
+    # The first run dies mid-step, then the subject is rerun elsewhere
+    first = RECON_LOG.format(subject_id='s1', ending='')
+    second = RECON_LOG.replace('node01', 'node02').replace('Jan  4',
+        'Jan  5').replace('2014:01:04', '2014:01:05').format(subject_id='s1',
+        ending='recon-all -s s1 exited with ERRORS at Sun Jan  5 10:02:00 '
+        'CST 2014\n')
+    rows = list(logs.parse_recon_log((first + second).splitlines(True)))
+    assert [(r['step'], r['host'], r['run'], r['wall'], r['status'])
+        for r in rows] == [
+        ('Motion Correction', 'node01', 1, 60.0, logs.DONE),
+        ('Talairach', 'node01', 1, 61.0, logs.INCOMPLETE),
+        ('Motion Correction', 'node02', 2, 60.0, logs.DONE),
+        ('Talairach', 'node02', 2, 60.0, logs.ERROR)]
+
+def test_profile_subjects_dir(tmpdir):
+    for sid in ('s1', 's2', 's3'):
+        write_log(tmpdir, sid, RECON_LOG.format(subject_id=sid, ending=''))
+    # Only a status log: wall time but no CPU time or host
+    write_log(tmpdir, 's4', '#@# Motion Correction Sat Jan  4 10:00:00 CST '
+        '2014\n#@# Talairach Sat Jan  4 10:01:00 CST 2014\n',
+        fname='recon-all-status.log')
+    os.makedirs(str(tmpdir.join('fsaverage')))
+    results = list(logs.profile_subjects_dir(str(tmpdir), processes=2,
+        chunksize=1))
+    assert [rows[0]['subject_id'] for rows in results] == ['s1', 's2', 's3',
+        's4']
+    assert (results[3][0]['wall'], results[3][0]['cpu'],
+        results[3][0]['host']) == (60.0, None, None)
+    # Cut off at the end of the log, up to the end of its last command
+    assert [(r['wall'], r['status']) for r in results[0]] == [
+        (60.0, logs.DONE), (61.0, logs.INCOMPLETE)]
+    columns = logs.to_columns(results)
+    assert columns['step'].count('Talairach') == 4
+
+def test_profile_cli(tmpdir, capsys):
+    from seam.cli import main
+    write_log(tmpdir, 's1', RECON_LOG.format(subject_id='s1', ending=''))
+    out = str(tmpdir.join('profile.tsv'))
+    main(['profile', str(tmpdir), '-o', out])
+    with open(out) as f:
+        lines = [line.rstrip('\n').split('\t') for line in f]
+    assert lines[0] == list(logs.COLUMNS)
+    assert lines[1] == ['s1', '1', 'Motion Correction', 'node01',
+        '2014-01-04T10:00:00', '60.00', '44.00', '2', 'done']
+    assert lines[2][5:] == ['61.00', '57.00', '1', 'incomplete']
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_freesurfer_morphometry.py
+
+Tests for memory-mapped per-vertex maps & cohort stacking
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import gzip
+import struct
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from seam.freesurfer.v1 import formats, morphometry
+
+
+def write_curv(path, values):
+    with open(str(path), 'wb') as f:
+        f.write(b'\xff\xff\xff')
+        f.write(struct.pack('>iii', len(values), 2 * len(values), 1))
+        f.write(np.asarray(values, '>f4').tobytes())
+
+def mgh_bytes(data, voxel_size=(1., 1., 1.)):
+    data = np.asarray(data, '>f4')
+    dims = data.shape + (1,) * (4 - data.ndim)
+    header = struct.pack('>7ih', 1, dims[0], dims[1], dims[2], dims[3], 3, 0,
+        1)
+    ras = struct.pack('>15f', *(list(voxel_size) + [-1, 0, 0, 0, 0, -1, 0, 1,
+        0, 1, 2, 3]))
+    header += ras
+    header += b'\x00' * (formats.MGH_HEADER_SIZE - len(header))
+    return header + data.reshape(-1, order='F').tobytes()
+
+def write_mgh(path, data, **kwargs):
+    path = str(path)
+    opener = gzip.open if path.endswith('.mgz') else open
+    with opener(path, 'wb') as f:
+        f.write(mgh_bytes(data, **kwargs))
+
+
+def test_read_morph_data(tmpdir):
+    path = tmpdir.join('lh.thickness')
+    write_curv(path, [1.5, 2.25, 3.])
+    values = formats.read_morph_data(str(path))
+    assert isinstance(values, np.memmap)
+    assert values.tolist() == [1.5, 2.25, 3.]
+    assert formats.read_morph_data(str(path), mmap=False).tolist() == [1.5,
+        2.25, 3.]
+
+def test_read_morph_data_not_curv(tmpdir):
+    path = tmpdir.join('lh.white')
+    with open(str(path), 'wb') as f:
+        f.write(b'\xff\xff\xfe' + b'\x00' * 12)
+    with pytest.raises(ValueError):
+        formats.read_morph_data(str(path))
+
+@pytest.mark.parametrize('ext', ['mgh', 'mgz'])
+def test_read_mgh(tmpdir, ext):
+    volume = np.arange(24, dtype=np.float32).reshape(2, 3, 4)
+    path = str(tmpdir.join('vol.' + ext))
+    write_mgh(path, volume, voxel_size=(1., 1., 2.))
+    data, header = formats.read_mgh(path)
+    assert header['dims'] == (2, 3, 4, 1)
+    assert header['voxel_size'] == (1., 1., 2.)
+    assert header['Mdc'][:, 0].tolist() == [-1, 0, 0]
+    assert header['c_ras'].tolist() == [1, 2, 3]
+    assert np.array_equal(data[..., 0], volume)
+    assert isinstance(data, np.memmap) == (ext == 'mgh')
+    assert formats.read_mgh_header(path)['dims'] == (2, 3, 4, 1)
+
+def test_morph_path():
+    assert morphometry.morph_path('s1', 'area', 'rh', '/sd') == \
+        '/sd/s1/surf/rh.area'
+    assert morphometry.morph_path('s1', 'area', 'rh', '/sd', fwhm=5,
+        target='fsaverage5') == '/sd/s1/surf/rh.area.fwhm5.fsaverage5.mgh'
+
+def test_stack_cohort(tmpdir):
+    rows = np.random.RandomState(0).rand(5, 7).astype(np.float32)
+    paths = []
+    for i, row in enumerate(rows):
+        # Mix both formats in one cohort
+        if i % 2:
+            path = str(tmpdir.join('s{}.mgh'.format(i)))
+            write_mgh(path, row)
+        else:
+            path = str(tmpdir.join('s{}.thickness'.format(i)))
+            write_curv(path, row)
+        paths.append(path)
+    out = str(tmpdir.join('cohort.npy'))
+    matrix = morphometry.stack_cohort(paths, out, threads=3)
+    assert matrix.shape == (5, 7)
+    assert np.array_equal(matrix, rows)
+    assert np.array_equal(np.load(out), rows)
+
+def test_stack_cohort_mismatch(tmpdir):
+    write_curv(tmpdir.join('a'), [1., 2., 3.])
+    write_curv(tmpdir.join('b'), [1., 2.])
+    with pytest.raises(ValueError):
+        morphometry.stack_cohort([str(tmpdir.join('a')),
+            str(tmpdir.join('b'))], str(tmpdir.join('out.npy')))
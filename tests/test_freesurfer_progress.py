@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Test following recon-all progress
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import time
+from datetime import datetime, timedelta
+
+from seam.freesurfer.v1 import logs, progress
+
+from test_freesurfer_logs import write_log
+
+DONE_LOG = """\
+#@# Motion Correction Sat Jan  4 10:00:00 CST 2014
+#@# Talairach Sat Jan  4 10:10:00 CST 2014
+#@# Nu Intensity Correction Sat Jan  4 10:40:00 CST 2014
+#@#%# recon-all-run-time-hours 0.833
+recon-all -s done1 finished without error at Sat Jan  4 10:50:00 CST 2014
+"""
+
+
+def lock(subjects_dir, subject_id):
+    "What recon-all holds while it runs"
+    path = os.path.join(str(subjects_dir), subject_id, 'scripts',
+        'IsRunning.lh+rh')
+    open(path, 'w').close()
+    return path
+
+def append(subjects_dir, subject_id, text):
+    path = os.path.join(str(subjects_dir), subject_id, 'scripts',
+        progress.STATUS_LOG)
+    with open(path, 'a') as f:
+        f.write(text)
+
+
+def test_step_history():
+    history = progress.StepHistory([
+        {'subject_id': 'a', 'run': 1, 'step': 'x', 'wall': 10.0,
+            'status': logs.DONE},
+        {'subject_id': 'a', 'run': 1, 'step': 'y', 'wall': 100.0,
+            'status': logs.DONE},
+        {'subject_id': 'b', 'run': 1, 'step': 'x', 'wall': 30.0,
+            'status': logs.DONE},
+        {'subject_id': 'b', 'run': 1, 'step': 'y', 'wall': 5.0,
+            'status': logs.INCOMPLETE}])
+    assert history.order == ['x', 'y']
+    assert history.expected('x') == 20.0
+    assert history.remaining('x', 5) == 115.0
+    assert history.remaining('x', 50) == 100.0
+    assert history.remaining('z', 0) is None
+
+def test_status_log_reads_only_appended(tmpdir):
+    write_log(tmpdir, 's1', '#@# Motion Correction Sat Jan  4 10:00:00 CST '
+        '2014\n#@# Talair', fname=progress.STATUS_LOG)
+    log = progress.StatusLog(str(tmpdir.join('s1', 'scripts',
+        progress.STATUS_LOG)))
+    assert log.poll()
+    assert log.step == 'Motion Correction'
+    offset = log.offset
+    # Nothing new: not even opened
+    assert not log.poll()
+    append(tmpdir, 's1', 'ach Sat Jan  4 10:10:00 CST 2014\n')
+    assert log.poll()
+    assert log.offset > offset
+    assert (log.step, log.status) == ('Talairach', None)
+    assert log.finished == [('Motion Correction', 600.0)]
+
+def test_progress_eta(tmpdir, capsys):
+    write_log(tmpdir, 'done1', DONE_LOG, fname=progress.STATUS_LOG)
+    write_log(tmpdir, 'run1', '#@# Motion Correction Sun Jan  5 09:00:00 CST '
+        '2014\n#@# Talairach Sun Jan  5 09:10:00 CST 2014\n',
+        fname=progress.STATUS_LOG)
+    lock(tmpdir, 'run1')
+    os.makedirs(str(tmpdir.join('fsaverage')))
+    watch = progress.Progress(str(tmpdir))
+    now = datetime(2014, 1, 5, 9, 20)
+    watch.poll(now)
+    rows = dict((r['subject_id'], r) for r in watch.subjects())
+    assert sorted(rows) == ['done1', 'run1']
+    assert rows['done1']['status'] == logs.DONE
+    # 20 of Talairach's 30 minutes left, then 10 of Nu Intensity Correction
+    assert rows['run1']['elapsed'] == 600
+    assert rows['run1']['remaining'] == 1800
+    assert watch.eta() == datetime(2014, 1, 5, 9, 50)
+    assert watch.text().splitlines() == ['run1\tTalairach\t0h10m\t0h30m',
+        '1 running, 1 done, 0 failed; ETA 2014-01-05 09:50 (in 0h30m)']
+
+    append(tmpdir, 'run1', 'recon-all -s run1 exited with ERRORS at Sun Jan  5 '
+        '09:21:00 CST 2014\n')
+    watch.poll(now)
+    assert watch.eta() is None
+    assert watch.text() == '0 running, 1 done, 1 failed'
+
+def test_progress_cohort_eta(tmpdir):
+    write_log(tmpdir, 'done1', DONE_LOG, fname=progress.STATUS_LOG)
+    write_log(tmpdir, 'run1', '#@# Talairach Sun Jan  5 09:10:00 CST 2014\n',
+        fname=progress.STATUS_LOG)
+    lock(tmpdir, 'run1')
+    # Set up by recon-all -i, and not even that
+    tmpdir.join('new1', 'mri', 'orig', '001.mgz').write('', ensure=True)
+    os.makedirs(str(tmpdir.join('fsaverage', 'mri')))
+    now = datetime(2014, 1, 5, 9, 20)
+    watch = progress.Progress(str(tmpdir), subject_ids=['run1', 'new2'])
+    watch.poll(now)
+    assert watch.pending == set(['new1', 'new2'])
+    assert watch.history.total() == 50 * 60
+    # One at a time, as now: run1's 30 minutes, then two whole runs
+    assert watch.eta() == now + timedelta(minutes=130)
+    assert watch.text().splitlines()[-1] == ('1 running, 1 done, 0 failed, '
+        '2 pending; ETA 2014-01-05 11:30 (in 2h10m)')
+    watch.slots = 2
+    assert watch.eta() == now + timedelta(minutes=80)
+    # Once run1 is done, the cohort still has work left
+    append(tmpdir, 'run1', '#@# Nu Intensity Correction Sun Jan  5 09:40:00 '
+        'CST 2014\n#@#%# recon-all-run-time-hours 0.5\nrecon-all -s run1 '
+        'finished without error at Sun Jan  5 09:50:00 CST 2014\n')
+    later = datetime(2014, 1, 5, 9, 50)
+    watch.poll(later)
+    assert watch.eta() == later + timedelta(minutes=50)
+
+def test_progress_stalled(tmpdir):
+    write_log(tmpdir, 'done1', DONE_LOG, fname=progress.STATUS_LOG)
+    for sid in ('run1', 'killed', 'quiet'):
+        write_log(tmpdir, sid, '#@# Talairach Sun Jan  5 09:10:00 CST '
+            '2014\n', fname=progress.STATUS_LOG)
+    lock(tmpdir, 'run1')
+    lock(tmpdir, 'quiet')
+    log = str(tmpdir.join('quiet', 'scripts', progress.STATUS_LOG))
+    watch = progress.Progress(str(tmpdir))
+    now = datetime.now()
+    # Talairach is expected to take 30 minutes, 'quiet' hasn't logged
+    # anything for two hours
+    old = time.mktime(now.timetuple()) - 2 * 3600
+    os.utime(log, (old, old))
+    watch.poll(now)
+    rows = dict((r['subject_id'], r) for r in watch.subjects())
+    assert rows['run1']['status'] == progress.RUNNING
+    # Killed, so its lock is gone
+    assert rows['killed']['status'] == progress.STALLED
+    assert rows['quiet']['status'] == progress.STALLED
+    assert rows['quiet']['remaining'] is None
+    # Left out of the ETA, run1 has Nu Intensity Correction to go
+    assert watch.eta() == now + timedelta(minutes=10)
+    assert watch.text().splitlines()[-1].startswith(
+        '1 running, 1 done, 0 failed, 2 stalled; ETA')
+
+def test_progress_cli(tmpdir, capsys):
+    from seam.cli import main
+    write_log(tmpdir, 's1', DONE_LOG, fname=progress.STATUS_LOG)
+    main(['progress', str(tmpdir), '--once'])
+    assert capsys.readouterr()[0] == '0 running, 1 done, 0 failed\n'
+    manifest = tmpdir.join('batch.csv')
+    manifest.write('subject_id,input\ns1,/d/1.nii\ns2,/d/2.nii\n')
+    main(['progress', str(tmpdir), '--once', '--manifest', str(manifest),
+        '--slots', '4'])
+    assert capsys.readouterr()[0].startswith(
+        '0 running, 1 done, 0 failed, 1 pending; ETA ')
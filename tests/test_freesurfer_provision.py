@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_freesurfer_provision.py
+
+Tests for sharing template subjects across a SUBJECTS_DIR
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import errno
+import subprocess
+from multiprocessing import Pool
+
+import pytest
+
+from seam.util import which
+from seam.freesurfer.v1 import provision, template_link_cmd
+
+
+def fake_freesurfer_home(tmpdir):
+    "A FREESURFER_HOME with just enough of fsaverage to link"
+    home = tmpdir.mkdir('freesurfer')
+    surf = home.mkdir('subjects').mkdir('fsaverage').mkdir('surf')
+    surf.join('lh.white').write('white')
+    surf.join('rh.white').write('white')
+    return str(home)
+
+def test_template_source(tmpdir):
+    home = fake_freesurfer_home(tmpdir)
+    expected = os.path.join(home, 'subjects', 'fsaverage')
+    assert provision.template_source(freesurfer_home=home) == expected
+
+def test_provision_symlink(tmpdir):
+    home = fake_freesurfer_home(tmpdir)
+    sd = str(tmpdir.join('subjects'))
+    dest = provision.provision_template(sd, freesurfer_home=home)
+    assert os.path.islink(dest)
+    assert os.path.isfile(os.path.join(dest, 'surf', 'lh.white'))
+    # Provisioning again is a no-op
+    assert provision.provision_template(sd, freesurfer_home=home) == dest
+
+def test_provision_hardlink(tmpdir):
+    home = fake_freesurfer_home(tmpdir)
+    sd = str(tmpdir.mkdir('subjects'))
+    dest = provision.provision_template(sd, freesurfer_home=home,
+        mode='hardlink')
+    assert not os.path.islink(dest)
+    linked = os.path.join(dest, 'surf', 'lh.white')
+    src = os.path.join(home, 'subjects', 'fsaverage', 'surf', 'lh.white')
+    assert os.stat(linked).st_ino == os.stat(src).st_ino
+
+def test_provision_copies_across_devices(tmpdir, monkeypatch):
+    def cross_device(src, dst):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+    monkeypatch.setattr(os, 'link', cross_device)
+    home = fake_freesurfer_home(tmpdir)
+    home_surf = os.path.join(home, 'subjects', 'fsaverage', 'surf')
+    os.symlink('lh.white', os.path.join(home_surf, 'lh.smoothwm'))
+    sd = str(tmpdir.mkdir('subjects'))
+    dest = provision.provision_template(sd, freesurfer_home=home,
+        mode='hardlink')
+    assert open(os.path.join(dest, 'surf', 'rh.white')).read() == 'white'
+    assert os.readlink(os.path.join(dest, 'surf', 'lh.smoothwm')) == \
+        'lh.white'
+
+def test_provision_failure_cleans_up(tmpdir, monkeypatch):
+    def broken(src, dst):
+        raise OSError('disk full')
+    monkeypatch.setattr(provision, '_link_or_copy', broken)
+    home = fake_freesurfer_home(tmpdir)
+    sd = str(tmpdir.mkdir('subjects'))
+    with pytest.raises(OSError):
+        provision.provision_template(sd, freesurfer_home=home,
+            mode='hardlink')
+    assert os.listdir(sd) == ['.fsaverage.lock']
+
+def test_provision_bad_mode(tmpdir):
+    with pytest.raises(ValueError):
+        provision.provision_template(str(tmpdir), mode='copy')
+
+def _provision(args):
+    sd, home = args
+    return provision.provision_template(sd, freesurfer_home=home,
+        mode='hardlink')
+
+def test_provision_concurrent(tmpdir):
+    home = fake_freesurfer_home(tmpdir)
+    sd = str(tmpdir.mkdir('subjects'))
+    pool = Pool(4)
+    try:
+        results = pool.map(_provision, [(sd, home)] * 16)
+    finally:
+        pool.close()
+        pool.join()
+    assert set(results) == set([os.path.join(sd, 'fsaverage')])
+    # No leftover partial trees
+    assert sorted(os.listdir(sd)) == ['.fsaverage.lock', 'fsaverage']
+
+def test_template_link_cmd():
+    cmd = template_link_cmd('/sd', mode='hardlink')
+    assert cmd.startswith('flock /sd/.fsaverage.lock')
+    assert 'cp -al "$FREESURFER_HOME"/subjects/fsaverage' in cmd
+    with pytest.raises(ValueError):
+        template_link_cmd('/sd', mode='copy')
+
+@pytest.mark.skipif("not which('flock')")
+def test_template_link_cmd_runs(tmpdir):
+    home = fake_freesurfer_home(tmpdir)
+    sd = str(tmpdir.mkdir('subjects'))
+    env = dict(os.environ, FREESURFER_HOME=home)
+    # Quotes in the path survive the flock -c command
+    odd = str(tmpdir.mkdir('it\'s "odd" $HOME'))
+    for path in (sd, odd):
+        for mode in ('symlink', 'hardlink'):
+            for _ in range(2):
+                subprocess.check_call(template_link_cmd(path, mode=mode),
+                    shell=True, env=env)
+            assert os.path.isfile(os.path.join(path, 'fsaverage', 'surf',
+                'rh.white'))
+            subprocess.check_call(['rm', '-rf', os.path.join(path,
+                'fsaverage')])
+
+@pytest.mark.skipif("not which('flock')")
+def test_template_link_cmd_cleans_up(tmpdir):
+    sd = str(tmpdir.mkdir('subjects'))
+    env = dict(os.environ, FREESURFER_HOME=str(tmpdir.join('missing')))
+    assert subprocess.call(template_link_cmd(sd, mode='hardlink'),
+        shell=True, env=env) != 0
+    assert os.listdir(sd) == ['.fsaverage.lock']
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_freesurfer_screenshots.py
+
+Tests for screenshot post-processing
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+
+from seam import images
+from seam.freesurfer.v1 import screenshots
+
+from test_images import gradient, write_tiff
+
+
+def fake_screenshots(ss_dir):
+    for i in (5, 15, 105):
+        write_tiff(ss_dir.join('tkmedit-{}.tiff'.format(i)), gradient(40, 30))
+    for view in ('lateral', 'medial'):
+        write_tiff(ss_dir.join('lh-{}.tiff'.format(view)), gradient(20, 20))
+    return str(ss_dir)
+
+def test_list_tiffs(tmpdir):
+    ss_dir = fake_screenshots(tmpdir)
+    assert screenshots.list_tiffs(ss_dir) == ['tkmedit-5.tiff',
+        'tkmedit-15.tiff', 'tkmedit-105.tiff', 'lh-lateral.tiff',
+        'lh-medial.tiff']
+
+def test_postprocess_screenshots(tmpdir):
+    ss_dir = fake_screenshots(tmpdir)
+    written = screenshots.postprocess_screenshots(ss_dir, columns=3, scale=2,
+        processes=2)
+    assert len(written) == 6
+    assert written[-1] == os.path.join(ss_dir, 'contact-sheet.png')
+    converted = images.read_png(os.path.join(ss_dir, 'tkmedit-15.png'))
+    assert converted.data == gradient(40, 30).data
+    sheet = images.read_png(written[-1])
+    assert (sheet.width, sheet.height) == (60, 30)
+    # TIFFs are kept unless asked otherwise
+    assert len(screenshots.list_tiffs(ss_dir)) == 5
+
+def test_postprocess_delete_tiffs(tmpdir):
+    ss_dir = fake_screenshots(tmpdir)
+    screenshots.postprocess_screenshots(ss_dir, contact_sheet=False,
+        delete_tiffs=True, processes=2)
+    assert screenshots.list_tiffs(ss_dir) == []
+    assert sorted(os.listdir(ss_dir))[0] == 'lh-lateral.png'
+    # Nothing left to convert
+    assert screenshots.postprocess_screenshots(ss_dir, contact_sheet=False) \
+        == []
+
+def test_postprocess_native_pngs(tmpdir):
+    for i in (5, 15):
+        images.write_png(str(tmpdir.join('tkmedit-{}.png'.format(i))),
+            gradient(40, 30))
+    images.write_png(str(tmpdir.join('lh-lateral.png')), gradient(20, 20))
+    ss_dir = str(tmpdir)
+    assert screenshots.list_images(ss_dir) == ['tkmedit-5.png',
+        'tkmedit-15.png', 'lh-lateral.png']
+    # Already PNGs, so only the contact sheet is written
+    written = screenshots.postprocess_screenshots(ss_dir, columns=3, scale=2)
+    assert written == [os.path.join(ss_dir, 'contact-sheet.png')]
+    sheet = images.read_png(written[-1])
+    assert (sheet.width, sheet.height) == (60, 15)
+    # The sheet isn't an input the next time
+    assert 'contact-sheet.png' not in screenshots.list_images(ss_dir)
+
+def test_postprocess_cmd():
+    cmd = screenshots.postprocess_cmd('/path/foo_screenshots')
+    assert cmd == 'seam screenshots /path/foo_screenshots --format png'
+    cmd = screenshots.postprocess_cmd('/path/x; rm -rf $HOME/foo_screenshots')
+    assert cmd == ("seam screenshots '/path/x; rm -rf $HOME/foo_screenshots' "
+        "--format png")
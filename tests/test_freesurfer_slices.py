@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_freesurfer_slices.py
+
+Tests for rendering QC slices without tkmedit
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import struct
+import zlib
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from seam.freesurfer.v1 import slices
+from test_freesurfer_morphometry import write_mgh
+
+# A tetrahedron around the middle of a 16 voxel cube (tkregister RAS)
+COORDS = [(0., 0., 4.), (-4., 0., -3.), (4., -4., -3.), (4., 4., -3.)]
+FACES = [(0, 1, 2), (0, 2, 3), (0, 3, 1), (1, 3, 2)]
+
+
+def write_surface(path, coords=COORDS, faces=FACES):
+    with open(str(path), 'wb') as f:
+        f.write(b'\xff\xff\xfe')
+        f.write(b'created by test on today\n\n')
+        f.write(struct.pack('>ii', len(coords), len(faces)))
+        for xyz in coords:
+            f.write(struct.pack('>3f', *xyz))
+        for face in faces:
+            f.write(struct.pack('>3i', *face))
+
+def read_png(path):
+    with open(str(path), 'rb') as f:
+        data = f.read()
+    assert data.startswith(b'\x89PNG\r\n\x1a\n')
+    width, height = struct.unpack('>II', data[16:24])
+    pos, idat = 8, b''
+    while pos < len(data):
+        length, = struct.unpack('>I', data[pos:pos + 4])
+        if data[pos + 4:pos + 8] == b'IDAT':
+            idat += data[pos + 8:pos + 8 + length]
+        pos += length + 12
+    raw = np.frombuffer(zlib.decompress(idat), np.uint8)
+    rows = raw.reshape(height, width * 3 + 1)
+    assert not rows[:, 0].any()
+    return rows[:, 1:].reshape(height, width, 3)
+
+def make_subject(sd, subject_id='foo'):
+    mri = sd.join(subject_id, 'mri')
+    mri.ensure(dir=True)
+    volume = np.zeros((16, 16, 16), np.float32)
+    volume[4:12, 4:12, 4:12] = 100
+    write_mgh(mri.join('brain.finalsurfs.mgz'), volume)
+    seg = np.zeros((16, 16, 16), np.float32)
+    seg[4:8, 4:12, 4:12] = 17
+    write_mgh(mri.join('aseg.mgz'), seg)
+    surf = sd.join(subject_id, 'surf')
+    surf.ensure(dir=True)
+    write_surface(surf.join('lh.white'))
+    return sd.join(subject_id)
+
+
+def test_ras_axes():
+    # Conformed (LIA) volumes
+    Mdc = np.array([[-1, 0, 0], [0, 0, 1], [0, -1, 0]])
+    assert slices.ras_axes(Mdc) == ([0, 2, 1], [True, False, True])
+    data = np.arange(8).reshape(2, 2, 2)
+    ras = slices.to_ras(data, Mdc)
+    # Voxel (1, 1, 0) is right-most, superior & anterior
+    assert ras[0, 0, 0] == data[1, 1, 0]
+
+def test_surface_voxels():
+    header = {'dims': (16, 16, 16, 1), 'voxel_size': (1., 1., 1.),
+        'Mdc': np.array([[-1, 0, 0], [0, 0, 1], [0, -1, 0]], np.float64)}
+    vox = slices.surface_voxels(np.array([[0., 0., 0.], [3., 2., 1.]]),
+        header)
+    # The centre voxel (8, 8, 8), with the flipped R & S axes reversed
+    assert vox[0].tolist() == [7., 8., 7.]
+    # Moving right, anterior & superior increases each axis
+    assert (vox[1] - vox[0]).tolist() == [3., 2., 1.]
+
+def test_slice_segments():
+    vox = np.array(COORDS)
+    faces = np.array(FACES)
+    segments = slices.slice_segments(vox, faces, 2, 0.)
+    # The plane cuts the three side faces, not the base
+    assert segments.shape == (3, 2, 2)
+    assert len(slices.slice_segments(vox, faces, 2, 10.)) == 0
+
+def test_blend():
+    gray = np.full((2, 2), 100.)
+    labels = np.array([[0, 17], [999, 17]])
+    lut = slices._lut_array({17: (220, 216, 20)})
+    rgb = slices.blend(gray, labels, lut, alpha=0.5)
+    assert rgb[0, 0].tolist() == [100, 100, 100]
+    assert rgb[0, 1].tolist() == [160, 158, 60]
+    assert rgb[1, 0].tolist() == [100, 100, 100]
+
+def test_read_lut(tmpdir):
+    path = tmpdir.join('lut.txt')
+    path.write('#No. Label Name: R G B A\n\n'
+        '0   Unknown        0   0   0   0\n'
+        '17  Left-Hippocampus 220 216 20 0\n')
+    lut = slices.read_lut(str(path))
+    assert lut.shape == (18, 3)
+    assert lut[17].tolist() == [220, 216, 20]
+
+def test_render_slices(tmpdir, monkeypatch):
+    monkeypatch.delenv('FREESURFER_HOME', raising=False)
+    sd = tmpdir.join('subjects')
+    make_subject(sd)
+    outdir = tmpdir.join('shots')
+    written = slices.render_slices('foo', str(outdir), subjects_dir=str(sd),
+        slices=(8, 100), scale=2, threads=2)
+    assert written == [str(outdir.join('tkmedit-8.png'))]
+    rgb = read_png(written[0])
+    assert rgb.shape == (32, 32, 3)
+    colors = set(map(tuple, rgb.reshape(-1, 3).tolist()))
+    assert (0, 0, 0) in colors
+    # The white surface outline
+    assert slices.SURFACE_COLORS['white'] in colors
+    # Hippocampus blended over the brain
+    assert any(r > g > b > 0 for r, g, b in colors)
+
+def test_render_slices_cli(tmpdir, monkeypatch, capsys):
+    from seam.cli import main
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    make_subject(tmpdir.join('subjects'))
+    outdir = str(tmpdir.join('shots'))
+    main(['render-slices', 'foo', outdir, '--orientation', 'axial'])
+    # Only slices 5 and 15 fit the volume
+    assert sorted(os.listdir(outdir)) == ['tkmedit-15.png', 'tkmedit-5.png']
+    assert 'wrote 2 slices' in capsys.readouterr()[0]
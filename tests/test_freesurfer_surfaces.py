@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_freesurfer_surfaces.py
+
+Tests for rendering surface views without tksurfer
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import struct
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from seam.freesurfer.v1 import surfaces
+from test_freesurfer_labels import value, _string
+from test_freesurfer_slices import write_surface, read_png
+
+# An octahedron, outward facing
+COORDS = [(-10., 0., 0.), (10., 0., 0.), (0., -10., 0.), (0., 10., 0.),
+    (0., 0., -10.), (0., 0., 10.)]
+FACES = [(5, 2, 1), (5, 1, 3), (5, 3, 0), (5, 0, 2), (4, 1, 2), (4, 3, 1),
+    (4, 0, 3), (4, 2, 0)]
+# Lateral (x < 0 for lh) vertex in one structure, the rest in another
+LATERAL, MEDIAL = (200, 100, 50), (10, 20, 30)
+STRUCTURES = [('Unknown', (25, 5, 25)), ('G_front', MEDIAL),
+    ('S_calc', LATERAL)]
+VERTEX_STRUCTURES = [2, 1, 1, 1, 1, 1]
+
+
+def write_annot(path):
+    with open(str(path), 'wb') as f:
+        f.write(struct.pack('>i', len(VERTEX_STRUCTURES)))
+        for vertex, index in enumerate(VERTEX_STRUCTURES):
+            f.write(struct.pack('>ii', vertex, value(STRUCTURES[index][1])))
+        f.write(struct.pack('>i', 1))
+        f.write(struct.pack('>ii', -2, len(STRUCTURES)))
+        f.write(_string('colortable.txt'))
+        f.write(struct.pack('>i', len(STRUCTURES)))
+        for index, (name, rgb) in enumerate(STRUCTURES):
+            f.write(struct.pack('>i', index))
+            f.write(_string(name))
+            f.write(struct.pack('>4i', rgb[0], rgb[1], rgb[2], 0))
+
+def make_subject(sd, subject_id='foo'):
+    for hemi in ('lh', 'rh'):
+        sd.join(subject_id, 'surf').ensure(dir=True)
+        sd.join(subject_id, 'label').ensure(dir=True)
+        write_surface(sd.join(subject_id, 'surf',
+            '{}.inflated'.format(hemi)), COORDS, FACES)
+        write_annot(sd.join(subject_id, 'label',
+            '{}.aparc.a2009s.annot'.format(hemi)))
+
+def colors(rgb):
+    return set(map(tuple, rgb.reshape(-1, 3).tolist()))
+
+
+def test_rasterize():
+    renderer = surfaces.SurfaceRenderer(np.array(COORDS), np.array(FACES),
+        'lh', size=20)
+    pixels, tris, weights = renderer.rasterize('lateral')
+    assert len(np.unique(pixels)) == len(pixels)
+    # Seen from the left, the faces toward +x only show at the silhouette
+    # (x = 0), where they tie with the front
+    x = (np.array(COORDS)[np.array(FACES)[tris], 0] * weights).sum(axis=1)
+    assert (x < 1e-6).all()
+    front = np.isin(tris, [2, 3, 6, 7])
+    assert front.sum() > 3 * (~front).sum()
+    assert np.allclose(weights.sum(axis=1), 1)
+    # Rasterized once per view
+    assert renderer.rasterize('lateral') is renderer.rasterize('lateral')
+
+def test_render_views():
+    renderer = surfaces.SurfaceRenderer(np.array(COORDS), np.array(FACES),
+        'lh', size=40)
+    annot = np.array([LATERAL] + [MEDIAL] * 5, np.uint8)
+    lateral = renderer.render('lateral', annot)
+    medial = renderer.render('medial', annot)
+    assert lateral.shape == (40, 40, 3)
+    # Background stays black
+    assert lateral[0, 0].tolist() == [0, 0, 0]
+    # The lateral vertex's structure shows on the lateral view only
+    assert any(r > g > b for r, g, b in colors(lateral))
+    assert not any(r > g > b for r, g, b in colors(medial))
+    plain = renderer.render('lateral')
+    assert all(r == g == b for r, g, b in colors(plain))
+
+def test_curvature_colors():
+    grays = surfaces.curvature_colors(np.array([-1., 0.5]), 2)
+    assert grays[:, 0].tolist() == [surfaces.GYRUS_GRAY,
+        surfaces.SULCUS_GRAY]
+
+def test_render_surfaces(tmpdir):
+    sd = tmpdir.join('subjects')
+    make_subject(sd)
+    outdir = tmpdir.join('shots')
+    written = surfaces.render_surfaces('foo', str(outdir),
+        subjects_dir=str(sd), size=32)
+    names = sorted(os.path.basename(p) for p in written)
+    assert names == sorted('{}-{}.png'.format(hemi, view)
+        for hemi in ('lh', 'rh') for view in ('lateral', 'medial',
+        'annot-lateral', 'annot-medial'))
+    assert read_png(outdir.join('rh-annot-medial.png')).shape == (32, 32, 3)
+
+def test_render_surfaces_cli(tmpdir, monkeypatch, capsys):
+    from seam.cli import main
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.join('subjects')))
+    make_subject(tmpdir.join('subjects'))
+    outdir = str(tmpdir.join('shots'))
+    main(['render-surfaces', 'foo', outdir, '--hemi', 'lh', '--annot',
+        'aparc.a2009s', '--annot', 'aparc', '--size', '16'])
+    # aparc doesn't exist, so it's skipped
+    assert sorted(os.listdir(outdir)) == ['lh-annot-lateral.png',
+        'lh-annot-medial.png', 'lh-lateral.png', 'lh-medial.png']
+    assert 'wrote 4 views' in capsys.readouterr()[0]
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_freesurfer_validate.py
+
+Tests for manifest validation
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import gzip
+import struct
+import warnings
+
+import pytest
+
+from seam.cli import main
+from seam.freesurfer.v1 import validate
+
+
+def nifti_bytes(dims=(4, 4, 4), bitpix=16, truncate=0):
+    header = bytearray(352)
+    struct.pack_into('<i', header, 0, 348)
+    struct.pack_into('<8h', header, 40, len(dims), *(list(dims) +
+        [1] * (7 - len(dims))))
+    struct.pack_into('<h', header, 72, bitpix)
+    struct.pack_into('<f', header, 108, 352.)
+    header[344:348] = b'n+1\x00'
+    nbytes = 1
+    for d in dims:
+        nbytes *= d
+    data = b'\x00' * (nbytes * bitpix // 8 - truncate)
+    return bytes(header) + data
+
+def write_bytes(path, data):
+    with open(str(path), 'wb') as f:
+        f.write(data)
+
+def dicom_bytes():
+    return b'\x00' * 128 + b'DICM' + b'\x00' * 1000
+
+def write_manifest(tmpdir, rows):
+    path = tmpdir.join('batch.csv')
+    path.write('subject_id,input\n' + ''.join('{},{}\n'.format(*row)
+        for row in rows))
+    return str(path)
+
+
+def test_sniff_header():
+    assert validate.sniff_header(dicom_bytes()) == ('dicom', None)
+    assert validate.sniff_header(nifti_bytes()) == ('nifti1', 352 + 128)
+    assert validate.sniff_header(b'not an image' * 40) == (None, None)
+
+def test_check_input(tmpdir):
+    good = tmpdir.join('t1.nii')
+    write_bytes(good, nifti_bytes())
+    assert validate.check_input(str(good), min_bytes=0) == []
+    assert validate.check_input(str(good))[0][0] == validate.WARNING
+    short = tmpdir.join('short.nii')
+    write_bytes(short, nifti_bytes(truncate=10))
+    assert validate.check_input(str(short), min_bytes=0) == [(validate.ERROR,
+        'is truncated: 470 of 480 bytes')]
+    gz = tmpdir.join('t1.nii.gz')
+    with gzip.open(str(gz), 'wb') as f:
+        f.write(nifti_bytes())
+    assert validate.check_input(str(gz), min_bytes=0) == []
+    text = tmpdir.join('notes.txt')
+    text.write('hello')
+    assert (validate.ERROR, 'is not NIfTI, DICOM or MGH') in \
+        validate.check_input(str(text))
+    assert validate.check_input(str(tmpdir.join('missing.nii'))) == [
+        (validate.ERROR, 'does not exist')]
+
+def test_check_subjects_dir(tmpdir):
+    assert validate.check_subjects_dir(str(tmpdir)) == []
+    assert validate.check_subjects_dir(str(tmpdir.join('new', 'sd'))) == []
+    f = tmpdir.join('file')
+    f.write('')
+    assert validate.check_subjects_dir(str(f)) == [
+        '{} is not a directory'.format(f)]
+
+def test_validate_manifest(tmpdir):
+    sd = tmpdir.mkdir('subjects')
+    sd.mkdir('done')
+    write_bytes(tmpdir.join('a.dcm'), dicom_bytes())
+    write_bytes(tmpdir.join('b.nii'), nifti_bytes())
+    manifest = write_manifest(tmpdir, [
+        ('a', tmpdir.join('a.dcm')),
+        ('b', tmpdir.join('b.nii')),
+        ('b', tmpdir.join('b.nii')),
+        ('done', tmpdir.join('a.dcm')),
+        ('c', tmpdir.join('missing.nii'))])
+    report = validate.validate_manifest(manifest, subjects_dir=str(sd),
+        threads=4, min_bytes=0)
+    assert not report.ok
+    assert report.subjects == 4
+    assert report.inputs == 3
+    errors = set((p.subject_id, p.message) for p in report.errors)
+    assert errors == set([('b', 'subject_id appears more than once'),
+        ('done', 'already exists in SUBJECTS_DIR'),
+        ('c', 'does not exist')])
+    assert set(p.subject_id for p in report.warnings) == set(['a', 'done'])
+    text = report.text()
+    assert text.splitlines()[-1] == '4 subjects, 3 inputs: 3 errors, 2 warnings'
+
+def test_validate_manifest_ok(tmpdir, monkeypatch):
+    monkeypatch.setenv('SUBJECTS_DIR', str(tmpdir.mkdir('subjects')))
+    write_bytes(tmpdir.join('a.nii'), nifti_bytes())
+    manifest = write_manifest(tmpdir, [('a', tmpdir.join('a.nii'))])
+    assert validate.validate_manifest(manifest, min_bytes=0).ok
+
+def test_validate_cli(tmpdir, capsys):
+    manifest = write_manifest(tmpdir, [('a', tmpdir.join('missing.nii'))])
+    with pytest.raises(SystemExit) as exc:
+        main(['validate', manifest, '--subjects-dir', str(tmpdir)])
+    assert exc.value.code == 1
+    assert 'does not exist' in capsys.readouterr()[0]
+
+def test_build_validate_cli(tmpdir, monkeypatch, capsys):
+    monkeypatch.delenv('SUBJECTS_DIR', raising=False)
+    write_bytes(tmpdir.join('a.nii'), nifti_bytes())
+    manifest = write_manifest(tmpdir, [('a', tmpdir.join('a.nii'))])
+    script_dir = tmpdir.join('scripts')
+    # Checked against the SUBJECTS_DIR the scripts are built for, the
+    # script directory when it isn't set
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        main(['build', manifest, str(script_dir), '--validate'])
+    assert caught[0].category is UserWarning
+    assert capsys.readouterr()[0].strip() == str(script_dir.join(
+        'a.recon.sh'))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Test image I/O
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import struct
+
+import pytest
+
+from seam import images
+
+
+def gradient(width, height, channels=3):
+    data = bytearray((x * 7 + y * 13 + c * 50) % 256 for y in range(height)
+        for x in range(width) for c in range(channels))
+    return images.Image(width, height, channels, data)
+
+def packbits(data):
+    "Literal runs only: enough to exercise the decoder"
+    out = bytearray()
+    for i in range(0, len(data), 128):
+        chunk = data[i:i + 128]
+        out.append(len(chunk) - 1)
+        out.extend(chunk)
+    return out
+
+def write_tiff(path, image, endian='<', compression=1, orientation=1):
+    "Write *image* as a single strip TIFF"
+    data = image.data
+    if orientation == 4:
+        data = images.flip_vertical(image).data
+    if compression == 32773:
+        data = packbits(data)
+    entries = [(256, 3, 1, image.width), (257, 3, 1, image.height),
+        (258, 3, 1, 8), (259, 3, 1, compression),
+        (262, 3, 1, 2 if image.channels >= 3 else 1),
+        (273, 4, 1, 0), (274, 3, 1, orientation),
+        (277, 3, 1, image.channels), (278, 3, 1, image.height),
+        (279, 4, 1, len(data))]
+    ifd_size = 2 + 12 * len(entries) + 4
+    strip_offset = 8 + ifd_size
+    buf = bytearray(b'II' if endian == '<' else b'MM')
+    buf += struct.pack(endian + 'HI', 42, 8)
+    buf += struct.pack(endian + 'H', len(entries))
+    for tag, typ, count, value in entries:
+        if tag == 273:
+            value = strip_offset
+        if typ == 3:
+            buf += struct.pack(endian + 'HHIHH', tag, typ, count, value, 0)
+        else:
+            buf += struct.pack(endian + 'HHII', tag, typ, count, value)
+    buf += struct.pack(endian + 'I', 0)
+    buf += data
+    with open(str(path), 'wb') as f:
+        f.write(buf)
+    return str(path)
+
+def test_image_size_checked():
+    with pytest.raises(ValueError):
+        images.Image(2, 2, 3, bytearray(5))
+
+@pytest.mark.parametrize(('endian', 'compression', 'orientation'), [
+    ('<', 1, 1), ('>', 1, 1), ('<', 32773, 1), ('<', 1, 4)])
+def test_read_tiff(tmpdir, endian, compression, orientation):
+    image = gradient(17, 9)
+    path = write_tiff(tmpdir.join('img.tiff'), image, endian, compression,
+        orientation)
+    read = images.read_tiff(path)
+    assert (read.width, read.height, read.channels) == (17, 9, 3)
+    assert read.data == image.data
+
+def test_unpackbits():
+    # Example from Apple's PackBits technical note
+    packed = bytearray.fromhex('FEAA02800 02AFDAA0380002A22F7AA'.replace(' ', ''))
+    expected = bytearray.fromhex('AAAAAA80002AAAAAAAAA80002A22' + 'AA' * 10)
+    assert images._unpackbits(packed) == expected
+
+def test_read_tiff_rejects_others(tmpdir):
+    path = tmpdir.join('not.tiff')
+    path.write('GIF89a')
+    with pytest.raises(ValueError):
+        images.read_tiff(str(path))
+
+@pytest.mark.parametrize('channels', [1, 2, 3, 4])
+def test_png_roundtrip(tmpdir, channels):
+    image = gradient(11, 5, channels)
+    path = str(tmpdir.join('img.png'))
+    images.write_png(path, image)
+    read = images.read_png(path)
+    assert (read.width, read.height, read.channels) == (11, 5, channels)
+    assert read.data == image.data
+
+def test_subsample():
+    image = gradient(10, 7)
+    small = images.subsample(image, 3)
+    assert (small.width, small.height) == (4, 3)
+    assert small.row(1)[3:6] == image.row(3)[9:12]
+    assert images.subsample(image, 1) is image
+
+def test_to_rgb():
+    gray = images.Image(2, 1, 1, bytearray([10, 20]))
+    assert images.to_rgb(gray).data == bytearray([10, 10, 10, 20, 20, 20])
+    rgba = images.Image(1, 1, 4, bytearray([1, 2, 3, 4]))
+    assert images.to_rgb(rgba).data == bytearray([1, 2, 3])
+
+def test_montage():
+    white = images.Image(2, 2, 3, bytearray([255]) * 12)
+    small = images.Image(1, 1, 3, bytearray([128]) * 3)
+    sheet = images.montage([white, small, white], columns=2)
+    assert (sheet.width, sheet.height) == (4, 4)
+    assert sheet.row(0) == bytearray([255] * 6 + [128] * 3 + [0] * 3)
+    assert sheet.row(2) == bytearray([255] * 6 + [0] * 6)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Test compiled command templates
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import pytest
+
+from seam.render import CommandTemplate
+from seam.freesurfer.v1 import core
+
+
+def test_fields_and_render():
+    t = CommandTemplate('cmd {b} {a} {b:>3} {{literal}} {a!r}')
+    assert t.fields == ('b', 'a')
+    assert t.render(a='x', b='y') == "cmd y x   y {literal} 'x'"
+    assert t.render_many([('y', 'x'), {'a': 1, 'b': 2}]) == [
+        "cmd y x   y {literal} 'x'", 'cmd 2 1   2 {literal} 1']
+
+def test_iter_render_is_lazy():
+    t = CommandTemplate('echo {n:d}')
+    rendered = t.iter_render((i,) for i in range(3))
+    assert next(rendered) == 'echo 0'
+    assert list(rendered) == ['echo 1', 'echo 2']
+
+def test_unnamed_fields():
+    with pytest.raises(ValueError):
+        CommandTemplate('echo {}')
+    with pytest.raises(ValueError):
+        CommandTemplate('echo {0}')
+
+def test_core_templates_match_functions():
+    rows = [('sub{:04d}'.format(i), hemi) for i in range(50)
+        for hemi in ('lh', 'rh')]
+    batch = core.ANNOT2LABEL_CMD.render_many((sid, hemi,
+        '/sd/{}/label/{}.aparc.annot'.format(sid, hemi), '/out', 'white')
+        for sid, hemi in rows)
+    assert batch == [core.annot2label_cmd(sid, hemi,
+        '/sd/{}/label/{}.aparc.annot'.format(sid, hemi), '/out')
+        for sid, hemi in rows]
+    assert core.RECON_ALL_THREADS.render_many([('s1', 2)]) == [
+        core.recon_all('s1', threads=2)]
+
+def test_tkmedit_screenshot_cmd_without_flags():
+    assert core.tkmedit_screenshot_cmd('foo', 'brain.mgz', '/p/t.tcl') == \
+        'tkmedit foo brain.mgz -tcl /p/t.tcl'
+
+def test_recon_input_empty_list():
+    assert core.recon_input('foo', []) == 'recon-all -s foo'
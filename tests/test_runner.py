@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_runner.py
+
+Tests for running generated scripts
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import sys
+import time
+import signal
+import socket
+import subprocess
+
+import pytest
+
+from seam.runner import retry, job, queue, LocalRunner, Job
+
+
+def write_script(path, steps, max_attempts=3, cleanup=None, delay=0):
+    "Write a script running each (name, command[, resume]) in *steps*"
+    path = str(path)
+    lines = ['#!/bin/bash', retry.step_preamble(retry.state_dir(path),
+        max_attempts=max_attempts, delay=delay, cleanup=cleanup,
+        stop_grace=5)]
+    lines.extend(retry.step_cmd(*step) for step in steps)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+def flaky_cmd(counter, failures, message='Stale file handle'):
+    "A command that fails with *message* the first *failures* times it runs"
+    return ('n=$(cat {0} 2>/dev/null || echo 0); echo $((n + 1)) > {0}; '
+        'if [ $n -lt {1} ]; then echo "{2}"; exit 1; fi').format(counter,
+        failures, message)
+
+def test_classify_failure():
+    assert retry.classify_failure(1, 'open: Stale NFS file handle')[0] == retry.TRANSIENT
+    assert retry.classify_failure(124)[0] == retry.TRANSIENT
+    kind, reason = retry.classify_failure(1, 'ERROR: talairach_afd failed\n'
+        'recon-all -s foo exited with ERRORS')
+    assert kind == retry.DETERMINISTIC
+    assert reason == 'ERROR: talairach'
+    assert retry.classify_failure(2) == (retry.DETERMINISTIC, 'exit status 2')
+
+def test_state_dir():
+    assert retry.state_dir('/scripts/foo.recon.sh') == '/scripts/foo.recon.state'
+
+def test_step_cmd():
+    assert retry.step_cmd('x', "echo 'hi'") == "seam_step x 'echo '\"'\"'hi'\"'\"''"
+    assert retry.step_cmd('x', 'make', 'make -k') == "seam_step x make 'make -k'"
+
+def test_job_name():
+    assert job.job_name('/scripts/foo.recon.sh') == 'foo'
+    assert job.job_name('bar.sh') == 'bar'
+
+def test_step_success_and_skip(tmpdir):
+    counter = str(tmpdir.join('count'))
+    script = write_script(tmpdir.join('foo.recon.sh'),
+        [('count', 'echo 1 >> {}'.format(counter))])
+    assert subprocess.call(['bash', script]) == 0
+    assert subprocess.call(['bash', script]) == 0
+    # The completed step is skipped on the second run
+    with open(counter) as f:
+        assert f.read() == '1\n'
+    assert os.path.isfile(os.path.join(retry.state_dir(script), 'count.done'))
+
+def test_step_retries_transient(tmpdir):
+    counter = str(tmpdir.join('count'))
+    script = write_script(tmpdir.join('foo.recon.sh'),
+        [('flaky', flaky_cmd(counter, 2))])
+    assert subprocess.call(['bash', script]) == 0
+    with open(counter) as f:
+        assert f.read() == '3\n'
+
+def test_step_gives_up_transient(tmpdir):
+    counter = str(tmpdir.join('count'))
+    script = write_script(tmpdir.join('foo.recon.sh'),
+        [('flaky', flaky_cmd(counter, 5))], max_attempts=2)
+    assert subprocess.call(['bash', script]) == retry.EXIT_TRANSIENT
+    assert retry.read_failure(script) is None
+    # Each attempt's output went to the step's log
+    state = tmpdir.join('foo.recon.state')
+    assert not state.join('flaky.attempt.log').check()
+    assert state.join('flaky.log').read().count('Stale file handle') == 2
+
+def test_step_retry_resumes(tmpdir):
+    lock = tmpdir.join('IsRunning')
+    # Like recon-all killed by a timeout, which then refuses to run while
+    # its lock is left behind
+    cmd = 'touch {}; exit 124'.format(lock)
+    resume = 'if [ -e {} ]; then echo locked; exit 1; fi; echo resumed'.format(
+        lock)
+    script = write_script(tmpdir.join('s.sh'), [('recon', cmd, resume)],
+        cleanup=['rm -f {}'.format(lock)])
+    out = subprocess.check_output(['bash', script]).decode()
+    assert 'step recon was started before, resuming' in out
+    assert 'resumed' in out
+    assert not tmpdir.join('s.state', 'recon.started').check()
+
+def test_step_deterministic(tmpdir):
+    after = str(tmpdir.join('after'))
+    script = write_script(tmpdir.join('foo.recon.sh'),
+        [('bad', 'echo "ERROR: talairach failed"; exit 1'),
+         ('after', 'touch {}'.format(after))])
+    assert subprocess.call(['bash', script]) == retry.EXIT_DETERMINISTIC
+    assert not os.path.exists(after)
+    assert retry.read_failure(script) == {'step': 'bad', 'status': 1,
+        'reason': 'ERROR: talairach'}
+    # Won't run again until the failure is cleared
+    assert subprocess.call(['bash', script]) == retry.EXIT_DETERMINISTIC
+    retry.clear_failure(script)
+    assert retry.read_failure(script) is None
+
+def test_local_runner(tmpdir):
+    scripts = [write_script(tmpdir.join('good{}.sh'.format(i)),
+        [('ok', 'true')]) for i in range(4)]
+    scripts.append(write_script(tmpdir.join('bad.sh'), [('bad', 'exit 3')]))
+    jobs = LocalRunner(processes=2, poll_interval=0.01).run(scripts)
+    statuses = dict((j.name, j.status) for j in jobs)
+    assert statuses == {'good0': job.DONE, 'good1': job.DONE,
+        'good2': job.DONE, 'good3': job.DONE, 'bad': job.FAILED}
+    bad = jobs[-1]
+    assert bad.reason == 'bad: exit status 3'
+    # Deterministic failures are not resubmitted
+    again = LocalRunner(poll_interval=0.01).run([Job(bad.script)])
+    assert again[0].status == job.FAILED
+    assert again[0].attempts == 0
+
+def test_local_runner_resubmits(tmpdir):
+    counter = str(tmpdir.join('count'))
+    script = write_script(tmpdir.join('flaky.sh'),
+        [('first', 'true'), ('flaky', flaky_cmd(counter, 1))], max_attempts=1)
+    runner = LocalRunner(resubmits=1, resubmit_delay=0, poll_interval=0.01)
+    done, = runner.run([script])
+    assert done.status == job.DONE
+    assert done.attempts == 2
+    # Transient failures beyond the resubmits are given up on
+    script = write_script(tmpdir.join('flakier.sh'),
+        [('flaky', flaky_cmd(str(tmpdir.join('count2')), 5))], max_attempts=1)
+    gave_up, = runner.run([script])
+    assert gave_up.status == job.TRANSIENT
+    assert gave_up.attempts == 2
+
+def test_queue_claim_release(tmpdir):
+    q = queue.FileQueue(str(tmpdir.join('q')))
+    q.submit(Job('/scripts/foo.recon.sh'))
+    claimed = q.claim('host:1')
+    assert claimed.name == 'foo'
+    assert q.claim('host:2') is None
+    assert q.names('claimed') == ['foo']
+    assert q.read('claimed', 'foo')[1] == 'host:1'
+    assert q.release(claimed, 'done', 'host:1')
+    assert q.counts() == {'pending': 0, 'claimed': 0, 'done': 1, 'failed': 0}
+    # A lost claim can't be released
+    assert not q.release(claimed, 'done', 'host:1')
+
+def test_queue_reclaim_stale(tmpdir):
+    q = queue.FileQueue(str(tmpdir.join('q')))
+    q.submit('/scripts/foo.sh')
+    q.submit('/scripts/bar.sh')
+    q.claim('elsewhere:1')
+    q.claim('elsewhere:2')
+    old = time.time() - 1000
+    os.utime(q.entry('claimed', 'bar'), (old, old))
+    assert q.reclaim_stale(stale_after=300) == ['bar']
+    assert q.names('pending') == ['bar']
+    assert q.names('claimed') == ['foo']
+
+def test_queue_reclaim_clock_skew(tmpdir, monkeypatch):
+    q = queue.FileQueue(str(tmpdir.join('q')))
+    q.submit('/scripts/foo.sh')
+    q.claim('elsewhere:1')
+    # This host's clock runs an hour ahead of the file server's
+    real_time = time.time
+    monkeypatch.setattr(time, 'time', lambda: real_time() + 3600)
+    assert q.reclaim_stale(stale_after=300) == []
+
+def test_worker_lost_claim(tmpdir):
+    q = queue.FileQueue(str(tmpdir.join('q')))
+    pid_file = tmpdir.join('pid')
+    q.submit(write_script(tmpdir.join('slow.sh'), [('slow',
+        'sh -c "echo \\$\\$ > {}; exec sleep 30"'.format(pid_file))]))
+    w = queue.Worker(q)
+    running = {}
+    w._fill(running)
+    wait_for(pid_file)
+    [(proc, claimed)] = running.items()
+    w._beat(running)
+    assert running
+    # Reclaimed as stale by another worker meanwhile
+    os.rename(q.entry('claimed', 'slow'), q.entry('pending', 'slow'))
+    w._beat(running)
+    assert not running
+    assert proc.returncode == -signal.SIGKILL
+    pid = int(pid_file.read())
+    deadline = time.time() + 5
+    while os.path.exists('/proc/{:d}'.format(pid)) and time.time() < deadline:
+        time.sleep(0.05)
+    assert not os.path.exists('/proc/{:d}'.format(pid))
+    # Left to the new claimant, the step isn't marked preempted or failed
+    assert retry.read_preempted(claimed.script) is None
+    assert q.names('pending') == ['slow']
+
+def test_queue_reclaim_dead_local_worker(tmpdir):
+    q = queue.FileQueue(str(tmpdir.join('q')))
+    q.submit('/scripts/foo.sh')
+    dead = subprocess.Popen(['true'])
+    dead.wait()
+    q.claim('{}:{:d}'.format(socket.gethostname(), dead.pid))
+    assert q.reclaim_stale(stale_after=300) == ['foo']
+
+def test_workers_drain_queue(tmpdir):
+    q = queue.FileQueue(str(tmpdir.join('q')))
+    ran = str(tmpdir.join('ran'))
+    for i in range(8):
+        script = write_script(tmpdir.join('sub{}.recon.sh'.format(i)),
+            [('record', 'echo sub{} >> {}; sleep 0.3'.format(i, ran))])
+        q.submit(script)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    cmd = [sys.executable, '-m', 'seam.cli', 'worker', q.path,
+        '--poll-interval', '0.05', '--exit-when-empty']
+    workers = [subprocess.Popen(cmd, env=env) for _ in range(3)]
+    assert [w.wait() for w in workers] == [0, 0, 0]
+    assert q.counts() == {'pending': 0, 'claimed': 0, 'done': 8, 'failed': 0}
+    # Every subject ran exactly once
+    with open(ran) as f:
+        assert sorted(f.read().split()) == ['sub{}'.format(i) for i in range(8)]
+    hosts = set(q.read('done', name)[1] for name in q.names('done'))
+    assert len(hosts) > 1
+
+def test_worker_failures(tmpdir):
+    q = queue.FileQueue(str(tmpdir.join('q')))
+    q.submit(write_script(tmpdir.join('bad.sh'), [('bad', 'exit 2')]))
+    q.submit(write_script(tmpdir.join('flaky.sh'),
+        [('flaky', flaky_cmd(str(tmpdir.join('count')), 1))], max_attempts=1))
+    w = queue.Worker(q, slots=2, resubmit_delay=0, poll_interval=0.01,
+        exit_when_empty=True)
+    w.run()
+    assert q.names('failed') == ['bad']
+    assert q.names('done') == ['flaky']
+    assert q.read('done', 'flaky')[0].attempts == 2
+
+def test_script_metadata(tmpdir):
+    path = tmpdir.join('foo.recon.sh')
+    path.write('#!/bin/bash\n# seam: threads=4\n\n# seam: ignored=1\n')
+    assert job.script_metadata(str(path)) == {'threads': '4'}
+    assert Job(str(path)).threads == 4
+    assert Job(str(path), threads=2).threads == 2
+    assert Job('/does/not/exist.sh').threads == 1
+
+def test_local_runner_cores(tmpdir):
+    active = tmpdir.mkdir('active')
+    peaks = str(tmpdir.join('peaks'))
+    cmd = ('touch {0}/$$; ls {0} | wc -l >> {1}; sleep 0.2; rm {0}/$$').format(
+        active, peaks)
+    jobs = [Job(write_script(tmpdir.join('sub{}.sh'.format(i)),
+        [('work', cmd)]), threads=2) for i in range(6)]
+    LocalRunner(processes=6, cores=4, poll_interval=0.01).run(jobs)
+    assert all(j.status == job.DONE for j in jobs)
+    with open(peaks) as f:
+        assert max(int(n) for n in f.read().split()) == 2
+
+def test_local_runner_dependencies(tmpdir):
+    order = str(tmpdir.join('order'))
+    def record(name):
+        return write_script(tmpdir.join('{}.sh'.format(name)),
+            [('run', 'echo {} >> {}; sleep 0.1'.format(name, order))])
+    cross = [Job(record('tp{}'.format(i))) for i in range(3)]
+    base = Job(record('base'), depends_on=[j.name for j in cross])
+    longs = [Job(record('long{}'.format(i)), depends_on=['base'])
+        for i in range(3)]
+    bad = Job(write_script(tmpdir.join('bad.sh'), [('bad', 'exit 3')]))
+    orphan = Job(record('orphan'), depends_on=['bad'])
+    jobs = LocalRunner(processes=4, poll_interval=0.01).run(
+        longs + [base] + cross + [bad, orphan])
+    with open(order) as f:
+        ran = f.read().split()
+    assert sorted(ran[:3]) == ['tp0', 'tp1', 'tp2']
+    assert ran[3] == 'base'
+    assert sorted(ran[4:]) == ['long0', 'long1', 'long2']
+    assert orphan.status == job.FAILED
+    assert orphan.reason == 'dependency bad failed'
+    assert orphan.attempts == 0
+    # A cycle can never start
+    a = Job(record('a'), depends_on=['b'])
+    b = Job(record('b'), depends_on=['a'])
+    LocalRunner(poll_interval=0.01).run([a, b])
+    assert (a.status, b.status) == (job.FAILED, job.FAILED)
+
+def test_queue_dependencies(tmpdir):
+    q = queue.FileQueue(str(tmpdir.join('q')))
+    q.submit(Job('/scripts/tp1.sh'))
+    q.submit(Job('/scripts/base.sh', depends_on=['tp1']))
+    q.submit(Job('/scripts/bad.sh'))
+    q.submit(Job('/scripts/after_bad.sh', depends_on=['bad']))
+    first = q.claim('host:1', policy='fifo')
+    assert first.name == 'tp1'
+    bad = q.claim('host:1', policy='fifo')
+    assert bad.name == 'bad'
+    # base waits for tp1
+    assert q.claim('host:1') is None
+    q.release(bad, 'failed', 'host:1')
+    q.release(first, 'done', 'host:1')
+    assert q.claim('host:1').name == 'base'
+    assert q.names('failed') == ['after_bad', 'bad']
+    assert q.read('failed', 'after_bad')[0].reason == 'dependency bad failed'
+
+def wait_for(path, timeout=10):
+    deadline = time.time() + timeout
+    while not os.path.exists(str(path)):
+        assert time.time() < deadline, '{} never appeared'.format(path)
+        time.sleep(0.05)
+
+def test_step_preempted(tmpdir):
+    pid_file = tmpdir.join('pid')
+    slow = ('if [ -e {0} ]; then echo resumed; else '
+        'sh -c "echo \\$\\$ > {1}; exec sleep 30"; fi').format(
+        tmpdir.join('resume'), pid_file)
+    script = write_script(tmpdir.join('s.sh'), [('first', 'true'),
+        ('slow', slow)], cleanup=['touch {}'.format(tmpdir.join('cleaned'))])
+    proc = subprocess.Popen(['bash', script])
+    wait_for(pid_file)
+    start = time.time()
+    proc.send_signal(signal.SIGTERM)
+    assert proc.wait() == retry.EXIT_REQUEUE
+    assert time.time() - start < 5
+    preempted = retry.read_preempted(script)
+    assert (preempted['step'], preempted['signal']) == ('slow', 'TERM')
+    assert tmpdir.join('cleaned').check()
+    assert retry.current_step(script) is None
+    # The step's process tree was stopped
+    pid = int(pid_file.read())
+    deadline = time.time() + 5
+    while os.path.exists('/proc/{:d}'.format(pid)) and time.time() < deadline:
+        time.sleep(0.05)
+    with pytest.raises(OSError):
+        os.kill(pid, 0)
+    # Rerun resumes at the interrupted step
+    tmpdir.join('resume').write('')
+    out = subprocess.check_output(['bash', script]).decode()
+    assert 'step first already complete' in out
+    assert 'resumed' in out
+    assert retry.read_preempted(script) is None
+
+def test_step_preempted_resume(tmpdir):
+    pid_file = tmpdir.join('pid')
+    slow = 'sh -c "echo \\$\\$ > {}; exec sleep 30"'.format(pid_file)
+    script = write_script(tmpdir.join('s.sh'),
+        [('slow', slow, 'echo carried on')])
+    proc = subprocess.Popen(['bash', script])
+    wait_for(pid_file)
+    proc.send_signal(signal.SIGTERM)
+    assert proc.wait() == retry.EXIT_REQUEUE
+    # The rerun carries on rather than starting over
+    out = subprocess.check_output(['bash', script]).decode()
+    assert 'carried on' in out
+
+def test_step_preempted_during_delay(tmpdir):
+    script = write_script(tmpdir.join('s.sh'),
+        [('flaky', 'echo "Stale file handle"; exit 1')], delay=30)
+    proc = subprocess.Popen(['bash', script])
+    wait_for(tmpdir.join('s.state', 'timings.tsv'))
+    start = time.time()
+    proc.send_signal(signal.SIGUSR1)
+    assert proc.wait() == retry.EXIT_REQUEUE
+    assert time.time() - start < 5
+
+def test_local_runner_requeues_preempted(tmpdir):
+    counter = tmpdir.join('count')
+    script = tmpdir.join('preempted.sh')
+    script.write('n=$(cat {0} 2>/dev/null || echo 0); echo $((n + 1)) > {0}\n'
+        'if [ $n -lt 2 ]; then exit {1:d}; fi\n'.format(counter,
+        retry.EXIT_REQUEUE))
+    done, = LocalRunner(resubmits=0, poll_interval=0.01).run([str(script)])
+    # Preemptions don't use up resubmissions
+    assert done.status == job.DONE
+    assert (done.attempts, done.preemptions) == (3, 2)
+    assert done.failed_attempts == 1
+
+def test_forwarding_signals():
+    from seam.runner.local import forwarding_signals
+
+    class Proc(object):
+        def __init__(self):
+            self.signals = []
+        def send_signal(self, signum):
+            self.signals.append(signum)
+
+    proc = Proc()
+    before = signal.getsignal(signal.SIGUSR1)
+    with forwarding_signals({proc: None}) as received:
+        os.kill(os.getpid(), signal.SIGUSR1)
+        time.sleep(0.01)
+    assert received == [signal.SIGUSR1]
+    assert proc.signals == [signal.SIGUSR1]
+    assert signal.getsignal(signal.SIGUSR1) == before
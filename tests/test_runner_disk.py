@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_runner_disk.py
+
+Tests for disk-space admission control
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import threading
+
+from seam.runner import disk, queue, LocalRunner, Job
+from seam.runner.job import DONE
+from seam.runner.local import kill_tree
+from seam.freesurfer.v1.recipe import write_step_script
+from seam.freesurfer import v1
+
+KB = 1024
+
+
+def disk_script(path, data_dir, steps=(('ok', 'true'),)):
+    "Write a script writing to *data_dir*, running (name, command) *steps*"
+    path = str(path)
+    write_step_script(path, [(name, name, cmd) for name, cmd in steps],
+        disk_paths=[str(data_dir)])
+    return path
+
+def fake_free_space(monkeypatch, free):
+    "Report *free()* bytes on one filesystem"
+    monkeypatch.setattr(disk, 'free_space', lambda path: (1, free()))
+
+
+def test_job_paths(tmpdir, monkeypatch):
+    sd = tmpdir.join('subjects')
+    monkeypatch.setenv('SUBJECTS_DIR', str(sd))
+    written = v1.build_recipe('foo', '/path/to/t1.nii', str(tmpdir))
+    assert disk.job_paths(Job(written[0])) == [str(sd.join('foo')),
+        str(tmpdir.join('foo_screenshots'))]
+    assert disk.job_paths(Job(str(tmpdir.join('missing.sh')))) == []
+
+def test_disk_usage(tmpdir):
+    data = tmpdir.join('data')
+    data.join('mri').ensure(dir=True)
+    data.join('mri', 'big').write('x' * 64 * KB)
+    tmpdir.join('outside').write('x' * 256 * KB)
+    # Links aren't followed
+    data.join('link').mksymlinkto(tmpdir.join('outside'))
+    usage = disk.disk_usage(str(data))
+    assert 64 * KB <= usage < 128 * KB
+    assert disk.disk_usage(str(tmpdir.join('missing'))) == 0
+
+def test_free_space(tmpdir):
+    device, free = disk.free_space(str(tmpdir.join('not', 'yet')))
+    assert device == os.stat(str(tmpdir)).st_dev
+    assert free > 0
+
+def test_admit(tmpdir, monkeypatch):
+    free = [100 * KB]
+    fake_free_space(monkeypatch, lambda: free[0])
+    guard = disk.DiskGuard(reserve=10 * KB, default_footprint=50 * KB)
+    running = Job(disk_script(tmpdir.join('a.sh'), tmpdir.join('a')))
+    new = Job(disk_script(tmpdir.join('b.sh'), tmpdir.join('b')))
+    assert guard.admit(new, [])
+    # a has still to write all of its 50 KB
+    assert not guard.admit(new, [running])
+    assert guard.held == set(['b'])
+    # What a has written already doesn't count against it
+    tmpdir.join('a').ensure(dir=True)
+    tmpdir.join('a', 'data').write('x' * 48 * KB)
+    guard.usage(running, force=True)
+    assert guard.admit(new, [running])
+    assert not guard.held
+    # Scripts not recording their directories are always admitted
+    free[0] = 0
+    assert guard.admit(Job(str(tmpdir.join('other.sh'))), [running])
+
+def test_admit_uses_published_usage(tmpdir, monkeypatch):
+    fake_free_space(monkeypatch, lambda: 100 * KB)
+    walked = []
+    measure = disk.disk_usage
+    monkeypatch.setattr(disk, 'disk_usage',
+        lambda path: walked.append(path) or measure(path))
+    guard = disk.DiskGuard(reserve=10 * KB, default_footprint=50 * KB)
+    # Another worker's job, which has written 48 KB of its 50
+    other = Job(disk_script(tmpdir.join('a.sh'), tmpdir.join('a')))
+    new = Job(disk_script(tmpdir.join('b.sh'), tmpdir.join('b')))
+    assert not guard.admit(new, [other])
+    other.disk_usage = {str(tmpdir.join('a')): 48 * KB}
+    assert guard.admit(new, [other])
+    # Only the job being admitted was walked
+    assert set(walked) == set([str(tmpdir.join('b'))])
+
+def test_worker_publishes_usage(tmpdir):
+    q = queue.FileQueue(str(tmpdir.join('q')))
+    tmpdir.join('a').ensure(dir=True)
+    tmpdir.join('a', 'data').write('x' * 16 * KB)
+    q.submit(disk_script(tmpdir.join('a.sh'), tmpdir.join('a'),
+        [('sleep', 'sleep 30')]))
+    worker = queue.Worker(q, disk=disk.DiskGuard(reserve=0))
+    running = {}
+    worker._fill(running)
+    try:
+        worker._beat(running)
+        claimed, _ = q.read('claimed', 'a')
+        assert claimed.disk_usage[str(tmpdir.join('a'))] >= 16 * KB
+    finally:
+        for proc in running:
+            kill_tree(proc)
+
+def test_finished_records_peak(tmpdir):
+    path = str(tmpdir.join('footprints.json'))
+    guard = disk.DiskGuard(path)
+    job = Job(disk_script(tmpdir.join('a.sh'), tmpdir.join('a')),
+        study='big')
+    tmpdir.join('a').ensure(dir=True)
+    tmpdir.join('a', 'scratch').write('x' * 64 * KB)
+    guard.sample([job])
+    # Intermediates removed before it finished still count
+    tmpdir.join('a', 'scratch').remove()
+    tmpdir.join('a', 'final').write('x' * 16 * KB)
+    guard.finished(job)
+    loaded = disk.FootprintHistory(path)
+    assert loaded.predict(job) >= 64 * KB
+    assert loaded.predict(Job('/s/new.sh', study='big')) == \
+        loaded.predict(job)
+
+def test_local_runner_holds_for_space(tmpdir, monkeypatch):
+    freed = tmpdir.join('freed')
+    fake_free_space(monkeypatch, lambda: 100 * KB if freed.check() else
+        20 * KB)
+    guard = disk.DiskGuard(reserve=0, default_footprint=50 * KB)
+    guard.history.record(Job('/s/a.sh'), 10 * KB)
+    a = Job(disk_script(tmpdir.join('a.sh'), tmpdir.join('a'),
+        [('sleep', 'sleep 0.5'), ('free', 'touch {}'.format(freed))]))
+    b = Job(disk_script(tmpdir.join('b.sh'), tmpdir.join('b')))
+    runner = LocalRunner(processes=2, poll_interval=0.05, disk=guard)
+    runner.run([a, b])
+    assert (a.status, b.status) == (DONE, DONE)
+    # b waited for a to free up space
+    assert b.started >= a.finished
+
+def test_local_runner_resumes_alone(tmpdir, monkeypatch):
+    freed = tmpdir.join('freed')
+    fake_free_space(monkeypatch, lambda: 100 * KB if freed.check() else 0)
+    timer = threading.Timer(0.3, freed.ensure)
+    timer.start()
+    job = Job(disk_script(tmpdir.join('a.sh'), tmpdir.join('a')))
+    runner = LocalRunner(poll_interval=0.05, disk=disk.DiskGuard(
+        reserve=0, default_footprint=10 * KB))
+    # Held with nothing running isn't mistaken for a dependency cycle
+    assert runner.run([job])[0].status == DONE
+    timer.join()
+
+def test_claim_admit(tmpdir):
+    q = queue.FileQueue(str(tmpdir.join('q')))
+    q.submit(str(tmpdir.join('a.sh')))
+    assert q.claim('w', admit=lambda job, running: False) is None
+    assert q.names('pending') == ['a']
+    assert q.claim('w', admit=lambda job, running: True).name == 'a'
+
+def test_worker_disk_cli(tmpdir):
+    from seam.cli import get_parser, _disk_guard
+    q = str(tmpdir.join('q'))
+    args = get_parser().parse_args(['worker', q, '--disk-reserve', '1.5'])
+    guard = _disk_guard(args)
+    assert guard.reserve == int(1.5 * disk.GB)
+    assert guard.history.path == os.path.join(q, 'footprints.json')
+    assert _disk_guard(get_parser().parse_args(['worker', q])) is None
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_runner_metrics.py
+
+Tests for the Prometheus exporter
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+import os
+import subprocess
+
+from seam.runner import retry, job, metrics, queue, LocalRunner, Job
+
+from test_runner import write_script, flaky_cmd
+
+
+def samples(text):
+    "Metric lines as {name{labels}: value}"
+    return dict(line.rsplit(' ', 1) for line in text.splitlines()
+        if line and not line.startswith('#'))
+
+
+def test_step_timings(tmpdir):
+    counter = str(tmpdir.join('count'))
+    script = write_script(tmpdir.join('foo.sh'),
+        [('ok', 'true'), ('flaky', flaky_cmd(counter, 1))])
+    assert subprocess.call(['bash', script]) == 0
+    timings, offset = retry.read_timings(script)
+    assert [(t['step'], t['attempt'], t['status'] != 0) for t in timings] == [
+        ('ok', 1, False), ('flaky', 1, True), ('flaky', 2, False)]
+    assert all(t['end'] >= t['start'] for t in timings)
+    assert retry.read_timings(script, offset) == ([], offset)
+    assert retry.current_step(script) is None
+
+def test_step_timings_garbled(tmpdir):
+    script = str(tmpdir.join('foo.sh'))
+    state = tmpdir.join('foo.state').ensure(dir=True)
+    state.join('timings.tsv').write('ok\t1\t100\t160\t0\n'
+        'ok\t1\t1\x00\x00\t\t0\n'
+        'flaky\t2\t200\t210\t75\n')
+    timings, offset = retry.read_timings(script)
+    assert [(t['step'], t['attempt']) for t in timings] == [('ok', 1),
+        ('flaky', 2)]
+    assert offset == state.join('timings.tsv').size()
+
+def test_exporter_lists_jobs_when_due():
+    listed = []
+
+    def jobs():
+        listed.append(True)
+        return []
+    exporter = metrics.Exporter(interval=3600)
+    exporter.update(jobs)
+    exporter.update(jobs)
+    assert len(listed) == 1
+    exporter.update(jobs, force=True)
+    assert len(listed) == 2
+
+def test_histogram():
+    h = metrics.Histogram((10, 60))
+    for value in (5, 10, 30, 100):
+        h.observe(value)
+    assert h.counts == [2, 3]
+    assert (h.count, h.sum) == (4, 145)
+
+def test_metrics_update(tmpdir):
+    done = Job(write_script(tmpdir.join('done.sh'), [('ok', 'true')]))
+    subprocess.check_call(['bash', done.script])
+    done.status, done.finished = job.DONE, 1000
+    # Pretend a job is in the middle of an xvfb step
+    running = Job(write_script(tmpdir.join('running.sh'),
+        [('tkmedit', 'xvfb-run -a tkmedit foo')]))
+    running.status = job.RUNNING
+    os.makedirs(retry.state_dir(running.script))
+    with open(os.path.join(retry.state_dir(running.script), 'current'),
+        'w') as f:
+        f.write('tkmedit\t900\n')
+    pending = Job(str(tmpdir.join('pending.sh')))
+    m = metrics.Metrics(buckets=(1, 60), window=3600, slots=4)
+    text = m.update([done, running, pending], now=1100)
+    values = samples(text)
+    assert values['seam_jobs{state="done"}'] == '1'
+    assert values['seam_jobs{state="running"}'] == '1'
+    assert values['seam_jobs{state="pending"}'] == '1'
+    assert values['seam_jobs{state="failed"}'] == '0'
+    assert values['seam_step_duration_seconds_bucket{le="60.0",step="ok"}'] \
+        == '1'
+    assert values['seam_step_duration_seconds_bucket{le="+Inf",step="ok"}'] \
+        == '1'
+    assert values['seam_step_duration_seconds_count{step="ok"}'] == '1'
+    assert values['seam_xvfb_in_use'] == '1'
+    assert values['seam_xvfb_utilization'] == '0.25'
+    assert values['seam_throughput_subjects_per_hour'] == '1.0'
+    assert values['seam_last_completion_timestamp_seconds'] == '1000.0'
+    # Timings are only counted once
+    again = samples(m.update([done, running, pending], now=1100 + 7200))
+    assert again['seam_step_duration_seconds_count{step="ok"}'] == '1'
+    assert again['seam_throughput_subjects_per_hour'] == '0.0'
+
+def test_exporter_textfile_and_http(tmpdir):
+    try:
+        from urllib.request import urlopen
+    except ImportError:  # Python 2
+        from urllib2 import urlopen
+    scripts = [write_script(tmpdir.join('s{}.sh'.format(i)),
+        [('ok', 'true')]) for i in range(3)]
+    prom = str(tmpdir.join('seam.prom'))
+    exporter = metrics.Exporter(textfile=prom, port=0, interval=0)
+    try:
+        LocalRunner(processes=2, poll_interval=0.01,
+            metrics=exporter).run(scripts)
+        with open(prom) as f:
+            text = f.read()
+        assert samples(text)['seam_jobs{state="done"}'] == '3'
+        served = urlopen('http://127.0.0.1:{:d}/metrics'.format(
+            exporter.server.port)).read().decode('utf-8')
+        assert served == text
+    finally:
+        exporter.close()
+
+def test_queue_jobs_and_metrics_cli(tmpdir, capsys):
+    from seam.cli import main
+    q = queue.FileQueue(str(tmpdir.join('queue')))
+    for i in range(2):
+        q.submit(write_script(tmpdir.join('s{}.sh'.format(i)),
+            [('ok', 'true')]))
+    assert [j.status for j in q.jobs()] == [job.PENDING, job.PENDING]
+    main(['metrics', q.path, '--once'])
+    assert samples(capsys.readouterr()[0])['seam_jobs{state="pending"}'] == '2'
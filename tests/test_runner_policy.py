@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_runner_policy.py
+
+Tests for scheduling policies
+"""
+__author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
+__copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
+
+from multiprocessing import Pool
+
+import pytest
+
+from seam.runner import policy, queue, Job
+
+
+def make_jobs():
+    "Three big-study jobs submitted before a small-study and an urgent job"
+    jobs = [Job('/s/big{}.sh'.format(i), study='big') for i in range(3)]
+    jobs.append(Job('/s/small0.sh', study='small'))
+    jobs.append(Job('/s/urgent.sh', study='clinical', priority=10))
+    for i, job in enumerate(jobs):
+        job.submitted = i
+    return jobs
+
+def drain(pol, jobs, running=()):
+    "Names of *jobs* in the order *pol* would start them"
+    ready, running, order = list(jobs), list(running), []
+    while ready:
+        job = pol.choose(ready, running)
+        ready.remove(job)
+        running.append(job)
+        order.append(job.name)
+    return order
+
+def test_fifo():
+    assert drain(policy.Fifo(), make_jobs()) == ['big0', 'big1', 'big2',
+        'small0', 'urgent']
+
+def test_priority():
+    assert drain(policy.Priority(), make_jobs()) == ['urgent', 'big0', 'big1',
+        'big2', 'small0']
+
+def test_fair_share():
+    jobs = make_jobs()
+    assert drain(policy.FairShare(), jobs) == ['urgent', 'big0', 'small0',
+        'big1', 'big2']
+    # Shares weight the studies
+    running = [Job('/s/x.sh', study='small')]
+    assert drain(policy.FairShare({'small': 2}), jobs[:4], running)[:2] == \
+        ['big0', 'small0']
+
+def test_runtime_history(tmpdir):
+    path = str(tmpdir.join('runtimes.json'))
+    history = policy.RuntimeHistory(path)
+    assert history.predict(Job('/s/a.sh')) is None
+    history.record(Job('/s/a.sh', study='big'), 100)
+    history.record(Job('/s/b.sh', study='big'), 300)
+    history.record(Job('/s/c.sh', study='small'), 50)
+    history.save()
+    # Another runner records to the same file meanwhile
+    other = policy.RuntimeHistory(path)
+    other.record(Job('/s/d.sh', study='small'), 70)
+    other.save()
+    history.save()
+    loaded = policy.RuntimeHistory(path)
+    assert loaded.predict(Job('/s/a.sh')) == 100
+    assert loaded.predict(Job('/s/new.sh', study='big')) == 200
+    assert loaded.predict(Job('/s/new.sh', study='small')) == 60
+    assert loaded.predict(Job('/s/new.sh', study='other')) == 85
+
+def _save_runtime(args):
+    path, i = args
+    history = policy.RuntimeHistory(path)
+    history.record(Job('/s/job{:d}.sh'.format(i)), i)
+    history.save()
+
+def test_runtime_history_concurrent(tmpdir):
+    path = str(tmpdir.join('runtimes.json'))
+    pool = Pool(4)
+    try:
+        pool.map(_save_runtime, [(path, i) for i in range(32)])
+    finally:
+        pool.close()
+        pool.join()
+    # Nobody's runtime was lost to another runner's save
+    assert len(policy.RuntimeHistory(path).runtimes) == 32
+
+def test_shortest_first():
+    history = policy.RuntimeHistory()
+    history.record(Job('/s/big0.sh', study='big'), 500)
+    history.record(Job('/s/small0.sh', study='small'), 100)
+    jobs = make_jobs()[:4]
+    assert drain(policy.ShortestFirst(history), jobs) == ['small0', 'big0',
+        'big1', 'big2']
+
+def test_get_policy():
+    assert isinstance(policy.get_policy(), policy.Fifo)
+    assert isinstance(policy.get_policy('fair-share'), policy.FairShare)
+    pol = policy.Priority()
+    assert policy.get_policy(pol) is pol
+    with pytest.raises(ValueError):
+        policy.get_policy('lottery')
+
+def test_queue_claim_policy(tmpdir):
+    q = queue.FileQueue(str(tmpdir.join('q')))
+    for job in make_jobs():
+        q.submit(job)
+    claimed = [q.claim('w:1', 'fair-share').name for _ in range(5)]
+    assert claimed == ['urgent', 'big0', 'small0', 'big1', 'big2']
+    assert q.claim('w:1', 'fair-share') is None
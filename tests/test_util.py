@@ -7,6 +7,8 @@ Test utility functions
 __author__ = 'Scott Burns <scott.s.burns@vanderbilt.edu>'
 __copyright__ = 'Copyright 2014 Vanderbilt University. All Rights Reserved'
 
+import os
+
 from seam.util import get_tmp_filename, wrap_with_xvfb, total, STRING_TYPE, PY2
 
 def test_default_tmp_filename():
@@ -29,8 +31,9 @@ def test_tmp_filename_options():
 def test_default_wrap_with_xvfb():
     cmd = 'ls -l'
     comp_wrapper = wrap_with_xvfb(cmd)
-    assert comp_wrapper.startswith('xvfb-run')
-    assert comp_wrapper.endswith(cmd)
+    assert comp_wrapper.startswith('(')
+    assert '; xvfb-run -a ' in comp_wrapper
+    assert comp_wrapper.endswith(cmd + ')')
     required_flags = ['-f', '-e', '-a', '--wait',
         '--server-args="-screen 0, 1600x1200x24"']
     for flag in required_flags:
@@ -55,4 +58,68 @@ def test_string_type():
 
 def test_python_version():
     import sys
-    assert (sys.version_info[0] == 2) == PY2
\ No newline at end of file
+    assert (sys.version_info[0] == 2) == PY2
+
+def test_wrap_with_xvfb_allocates_at_runtime():
+    cmd = wrap_with_xvfb('ls -l')
+    assert '/tmp/' not in cmd
+    assert cmd.startswith('(xvfb_tmp="$(mktemp -d '
+        '"${SEAM_TMP:-${TMPDIR:-/tmp}}/xvfb.XXXXXXXXXX")"')
+    assert '-f "$xvfb_tmp/auth" -e "$xvfb_tmp/err"' in cmd
+
+def test_wrap_with_xvfb_cleans_up(tmpdir, monkeypatch):
+    import subprocess
+    # Stands in for xvfb-run: writes its auth & error files, runs the rest
+    bin_dir = tmpdir.mkdir('bin')
+    fake = bin_dir.join('xvfb-run')
+    fake.write('#!/bin/bash\ntouch "$3" "$5"\nshift 7\n"$@"\n')
+    fake.chmod(0o755)
+    tmp = tmpdir.mkdir('tmp')
+    monkeypatch.setenv('PATH', '{}:{}'.format(bin_dir, os.environ['PATH']))
+    monkeypatch.setenv('TMPDIR', str(tmp))
+    monkeypatch.delenv('SEAM_TMP', raising=False)
+    # Outside a seam script, and whether the command works or not
+    assert subprocess.call(['bash', '-c', wrap_with_xvfb('ls /')]) == 0
+    assert subprocess.call(['bash', '-c', wrap_with_xvfb('exit 3')]) == 3
+    assert tmp.listdir() == []
+
+def test_temp_files(tmpdir, monkeypatch):
+    from seam.util import TempFiles, fast_tmp_dir
+    monkeypatch.setenv('SEAM_TMPDIR', str(tmpdir))
+    assert fast_tmp_dir() == str(tmpdir)
+    with TempFiles(cleanup_at_exit=False) as tmp:
+        paths = [tmp.allocate('.auth') for _ in range(200)]
+        assert len(set(paths)) == 200
+        assert all(p.startswith(str(tmpdir)) and p.endswith('.auth')
+            for p in paths)
+        assert len(tmpdir.listdir()) == 200
+    assert tmpdir.listdir() == []
+
+def test_temp_files_at_exit(tmpdir):
+    from seam import util
+    def handlers():
+        if hasattr(util.atexit, '_ncallbacks'):
+            return util.atexit._ncallbacks()
+        return len(util.atexit._exithandlers)  # Python 2
+    # One handler for every instance, not one each
+    before = handlers()
+    tmps = [util.TempFiles(str(tmpdir)) for _ in range(100)]
+    assert handlers() == before
+    path = tmps[0].allocate()
+    assert path in util._exit_paths
+    util._cleanup_at_exit()
+    assert tmpdir.listdir() == []
+    tmps[1].allocate()
+    tmps[1].cleanup()
+    assert not util._exit_paths
+
+def test_tmp_preamble_cleans_up(tmpdir):
+    import subprocess
+    from seam.util import tmp_preamble, script_mktemp
+    script = tmpdir.join('s.sh')
+    script.write('\n'.join(['#!/bin/bash', tmp_preamble(str(tmpdir)),
+        'f={}'.format(script_mktemp('xvfb-auth')),
+        'test -f "$f" && echo "$SEAM_TMP"']) + '\n')
+    out = subprocess.check_output(['bash', str(script)]).decode().strip()
+    assert out.startswith(str(tmpdir.join('seam.')))
+    assert tmpdir.listdir() == [script]